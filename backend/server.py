@@ -4,8 +4,8 @@ import stripe
 import httpx
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, Response
-from pymongo import MongoClient, ReturnDocument
-from pymongo.errors import OperationFailure, DuplicateKeyError
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure, DuplicateKeyError, BulkWriteError
 import os
 import math
 import logging
@@ -42,7 +42,6 @@ if STRIPE_API_KEY:
     stripe.api_key = STRIPE_API_KEY
 SUBSCRIPTION_PRICE_CAD = 15.00
 SUPPORTED_CURRENCIES = ["CAD", "USD", "EUR", "GBP"]
-_exchange_rate_cache = {"rates": {}, "fetched_at": None}
 
 if RESEND_API_KEY:
     resend.api_key = RESEND_API_KEY
@@ -107,6 +106,50 @@ db = client[DB_NAME]
 # anti-leak feature #8). Le message stocké côté doc source reste générique.
 logger = logging.getLogger("facturepro")
 
+from collections import OrderedDict
+import threading
+
+
+class _LRUCache:
+    """Cache mémoire borné (moins récemment utilisé évincé), sûr entre threads. `get`
+    retourne `default` sur un miss ; les valeurs sont partagées, ne pas les muter."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def pop_where(self, predicate):
+        """Retire les entrées dont `predicate(key, value)` est vrai."""
+        with self._lock:
+            for key in [k for k, v in self._data.items() if predicate(k, v)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
 def _take_regs(doc):
     """Extrait les 5 numéros officiels d'un doc (settings ou client).
     Retourne {bn, gst, qst, hst, neq} avec valeurs vides si absent.
@@ -353,35 +396,90 @@ def _mileage_sum_ytd(trips, current_id, current_date, employee_key, vehicle_id,
     return round(total, 2)
 
 
-def _mileage_ytd_before(scope, employee_key, vehicle_id, current_date, current_id,
-                        current_created_at=""):
-    """Charge les trajets de l'annee civile de current_date pour la meme
-    personne+vehicule (scope org via `scope`), puis somme les anterieurs.
-    `scope` = dict de filtre org (issu de _org_scope). employee_key est
-    la cle deja resolue via _mileage_employee_key. current_created_at departage
-    l'ordre intra-journee (cf. _mileage_order_key)."""
-    year = int(_mileage_trip_date_str(current_date)[:4])
-    # Borne haute semi-ouverte ($lt annee+1) : inclut tout '{year}-12-31...' meme
-    # avec une composante horaire ('2026-12-31T09:00'), que $lte '{year}-12-31'
-    # exclurait a tort (car '2026-12-31T09:00' > '2026-12-31'), sous-comptant le
-    # cumul et faussant le split au seuil sur le dernier jour de l'annee.
+def _mileage_ytd_trip(d) -> dict:
+    """Forme allégée d'un trajet pour le cumul YTD (cf. _mileage_sum_ytd)."""
+    return {
+        "id": d["id"],
+        "trip_date": d["trip_date"],
+        "distance_km": d.get("distance_km", 0.0),
+        "created_at": d.get("created_at", ""),
+        "employee_key": _mileage_employee_key(d.get("employee_id"), d.get("created_by_user_id")),
+        "vehicle_id": d["vehicle_id"],
+    }
+
+
+def _mileage_ytd_trips(scope, first_year, last_year, vehicle_id=None) -> list:
+    """Charge en UNE requête les trajets des années civiles [first_year, last_year] (scope
+    org, véhicule optionnel). Borne haute semi-ouverte ($lt annee+1) : inclut tout
+    '{year}-12-31...' meme avec une composante horaire ('2026-12-31T09:00'), que $lte
+    '{year}-12-31' exclurait a tort, sous-comptant le cumul sur le dernier jour de l'annee."""
     query = {
         **scope,
-        "vehicle_id": vehicle_id,
-        "trip_date": {"$gte": f"{year}-01-01", "$lt": f"{year + 1}-01-01"},
+        "trip_date": {"$gte": f"{int(first_year)}-01-01", "$lt": f"{int(last_year) + 1}-01-01"},
     }
-    docs = list(db.mileage_trips.find(query))
-    trips = [
-        {
-            "id": d["id"],
-            "trip_date": d["trip_date"],
-            "distance_km": d.get("distance_km", 0.0),
-            "created_at": d.get("created_at", ""),
-            "employee_key": _mileage_employee_key(d.get("employee_id"), d.get("created_by_user_id")),
-            "vehicle_id": d["vehicle_id"],
-        }
-        for d in docs
-    ]
+    if vehicle_id:
+        query["vehicle_id"] = vehicle_id
+    return [_mileage_ytd_trip(d) for d in db.mileage_trips.find(query, {"_id": 0})]
+
+
+# Moteur de cumul YTD : les trajets sont triés UNE fois par _mileage_order_key dans chaque
+# groupe (personne, véhicule, année), avec les sommes préfixes des distances. Le cumul
+# antérieur d'un trajet = somme préfixe à sa position (bisect, O(log n)) au lieu d'un
+# parcours de tous les trajets par trajet (_mileage_sum_ytd, conservée comme définition de
+# référence). Mêmes trajets, même ordre strict, même arrondi : le split 5000 km est inchangé.
+
+def _build_mileage_ytd_index(trips) -> dict:
+    """Index {(employee_key, vehicle_id, année): (clés d'ordre triées, sommes préfixes)}.
+    `trips` a la forme de _mileage_ytd_trip ; prefix[i] = km des i premiers trajets."""
+    groups = {}
+    for t in trips:
+        day = _mileage_trip_date_str(t["trip_date"])
+        groups.setdefault((t["employee_key"], t["vehicle_id"], day[:4]), []).append(
+            (_mileage_order_key(day, t.get("created_at"), t["id"]), float(t["distance_km"])))
+    index = {}
+    for group, entries in groups.items():
+        entries.sort(key=lambda e: e[0])
+        prefix = [0.0]
+        for _, km in entries:
+            prefix.append(prefix[-1] + km)
+        index[group] = ([k for k, _ in entries], prefix)
+    return index
+
+
+def _mileage_index_ytd_before(index, trip, rounded=True) -> float:
+    """Km cumulés des trajets ANTÉRIEURS (ordre strict jour, created_at, id) de la même
+    personne+véhicule+année que `trip` (document trajet). `rounded=False` rend la somme
+    brute, telle que la cumule le carnet de route."""
+    day = _mileage_trip_date_str(trip["trip_date"])
+    employee_key = _mileage_employee_key(trip.get("employee_id"), trip.get("created_by_user_id"))
+    group = index.get((employee_key, trip["vehicle_id"], day[:4]))
+    if group is None:
+        return 0.0
+    keys, prefix = group
+    total = prefix[bisect.bisect_left(
+        keys, _mileage_order_key(day, trip.get("created_at", ""), trip["id"]))]
+    return round(total, 2) if rounded else total
+
+
+def _mileage_index_allocation(index, trip):
+    """(ytd_before, rates, amount, breakdown) d'un trajet via l'index ; amount/breakdown None
+    si l'année n'a pas de taux (rates None)."""
+    ytd_before = _mileage_index_ytd_before(index, trip)
+    rates = _mileage_rate_for_year(int(_mileage_trip_date_str(trip["trip_date"])[:4]))
+    if rates is None:
+        return ytd_before, None, None, None
+    amount, breakdown = _mileage_allocation(float(trip.get("distance_km", 0.0)), ytd_before, rates)
+    return ytd_before, rates, amount, breakdown
+
+
+def _mileage_ytd_before(scope, employee_key, vehicle_id, current_date, current_id,
+                        current_created_at=""):
+    """Charge les trajets de l'annee civile de current_date pour le meme vehicule
+    (scope org via `scope`), puis somme les anterieurs de la meme personne.
+    employee_key est la cle deja resolue via _mileage_employee_key ; current_created_at
+    departage l'ordre intra-journee (cf. _mileage_order_key)."""
+    year = int(_mileage_trip_date_str(current_date)[:4])
+    trips = _mileage_ytd_trips(scope, year, year, vehicle_id)
     return _mileage_sum_ytd(trips, current_id, current_date, employee_key, vehicle_id,
                             current_created_at=current_created_at)
 
@@ -544,6 +642,7 @@ def migrate_expense_tax_codes_v1():
                 "category_arc_line": t2125_line,  # aligné sur T2125 (corrige les erreurs historiques)
             }})
         if result.modified_count:
+            _bump_org_data_version(exp.get("organization_id"))
             updated += 1
             touched.append(exp["id"])
     return {"updated": updated, "touched_ids": touched}
@@ -661,67 +760,18 @@ def _aggregate_pnl(scope, start, end, basis):
     `balanced=false` À TORT (P&L=0 mais GL=revenu → diff=−subtotal). On aligne les
     trois chemins sur 'partial' inclus.
     """
-    if basis == "cash":
-        status_filter = "paid"
-    else:
-        status_filter = {"$in": ["sent", "partial", "paid", "overdue"]}
-    # [COMPTA] Bornes de période comparées en Python (via _in_period) et NON par
-    # un $gte/$lte de CHAÎNES Mongo : issue_date/expense_date sont stockés tantôt
-    # en 'YYYY-MM-DD', tantôt en ISO datetime complet (défaut serveur
+    # [COMPTA] Bornes de période sur les jours CANONIQUES issue_day/expense_day et NON
+    # par un $gte/$lte sur les chaînes brutes : issue_date/expense_date sont stockés
+    # tantôt en 'YYYY-MM-DD', tantôt en ISO datetime complet (défaut serveur
     # datetime.now().isoformat(), cf. create_invoice/create_expense). Un $lte de
-    # chaînes exclurait à tort une facture émise le DERNIER jour de la période
+    # chaînes brutes exclurait à tort une facture émise le DERNIER jour de la période
     # avec un issue_date='2026-03-31T22:00:00+00:00' ('...T22:00...' > '2026-03-31'
-    # en tri lexical). C'est ce filtrage-là qui faisait diverger le P&L du grand
-    # livre (qui, lui, filtre entry_date via _in_period) et déséquilibrait à tort
-    # /api/ledger/reconciliation (T13). On aligne les deux côtés sur _in_period.
-    _pnl_start = _parse_iso_date(start)
-    _pnl_end = _parse_iso_date(end)
-    invoice_filter = {
-        **scope,
-        "status": status_filter,
-    }
-    invoices = [
-        inv for inv in db.invoices.find(invoice_filter, {"_id": 0})
-        if _in_period(inv.get("issue_date"), _pnl_start, _pnl_end)
-    ]
-    revenue = 0.0
-    for inv in invoices:
-        rate = inv.get("exchange_rate_to_cad", 1.0) or 1.0
-        cur = inv.get("currency", "CAD")
-        subtotal = float(inv.get("subtotal", 0) or 0)
-        if cur != "CAD" and float(rate) > 0:
-            subtotal = subtotal / float(rate)
-        revenue += subtotal
-
-    # Même filtrage Python (_in_period) que les factures : tolère expense_date en
-    # ISO datetime complet en fin de borne (cf. commentaire ci-dessus).
-    expenses = [
-        exp for exp in db.expenses.find(scope, {"_id": 0})
-        if _in_period(exp.get("expense_date"), _pnl_start, _pnl_end)
-    ]
-
-    by_code = {}
-    for e in expenses:
-        code = e.get("category_code") or "other"
-        if code not in by_code:
-            by_code[code] = {"gross": 0.0, "deductible": 0.0}
-        # [COMPTA] Feature #7.7 — la charge est NETTE des taxes récupérables (CTI/RTI),
-        # alignée EXACTEMENT sur le grand livre (_expense_net_business_cad). La déductibilité
-        # (50 % repas, etc.) s'applique AU NET. Pour le télécom, la portion affaires est déjà
-        # isolée dans net_business et est 100 % déductible.
-        gross_val = _expense_net_business_cad(e)
-        if e.get("personal_use_amount_cad") is not None:
-            ded_val = gross_val  # télécom : portion affaires nette, 100 % déductible
-        else:
-            # Fallback : dérive le taux du catalogue si l'ancien schéma n'a pas snapshoté
-            # deductible_percentage (dépenses pré-#3), pour garder le 50 % repas.
-            pct = e.get("deductible_percentage")
-            if pct is None:
-                cat = _find_category(code)
-                pct = cat["deductible_percentage"] if cat else 100
-            ded_val = round(gross_val * float(pct) / 100, 2)
-        by_code[code]["gross"] += gross_val
-        by_code[code]["deductible"] += ded_val
+    # en tri lexical) — ce qui faisait diverger le P&L du grand livre (T13). Le jour
+    # canonique suit exactement la lecture de _in_period (cf. _find_in_period).
+    # Les mois entiers de la période sont lus dans les rollups mensuels (_report_totals).
+    totals = _report_totals(scope, start, end, basis)
+    revenue = totals["revenue"]
+    by_code = {c["code"]: c for c in totals["categories"]}
 
     groups_order = ["office", "marketing", "premises", "travel", "personnel", "other"]
     expense_groups = []
@@ -762,8 +812,8 @@ def _aggregate_pnl(scope, start, end, basis):
             "management": round(revenue - total_gross, 2),
             "taxable": round(revenue - total_ded, 2),
         },
-        "invoice_count": len(invoices),
-        "expense_count": len(expenses),
+        "invoice_count": totals["invoice_count"],
+        "expense_count": totals["expense_count"],
     }
 
 
@@ -855,6 +905,9 @@ def _enrich_invoice(invoice):
 import csv as csv_module
 import io
 import hashlib
+import codecs
+import unicodedata
+import itertools
 
 _CSV_INJECTION_PREFIXES = ("=", "+", "-", "@", "\t")
 
@@ -932,8 +985,35 @@ def _compute_file_hash(data):
     return hashlib.sha256(normalized).hexdigest()
 
 
-ROW_LIMIT = 5000
+def _compute_file_hash_stream(fileobj):
+    """Même empreinte que `_compute_file_hash`, calculée en flux sur un fichier binaire
+    seekable (un CR en fin de bloc est retenu pour normaliser un CRLF coupé en deux)."""
+    h = hashlib.sha256()
+    fileobj.seek(0)
+    pending_cr = False
+    while True:
+        block = fileobj.read(_BANK_STREAM_BLOCK)
+        if not block:
+            break
+        if pending_cr:
+            block = b"\r" + block
+        pending_cr = block.endswith(b"\r")
+        if pending_cr:
+            block = block[:-1]
+        h.update(block.replace(b"\r\n", b"\n").replace(b"\r", b"\n"))
+    if pending_cr:
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+# Plafond de lignes d'un relevé. Le pipeline CSV/XLSX est en flux (mémoire O(paquet), cf.
+# `_scan_bank_upload` / `_persist_bank_import`) : la limite n'est plus bornée par la RAM et peut
+# être relevée par env pour les relevés multi-années.
+ROW_LIMIT = int(os.environ.get("BANK_IMPORT_ROW_LIMIT", "5000"))
 MAX_XLSX_COLS = 100  # borne dure de colonnes lues par ligne XLSX (anti zip-bomb mémoire)
+BANK_IMPORT_CHUNK_SIZE = 500  # transactions insérées (puis auto-matchées) par paquet
+_BANK_STREAM_BLOCK = 64 * 1024  # taille de lecture / préfixe de détection d'encodage
+_BANK_CSV_ENCODINGS = ("utf-8-sig", "utf-8", "cp1252", "latin-1")
 
 
 def _decode_bank_csv(csv_bytes):
@@ -944,7 +1024,7 @@ def _decode_bank_csv(csv_bytes):
     quel octet en dernier recours. Évite le remplacement silencieux (U+FFFD) des accents
     français d'un fichier latin-1 que faisait l'ancien `decode('utf-8', errors='replace')`.
     """
-    for enc in ("utf-8-sig", "utf-8", "cp1252", "latin-1"):
+    for enc in _BANK_CSV_ENCODINGS:
         try:
             return csv_bytes.decode(enc)
         except (UnicodeDecodeError, LookupError):
@@ -952,12 +1032,39 @@ def _decode_bank_csv(csv_bytes):
     return csv_bytes.decode("utf-8", errors="replace")
 
 
+def _detect_bank_csv_encoding(prefix):
+    """Premier encodage de `_BANK_CSV_ENCODINGS` qui décode le PRÉFIXE du fichier. Décodeur
+    incrémental : un caractère multi-octets coupé en fin de préfixe n'est pas une erreur. Un
+    encodage rejeté ici le serait aussi sur le fichier complet -> même choix que
+    `_decode_bank_csv`, confirmé (ou dégradé) par la passe de validation `_scan_bank_upload`."""
+    for enc in _BANK_CSV_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(enc)().decode(prefix, final=False)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return _BANK_CSV_ENCODINGS[-1]
+
+
+def _iter_csv_cells(fileobj, mapping, encoding):
+    """Lignes CSV (listes de cellules) lues en flux depuis `fileobj` (binaire, seekable) :
+    décodage incrémental, jamais le fichier entier en mémoire. Un CSV malformé (octet NUL…)
+    -> ValueError (422) plutôt qu'une erreur 500."""
+    fileobj.seek(0)
+    text = io.TextIOWrapper(fileobj, encoding=encoding, newline="")
+    try:
+        yield from csv_module.reader(text, delimiter=mapping["delimiter"])
+    except csv_module.Error:
+        raise ValueError("Fichier CSV illisible")
+    finally:
+        text.detach()  # ne ferme PAS le fichier d'upload (relu par la passe suivante)
+
+
 def _parse_csv_rows(csv_bytes, mapping):
     """Parse les lignes CSV selon le mapping (décode puis délègue à _map_bank_rows).
     Lève ValueError("row limit") si > ROW_LIMIT lignes de données."""
-    text = _decode_bank_csv(csv_bytes)
-    reader = csv_module.reader(io.StringIO(text), delimiter=mapping["delimiter"])
-    return _map_bank_rows(reader, mapping)
+    open_rows, _total, _preview = _scan_bank_upload(io.BytesIO(csv_bytes), mapping, "csv")
+    return list(open_rows())
 
 
 def _map_bank_rows(rows, mapping):
@@ -965,7 +1072,12 @@ def _map_bank_rows(rows, mapping):
     lignes (chaque ligne = liste de cellules str). Partagé par le CSV et le XLSX pour un
     parsing IDENTIQUE. Retourne la liste de dicts {row_index, date, description, amount_cad,
     parse_error, raw_line(opt)} ; lève ValueError('row limit') au-delà de ROW_LIMIT lignes."""
-    out = []
+    return list(_iter_mapped_bank_rows(rows, mapping))
+
+
+def _iter_mapped_bank_rows(rows, mapping):
+    """Version générateur de `_map_bank_rows` (pipeline d'import en flux) : produit les lignes
+    mappées une à une ; ValueError('row limit') levée à la lecture de la ligne ROW_LIMIT+1."""
     data_index = 0
     skip_header = mapping.get("has_header", True)
     expected_cols = None  # référence du nb de colonnes (l'en-tête, ou la 1re ligne de données)
@@ -1034,9 +1146,8 @@ def _map_bank_rows(rows, mapping):
             row_dict["raw_line"] = (mapping["delimiter"].join(raw_row))[:500]
         else:
             row_dict["raw_line"] = None
-        out.append(row_dict)
+        yield row_dict
         data_index += 1
-    return out
 
 
 def _xlsx_cell_to_str(v):
@@ -1055,38 +1166,94 @@ def _xlsx_cell_to_str(v):
     return str(v)
 
 
-def _parse_xlsx_rows(xlsx_bytes, mapping):
-    """Parse un relevé XLSX (1re feuille) via le MÊME pipeline que le CSV (_map_bank_rows).
-    openpyxl en lecture seule + data_only (valeurs calculées, pas de formule).
+def _iter_xlsx_raw_rows(fileobj):
+    """Lignes brutes (cellules str) de la 1re feuille d'un XLSX, en flux : openpyxl en lecture
+    seule + data_only (valeurs calculées, pas de formule), sans matérialiser la feuille.
     Bornes DURES anti zip-bomb : ROW_LIMIT+50 lignes lues ET MAX_XLSX_COLS colonnes/ligne
     (une cellule très à droite ou une ligne maximalement large ne peut pas exploser la RAM).
-    Lève HTTPException 503 si openpyxl absent, ValueError si illisible ou > ROW_LIMIT lignes."""
+    Lève HTTPException 503 si openpyxl absent, ValueError si illisible."""
     try:
         import openpyxl  # lazy : n'impacte pas le boot si la lib manque sur un env
     except ImportError:
         raise HTTPException(503, "Support XLSX indisponible sur ce serveur.")
+    fileobj.seek(0)
     try:
-        wb = openpyxl.load_workbook(io.BytesIO(xlsx_bytes), read_only=True, data_only=True)
+        wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
     except Exception:
         raise ValueError("Fichier XLSX illisible ou corrompu")
     try:
         if not wb.sheetnames:
-            return _map_bank_rows([], mapping)
+            return
         ws = wb[wb.sheetnames[0]]
-        raw_rows = []
         for i, row in enumerate(ws.iter_rows(values_only=True)):
             if i > ROW_LIMIT + 50:      # borne de lecture (plafond réel de lignes dans _map_bank_rows)
                 break
-            # Tronque à MAX_XLSX_COLS AVANT de matérialiser les cellules : borne la mémoire à
-            # O(lignes × MAX_XLSX_COLS) même si la feuille a 16384 colonnes.
-            raw_rows.append([_xlsx_cell_to_str(c) for c in list(row)[:MAX_XLSX_COLS]])
+            # Tronque à MAX_XLSX_COLS AVANT de convertir les cellules : borne la mémoire à
+            # O(MAX_XLSX_COLS) par ligne même si la feuille a 16384 colonnes.
+            yield [_xlsx_cell_to_str(c) for c in itertools.islice(row, MAX_XLSX_COLS)]
     finally:
         wb.close()
-    # openpyxl (read_only) peut rogner les cellules vides de fin -> uniformise la largeur (bornée
-    # à MAX_XLSX_COLS pour ne pas répliquer une largeur contrôlée par l'attaquant) sans faux mismatch.
-    width = min(max((len(r) for r in raw_rows), default=0), MAX_XLSX_COLS)
-    norm = [r[:width] + [""] * (width - len(r)) for r in raw_rows]
-    return _map_bank_rows(norm, mapping)
+
+
+def _xlsx_width(fileobj):
+    """Largeur de référence d'un XLSX (plus longue ligne lue, bornée à MAX_XLSX_COLS)."""
+    return min(max((len(r) for r in _iter_xlsx_raw_rows(fileobj)), default=0), MAX_XLSX_COLS)
+
+
+def _iter_xlsx_cells(fileobj, width):
+    """Lignes XLSX uniformisées à `width` colonnes. openpyxl (read_only) peut rogner les
+    cellules vides de fin -> on complète sans faux col_mismatch (largeur bornée à MAX_XLSX_COLS
+    pour ne pas répliquer une largeur contrôlée par l'attaquant)."""
+    for r in _iter_xlsx_raw_rows(fileobj):
+        yield r[:width] + [""] * (width - len(r))
+
+
+def _parse_xlsx_rows(xlsx_bytes, mapping):
+    """Parse un relevé XLSX (1re feuille) via le MÊME pipeline que le CSV (_map_bank_rows).
+    Lève HTTPException 503 si openpyxl absent, ValueError si illisible ou > ROW_LIMIT lignes."""
+    open_rows, _total, _preview = _scan_bank_upload(io.BytesIO(xlsx_bytes), mapping, "xlsx")
+    return list(open_rows())
+
+
+def _count_bank_rows(rows, preview_size=10):
+    """Consomme un flux de lignes mappées : (nombre total, `preview_size` premières lignes)."""
+    total = 0
+    preview = []
+    for row in rows:
+        if total < preview_size:
+            preview.append(row)
+        total += 1
+    return total, preview
+
+
+def _scan_bank_upload(fileobj, mapping, source):
+    """Passe de VALIDATION en flux d'un relevé CSV/XLSX (aucune écriture) : choisit l'encodage
+    (CSV) ou la largeur (XLSX), compte les lignes (ValueError('row limit') au-delà de
+    ROW_LIMIT) et garde l'aperçu. Retourne (open_rows, total, preview) où `open_rows()` relit
+    le fichier en un générateur de lignes mappées — consommé par paquets par
+    `_persist_bank_import`. Mémoire O(ligne) : le fichier n'est jamais chargé en entier.
+
+    CSV : l'encodage est détecté sur un préfixe ; si un octet plus loin le contredit
+    (UnicodeDecodeError), on reprend la passe avec l'encodage suivant — même résultat que
+    `_decode_bank_csv` sur le fichier complet."""
+    if source == "xlsx":
+        width = _xlsx_width(fileobj)
+
+        def open_rows():
+            return _iter_mapped_bank_rows(_iter_xlsx_cells(fileobj, width), mapping)
+        total, preview = _count_bank_rows(open_rows())
+        return open_rows, total, preview
+    fileobj.seek(0)
+    first = _detect_bank_csv_encoding(fileobj.read(_BANK_STREAM_BLOCK))
+    for enc in _BANK_CSV_ENCODINGS[_BANK_CSV_ENCODINGS.index(first):]:
+        def open_rows(enc=enc):
+            return _iter_mapped_bank_rows(_iter_csv_cells(fileobj, mapping, enc), mapping)
+        try:
+            total, preview = _count_bank_rows(open_rows())
+        except UnicodeDecodeError:
+            continue
+        return open_rows, total, preview
+    raise ValueError("Encodage du fichier CSV non reconnu")
 
 
 def _get_invoice_outstanding(invoice):
@@ -1128,6 +1295,7 @@ def _release_bank_transaction(tx_id, scope):
                 updated["status"] = "sent"
             new_status = _recompute_invoice_status(updated)
             db.invoices.update_one({"id": iid, **scope}, {"$set": {"status": new_status}})
+            _report_data_changed(updated.get("organization_id"), updated.get("issue_date"))
     db.bank_transactions.update_one(
         {"id": tx_id, **scope},
         {"$set": {
@@ -1189,6 +1357,22 @@ def _apply_match(tx, kind, target_id, scope):
     now = datetime.now(timezone.utc).isoformat()
     tx_amount = abs(float(tx.get("amount_cad", 0) or 0))
 
+    def claim_tx(match_kind, match_id, invoice_id):
+        # Garde `status: unmatched` côté base (pas seulement sur le doc lu) : deux
+        # rapprochements concurrents de la même transaction -> un seul gagne.
+        res = db.bank_transactions.update_one(
+            {"id": tx["id"], **scope, "status": "unmatched"},
+            {"$set": {"status": "matched", "match_kind": match_kind,
+                      "match_id": match_id, "invoice_id": invoice_id,
+                      "matched_at": now}})
+        return res.matched_count == 1
+
+    def release_tx(match_id):
+        db.bank_transactions.update_one(
+            {"id": tx["id"], **scope, "status": "matched", "match_id": match_id},
+            {"$set": {"status": "unmatched", "match_kind": None, "match_id": None,
+                      "invoice_id": None, "matched_at": None}})
+
     if kind == "invoice_payment":
         invoice = db.invoices.find_one({"id": target_id, **scope}, {"_id": 0})
         if not invoice:
@@ -1204,16 +1388,23 @@ def _apply_match(tx, kind, target_id, scope):
             "bank_transaction_id": tx["id"],
             "created_at": now,
         }
-        db.invoices.update_one(
-            {"id": target_id, **scope},
+        if not claim_tx("invoice_payment", payment["id"], target_id):
+            raise HTTPException(409, "Transaction already matched or ignored")
+        # Verrou optimiste : le paiement n'est ajouté que si la facture a toujours le même
+        # nombre de paiements qu'à la lecture (pas de paiement concurrent -> pas de sur-paiement).
+        n_payments = len(invoice.get("payments") or [])
+        pushed = db.invoices.update_one(
+            {"id": target_id, **scope, "status": {"$ne": "paid"},
+             f"payments.{n_payments}": {"$exists": False}},
             {"$push": {"payments": payment}})
+        if pushed.matched_count == 0:
+            release_tx(payment["id"])
+            raise HTTPException(409, "Facture modifiée entre-temps — réessaie")
         updated = db.invoices.find_one({"id": target_id, **scope}, {"_id": 0})
         new_status = _recompute_invoice_status(updated)
         db.invoices.update_one({"id": target_id, **scope},
                                {"$set": {"status": new_status}})
-        match_kind = "invoice_payment"
-        match_id = payment["id"]
-        invoice_id = target_id
+        _report_data_changed(updated.get("organization_id"), updated.get("issue_date"))
 
     elif kind == "expense":
         expense = db.expenses.find_one({"id": target_id, **scope}, {"_id": 0})
@@ -1224,7 +1415,21 @@ def _apply_match(tx, kind, target_id, scope):
         # silence). Symétrique au garde tx.status == unmatched.
         if expense.get("bank_transaction_id") and expense.get("bank_transaction_id") != tx["id"]:
             raise HTTPException(409, "Cette dépense est déjà rapprochée à une autre transaction")
-        update = {"bank_transaction_id": tx["id"]}
+        # Réclamation ATOMIQUE (update conditionnel sur bank_transaction_id encore libre) : deux
+        # rapprochements concurrents (re-match parallèle, double clic) ne prennent jamais la
+        # même dépense — le perdant reçoit 409 et sa transaction reste non rapprochée.
+        claimed = db.expenses.update_one(
+            {"id": target_id, **scope, "bank_transaction_id": {"$in": [None, tx["id"]]}},
+            {"$set": {"bank_transaction_id": tx["id"]}})
+        if claimed.matched_count == 0:
+            raise HTTPException(409, "Cette dépense est déjà rapprochée à une autre transaction")
+        if not claim_tx("expense", target_id, None):
+            if not expense.get("bank_transaction_id"):
+                db.expenses.update_one(
+                    {"id": target_id, **scope, "bank_transaction_id": tx["id"]},
+                    {"$set": {"bank_transaction_id": None}})
+            raise HTTPException(409, "Transaction already matched or ignored")
+        update = {}
         # [FX] Dépense en DEVISE ÉTRANGÈRE : adopter le VRAI montant CAD débité par la banque
         # (le relevé) plutôt que l'estimation par taux de marché — la banque applique sa propre
         # marge de change. On conserve l'estimation d'origine (amount_cad_estimated) pour pouvoir
@@ -1244,25 +1449,18 @@ def _apply_match(tx, kind, target_id, scope):
                 update["deductible_amount"] = new_ded
                 if expense.get("personal_use_amount_cad") is not None:
                     update["personal_use_amount_cad"] = round(tx_amount - new_ded, 2)
-        db.expenses.update_one({"id": target_id, **scope}, {"$set": update})
+        if update:
+            db.expenses.update_one({"id": target_id, **scope}, {"$set": update})
+            _report_data_changed(expense.get("organization_id"), expense.get("expense_date"))
         if "amount_cad" in update:
             _repost_expense_gl(
                 expense.get("organization_id"),
                 expense.get("created_by_user_id") or expense.get("user_id"),
                 target_id, db.expenses.find_one({"id": target_id, **scope}, {"_id": 0}))
-        match_kind = "expense"
-        match_id = target_id
-        invoice_id = None
 
     else:
         raise HTTPException(422, "Invalid kind")
 
-    db.bank_transactions.update_one(
-        {"id": tx["id"], **scope},
-        {"$set": {"status": "matched", "match_kind": match_kind,
-                  "match_id": match_id, "invoice_id": invoice_id,
-                  "matched_at": now}},
-    )
     return db.bank_transactions.find_one({"id": tx["id"], **scope}, {"_id": 0})
 
 
@@ -1327,6 +1525,7 @@ def _apply_invoice_split_match(tx, target_ids, scope):
         new_status = _recompute_invoice_status(updated)
         db.invoices.update_one({"id": inv["id"], **scope},
                                {"$set": {"status": new_status}})
+        _report_data_changed(updated.get("organization_id"), updated.get("issue_date"))
         payment_ids.append(payment["id"])
 
     db.bank_transactions.update_one(
@@ -1354,6 +1553,14 @@ def _parse_iso_date(s):
             return None
 
 
+def _canonical_day(raw):
+    """Jour métier canonique 'YYYY-MM-DD' (champs `issue_day`/`expense_day`) d'une date brute
+    'YYYY-MM-DD' ou ISO datetime — même lecture que `_in_period` — ou None si illisible.
+    Les rapports filtrent ce champ par plage ($gte/$lte de chaînes homogènes, indexé)."""
+    d = _parse_iso_date(raw) if isinstance(raw, str) else None
+    return d.isoformat() if d else None
+
+
 def _require_entry_date(value) -> str:
     """Valide et NORMALISE une entry_date comptable (§4 modèle, ligne 94 spec).
 
@@ -1383,10 +1590,31 @@ def _score_invoice_candidate(tx_date, target, inv, client_name_lower, desc_lower
     hors stopwords bancaires, donc « Ferme Lebleu-Deschamps inc. » matche « virement interac
     de /LEBLEU DESCHAM/ » via le token « lebleu ». La sécurité anti-faux-match reste assurée
     par la décision au niveau `_auto_match_transactions` (top==3 ET second<3)."""
-    outstanding = _get_invoice_outstanding(inv)
-    amount_diff = abs(outstanding - target)
+    return _score_invoice_entry(tx_date, target, _invoice_match_entry(inv, client_name_lower),
+                                desc_lower)
+
+
+def _invoice_match_entry(inv, client_name_lower="", pos=0):
+    """Précalcule UNE fois ce que le scoring d'une facture relit à chaque transaction : solde,
+    dates émission/échéance parsées, nom client + ses tokens. `pos` = rang dans la liste
+    d'origine (départage stable, cf. `_build_bank_match_index`)."""
     issue = _parse_iso_date(inv.get("issue_date"))
-    due = _parse_iso_date(inv.get("due_date")) or issue
+    return {
+        "doc": inv, "pos": pos,
+        "outstanding": _get_invoice_outstanding(inv),
+        "issue": issue,
+        "due": _parse_iso_date(inv.get("due_date")) or issue,
+        "client_name": client_name_lower,
+        "client_tokens": _significant_tokens(client_name_lower),
+    }
+
+
+def _score_invoice_entry(tx_date, target, entry, desc_lower, desc_tokens=None):
+    """Cœur de `_score_invoice_candidate` sur une entrée précalculée (`_invoice_match_entry`)."""
+    outstanding = entry["outstanding"]
+    amount_diff = abs(outstanding - target)
+    issue = entry["issue"]
+    due = entry["due"]
     score = 1  # filtre amount = +1
     date_diff = 999
     if issue:
@@ -1395,7 +1623,8 @@ def _score_invoice_candidate(tx_date, target, inv, client_name_lower, desc_lower
         date_diff = min(d_issue, d_due)
         if d_issue <= 3 or d_due <= 3:
             score += 1
-    if _name_match(client_name_lower, desc_lower):
+    if _name_match(entry["client_name"], desc_lower,
+                   name_tokens=entry["client_tokens"], desc_tokens=desc_tokens):
         score += 1
     return score, date_diff, amount_diff
 
@@ -1422,17 +1651,22 @@ def _significant_tokens(s):
             if len(t) >= 3 and not t.isdigit() and t not in _MATCH_STOPWORDS}
 
 
-def _name_match(name, desc_lower):
+def _name_match(name, desc_lower, name_tokens=None, desc_tokens=None):
     """Vrai si le nom de la dépense (vendor OU description) recoupe la description bancaire :
     inclusion dans un sens ou l'autre, OU partage d'au moins un token significatif (≥3 car,
     hors mots génériques). Permissif mais ancré sur un vrai token — « genspark » matche
-    « GENSPARK.AI 877-... », mais « Paiement X » ne matche pas « Paiement Y »."""
+    « GENSPARK.AI 877-... », mais « Paiement X » ne matche pas « Paiement Y ».
+    `name_tokens` / `desc_tokens` : tokens déjà calculés (index du matcheur), sinon recalculés."""
     name = (name or "").strip().lower()
     if not name:
         return False
     if name in desc_lower or (desc_lower and desc_lower in name):
         return True
-    return bool(_significant_tokens(name) & _significant_tokens(desc_lower))
+    if name_tokens is None:
+        name_tokens = _significant_tokens(name)
+    if desc_tokens is None:
+        desc_tokens = _significant_tokens(desc_lower)
+    return bool(name_tokens & desc_tokens)
 
 
 def _alias_bridges(tx_tokens, exp_tokens, aliases):
@@ -1440,26 +1674,119 @@ def _alias_bridges(tx_tokens, exp_tokens, aliases):
     nom de la dépense : ses bank_tokens recoupent les tokens du relevé ET ses vendor_tokens
     recoupent ceux de la dépense. Permet de rapprocher « Genspark.ai » -> « MainFunc » après
     l'avoir fait manuellement une fois, même sans token commun direct. NE débloque QUE le
-    signal nom — le montant (±0,01 CAD / ±5 % devise) et la date restent requis."""
+    signal nom — le montant (±0,01 CAD / ±5 % devise) et la date restent requis.
+
+    `aliases` : index inversé (`_build_alias_index`, cf. `_alias_index_for`) ou liste brute
+    d'alias. Le pont devient une intersection d'ensembles d'ids d'alias."""
     if not tx_tokens or not exp_tokens or not aliases:
         return False
-    for a in aliases:
-        if (set(a.get("bank_tokens") or []) & tx_tokens) and (set(a.get("vendor_tokens") or []) & exp_tokens):
-            return True
-    return False
+    index = aliases if isinstance(aliases, dict) else _build_alias_index(aliases)
+    if not index["size"]:
+        return False
+    return bool(_alias_ids_for(index, "bank", tx_tokens)
+                & _alias_ids_for(index, "vendor", exp_tokens))
+
+
+def _build_alias_index(aliases):
+    """Index inversé des alias appris : token -> ids d'alias (rang dans `aliases`), côté relevé
+    (`bank`) et côté fournisseur (`vendor`)."""
+    bank, vendor = {}, {}
+    for i, a in enumerate(aliases):
+        for t in a.get("bank_tokens") or []:
+            bank.setdefault(t, set()).add(i)
+        for t in a.get("vendor_tokens") or []:
+            vendor.setdefault(t, set()).add(i)
+    return {"bank": bank, "vendor": vendor, "size": len(aliases)}
+
+
+def _alias_ids_for(index, side, tokens):
+    """Union des ids d'alias dont le côté `side` ('bank' | 'vendor') contient un des tokens."""
+    ids = set()
+    postings = index[side]
+    for t in tokens:
+        ids.update(postings.get(t, ()))
+    return ids
+
+
+# Cache process-local des index d'alias par org : {organization_id: {"stamp", "index"}}. Le
+# stamp (nb d'alias, max last_used_at) détecte un upsert fait par un AUTRE worker ; dans ce
+# process, `_record_match_alias` invalide directement. Borné (FIFO) pour ne pas croître sans fin.
+_ALIAS_INDEX_CACHE = {}
+_ALIAS_INDEX_CACHE_MAX_ORGS = 256
+
+
+def _scope_organization_id(scope):
+    """organization_id d'un filtre `_org_scope` (ou d'un filtre plat {organization_id: ...})."""
+    if scope.get("organization_id"):
+        return scope["organization_id"]
+    for branch in scope.get("$or") or []:
+        if isinstance(branch.get("organization_id"), str):
+            return branch["organization_id"]
+    return None
+
+
+def _invalidate_alias_index(organization_id):
+    _ALIAS_INDEX_CACHE.pop(organization_id, None)
+
+
+def _alias_index_for(scope):
+    """Index inversé des alias de l'org du `scope`, partagé par l'auto-match (import et
+    rematch) et les suggestions. Reconstruit seulement si le stamp a changé : une agrégation
+    légère remplace le rechargement complet de `bank_match_aliases` à chaque appel."""
+    org_id = _scope_organization_id(scope)
+    stamp_doc = next(db.bank_match_aliases.aggregate([
+        {"$match": scope},
+        {"$group": {"_id": None, "n": {"$sum": 1}, "last": {"$max": "$last_used_at"}}},
+    ]), None)
+    stamp = (stamp_doc["n"], stamp_doc["last"]) if stamp_doc else (0, None)
+    cached = _ALIAS_INDEX_CACHE.get(org_id) if org_id else None
+    if cached is not None and cached["stamp"] == stamp:
+        return cached["index"]
+    index = _build_alias_index(list(db.bank_match_aliases.find(
+        scope, {"_id": 0, "bank_tokens": 1, "vendor_tokens": 1})))
+    if org_id:
+        _ALIAS_INDEX_CACHE.pop(org_id, None)
+        while len(_ALIAS_INDEX_CACHE) >= _ALIAS_INDEX_CACHE_MAX_ORGS:
+            _ALIAS_INDEX_CACHE.pop(next(iter(_ALIAS_INDEX_CACHE)))
+        _ALIAS_INDEX_CACHE[org_id] = {"stamp": stamp, "index": index}
+    return index
 
 
 def _score_expense_candidate(tx_date, target, exp, desc_lower, aliases=None, tx_tokens=None):
     """Score d'un candidat dépense. Le NOM (vendor OU description, recoupement direct OU alias
     APPRIS) est l'ancre : +2, REQUIS pour un auto-match (seuil 4). Bonus : montant EXACT (±0,01)
     +1 et date proche (≤3j) +1. Max = 5."""
-    amount_diff = abs(float(exp.get("amount_cad", 0) or 0) - target)
-    exp_date = _parse_iso_date(exp.get("expense_date") or exp.get("date"))
-    date_diff = abs((tx_date - exp_date).days) if exp_date else 999
+    return _score_expense_entry(tx_date, target, _expense_match_entry(exp), desc_lower,
+                                aliases, tx_tokens)
+
+
+def _expense_match_entry(exp, pos=0):
+    """Précalcule UNE fois ce que le matcheur relit à chaque transaction pour une dépense :
+    montant CAD, date parsée, nom (vendor OU description) + ses tokens, devise étrangère,
+    empreinte de doublon. `pos` = rang dans la liste d'origine (départage stable)."""
     name = exp.get("vendor") or exp.get("description") or ""
-    name_matched = _name_match(name, desc_lower)
+    cur = (exp.get("currency") or "CAD").strip().upper()
+    return {
+        "doc": exp, "pos": pos,
+        "amount_cad": float(exp.get("amount_cad", 0) or 0),
+        "date": _parse_iso_date(exp.get("expense_date") or exp.get("date")),
+        "name": name,
+        "name_tokens": _significant_tokens(name),
+        "is_foreign": cur not in ("", "CAD"),
+        "fp": _expense_dup_fingerprint(exp),
+    }
+
+
+def _score_expense_entry(tx_date, target, entry, desc_lower, aliases=None, tx_tokens=None,
+                         desc_tokens=None):
+    """Cœur de `_score_expense_candidate` sur une entrée précalculée (`_expense_match_entry`)."""
+    amount_diff = abs(entry["amount_cad"] - target)
+    exp_date = entry["date"]
+    date_diff = abs((tx_date - exp_date).days) if exp_date else 999
+    name_matched = _name_match(entry["name"], desc_lower,
+                               name_tokens=entry["name_tokens"], desc_tokens=desc_tokens)
     if not name_matched:  # repli sur la mémoire de rapprochements manuels
-        name_matched = _alias_bridges(tx_tokens, _significant_tokens(name), aliases)
+        name_matched = _alias_bridges(tx_tokens, entry["name_tokens"], aliases)
     score = 1  # dans la fourchette de montant
     if name_matched:
         score += 2
@@ -1489,6 +1816,7 @@ def _record_match_alias(organization_id, tx_description, expense):
          "$setOnInsert": {"created_at": now},
          "$inc": {"hit_count": 1}},
         upsert=True)
+    _invalidate_alias_index(organization_id)
 
 
 def _expense_dup_fingerprint(exp):
@@ -1532,27 +1860,161 @@ def _expense_dup_fingerprint(exp):
     )
 
 
-def _auto_match_transactions(import_id, scope):
+import bisect
+
+
+def _amount_cents(value):
+    """Montant -> centimes entiers (clé de bucket de l'index du matcheur)."""
+    return int(round(float(value) * 100))
+
+
+def _match_window(pairs):
+    """Trie des (clé, entrée) par clé et renvoie (clés, entrées) alignées pour `bisect`."""
+    pairs.sort(key=lambda p: (p[0], p[1]["pos"]))
+    return [k for k, _ in pairs], [e for _, e in pairs]
+
+
+def _build_bank_match_index(open_invoices=(), open_expenses=(), clients_by_id=None):
+    """Index du matcheur bancaire, construit UNE fois par passe d'auto-match (au lieu de
+    re-parcourir toutes les factures/dépenses ouvertes pour chaque transaction).
+
+    - factures : buckets par solde en centimes, chaque bucket trié par date d'émission ;
+    - dépenses CAD : buckets par montant CAD en centimes, triés par date de dépense ;
+    - dépenses en devise : liste triée par montant en centimes (fourchette ±5 % = plage
+      `bisect`), la date étant filtrée ensuite.
+
+    Chaque entrée porte ses champs précalculés (`_invoice_match_entry` / `_expense_match_entry`)
+    et son rang `pos` dans la liste d'origine : les requêtes renvoient les hits dans CET ordre,
+    donc le tri stable des candidats départage exactement comme l'ancienne boucle. Les documents
+    sans date exploitable (jamais candidats) ou au montant non fini sont exclus d'emblée."""
+    clients_by_id = clients_by_id or {}
+    inv_buckets = {}
+    for pos, inv in enumerate(open_invoices):
+        entry = _invoice_match_entry(
+            inv, clients_by_id.get(inv.get("client_id"), "").lower(), pos)
+        if entry["issue"] is None or not math.isfinite(entry["outstanding"]):
+            continue
+        inv_buckets.setdefault(_amount_cents(entry["outstanding"]), []).append(
+            (entry["issue"].toordinal(), entry))
+    exp_buckets = {}
+    foreign = []
+    for pos, exp in enumerate(open_expenses):
+        entry = _expense_match_entry(exp, pos)
+        if entry["date"] is None or not math.isfinite(entry["amount_cad"]):
+            continue
+        cents = _amount_cents(entry["amount_cad"])
+        if entry["is_foreign"]:
+            foreign.append((cents, entry))
+        else:
+            exp_buckets.setdefault(cents, []).append((entry["date"].toordinal(), entry))
+    return {
+        "invoices": {c: _match_window(b) for c, b in inv_buckets.items()},
+        "expenses": {c: _match_window(b) for c, b in exp_buckets.items()},
+        "foreign_expenses": _match_window(foreign),
+        "consumed": set(),
+    }
+
+
+def _match_index_invoices(index, tx_date, target):
+    """Factures candidates pour un crédit : solde à ±0,01 de `target` ET émise dans
+    [tx_date − 90 j, tx_date + 3 j]. Hits dans l'ordre d'origine."""
+    lo = (tx_date - timedelta(days=90)).toordinal()
+    hi = (tx_date + timedelta(days=3)).toordinal()
+    cents = _amount_cents(target)
+    hits = []
+    # ±2 centimes couvre tout écart flottant ≤ 0,01 ; le filtre exact ci-dessous tranche.
+    for c in range(cents - 2, cents + 3):
+        bucket = index["invoices"].get(c)
+        if not bucket:
+            continue
+        keys, entries = bucket
+        for e in entries[bisect.bisect_left(keys, lo):bisect.bisect_right(keys, hi)]:
+            if abs(e["outstanding"] - target) <= 0.01:
+                hits.append(e)
+    hits.sort(key=lambda e: e["pos"])
+    return hits
+
+
+def _match_index_expenses(index, tx_date, target, max_days=7, fx_tolerance=True):
+    """Dépenses candidates pour un débit, non encore consommées : date à ±`max_days` jours et
+    montant EXACT (±0,01) — ou ±5 % du montant de la transaction (min 0,02) pour une dépense en
+    devise si `fx_tolerance`. Hits dans l'ordre d'origine."""
+    lo = (tx_date - timedelta(days=max_days)).toordinal()
+    hi = (tx_date + timedelta(days=max_days)).toordinal()
+    cents = _amount_cents(target)
+    consumed = index["consumed"]
+    hits = []
+    for c in range(cents - 2, cents + 3):
+        bucket = index["expenses"].get(c)
+        if not bucket:
+            continue
+        keys, entries = bucket
+        for e in entries[bisect.bisect_left(keys, lo):bisect.bisect_right(keys, hi)]:
+            if abs(e["amount_cad"] - target) <= 0.01 and e["doc"].get("id") not in consumed:
+                hits.append(e)
+    fx_tol = max(0.02, round(target * 0.05, 2)) if fx_tolerance else 0.01
+    tol_cents = _amount_cents(fx_tol)
+    keys, entries = index["foreign_expenses"]
+    for e in entries[bisect.bisect_left(keys, cents - tol_cents - 2):
+                     bisect.bisect_right(keys, cents + tol_cents + 2)]:
+        if abs(e["amount_cad"] - target) > fx_tol or e["doc"].get("id") in consumed:
+            continue
+        if abs((tx_date - e["date"]).days) <= max_days:
+            hits.append(e)
+    hits.sort(key=lambda e: e["pos"])
+    return hits
+
+
+def _invoice_client_names(invoices, scope):
+    """{client_id: nom} des seuls clients des factures données — UNE requête $in."""
+    ids = list({inv.get("client_id") for inv in invoices if inv.get("client_id")})
+    if not ids:
+        return {}
+    return {c["id"]: (c.get("name") or "")
+            for c in db.clients.find({**scope, "id": {"$in": ids}},
+                                     {"_id": 0, "id": 1, "name": 1})}
+
+
+def _bank_match_context(scope):
+    """Charge UNE fois ce dont l'auto-match a besoin pour le `scope` : index des factures et
+    dépenses ouvertes (`_build_bank_match_index`) + index des alias appris. Réutilisable sur
+    plusieurs paquets d'un même import (les dépenses consommées restent marquées)."""
+    open_invoices = list(db.invoices.find(
+        {**scope, "status": {"$in": ["sent", "partial", "overdue"]}}, {"_id": 0}))
+    open_expenses = list(db.expenses.find(
+        {**scope, "bank_transaction_id": None}, {"_id": 0}))
+    clients_by_id = _invoice_client_names(open_invoices, scope)
+    return {
+        "index": _build_bank_match_index(open_invoices, open_expenses, clients_by_id),
+        "client_names": clients_by_id,
+        # Mémoire de rapprochements manuels (feature #7.3) : alias description-relevé ->
+        # nom-dépense, en index inversé token -> alias (cache par org, cf. `_alias_index_for`).
+        "aliases": _alias_index_for(scope),
+    }
+
+
+def _auto_match_transactions(import_id, scope, tx_ids=None, context=None):
     """Pour chaque transaction unmatched de l'import, tente un match auto.
     Retourne nombre de matches appliqués.
 
     `scope` est un filtre Mongo (typiquement `_org_scope(current_user)`). Sans ça,
     un non-owner important un CSV n'obtient AUCUN auto-match car les lookups
     d'invoices/expenses/clients sont keyés sur le `user_id` legacy du membre.
+
+    Les candidats sont lus dans un index construit une fois (`_build_bank_match_index`) :
+    O(transactions × candidats du bucket) au lieu de O(transactions × documents ouverts).
+    `tx_ids` restreint la passe à un paquet de transactions ; `context`
+    (`_bank_match_context`) permet de partager l'index entre les paquets d'un import.
     """
-    open_invoices = list(db.invoices.find(
-        {**scope, "status": {"$in": ["sent", "partial", "overdue"]}}, {"_id": 0}))
-    open_expenses = list(db.expenses.find(
-        {**scope, "bank_transaction_id": None}, {"_id": 0}))
-    clients_by_id = {c["id"]: (c.get("name") or "")
-                     for c in db.clients.find(scope,
-                                              {"_id": 0, "id": 1, "name": 1})}
-    # Mémoire de rapprochements manuels (feature #7.3) : alias description-relevé -> nom-dépense.
-    aliases = list(db.bank_match_aliases.find(scope, {"_id": 0}))
-
-    txs = list(db.bank_transactions.find(
-        {"import_id": import_id, **scope, "status": "unmatched",
-         "parse_error": False}, {"_id": 0}))
+    if context is None:
+        context = _bank_match_context(scope)
+    index = context["index"]
+    aliases = context["aliases"]
+
+    tx_query = {"import_id": import_id, **scope, "status": "unmatched", "parse_error": False}
+    if tx_ids is not None:
+        tx_query["id"] = {"$in": list(tx_ids)}
+    txs = list(db.bank_transactions.find(tx_query, {"_id": 0}))
     applied = 0
     for tx in txs:
         if tx.get("date") is None or tx.get("amount_cad") is None:
@@ -1561,51 +2023,37 @@ def _auto_match_transactions(import_id, scope):
         if tx_date is None:
             continue
         target = abs(float(tx["amount_cad"]))
+        if not math.isfinite(target):
+            continue
         desc_lower = (tx.get("description") or "").lower()
         tx_tokens = _significant_tokens(tx.get("description"))
         candidates = []
 
         if tx["amount_cad"] > 0:  # crédit → factures
-            for inv in open_invoices:
-                outstanding = _get_invoice_outstanding(inv)
-                if abs(outstanding - target) > 0.01:
-                    continue
-                issue = _parse_iso_date(inv.get("issue_date"))
-                if not issue:
-                    continue
-                if not (tx_date - timedelta(days=90) <= issue <= tx_date + timedelta(days=3)):
-                    continue
-                client_name = clients_by_id.get(inv.get("client_id"), "").lower()
-                score, date_diff, amt_diff = _score_invoice_candidate(
-                    tx_date, target, inv, client_name, desc_lower)
+            for entry in _match_index_invoices(index, tx_date, target):
+                score, date_diff, amt_diff = _score_invoice_entry(
+                    tx_date, target, entry, desc_lower, desc_tokens=tx_tokens)
                 candidates.append((score, date_diff, amt_diff,
-                                   {"kind": "invoice_payment", "id": inv["id"]}))
+                                   {"kind": "invoice_payment", "id": entry["doc"]["id"]}))
 
         elif tx["amount_cad"] < 0:  # débit → dépenses
-            for exp in open_expenses:
-                exp_cad = float(exp.get("amount_cad", 0) or 0)
-                # Montant EXACT (±0,01) par défaut. Fourchette ±5 % du montant de la TRANSACTION
-                # uniquement pour une dépense marquée en devise étrangère (son CAD est un estimé
-                # ≠ débité). Pour une dépense CAD, aucun estimé de change n'excuse un écart : un
-                # montant décalé = probablement une AUTRE charge du même fournisseur -> exact requis
-                # (sinon faux rapprochement — cf. revue : Bell 100↔105, vol glouton entre tx).
-                cur = (exp.get("currency") or "CAD").strip().upper()
-                is_foreign = cur not in ("", "CAD")
-                amount_tol = max(0.02, round(target * 0.05, 2)) if is_foreign else 0.01
-                if abs(exp_cad - target) > amount_tol:
-                    continue
-                exp_date = _parse_iso_date(exp.get("expense_date") or exp.get("date"))
-                if not exp_date or abs((tx_date - exp_date).days) > 7:  # fenêtre élargie (délai saisie/débit)
-                    continue
-                score, date_diff, amt_diff = _score_expense_candidate(
-                    tx_date, target, exp, desc_lower, aliases, tx_tokens)
+            # Montant EXACT (±0,01) par défaut. Fourchette ±5 % du montant de la TRANSACTION
+            # uniquement pour une dépense marquée en devise étrangère (son CAD est un estimé
+            # ≠ débité). Pour une dépense CAD, aucun estimé de change n'excuse un écart : un
+            # montant décalé = probablement une AUTRE charge du même fournisseur -> exact requis
+            # (sinon faux rapprochement — cf. revue : Bell 100↔105, vol glouton entre tx).
+            # Fenêtre de date élargie à ±7 j (délai saisie/débit).
+            for entry in _match_index_expenses(index, tx_date, target, max_days=7):
+                score, date_diff, amt_diff = _score_expense_entry(
+                    tx_date, target, entry, desc_lower, aliases, tx_tokens,
+                    desc_tokens=tx_tokens)
                 # Empreinte complète (payeur, libellé, montant, devise, catégorie, taxes) : sert à
                 # détecter les DOUBLONS INDISCERNABLES à la décision (abonnement récurrent débité N
                 # fois). NB : une simple signature de tokens ne suffit PAS (les stopwords écrasent
                 # « Tremblay Inc » et « Tremblay Ltd » sur le même token) -> revue adversariale.
                 candidates.append((score, date_diff, amt_diff,
-                                   {"kind": "expense", "id": exp["id"],
-                                    "fp": _expense_dup_fingerprint(exp)}))
+                                   {"kind": "expense", "id": entry["doc"]["id"],
+                                    "fp": entry["fp"]}))
 
         if not candidates:
             continue
@@ -1625,7 +2073,7 @@ def _auto_match_transactions(import_id, scope):
             # partagent l'empreinte EXACTE du meilleur (même payeur, libellé, montant, catégorie,
             # taxes) ET sont en CAD, l'ambiguïté est bénigne — un abonnement récurrent débité N fois
             # (Emergent.sh 144,67 $) s'apparie 1:1 quel que soit l'ordre et produit des livres
-            # identiques. On prend le plus proche en date puis on consomme (open_expenses) -> 1:1.
+            # identiques. On prend le plus proche en date puis on consomme (index) -> 1:1.
             #
             # Restreint au CAD : pour une dépense en devise, amount_cad n'est qu'un ESTIMÉ (≠ débité)
             # et _apply_match le RÉÉCRIT au montant du relevé — deux estimés égaux ne prouvent donc
@@ -1646,7 +2094,7 @@ def _auto_match_transactions(import_id, scope):
                 _apply_match(tx, top[3]["kind"], top[3]["id"], scope)
                 applied += 1
                 if top[3]["kind"] == "expense":
-                    open_expenses = [e for e in open_expenses if e["id"] != top[3]["id"]]
+                    index["consumed"].add(top[3]["id"])
             except HTTPException:
                 pass
     return applied
@@ -1686,7 +2134,8 @@ MAX_IMAGE_MEGAPIXELS = 50
 
 def _check_image_decompression(data):
     """Ouvre l'image et vérifie que les dimensions ne sont pas excessives.
-    Lève ValueError si > 50 MP ou si l'image est corrompue."""
+    Lève ValueError si > 50 MP ou si l'image est corrompue. Retourne l'image chargée
+    (réutilisée par `_normalize_receipt_image`, sans 2e décodage)."""
     try:
         img = PILImage.open(io.BytesIO(data))
         img.load()
@@ -1695,6 +2144,66 @@ def _check_image_decompression(data):
     w, h = img.size
     if w * h > MAX_IMAGE_MEGAPIXELS * 1_000_000:
         raise ValueError(f"Image too large: {w}x{h} = {w*h/1e6:.1f} MP > {MAX_IMAGE_MEGAPIXELS} MP")
+    return img
+
+
+# Normalisation des reçus (photo de téléphone 4–12 MP -> ~2000 px) AVANT l'OCR et le stockage.
+RECEIPT_MAX_EDGE = int(os.environ.get("RECEIPT_MAX_EDGE", "2000"))
+RECEIPT_IMAGE_FORMAT = os.environ.get("RECEIPT_IMAGE_FORMAT", "JPEG").upper()  # JPEG ou WEBP
+RECEIPT_IMAGE_QUALITY = int(os.environ.get("RECEIPT_IMAGE_QUALITY", "82"))
+RECEIPT_THUMB_EDGE = 320
+_RECEIPT_FORMAT_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def _encode_receipt_image(img, fmt, quality):
+    buf = io.BytesIO()
+    if fmt == "WEBP":
+        img.save(buf, "WEBP", quality=quality, method=4)
+    else:
+        img.save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def _normalize_receipt_image(img, raw, mime):
+    """Image de reçu prête pour l'OCR et le stockage, depuis l'image chargée par
+    `_check_image_decompression` :
+    - rotation selon l'orientation EXIF (photo prise de côté) ;
+    - 1re frame seulement (GIF animé), transparence aplatie sur fond blanc ;
+    - réduction au plus à RECEIPT_MAX_EDGE px de côté (jamais d'agrandissement) ;
+    - ré-encodage JPEG/WebP (RECEIPT_IMAGE_FORMAT) — les métadonnées EXIF (GPS) disparaissent.
+    L'original est conservé tel quel s'il est déjà au format cible, droit, assez petit et plus
+    léger que le ré-encodage. Retourne {"data", "mime_type", "width", "height", "thumbnail"}
+    (miniature JPEG RECEIPT_THUMB_EDGE px pour les listes)."""
+    from PIL import ImageOps
+    fmt = RECEIPT_IMAGE_FORMAT if RECEIPT_IMAGE_FORMAT in _RECEIPT_FORMAT_MIME else "JPEG"
+    target_mime = _RECEIPT_FORMAT_MIME[fmt]
+    try:
+        oriented = img.getexif().get(0x0112, 1) not in (None, 1)  # tag EXIF Orientation
+    except Exception:
+        oriented = False
+    rotated = ImageOps.exif_transpose(img) if oriented else img
+    if rotated.mode in ("RGBA", "LA", "P"):
+        rgba = rotated.convert("RGBA")
+        flat = PILImage.new("RGB", rgba.size, (255, 255, 255))
+        flat.paste(rgba, mask=rgba.split()[-1])
+        rotated = flat
+    elif rotated.mode != "RGB":
+        rotated = rotated.convert("RGB")
+    resized = max(rotated.size) > RECEIPT_MAX_EDGE
+    if resized:
+        rotated.thumbnail((RECEIPT_MAX_EDGE, RECEIPT_MAX_EDGE), PILImage.LANCZOS)
+    data = _encode_receipt_image(rotated, fmt, RECEIPT_IMAGE_QUALITY)
+    if mime == target_mime and not resized and not oriented and len(raw) <= len(data):
+        data = raw
+    thumb = rotated.copy()
+    thumb.thumbnail((RECEIPT_THUMB_EDGE, RECEIPT_THUMB_EDGE), PILImage.LANCZOS)
+    return {
+        "data": data,
+        "mime_type": target_mime,
+        "width": rotated.size[0],
+        "height": rotated.size[1],
+        "thumbnail": _encode_receipt_image(thumb, "JPEG", 70),
+    }
 
 
 def _normalize_extraction(payload):
@@ -1746,10 +2255,10 @@ SCAN_QUOTA_LIMIT = 400
 import anthropic
 
 
-def _check_and_bill_scan(organization_id):
-    """Atomique : reset le compteur si mois changé, puis l'incrémente.
-    Retourne le nouveau count (1..400). Lève HTTPException 429 si > 400
-    avec rollback decrement.
+def _check_and_bill_scan(organization_id, n=1):
+    """Atomique : reset le compteur si mois changé, puis l'incrémente de `n`
+    (lot de reçus : réservation tout-ou-rien). Retourne le nouveau count
+    (n..400). Lève HTTPException 429 si > 400 avec rollback decrement.
 
     Feature #11 — le quota est partagé entre tous les membres d'une même
     organisation : on écrit désormais sur `db.organizations` (source de
@@ -1766,8 +2275,8 @@ def _check_and_bill_scan(organization_id):
             "scan_count_this_month": {
                 "$cond": [
                     {"$lt": [{"$ifNull": ["$scan_quota_reset_at", ""]}, month_start]},
-                    1,
-                    {"$add": [{"$ifNull": ["$scan_count_this_month", 0]}, 1]},
+                    n,
+                    {"$add": [{"$ifNull": ["$scan_count_this_month", 0]}, n]},
                 ]
             },
             "scan_quota_reset_at": {
@@ -1784,12 +2293,22 @@ def _check_and_bill_scan(organization_id):
         raise HTTPException(404, "Organization not found")
     count = org_after.get("scan_count_this_month", 0)
     if count > SCAN_QUOTA_LIMIT:
-        db.organizations.update_one({"id": organization_id}, {"$inc": {"scan_count_this_month": -1}})
+        _refund_scans(organization_id, n)
+        if n > 1:
+            raise HTTPException(429, f"Quota mensuel insuffisant pour {n} scans "
+                                     f"({max(0, SCAN_QUOTA_LIMIT - (count - n))} restants)")
         raise HTTPException(429, f"Quota mensuel atteint ({SCAN_QUOTA_LIMIT} scans)")
     return count
 
 
+def _refund_scans(organization_id, n=1):
+    """Rend `n` scans réservés par `_check_and_bill_scan` (échec d'extraction)."""
+    if n:
+        db.organizations.update_one({"id": organization_id}, {"$inc": {"scan_count_this_month": -n}})
+
+
 _anthropic_client = None
+_anthropic_async_client = None
 
 
 def _get_anthropic_client():
@@ -1804,6 +2323,18 @@ def _get_anthropic_client():
     return _anthropic_client
 
 
+def _get_anthropic_async_client():
+    """Pendant async de `_get_anthropic_client` : l'appel modèle n'occupe pas la boucle
+    d'événements (scan de reçus, lots concurrents)."""
+    global _anthropic_async_client
+    if _anthropic_async_client is None:
+        api_key = os.environ.get("ANTHROPIC_API_KEY")
+        if not api_key:
+            raise HTTPException(500, "ANTHROPIC_API_KEY not configured")
+        _anthropic_async_client = anthropic.AsyncAnthropic(api_key=api_key)
+    return _anthropic_async_client
+
+
 def _build_extract_tool():
     """Construit le tool schema depuis EXPENSE_CATEGORIES (feature #3) pour
     éviter toute drift entre prompt et code."""
@@ -1875,17 +2406,9 @@ Si tu ne sais pas, choisis "other" plutôt que d'inventer.
 Réponds via l'outil extract_receipt."""
 
 
-def _call_anthropic_extract(image_bytes, mime_type):
-    """Appelle Claude Haiku 4.5 et retourne le dict extraction brut.
-    Supporte les images (JPEG/PNG/WEBP/GIF) via bloc 'image' et les PDFs
-    via bloc 'document'.
-    Lève HTTPException 502 en cas d'erreur API ou réponse invalide.
-    NE LOG JAMAIS str(e) (peut leaker la clé API)."""
-    # Test mock injection (jamais set en prod ; pas exposé via API)
-    mock = globals().get("_TEST_MOCK_EXTRACTION")
-    if mock is not None:
-        return mock
-    client = _get_anthropic_client()
+def _receipt_extract_request(image_bytes, mime_type):
+    """Arguments de messages.create pour l'extraction d'un reçu. Images (JPEG/PNG/WEBP/GIF)
+    via bloc 'image', PDFs via bloc 'document'."""
     if mime_type == "application/pdf":
         content_block = {
             "type": "document",
@@ -1904,16 +2427,19 @@ def _call_anthropic_extract(image_bytes, mime_type):
                 "data": base64.b64encode(image_bytes).decode("ascii"),
             },
         }
-    try:
-        message = client.messages.create(
-            model="claude-haiku-4-5-20251001",
-            max_tokens=1024,
-            system=_build_system_prompt(),
-            tools=[_build_extract_tool()],
-            tool_choice={"type": "tool", "name": "extract_receipt"},
-            messages=[{"role": "user", "content": [content_block]}],
-        )
-    except (anthropic.APIStatusError, anthropic.APITimeoutError, anthropic.APIConnectionError) as e:
+    return {
+        "model": "claude-haiku-4-5-20251001",
+        "max_tokens": 1024,
+        "system": _build_system_prompt(),
+        "tools": [_build_extract_tool()],
+        "tool_choice": {"type": "tool", "name": "extract_receipt"},
+        "messages": [{"role": "user", "content": [content_block]}],
+    }
+
+
+def _receipt_extract_error(e, mime_type):
+    """Log (sans str(e)) + HTTPException 502 pour une erreur de l'appel modèle."""
+    if isinstance(e, (anthropic.APIStatusError, anthropic.APITimeoutError, anthropic.APIConnectionError)):
         status = getattr(e, "status_code", None)
         # Body Anthropic peut aider au debug (type d'erreur, pas la clé) — safe à log
         body_type = None
@@ -1923,17 +2449,47 @@ def _call_anthropic_extract(image_bytes, mime_type):
         except Exception:
             pass
         print(f"ERROR scan_receipt_api_error status={status} type={type(e).__name__} mime={mime_type} err_type={body_type}")
-        raise HTTPException(502, "Service d'analyse temporairement indisponible")
-    except Exception as e:
+    else:
         print(f"ERROR scan_receipt_unexpected type={type(e).__name__} mime={mime_type}")
-        raise HTTPException(502, "Service d'analyse temporairement indisponible")
+    return HTTPException(502, "Service d'analyse temporairement indisponible")
+
 
+def _receipt_tool_input(message):
     tool_use = next((b for b in message.content if getattr(b, "type", None) == "tool_use"), None)
     if not tool_use:
         raise HTTPException(502, "Réponse IA invalide")
     return tool_use.input
 
 
+def _call_anthropic_extract(image_bytes, mime_type):
+    """Appelle Claude Haiku 4.5 et retourne le dict extraction brut.
+    Lève HTTPException 502 en cas d'erreur API ou réponse invalide.
+    NE LOG JAMAIS str(e) (peut leaker la clé API)."""
+    # Test mock injection (jamais set en prod ; pas exposé via API)
+    mock = globals().get("_TEST_MOCK_EXTRACTION")
+    if mock is not None:
+        return mock
+    client = _get_anthropic_client()
+    try:
+        message = client.messages.create(**_receipt_extract_request(image_bytes, mime_type))
+    except Exception as e:
+        raise _receipt_extract_error(e, mime_type)
+    return _receipt_tool_input(message)
+
+
+async def _call_anthropic_extract_async(image_bytes, mime_type):
+    """Version async de `_call_anthropic_extract` (même mock, mêmes erreurs 502)."""
+    mock = globals().get("_TEST_MOCK_EXTRACTION")
+    if mock is not None:
+        return mock
+    client = _get_anthropic_async_client()
+    try:
+        message = await client.messages.create(**_receipt_extract_request(image_bytes, mime_type))
+    except Exception as e:
+        raise _receipt_extract_error(e, mime_type)
+    return _receipt_tool_input(message)
+
+
 # ── Extraction de relevés bancaires PDF (feature #7.1 — import PDF via Claude) ──
 def _build_bank_extract_tool():
     """Tool schema forcé pour extraire les transactions d'un relevé bancaire PDF."""
@@ -1986,15 +2542,8 @@ de sous-total ni de total — seulement les vraies transactions. Si une ligne es
 partiellement illisible, extrais ce que tu peux ; ne devine pas un montant."""
 
 
-def _call_anthropic_bank_extract(pdf_bytes):
-    """Appelle Claude Haiku 4.5 sur un relevé PDF, retourne le dict brut
-    {"transactions": [...]}. Lève HTTPException 502 sur erreur API.
-    NE LOG JAMAIS str(e) (peut leaker la clé API)."""
-    mock = globals().get("_TEST_MOCK_BANK_EXTRACTION")
-    if mock is not None:
-        return mock
-    client = _get_anthropic_client()
-    content_block = {
+def _bank_pdf_document_block(pdf_bytes):
+    return {
         "type": "document",
         "source": {
             "type": "base64",
@@ -2002,6 +2551,30 @@ def _call_anthropic_bank_extract(pdf_bytes):
             "data": base64.b64encode(pdf_bytes).decode("ascii"),
         },
     }
+
+
+def _call_anthropic_bank_extract(pdf_bytes, header_pdf=None):
+    """Appelle Claude Haiku 4.5 sur un relevé PDF, retourne le dict brut
+    {"transactions": [...]}. Lève HTTPException 502 sur erreur API.
+    `header_pdf` : 1re page du relevé, jointe en contexte aux tranches suivantes (période,
+    année, compte) — le modèle n'en extrait aucune transaction.
+    Mock de test : _TEST_MOCK_BANK_EXTRACTION (dict rendu tel quel, ou callable
+    (pdf_bytes, header_pdf) -> dict). NE LOG JAMAIS str(e) (peut leaker la clé API)."""
+    mock = globals().get("_TEST_MOCK_BANK_EXTRACTION")
+    if mock is not None:
+        return mock(pdf_bytes, header_pdf) if callable(mock) else mock
+    client = _get_anthropic_client()
+    content = [_bank_pdf_document_block(pdf_bytes)]
+    if header_pdf is not None:
+        content = [
+            _bank_pdf_document_block(header_pdf),
+            {"type": "text", "text": (
+                "Le 1er document est la PREMIÈRE page du relevé, fournie seulement comme "
+                "contexte (période, année, compte) : n'en extrais AUCUNE transaction. "
+                "Extrais les transactions du 2e document (pages suivantes du même relevé) "
+                "et date-les d'après cette période.")},
+            content[0],
+        ]
     try:
         message = client.messages.create(
             model="claude-haiku-4-5-20251001",
@@ -2009,7 +2582,7 @@ def _call_anthropic_bank_extract(pdf_bytes):
             system=_build_bank_system_prompt(),
             tools=[_build_bank_extract_tool()],
             tool_choice={"type": "tool", "name": "extract_bank_transactions"},
-            messages=[{"role": "user", "content": [content_block]}],
+            messages=[{"role": "user", "content": content}],
         )
     except (anthropic.APIStatusError, anthropic.APITimeoutError, anthropic.APIConnectionError) as e:
         status = getattr(e, "status_code", None)
@@ -2695,6 +3268,7 @@ def _create_journal_entry(organization_id: str, user_id: str, entry_date: str,
         "posted_at": now if status == "posted" else None,
     }
     db.journal_entries.insert_one(dict(doc))
+    _bump_org_data_version(organization_id)
     return {k: v for k, v in doc.items() if k != "_id"}
 
 
@@ -3378,6 +3952,7 @@ def migrate_expense_net_tax_v1():
         ded_changed = abs(new_ded - old_ded) > 0.01
         if ded_changed:
             db.expenses.update_one({"id": exp["id"]}, {"$set": {"deductible_amount": new_ded}})
+            _bump_org_data_version(exp.get("organization_id"))
             resnapshotted += 1
             resnapshotted_ids.append(exp["id"])
         # Re-post GL uniquement si la charge nette a VRAIMENT changé (garde d'idempotence).
@@ -3704,6 +4279,7 @@ def migrate_bank_created_expenses_v1():
         # 1) date -> expense_date (les rapports filtrent sur expense_date)
         if not exp.get("expense_date") and exp.get("date"):
             updates["expense_date"] = exp["date"]
+            updates["expense_day"] = _canonical_day(exp["date"])
         # 2) catégorie nichée (dict) -> à plat : reconstruit le snapshot depuis le code stocké.
         #    `**snap` inclut `category` = label (str) qui écrase le dict niché.
         cat = exp.get("category")
@@ -3739,6 +4315,7 @@ def migrate_bank_created_expenses_v1():
             updates["status"] = "pending"
         if updates:
             db.expenses.update_one({"id": exp["id"]}, {"$set": updates})
+            _report_data_changed(exp.get("organization_id"), exp.get("expense_date") or exp.get("date"))
             fixed += 1
     if fixed:
         print(f"Migrated {fixed} bank-created expense(s) to canonical schema")
@@ -4017,12 +4594,10 @@ _EMAIL_RE = _re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 
 
 def _send_invitation_email(to_email: str, org_name: str, token: str):
-    """Envoie l'email d'invitation via Resend. Retourne True/False sans lever.
-    Réutilise le pattern existant du fichier (RESEND_API_KEY, SENDER_EMAIL)."""
+    """Enfile l'email d'invitation dans l'outbox (envoi Resend par le worker). Retourne
+    True/False sans lever. Clé d'idempotence = jeton d'invitation."""
     try:
         from html import escape as html_escape
-        import resend
-        resend.api_key = os.environ.get("RESEND_API_KEY")
         sender = os.environ.get("SENDER_EMAIL", "noreply@facturepro.ca")
         link = f"https://facturepro.ca/accept-invite?token={token}"
         # org_name proviennent de user-supplied company_name — escape pour éviter
@@ -4037,15 +4612,15 @@ def _send_invitation_email(to_email: str, org_name: str, token: str):
         <p style="color:#6b7280;font-size:12px">Ce lien expire dans 7 jours.
            Si le bouton ne fonctionne pas, copie ce lien : <br/>{link}</p>
         """
-        resend.Emails.send({
+        _enqueue_email({
             "from": sender,
             "to": to_email,
             "subject": f"Invitation à rejoindre {safe_org_name} sur FacturePro",
             "html": html,
-        })
+        }, "invitation", f"invitation:{token}")
         return True
     except Exception as e:
-        print(f"[invitations] Resend error type={type(e).__name__}")  # no secrets in log
+        print(f"[invitations] enqueue error type={type(e).__name__}")  # no secrets in log
         return False
 
 
@@ -4835,6 +5410,7 @@ def update_entry(
     db.journal_entries.update_one(
         {"id": entry_id, "organization_id": current_user.organization_id},
         {"$set": set_fields})
+    _bump_org_data_version(current_user.organization_id)
     return db.journal_entries.find_one(
         {"id": entry_id, "organization_id": current_user.organization_id}, {"_id": 0})
 
@@ -4865,6 +5441,7 @@ def post_entry(
         {"$set": {"status": "posted", "posted_at": now, "lines": enriched,
                   "total_debit": round(sum(l["debit"] for l in enriched), 2),
                   "total_credit": round(sum(l["credit"] for l in enriched), 2)}})
+    _bump_org_data_version(current_user.organization_id)
     return db.journal_entries.find_one(
         {"id": entry_id, "organization_id": current_user.organization_id}, {"_id": 0})
 
@@ -4912,6 +5489,7 @@ def delete_entry(
         raise HTTPException(400, "Écriture figée — seuls les brouillons sont supprimables")
     db.journal_entries.delete_one(
         {"id": entry_id, "organization_id": current_user.organization_id})
+    _bump_org_data_version(current_user.organization_id)
     return
 
 
@@ -5004,6 +5582,7 @@ def update_opening_balance(
         {"$set": {"ledger_start_date": opening_date},
          "$setOnInsert": {"organization_id": current_user.organization_id}},
         upsert=True)
+    _bump_org_data_version(current_user.organization_id)
     return db.journal_entries.find_one(
         {"id": existing["id"], "organization_id": current_user.organization_id},
         {"_id": 0})
@@ -5456,32 +6035,47 @@ def _ledger_pdf_generated_line():
                 "— État non audité, usage interne")
 
 
-def _ledger_pdf_load_logo(org_id):
-    """Charge le logo de l'entreprise (db.files via settings.logo_url) comme flowable RLImage
-    borné à 1 pouce. Même source que le PDF de facture. Retourne None si absent/illisible
-    (jamais bloquant : un PDF sans logo reste valide)."""
-    try:
-        from reportlab.platypus import Image as RLImage
-        from reportlab.lib.units import inch
-        settings = db.company_settings.find_one({"organization_id": org_id}, {"_id": 0}) or {}
-        logo_url = settings.get("logo_url") or ""
-        if logo_url.startswith("/api/files/"):
-            file_id = logo_url.rsplit("/", 1)[-1]
-            record = db.files.find_one({"id": file_id, "is_deleted": False})
-            if record and "data" in record:
-                return RLImage(io.BytesIO(bytes(record["data"])),
-                               width=1.0 * inch, height=1.0 * inch)
-    except Exception:
-        return None
-    return None
+# ─── Thèmes et logos PDF partagés entre les rendus ───
+# Chaque rendu reconstruisait getSampleStyleSheet() + ses ParagraphStyle et relisait/décodait
+# le logo. Les styles sont désormais construits une fois par (couleur primaire, secondaire) et
+# le logo décodé/réduit une fois par org. Styles et ImageReader sont PARTAGÉS entre rendus
+# (et threads) : ne jamais les muter.
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import Flowable
 
+PDF_LOGO_MAX_PX = 360  # 1,2 po à 300 dpi : plus grande taille d'affichage (PDF de facture)
+_PDF_THEMES = _LRUCache(32)
+_PDF_LOGO_CACHE = _LRUCache(int(os.environ.get("PDF_LOGO_CACHE_MAX", "256")))
 
-def _ledger_pdf_styles():
-    """Feuille de styles partagée des PDF du grand livre (couleurs + paragraphes)."""
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.colors import HexColor
+
+def _build_document_pdf_theme(primary, secondary):
+    """Styles du PDF de facture/soumission (generate_document_pdf)."""
+    base = getSampleStyleSheet()
+    teal = HexColor(primary); dark = HexColor(secondary); gray = HexColor('#6b7280')
+    small = ParagraphStyle('Small', parent=base['Normal'], fontSize=9, textColor=gray, leading=12)
+    return {
+        "primary": teal, "secondary": dark, "gray": gray, "small": small,
+        "title": ParagraphStyle('DocTitle', parent=base['Heading1'], fontSize=28, textColor=teal, spaceAfter=4),
+        "subtitle": ParagraphStyle('Subtitle', parent=base['Normal'], fontSize=11, textColor=gray),
+        "company": ParagraphStyle('Company', parent=base['Normal'], fontSize=10, textColor=dark, leading=14),
+        "right": ParagraphStyle('Right', parent=base['Normal'], fontSize=10, textColor=dark, alignment=TA_RIGHT),
+        "terms": ParagraphStyle('Terms', parent=base['Normal'], fontSize=8, textColor=gray, leading=11),
+        "company_name": ParagraphStyle('CompName', parent=base['Normal'], fontSize=14, textColor=dark, fontName='Helvetica-Bold', leading=18),
+        "doc_label": ParagraphStyle('DocLabel', parent=base['Normal'], fontSize=20, textColor=teal, alignment=TA_RIGHT, fontName='Helvetica-Bold', spaceAfter=6),
+        "status": ParagraphStyle('Status', parent=base['Normal'], fontSize=10, textColor=teal, alignment=TA_RIGHT, fontName='Helvetica-Bold'),
+        "client_name": ParagraphStyle('ClientName', parent=base['Normal'], fontSize=12, textColor=dark, fontName='Helvetica-Bold', leading=16),
+        "client_line": ParagraphStyle('ClientLine', parent=small, leading=14),
+        "client_nums": ParagraphStyle('ClientNums', parent=small, fontName='Courier', fontSize=8, leading=11),
+        "reg_title": ParagraphStyle('RegTitle', parent=small, fontName='Helvetica-Bold', fontSize=8.5, textColor=dark),
+        "reg_body": ParagraphStyle('RegBody', parent=small, fontName='Courier', fontSize=8, leading=11),
+        "footer": ParagraphStyle('Footer', parent=base['Normal'], fontSize=10, textColor=teal, alignment=TA_CENTER),
+    }
+
+
+def _build_ledger_pdf_theme(primary, secondary):
+    """Styles des PDF du grand livre (couleurs + paragraphes)."""
     base = getSampleStyleSheet()
-    teal = HexColor("#008F7A"); dark = HexColor("#1f2937"); gray = HexColor("#6b7280")
+    teal = HexColor(primary); dark = HexColor(secondary); gray = HexColor("#6b7280")
     return {
         "teal": teal, "dark": dark, "gray": gray,
         "title": ParagraphStyle("T", parent=base["Heading1"], fontSize=18, textColor=teal, spaceAfter=4),
@@ -5490,13 +6084,127 @@ def _ledger_pdf_styles():
     }
 
 
-def _ledger_pdf_header_flowables(title, subtitle, org_id, S):
-    """Entête commun à tous les PDF du grand livre : logo (si présent) à gauche + bloc titre /
-    raison sociale / heure du Québec à droite. Strings user-supplied échappées (anti-injection).
-    Retourne une liste de flowables (le logo est optionnel)."""
-    from reportlab.platypus import Paragraph, Spacer, Table, TableStyle
-    from reportlab.lib.units import inch
-    from html import escape as html_escape
+_PDF_THEME_BUILDERS = {"document": _build_document_pdf_theme, "ledger": _build_ledger_pdf_theme}
+
+
+def _pdf_theme(kind, primary, secondary):
+    """Thème `kind` ("document" | "ledger") pour ces couleurs, construit au premier appel."""
+    key = (kind, primary.lower(), secondary.lower())
+    theme = _PDF_THEMES.get(key)
+    if theme is None:
+        theme = _PDF_THEME_BUILDERS[kind](primary, secondary)
+        _PDF_THEMES.put(key, theme)
+    return theme
+
+
+def _decode_pdf_logo(data):
+    """Logo décodé une fois et réduit à PDF_LOGO_MAX_PX (plus grand côté) en ImageReader prêt
+    à dessiner, None si illisible."""
+    try:
+        img = PILImage.open(io.BytesIO(data))
+        img.load()
+        if img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGBA")
+        img.thumbnail((PDF_LOGO_MAX_PX, PDF_LOGO_MAX_PX))
+        reader = ImageReader(img)
+        reader.getRGBData()  # pixels calculés ici, pas au premier rendu concurrent
+        return reader
+    except Exception:
+        return None
+
+
+def _org_pdf_logo(org_id, company_settings):
+    """ImageReader du logo de l'org, réutilisé tant que `logo_url` ne change pas (et purgé à
+    chaque écriture des paramètres/logo). None si aucun logo ou illisible. Sans org : décodé
+    à chaque appel. Une lecture en échec n'est pas mise en cache (réessayée au rendu suivant)."""
+    logo_url = company_settings.get("logo_url") or ""
+    if org_id:
+        entry = _PDF_LOGO_CACHE.get(org_id)
+        if entry is not None and entry[0] == logo_url:
+            return entry[1]
+    data = _document_logo_bytes(company_settings)
+    reader = _decode_pdf_logo(data) if data else None
+    if org_id and (reader is not None or not logo_url.startswith("/api/files/")):
+        _PDF_LOGO_CACHE.put(org_id, (logo_url, reader))
+    return reader
+
+
+def _forget_org_pdf_logo(org_id):
+    _PDF_LOGO_CACHE.pop(org_id)
+
+
+def _bench_pdf_render_setup(iterations=200):
+    """Micro-benchmark de la mise en place d'un rendu (styles + logo), avant/après le
+    registre : « before » reconstruit le thème et décode le logo à chaque rendu (ancien
+    chemin), « after » lit le registre et le cache de logo. Logo synthétique 1200×1200 :
+    aucun accès DB. Retourne les ms par rendu."""
+    buf = io.BytesIO()
+    PILImage.new("RGBA", (1200, 1200), (0, 160, 140, 255)).save(buf, format="PNG")
+    logo = buf.getvalue()
+    settings = {"logo_url": "/api/files/__bench__"}
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        _build_document_pdf_theme('#00A08C', '#1f2937')
+        ImageReader(io.BytesIO(logo)).getRGBData()
+    before = (time.perf_counter() - started) * 1000 / iterations
+
+    _PDF_LOGO_CACHE.put("__bench__", (settings["logo_url"], _decode_pdf_logo(logo)))
+    try:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            _pdf_theme("document", '#00A08C', '#1f2937')
+            _org_pdf_logo("__bench__", settings)
+        after = (time.perf_counter() - started) * 1000 / iterations
+    finally:
+        _forget_org_pdf_logo("__bench__")
+    return {"iterations": iterations, "before_ms": round(before, 4), "after_ms": round(after, 4),
+            "speedup": round(before / after, 1) if after > 0 else None}
+
+
+class _PdfLogo(Flowable):
+    """Flowable qui dessine un ImageReader partagé à la taille demandée (platypus.Image
+    n'accepte qu'un fichier ou un flux, qu'il décoderait à chaque rendu)."""
+
+    def __init__(self, reader, width, height):
+        super().__init__()
+        self.reader = reader
+        self.width = width
+        self.height = height
+        self.hAlign = "CENTER"
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.reader, 0, 0, self.width, self.height, mask="auto")
+
+
+def _ledger_pdf_load_logo(org_id):
+    """Logo de l'entreprise (même source que le PDF de facture) comme flowable borné à
+    1 pouce. Retourne None si absent/illisible (jamais bloquant : un PDF sans logo reste
+    valide)."""
+    try:
+        settings = db.company_settings.find_one({"organization_id": org_id},
+                                                {"_id": 0, "logo_url": 1}) or {}
+        reader = _org_pdf_logo(org_id, settings)
+        return _PdfLogo(reader, 1.0 * inch, 1.0 * inch) if reader is not None else None
+    except Exception:
+        return None
+
+
+def _ledger_pdf_styles():
+    """Feuille de styles partagée des PDF du grand livre (couleurs + paragraphes)."""
+    return _pdf_theme("ledger", "#008F7A", "#1f2937")
+
+
+def _ledger_pdf_header_flowables(title, subtitle, org_id, S):
+    """Entête commun à tous les PDF du grand livre : logo (si présent) à gauche + bloc titre /
+    raison sociale / heure du Québec à droite. Strings user-supplied échappées (anti-injection).
+    Retourne une liste de flowables (le logo est optionnel)."""
+    from reportlab.platypus import Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.units import inch
+    from html import escape as html_escape
     settings = db.company_settings.find_one({"organization_id": org_id}, {"_id": 0}) or {}
     company_name = html_escape(settings.get("company_name") or "(sans nom)")
     text_block = [
@@ -6239,6 +6947,428 @@ def _in_period(raw_date, start_date, end_date) -> bool:
     return True
 
 
+def _find_in_period(coll, scope, day_field, raw_field, start_date, end_date, extra=None):
+    """Documents de `scope` (+ filtre `extra`) dont le jour métier tombe dans
+    [start_date, end_date] (bornes `date` ; None = non bornée, comme `_in_period`).
+
+    Requête de PLAGE sur le champ canonique `day_field` ('YYYY-MM-DD', index
+    (organization_id, day_field)) : seuls les documents de la période sont lus. Les
+    documents sans ce champ (antérieurs à la migration day_fields_v1) sont rattrapés par
+    `_in_period` sur `raw_field` — le résultat est identique à l'ancien filtrage Python."""
+    base = {**scope, **(extra or {})}
+    day_range = {}
+    if start_date is not None:
+        day_range["$gte"] = start_date.isoformat()
+    if end_date is not None:
+        day_range["$lte"] = end_date.isoformat()
+    docs = list(coll.find({**base, day_field: day_range or {"$type": "string"}}, {"_id": 0}))
+    docs.extend(d for d in coll.find({**base, day_field: {"$exists": False}}, {"_id": 0})
+                if _in_period(d.get(raw_field), start_date, end_date))
+    return docs
+
+
+DAY_FIELDS_BATCH = 1000
+
+
+def migrate_day_fields_v1(batch_size=DAY_FIELDS_BATCH):
+    """Idempotente. Pose `issue_day` (factures) / `expense_day` (dépenses) depuis la date
+    brute, par paquets. Une date illisible reçoit None (le document n'est plus candidat à la
+    migration et reste exclu des périodes, comme avec `_in_period`)."""
+    total = 0
+    for coll, day_field, raw_field in ((db.invoices, "issue_day", "issue_date"),
+                                       (db.expenses, "expense_day", "expense_date")):
+        while True:
+            batch = list(coll.find({day_field: {"$exists": False}},
+                                   {"_id": 1, raw_field: 1}).limit(batch_size))
+            if not batch:
+                break
+            coll.bulk_write([
+                UpdateOne({"_id": d["_id"]}, {"$set": {day_field: _canonical_day(d.get(raw_field))}})
+                for d in batch], ordered=False)
+            total += len(batch)
+    if total:
+        print(f"Migration day_fields_v1: {total} document(s)")
+    return total
+
+
+# ─── Rollups mensuels des rapports (P&L, T2125, GIFI, TPS/TVQ) ───
+# Un document `report_rollups` par (organization_id, month 'YYYY-MM', basis) porte les totaux
+# BRUTS (non arrondis) du mois : revenu, taxes perçues/payées, brut/déductible par
+# category_code. Les rapports composent une période de mois ENTIERS lus ici + les mois de bord
+# partiels agrégés à la volée : un T2125 annuel = 12 lectures au lieu de tout re-parcourir.
+#
+# Cohérence : toute écriture de facture/dépense/paiement appelle `_report_data_changed`, qui
+# marque le(s) mois touché(s) invalides (`valid=False`, `gen` incrémenté). Le mois est
+# recalculé au prochain rapport qui le lit ; l'écriture du recalcul est conditionnée au `gen`
+# lu AVANT l'agrégation, de sorte qu'une écriture concurrente n'est jamais masquée par un
+# rollup calculé sur l'état précédent.
+REPORT_ROLLUP_VERSION = 1
+REPORT_ROLLUP_BASES = ("accrual", "cash")
+# Au-delà, une période (bornes farfelues) est agrégée directement plutôt que de matérialiser
+# des centaines de mois vides.
+REPORT_ROLLUP_MAX_MONTHS = 240
+_REPORT_INVOICE_STATUSES = {
+    "accrual": ["sent", "partial", "paid", "overdue"],
+    "cash": ["paid"],
+}
+
+
+def _empty_report_totals():
+    return {
+        "revenue": 0.0, "invoice_count": 0, "sales_qc": 0.0,
+        "gst_collected": 0.0, "qst_collected": 0.0, "hst_collected": 0.0,
+        "expense_count": 0, "gst_paid": 0.0, "qst_paid": 0.0, "hst_paid": 0.0,
+        "categories": [],
+    }
+
+
+def _merge_report_totals(into, other):
+    """Additionne `other` dans `into` (catégories fusionnées par code, ordre d'apparition)."""
+    for key, value in other.items():
+        if key != "categories":
+            into[key] += value
+    by_code = {c["code"]: c for c in into["categories"]}
+    for cat in other["categories"]:
+        mine = by_code.get(cat["code"])
+        if mine is None:
+            mine = by_code[cat["code"]] = {"code": cat["code"], "gross": 0.0, "deductible": 0.0}
+            into["categories"].append(mine)
+        mine["gross"] += cat["gross"]
+        mine["deductible"] += cat["deductible"]
+    return into
+
+
+def _invoice_amount_cad(inv, field):
+    """Montant `field` d'une facture converti en CAD au taux figé sur la facture."""
+    amount = inv.get(field, 0)
+    if amount is None:
+        return 0
+    rate = inv.get("exchange_rate_to_cad", 1.0) or 1.0
+    if inv.get("currency", "CAD") == "CAD":
+        return float(amount)
+    rate_f = float(rate)
+    return float(amount) / rate_f if rate_f > 0 else float(amount)
+
+
+def _expense_deductible_split(e):
+    """(brut, déductible) CAD d'une dépense pour le P&L / T2125.
+
+    [COMPTA] Feature #7.7 — la charge est NETTE des taxes récupérables (CTI/RTI),
+    alignée EXACTEMENT sur le grand livre (_expense_net_business_cad). La déductibilité
+    (50 % repas, etc.) s'applique AU NET. Pour le télécom, la portion affaires est déjà
+    isolée dans net_business et est 100 % déductible."""
+    gross_val = _expense_net_business_cad(e)
+    if e.get("personal_use_amount_cad") is not None:
+        return gross_val, gross_val  # télécom : portion affaires nette, 100 % déductible
+    # Fallback : dérive le taux du catalogue si l'ancien schéma n'a pas snapshoté
+    # deductible_percentage (dépenses pré-#3), pour garder le 50 % repas.
+    pct = e.get("deductible_percentage")
+    if pct is None:
+        cat = _find_category(e.get("category_code") or "other")
+        pct = cat["deductible_percentage"] if cat else 100
+    return gross_val, round(gross_val * float(pct) / 100, 2)
+
+
+def _report_totals_raw(scope, start_date, end_date, basis):
+    """Totaux de rapport agrégés directement depuis les factures/dépenses de `scope` dont le
+    jour métier tombe dans [start_date, end_date] (bornes `date`, None = non bornée)."""
+    totals = _empty_report_totals()
+    invoices = _find_in_period(db.invoices, scope, "issue_day", "issue_date", start_date, end_date,
+                               {"status": {"$in": _REPORT_INVOICE_STATUSES[basis]}})
+    for inv in invoices:
+        subtotal_cad = _invoice_amount_cad(inv, "subtotal")
+        totals["revenue"] += subtotal_cad
+        if inv.get("province") == "QC":
+            totals["sales_qc"] += subtotal_cad
+        totals["gst_collected"] += _invoice_amount_cad(inv, "gst_amount")
+        totals["qst_collected"] += _invoice_amount_cad(inv, "pst_amount")  # pst_amount = TVQ legacy
+        totals["hst_collected"] += _invoice_amount_cad(inv, "hst_amount")
+    totals["invoice_count"] = len(invoices)
+
+    expenses = _find_in_period(db.expenses, scope, "expense_day", "expense_date",
+                               start_date, end_date)
+    by_code = {}
+    for e in expenses:
+        code = e.get("category_code") or "other"
+        if code not in by_code:
+            by_code[code] = {"code": code, "gross": 0.0, "deductible": 0.0}
+            totals["categories"].append(by_code[code])
+        gross_val, ded_val = _expense_deductible_split(e)
+        by_code[code]["gross"] += gross_val
+        by_code[code]["deductible"] += ded_val
+        gst, qst, hst = _expense_recoverable_tax_cad(e)
+        totals["gst_paid"] += gst
+        totals["qst_paid"] += qst
+        totals["hst_paid"] += hst
+    totals["expense_count"] = len(expenses)
+    return totals
+
+
+def _month_bounds(month):
+    """(premier jour, dernier jour) du mois 'YYYY-MM'."""
+    year, mon = int(month[:4]), int(month[5:7])
+    first = date(year, mon, 1)
+    following = date(year + 1, 1, 1) if mon == 12 else date(year, mon + 1, 1)
+    return first, following - timedelta(days=1)
+
+
+def _split_period_months(start_date, end_date):
+    """Découpe [start_date, end_date] en mois entiers ('YYYY-MM') et en bords partiels
+    (liste de (début, fin)). Ex. 2026-01-15 → 2026-04-10 : mois entiers 02 et 03, bords
+    (01-15, 01-31) et (04-01, 04-10)."""
+    whole, edges = [], []
+    year, mon = start_date.year, start_date.month
+    while (year, mon) <= (end_date.year, end_date.month):
+        month = f"{year:04d}-{mon:02d}"
+        first, last = _month_bounds(month)
+        lo, hi = max(first, start_date), min(last, end_date)
+        if lo == first and hi == last:
+            whole.append(month)
+        else:
+            edges.append((lo, hi))
+        year, mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+    return whole, edges
+
+
+def _compute_month_rollup(org_id, month, basis, gen):
+    """Agrège le mois depuis les documents bruts et enregistre le rollup, SAUF si le mois a été
+    invalidé entre-temps (`gen` différent de celui lu avant l'agrégation) : le rollup serait
+    alors calculé sur un état périmé. Retourne les totaux (justes au moment de la lecture)."""
+    first, last = _month_bounds(month)
+    totals = _report_totals_raw({"organization_id": org_id}, first, last, basis)
+    key = {"organization_id": org_id, "month": month, "basis": basis}
+    fields = {"totals": totals, "valid": True, "version": REPORT_ROLLUP_VERSION,
+              "computed_at": datetime.now(timezone.utc).isoformat()}
+    try:
+        if gen is None:
+            db.report_rollups.update_one({**key, "gen": {"$exists": False}},
+                                         {"$set": fields, "$setOnInsert": {"gen": 0}}, upsert=True)
+        else:
+            db.report_rollups.update_one({**key, "gen": gen}, {"$set": fields})
+    except DuplicateKeyError:
+        pass  # créé/invalidé concurremment : le prochain rapport recalculera
+    return totals
+
+
+def _month_rollups(org_id, months, basis):
+    """Totaux des `months` (mois entiers) de l'org : rollups valides lus en une requête, les
+    mois absents/invalidés/d'une version antérieure recalculés et ré-enregistrés."""
+    docs = {d["month"]: d for d in db.report_rollups.find(
+        {"organization_id": org_id, "basis": basis, "month": {"$in": months}}, {"_id": 0})}
+    out = []
+    for month in months:
+        doc = docs.get(month)
+        if doc and doc.get("valid") and doc.get("version") == REPORT_ROLLUP_VERSION:
+            out.append(doc["totals"])
+        else:
+            out.append(_compute_month_rollup(org_id, month, basis, doc.get("gen") if doc else None))
+    return out
+
+
+def _scope_legacy_filter(scope):
+    """Partie « legacy » d'un `_org_scope` (documents sans organization_id, rattachés par
+    user_id), absente des rollups, ou None. `False` si le filtre n'a pas la forme attendue."""
+    if set(scope) - {"$or", "organization_id"}:
+        return False
+    branches = [b for b in scope.get("$or") or []
+                if not isinstance(b.get("organization_id"), str)]
+    return {"$or": branches} if branches else None
+
+
+def _report_totals(scope, start, end, basis):
+    """Totaux de rapport de `scope` sur [start, end] (chaînes ISO) pour `basis`.
+
+    Mois entiers lus dans `report_rollups`, mois de bord partiels et documents legacy agrégés
+    directement. Repli sur l'agrégation complète quand le scope n'identifie pas une org ou que
+    la période n'est pas bornée (start/end illisibles : même sémantique que `_in_period`)."""
+    start_date, end_date = _parse_iso_date(start), _parse_iso_date(end)
+    org_id = _scope_organization_id(scope)
+    legacy = _scope_legacy_filter(scope)
+    if (org_id is None or legacy is False or start_date is None or end_date is None
+            or start_date > end_date):
+        return _report_totals_raw(scope, start_date, end_date, basis)
+    whole, edges = _split_period_months(start_date, end_date)
+    if len(whole) > REPORT_ROLLUP_MAX_MONTHS:
+        return _report_totals_raw(scope, start_date, end_date, basis)
+    totals = _empty_report_totals()
+    for month_totals in _month_rollups(org_id, whole, basis) if whole else []:
+        _merge_report_totals(totals, month_totals)
+    for lo, hi in edges:
+        _merge_report_totals(totals, _report_totals_raw({"organization_id": org_id}, lo, hi, basis))
+    if legacy:
+        _merge_report_totals(totals, _report_totals_raw(legacy, start_date, end_date, basis))
+    return totals
+
+
+def _report_data_changed(org_id, *raw_dates):
+    """À appeler après toute écriture de facture/dépense/paiement de l'org : invalide les
+    rollups des mois des dates métier passées (ancienne ET nouvelle date lors d'une
+    modification), ou de TOUS les mois de l'org si aucune date n'est fournie. Une date
+    illisible est ignorée (le document n'entre dans aucune période)."""
+    if not org_id:
+        return
+    _bump_org_data_version(org_id)
+    invalidate = {"$set": {"valid": False}, "$inc": {"gen": 1}}
+    if not raw_dates:
+        db.report_rollups.update_many({"organization_id": org_id}, invalidate)
+        return
+    months = {day[:7] for day in map(_canonical_day, raw_dates) if day}
+    for month in sorted(months):
+        for basis in REPORT_ROLLUP_BASES:
+            # upsert : un mois sans rollup reçoit quand même un `gen`, pour qu'un recalcul
+            # lancé avant cette écriture ne puisse pas enregistrer un état périmé.
+            db.report_rollups.update_one(
+                {"organization_id": org_id, "month": month, "basis": basis}, invalidate, upsert=True)
+
+
+def _rollup_totals_match(a, b, tol=0.005):
+    for key, value in a.items():
+        if key == "categories":
+            continue
+        if abs(float(value) - float(b.get(key, 0))) > tol:
+            return False
+    cats_a = {c["code"]: c for c in a["categories"]}
+    cats_b = {c["code"]: c for c in b.get("categories", [])}
+    for code in set(cats_a) | set(cats_b):
+        ca = cats_a.get(code, {"gross": 0.0, "deductible": 0.0})
+        cb = cats_b.get(code, {"gross": 0.0, "deductible": 0.0})
+        if abs(ca["gross"] - cb["gross"]) > tol or abs(ca["deductible"] - cb["deductible"]) > tol:
+            return False
+    return True
+
+
+def _org_report_months(org_id):
+    """Mois ('YYYY-MM') où l'org a au moins une facture ou une dépense datée."""
+    months = set()
+    for coll, day_field in ((db.invoices, "issue_day"), (db.expenses, "expense_day")):
+        months.update(day[:7] for day in coll.distinct(day_field, {"organization_id": org_id})
+                      if isinstance(day, str))
+    return sorted(months)
+
+
+def rebuild_report_rollups(org_id=None):
+    """Recalcule tous les rollups (d'une org, ou de toutes les orgs ayant des documents)."""
+    org_ids = [org_id] if org_id else sorted(
+        set(db.invoices.distinct("organization_id")) | set(db.expenses.distinct("organization_id")))
+    rebuilt = 0
+    for oid in org_ids:
+        if not isinstance(oid, str):
+            continue
+        db.report_rollups.delete_many({"organization_id": oid})
+        for month in _org_report_months(oid):
+            for basis in REPORT_ROLLUP_BASES:
+                _compute_month_rollup(oid, month, basis, None)
+                rebuilt += 1
+    return rebuilt
+
+
+def verify_report_rollups(org_id=None):
+    """Compare chaque rollup VALIDE à une agrégation directe du mois. Retourne la liste des
+    écarts [{organization_id, month, basis}] (vide = rollups cohérents)."""
+    query = {"valid": True, "version": REPORT_ROLLUP_VERSION}
+    if org_id:
+        query["organization_id"] = org_id
+    mismatches = []
+    for doc in db.report_rollups.find(query, {"_id": 0}):
+        first, last = _month_bounds(doc["month"])
+        fresh = _report_totals_raw({"organization_id": doc["organization_id"]},
+                                   first, last, doc["basis"])
+        if not _rollup_totals_match(fresh, doc["totals"]):
+            mismatches.append({"organization_id": doc["organization_id"],
+                               "month": doc["month"], "basis": doc["basis"]})
+    return mismatches
+
+
+# ─── Cache des résultats de rapports ───
+# Clé = (org, rapport, paramètres, version de données de l'org). La version est un compteur
+# par org (`org_data_versions`) incrémenté par TOUTE écriture de facture, dépense, paiement,
+# paramètres ou écriture de journal : une écriture rend simplement les anciennes clés
+# injoignables (elles sortent du LRU d'elles-mêmes), sans invalidation explicite. Lire la
+# version coûte une requête indexée, contre plusieurs agrégations pour recalculer le rapport.
+# Cache côté serveur uniquement : les en-têtes HTTP des réponses ne changent pas.
+REPORT_CACHE_MAX = int(os.environ.get("REPORT_CACHE_MAX", "512"))
+# Stockage partagé optionnel (collection Mongo `report_cache`, TTL) entre workers/instances.
+REPORT_CACHE_SHARED = os.environ.get("REPORT_CACHE_SHARED", "0") == "1"
+REPORT_CACHE_SHARED_TTL_SECONDS = int(os.environ.get("REPORT_CACHE_SHARED_TTL_SECONDS", str(24 * 3600)))
+_REPORT_CACHE = _LRUCache(REPORT_CACHE_MAX)
+_REPORT_CACHE_STATS = {"hits": 0, "shared_hits": 0, "misses": 0}
+_REPORT_CACHE_STATS_LOCK = threading.Lock()
+_REPORT_CACHE_MISS = object()
+
+
+def _bump_org_data_version(org_id):
+    """Nouvelle version des données de l'org : les résultats de rapports en cache deviennent
+    périmés. À appeler après toute écriture qui peut changer un rapport."""
+    if org_id:
+        db.org_data_versions.update_one({"organization_id": org_id},
+                                        {"$inc": {"version": 1}}, upsert=True)
+
+
+def _settings_data_changed(settings_filter):
+    """Variante pour les écritures de paramètres filtrées par user_id (routes legacy `User`) :
+    l'org est relue sur le document de paramètres."""
+    doc = db.company_settings.find_one(settings_filter, {"_id": 0, "organization_id": 1})
+    _bump_org_data_version((doc or {}).get("organization_id"))
+    _invalidate_document_pdfs((doc or {}).get("organization_id"))  # logo / paramètres affichés
+
+
+def _org_data_version(org_id):
+    doc = db.org_data_versions.find_one({"organization_id": org_id}, {"_id": 0, "version": 1})
+    return (doc or {}).get("version", 0)
+
+
+def _count_report_cache(outcome):
+    with _REPORT_CACHE_STATS_LOCK:
+        _REPORT_CACHE_STATS[outcome] += 1
+
+
+def _report_cache_stats():
+    with _REPORT_CACHE_STATS_LOCK:
+        stats = dict(_REPORT_CACHE_STATS)
+    lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+    stats.update(size=len(_REPORT_CACHE), maxsize=REPORT_CACHE_MAX, shared=REPORT_CACHE_SHARED,
+                 hit_rate=round((stats["hits"] + stats["shared_hits"]) / lookups, 3) if lookups else 0.0)
+    return stats
+
+
+def _cached_report(scope, report, params, compute):
+    """Résultat de `compute()` pour (org du scope, `report`, `params`), servi depuis le cache
+    tant que la version de données de l'org n'a pas changé. Le résultat est partagé entre
+    requêtes : les appelants ne doivent pas le muter. Sans org identifiable (filtre legacy),
+    pas de cache."""
+    org_id = _scope_organization_id(scope)
+    if org_id is None:
+        return compute()
+    # Version lue AVANT le calcul : une écriture concurrente range le résultat sous
+    # l'ancienne version, jamais relue.
+    version = _org_data_version(org_id)
+    key = _json.dumps([org_id, report, params, version], sort_keys=True, default=str)
+    value = _REPORT_CACHE.get(key, _REPORT_CACHE_MISS)
+    if value is not _REPORT_CACHE_MISS:
+        _count_report_cache("hits")
+        return value
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    if REPORT_CACHE_SHARED:
+        doc = db.report_cache.find_one({"key": digest}, {"_id": 0, "value": 1})
+        if doc is not None:
+            _count_report_cache("shared_hits")
+            _REPORT_CACHE.put(key, doc["value"])
+            return doc["value"]
+    _count_report_cache("misses")
+    value = compute()
+    _REPORT_CACHE.put(key, value)
+    if REPORT_CACHE_SHARED:
+        try:
+            db.report_cache.update_one(
+                {"key": digest},
+                {"$set": {"organization_id": org_id, "report": report, "value": value,
+                          "created_at": datetime.now(timezone.utc)}},
+                upsert=True)
+        except Exception as e:  # noqa: BLE001 — le stockage partagé reste best-effort
+            logger.warning("report cache: écriture partagée échouée (%s)", type(e).__name__)
+    return value
+
+
 def _backfill_failure(source_type: str, source_id: str) -> dict:
     """Item de la liste `failed` renvoyée par l'apply du backfill (spec §7,
     forme `{source_type, source_id, error}`).
@@ -6296,8 +7426,8 @@ def autopost_backfill(
 
     Période (§7.2) : `start`/`end` ISO inclusifs ; défaut = exercice courant
     (`_current_fiscal_year`). Factures sur `issue_date`, paiements sur `date`,
-    dépenses sur `expense_date` — filtrées en Python (`_in_period`) pour tolérer
-    les dates stockées en ISO datetime complet.
+    dépenses sur `expense_date` — sélectionnées par jour canonique (`_find_in_period`)
+    pour tolérer les dates stockées en ISO datetime complet.
 
     [COMPTA] no-store : action comptable jamais mise en cache."""
     _apply_ledger_no_store(response)
@@ -6319,15 +7449,10 @@ def autopost_backfill(
     # une draft n'a ni revenu ni A/R comptabilisé, donc un Dr 1000 / Cr 1100 y
     # créerait un compte-client fantôme négatif. En pratique, l'UI masque le bouton
     # paiement sur les drafts (feature #6), donc ce cas n'apparaît normalement pas.
-    invoices = [
-        inv for inv in db.invoices.find(
-            {**scope, "status": {"$ne": "draft"}}, {"_id": 0})
-        if _in_period(inv.get("issue_date"), start_date, end_date)
-    ]
-    expenses = [
-        exp for exp in db.expenses.find(scope, {"_id": 0})
-        if _in_period(exp.get("expense_date"), start_date, end_date)
-    ]
+    invoices = _find_in_period(db.invoices, scope, "issue_day", "issue_date",
+                               start_date, end_date, {"status": {"$ne": "draft"}})
+    expenses = _find_in_period(db.expenses, scope, "expense_day", "expense_date",
+                               start_date, end_date)
 
     # ── DRY-RUN : compte sans écrire (via _find_live_source_entry). ──
     if dry_run:
@@ -6907,14 +8032,18 @@ def create_invoice(invoice_data: dict, current_user: CurrentUser = Depends(requi
         "recurrence_active": invoice_data.get("recurrence", "none") != "none",
         "created_at": datetime.now(timezone.utc).isoformat()
     }
+    doc["issue_day"] = _canonical_day(doc["issue_date"])
     doc["tax_registrations"] = _build_tax_registrations(_org_scope(current_user), doc.get("client_id"))
     db.invoices.insert_one(doc)
+    _report_data_changed(doc["organization_id"], doc["issue_date"])
     return clean_doc(doc)
 
 @app.put("/api/invoices/{invoice_id}")
 def update_invoice(invoice_id: str, invoice_data: dict, current_user: CurrentUser = Depends(require_permission("invoices:write"))):
-    for k in ("id", "user_id", "organization_id", "_id"):
+    for k in ("id", "user_id", "organization_id", "_id", "issue_day"):
         invoice_data.pop(k, None)
+    if "issue_date" in invoice_data:
+        invoice_data["issue_day"] = _canonical_day(invoice_data["issue_date"])
     if "items" in invoice_data:
         items = invoice_data["items"]
         subtotal = sum(float(item.get("quantity", 1)) * float(item.get("unit_price", 0)) for item in items)
@@ -6936,6 +8065,9 @@ def update_invoice(invoice_id: str, invoice_data: dict, current_user: CurrentUse
         client_id_for_snapshot = invoice_data.get("client_id", existing.get("client_id"))
         invoice_data["tax_registrations"] = _build_tax_registrations(_org_scope(current_user), client_id_for_snapshot)
     db.invoices.update_one({"id": invoice_id, **_org_scope(current_user)}, {"$set": invoice_data})
+    _report_data_changed(existing.get("organization_id"), existing.get("issue_date"),
+                         invoice_data.get("issue_date", existing.get("issue_date")))
+    _invalidate_document_pdfs(existing.get("organization_id"), "invoice", invoice_id)
     return clean_doc(db.invoices.find_one({"id": invoice_id}, {"_id": 0}))
 
 @app.put("/api/invoices/{invoice_id}/status")
@@ -6950,6 +8082,7 @@ def update_invoice_status(invoice_id: str, status_data: dict, current_user: Curr
     result = db.invoices.update_one({"id": invoice_id, **_org_scope(current_user)}, {"$set": {"status": new_status}})
     if result.matched_count == 0:
         raise HTTPException(404, "Invoice not found")
+    _report_data_changed(existing.get("organization_id"), existing.get("issue_date"))
     # Auto-posting (§5.5), opt-in par org (décision #10). NE DOIT JAMAIS faire
     # échouer le PUT : encapsulé dans _safe_autopost (avale l'exception, pose un
     # autopost_error générique sur la facture). Le doc `inv` passé au mapping
@@ -6988,6 +8121,7 @@ def add_invoice_payment(invoice_id: str, body: dict,
         {"id": invoice_id, **_org_scope(current_user)},
         {"$push": {"payments": payment}, "$set": {"status": new_status}}
     )
+    _report_data_changed(invoice.get("organization_id"), invoice.get("issue_date"))
     # [GL P2 — T8] Encaissement auto (§5.2), opt-in par org. Le recompute de statut
     # ci-dessus (partial/paid) NE re-poste PAS le revenu : seul le PAIEMENT est posté
     # ici (Dr 1000 / Cr 1100). _safe_autopost avale toute erreur → le POST reste 200.
@@ -7028,6 +8162,7 @@ def delete_invoice_payment(invoice_id: str, payment_id: str,
         {"id": invoice_id, **_org_scope(current_user)},
         {"$set": {"payments": payments, "status": new_status}}
     )
+    _report_data_changed(invoice.get("organization_id"), invoice.get("issue_date"))
     # [GL P2 — T8] Contre-passation auto de l'encaissement (§5.3), opt-in par org.
     # _unpost_source_entry pose un miroir POSTED (net zéro 1000/1100) ; le revenu
     # de la facture reste vivant. _safe_autopost avale toute erreur → DELETE 200.
@@ -7099,6 +8234,8 @@ def delete_invoice(invoice_id: str, current_user: CurrentUser = Depends(require_
     result = db.invoices.delete_one({"id": invoice_id, **_org_scope(current_user)})
     if result.deleted_count == 0:
         raise HTTPException(404, "Invoice not found")
+    _report_data_changed(inv.get("organization_id"), inv.get("issue_date"))
+    _invalidate_document_pdfs(inv.get("organization_id"), "invoice", invoice_id)
     return {"message": "deleted"}
 
 @app.put("/api/invoices/{invoice_id}/recurrence")
@@ -7111,6 +8248,7 @@ def toggle_recurrence(invoice_id: str, body: dict, current_user: CurrentUser = D
     result = db.invoices.update_one({"id": invoice_id, **_org_scope(current_user)}, {"$set": update})
     if result.matched_count == 0:
         raise HTTPException(404, "Invoice not found")
+    _bump_org_data_version(current_user.organization_id)
     return {"message": "Recurrence updated"}
 
 def _advance_date(date_str, recurrence):
@@ -7126,53 +8264,169 @@ def _advance_date(date_str, recurrence):
         d += relativedelta(years=1)
     return d.strftime("%Y-%m-%d")
 
-@app.post("/api/invoices/process-recurring")
-def process_recurring_invoices(current_user: CurrentUser = Depends(require_permission("invoices:write"))):
-    if not RESEND_API_KEY:
-        raise HTTPException(500, "Email service not configured")
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    invoices = list(db.invoices.find({
-        **_org_scope(current_user),
+# ─── Factures récurrentes : planificateur multi-organisations ───
+# Une seule requête indexée (recurrence_active, next_send_date) trouve les factures dues de
+# toutes les orgs. Chaque facture est RÉCLAMÉE par un bail (mise à jour conditionnelle sur
+# next_send_date + bail libre ou expiré) : deux exécutions concurrentes (cron + bouton, deux
+# process) ne traitent jamais la même échéance. Rendu PDF sur le pool de process, envoi par
+# l'outbox email : le débit dépend du nombre de workers, plus de la latence HTTP du fournisseur.
+RECURRING_WORKERS = int(os.environ.get("RECURRING_WORKERS", "4"))
+RECURRING_LEASE_SECONDS = 300
+RECURRING_SCHEDULER_SECONDS = int(os.environ.get("RECURRING_SCHEDULER_SECONDS", "0"))  # 0 = off
+
+
+def _due_recurring_invoices(today, match=None):
+    return list(db.invoices.find({
+        **(match or {}),
         "recurrence_active": True,
         "recurrence": {"$ne": "none"},
-        "next_send_date": {"$lte": today, "$ne": ""}
-    }, {"_id": 0}))
-    sent_count = 0
-    errors = []
-    settings = db.company_settings.find_one(_org_scope(current_user), {"_id": 0}) or {}
-    products = list(db.products.find(_org_scope(current_user), {"_id": 0}))
-    for inv in invoices:
-        client = db.clients.find_one({"id": inv.get("client_id"), **_org_scope(current_user)}, {"_id": 0})
-        to_email = (client or {}).get("email", "")
-        if not to_email:
-            errors.append(f"{inv.get('invoice_number')}: pas d'email client")
-            continue
+        "next_send_date": {"$lte": today, "$ne": ""},
+    }, {"_id": 0}).sort("next_send_date", 1))
+
+
+def _recurring_owner_scope(inv):
+    """Scope de la facture, même forme que `_org_scope` de son créateur. Facture legacy sans
+    organization_id : UNIQUEMENT la branche legacy — `{"organization_id": None}` matcherait
+    tous les documents sans org, donc ceux des autres tenants legacy."""
+    legacy = {"user_id": inv.get("created_by_user_id") or inv.get("user_id"),
+              "organization_id": {"$exists": False}}
+    if not inv.get("organization_id"):
+        return legacy
+    return {"$or": [{"organization_id": inv["organization_id"]}, legacy]}
+
+
+def _recurring_org_context(inv, client_ids):
+    """Entrées partagées par les factures d'une même org : paramètres, produits, logo et
+    clients (une requête $in dans le scope de l'org)."""
+    scope = _recurring_owner_scope(inv)
+    settings = db.company_settings.find_one(scope, {"_id": 0}) or {}
+    return {"scope": scope, "settings": settings,
+            "products": list(db.products.find(scope, {"_id": 0})),
+            "logo": _document_logo_bytes(settings) or b"",
+            "clients": {c["id"]: c for c in db.clients.find(
+                {**scope, "id": {"$in": sorted(client_ids)}}, {"_id": 0})} if client_ids else {}}
+
+
+def _claim_recurring_invoice(inv, now):
+    """Bail sur l'échéance `next_send_date` de la facture. Retourne le jeton, ou None si
+    l'échéance a déjà avancé ou qu'un autre exécuteur tient un bail encore valide."""
+    token = str(uuid.uuid4())
+    res = db.invoices.update_one(
+        {"id": inv["id"], "recurrence_active": True, "next_send_date": inv["next_send_date"],
+         "$or": [{"recurrence_lease_until": None}, {"recurrence_lease_until": {"$lte": now}}]},
+        {"$set": {"recurrence_lease_token": token,
+                  "recurrence_lease_until": now + timedelta(seconds=RECURRING_LEASE_SECONDS)}})
+    return token if res.modified_count else None
+
+
+def _render_recurring_pdf(inv, ctx, client):
+    args = ("invoice", inv, ctx["settings"], client, ctx["products"], ctx["logo"])
+    if PDF_RENDER_WORKERS <= 1:
+        return _render_document_pdf_bytes(*args)
+    pool = _pdf_render_pool()
+    try:
+        return pool.submit(_render_document_pdf_bytes, *args).result()
+    except BrokenProcessPool:
+        _reset_pdf_render_pool(pool)
+        return _render_document_pdf_bytes(*args)
+
+
+def _process_recurring_invoice(inv, ctx, client):
+    """Unité de travail du pool : bail -> rendu -> enfilage -> avance de l'échéance.
+    Retourne (statut, erreur) avec statut ∈ sent | skipped | error."""
+    now = datetime.now(timezone.utc)
+    to_email = (client or {}).get("email", "")
+    if not to_email:
+        return "error", f"{inv.get('invoice_number')}: pas d'email client"
+    token = _claim_recurring_invoice(inv, now)
+    if token is None:
+        return "skipped", None
+    lease = {"id": inv["id"], "recurrence_lease_token": token}
+    release = {"$unset": {"recurrence_lease_token": "", "recurrence_lease_until": ""}}
+    try:
+        pdf_bytes = _render_recurring_pdf(inv, ctx, client)
+        comp_name = ctx["settings"].get('company_name', 'FacturePro')
+        inv_num = inv.get('invoice_number', 'N/A')
+        params = {
+            "from": SENDER_EMAIL,
+            "to": [to_email],
+            "subject": f"Facture {inv_num} - {comp_name}",
+            "text": f"Bonjour,\n\nVeuillez trouver ci-joint la facture {inv_num}.\n\nCordialement,\n{comp_name}",
+        }
+        # Clé = (facture, échéance) : un bail expiré puis repris n'enfile pas un second envoi
+        _enqueue_email(params, "recurring_invoice", f"recurring:{inv['id']}:{inv['next_send_date']}",
+                       inv.get("organization_id"),
+                       attachments=[(f"facture_{inv_num}.pdf", pdf_bytes)])
+    except Exception as e:  # noqa: BLE001 — la facture reste due, retentée au prochain passage
+        db.invoices.update_one(lease, release)
+        return "error", f"{inv.get('invoice_number')}: {type(e).__name__}"
+    db.invoices.update_one(lease, {**release, "$set": {
+        "next_send_date": _advance_date(inv["next_send_date"], inv["recurrence"]),
+        "due_date": _advance_date(inv.get("due_date", inv["next_send_date"]), inv["recurrence"]),
+        "status": "sent",
+        "last_sent": now.isoformat(),
+    }})
+    _report_data_changed(inv.get("organization_id"), inv.get("issue_date"))
+    return "sent", None
+
+
+def run_recurring_invoices(match=None, workers=None, today=None):
+    """Traite les factures récurrentes dues (toutes les orgs, ou celles de `match`). Les
+    entrées partagées et les clients ($in) sont lus une fois par org ; les
+    factures sont traitées sur un pool de `workers` threads. Retourne les statistiques."""
+    started = time.monotonic()
+    today = today or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    due = _due_recurring_invoices(today, match)
+    groups = {}  # (org, créateur) -> factures : même scope que `_org_scope` du créateur
+    for inv in due:
+        owner = (inv.get("organization_id"), inv.get("created_by_user_id") or inv.get("user_id"))
+        groups.setdefault(owner, []).append(inv)
+    tasks = []
+    for invoices in groups.values():
+        ctx = _recurring_org_context(
+            invoices[0], {inv["client_id"] for inv in invoices if inv.get("client_id")})
+        tasks.extend((inv, ctx, ctx["clients"].get(inv.get("client_id"))) for inv in invoices)
+    workers = max(1, min(workers or RECURRING_WORKERS, len(tasks) or 1))
+    if workers == 1:
+        results = [_process_recurring_invoice(*t) for t in tasks]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="recurring") as pool:
+            results = list(pool.map(lambda t: _process_recurring_invoice(*t), tasks))
+    elapsed = time.monotonic() - started
+    sent = sum(1 for st, _ in results if st == "sent")
+    return {
+        "due": len(due),
+        "sent": sent,
+        "skipped": sum(1 for st, _ in results if st == "skipped"),
+        "errors": [err for st, err in results if st == "error"],
+        "organizations": len({org for org, _ in groups}),
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "invoices_per_second": round(sent / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def _recurring_scheduler():
+    """Thread démon optionnel (RECURRING_SCHEDULER_SECONDS > 0) : passe périodique sur toutes
+    les orgs. Sûr à lancer dans plusieurs process grâce aux baux."""
+    while True:
         try:
-            pdf_buffer = generate_document_pdf("invoice", inv, settings, client, products)
-            pdf_bytes = pdf_buffer.read()
-            pdf_b64 = base64.b64encode(pdf_bytes).decode()
-            comp_name = settings.get('company_name', 'FacturePro')
-            inv_num = inv.get('invoice_number', 'N/A')
-            params = {
-                "from": SENDER_EMAIL,
-                "to": [to_email],
-                "subject": f"Facture {inv_num} - {comp_name}",
-                "text": f"Bonjour,\n\nVeuillez trouver ci-joint la facture {inv_num}.\n\nCordialement,\n{comp_name}",
-                "attachments": [{"filename": f"facture_{inv_num}.pdf", "content": pdf_b64}]
-            }
-            resend.Emails.send(params)
-            new_next = _advance_date(inv["next_send_date"], inv["recurrence"])
-            new_due = _advance_date(inv.get("due_date", inv["next_send_date"]), inv["recurrence"])
-            db.invoices.update_one({"id": inv["id"]}, {"$set": {
-                "next_send_date": new_next,
-                "due_date": new_due,
-                "status": "sent",
-                "last_sent": datetime.now(timezone.utc).isoformat()
-            }})
-            sent_count += 1
+            stats = run_recurring_invoices()
+            if stats["due"]:
+                print(f"INFO recurring_scheduler due={stats['due']} sent={stats['sent']} "
+                      f"errors={len(stats['errors'])} {stats['seconds']}s")
         except Exception as e:
-            errors.append(f"{inv.get('invoice_number')}: {str(e)}")
-    return {"sent": sent_count, "errors": errors}
+            print(f"WARN recurring_scheduler type={type(e).__name__}")
+        time.sleep(RECURRING_SCHEDULER_SECONDS)
+
+
+@app.post("/api/invoices/process-recurring")
+def process_recurring_invoices(current_user: CurrentUser = Depends(require_permission("invoices:write"))):
+    """Traitement immédiat des factures récurrentes dues de l'organisation (même moteur que le
+    planificateur multi-organisations)."""
+    if not RESEND_API_KEY:
+        raise HTTPException(500, "Email service not configured")
+    return run_recurring_invoices(_org_scope(current_user))
 
 # ─── Bank reconciliation endpoints (feature #7) ───
 BANK_MAPPING_LIMIT = 20
@@ -7298,55 +8552,412 @@ def _delete_pdf_extraction(organization_id, file_hash):
         {"organization_id": organization_id, "file_hash": file_hash})
 
 
-def _extract_bank_rows_from_pdf(pdf_bytes, organization_id, file_hash):
-    """Extrait les transactions d'un relevé PDF via Claude, normalisées comme le CSV.
-    Réutilise le cache (org+hash) si frais. Sinon RÉSERVE la clé de façon ATOMIQUE (index
-    unique org+hash) AVANT de facturer/appeler Claude : une 2e requête concurrente sur le
-    même PDF échoue l'insert (DuplicateKeyError) et ne facture donc PAS de 2e scan.
-    Rollback du quota + suppression de la réservation sur toute erreur (jamais de scan
-    facturé sans lignes en cache). Quota -> 429 ; erreur API -> 502 ; extraction concurrente -> 409."""
+# ── Extraction PDF : découpage en tranches de pages + extracteur interchangeable ──
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+
+BANK_PDF_PAGES_PER_RANGE = int(os.environ.get("BANK_PDF_PAGES_PER_RANGE", "8"))
+BANK_PDF_RANGE_WORKERS = int(os.environ.get("BANK_PDF_RANGE_WORKERS", "4"))
+BANK_PDF_JOB_WORKERS = int(os.environ.get("BANK_PDF_JOB_WORKERS", "2"))
+
+# Bail d'une extraction en cours (réservation + job) : un battement rafraîchit updated_at
+# tant que le worker vit ; au-delà de ce délai sans battement, le worker est réputé mort et
+# la réservation peut être reprise (scan remboursé).
+BANK_PDF_LEASE_SECONDS = int(os.environ.get("BANK_PDF_LEASE_SECONDS", "300"))
+
+_bank_pdf_pools = {}
+_bank_pdf_pools_lock = threading.Lock()
+
+
+def _bank_pdf_pool(kind):
+    """Pools de threads process-wide (lazy) : "jobs" exécute les extractions en arrière-plan,
+    "ranges" les tranches de pages. Deux pools distincts : un job qui attend ses tranches
+    n'occupe jamais un worker dont une tranche aurait besoin (pas d'interblocage)."""
+    with _bank_pdf_pools_lock:
+        pool = _bank_pdf_pools.get(kind)
+        if pool is None:
+            size = BANK_PDF_JOB_WORKERS if kind == "jobs" else BANK_PDF_RANGE_WORKERS
+            pool = ThreadPoolExecutor(max_workers=max(1, size),
+                                      thread_name_prefix=f"bank-pdf-{kind}")
+            _bank_pdf_pools[kind] = pool
+        return pool
+
+
+def _pdf_header_page(pdf_bytes):
+    """1re page du relevé en sous-PDF (en-tête : période, année, compte), jointe aux
+    tranches suivantes ; None si illisible ou si pypdf est absent."""
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        return None
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        writer = PdfWriter()
+        writer.add_page(reader.pages[0])
+        buf = io.BytesIO()
+        writer.write(buf)
+        return buf.getvalue()
+    except Exception:
+        return None
+
+
+def _split_pdf_page_ranges(pdf_bytes, pages_per_range=None):
+    """Découpe un PDF en sous-PDF de `pages_per_range` pages, dans l'ordre. Retourne
+    [pdf_bytes] tel quel si le PDF est court, illisible/chiffré ou si pypdf est absent
+    (dégradation : une seule extraction, comme avant)."""
+    pages_per_range = BANK_PDF_PAGES_PER_RANGE if pages_per_range is None else pages_per_range
+    if pages_per_range <= 0:
+        return [pdf_bytes]
+    try:
+        from pypdf import PdfReader, PdfWriter  # lazy : optionnel sur un env sans la lib
+    except ImportError:
+        return [pdf_bytes]
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        n_pages = len(reader.pages)
+        if n_pages <= pages_per_range:
+            return [pdf_bytes]
+        parts = []
+        for start in range(0, n_pages, pages_per_range):
+            writer = PdfWriter()
+            for i in range(start, min(start + pages_per_range, n_pages)):
+                writer.add_page(reader.pages[i])
+            buf = io.BytesIO()
+            writer.write(buf)
+            parts.append(buf.getvalue())
+        return parts
+    except Exception:
+        return [pdf_bytes]
+
+
+def _extract_pdf_transactions(pdf_bytes, on_progress=None):
+    """Extraction brute d'un relevé : tranches de pages extraites EN PARALLÈLE puis fusionnées
+    dans l'ordre des pages -> {"transactions": [...]} (même forme qu'un appel unique, à passer
+    à _normalize_bank_rows). `on_progress(done, total)` est appelé après chaque tranche.
+    Les tranches après la 1re reçoivent la page d'en-tête en contexte (période/année).
+    Une tranche en échec fait échouer l'extraction entière (jamais de relevé partiel)."""
+    parts = _split_pdf_page_ranges(pdf_bytes)
+    total = len(parts)
+    if on_progress:
+        on_progress(0, total)
+    if total == 1:
+        results = [_call_anthropic_bank_extract(parts[0])]
+        if on_progress:
+            on_progress(1, 1)
+    else:
+        header = _pdf_header_page(pdf_bytes)
+        pool = _bank_pdf_pool("ranges")
+        futures = {pool.submit(_call_anthropic_bank_extract, part,
+                               header if i else None): i
+                   for i, part in enumerate(parts)}
+        results = [None] * total
+        try:
+            for done, fut in enumerate(as_completed(futures), start=1):
+                results[futures[fut]] = fut.result()
+                if on_progress:
+                    on_progress(done, total)
+        except Exception:
+            for fut in futures:
+                fut.cancel()
+            raise
+    merged = []
+    for raw in results:
+        txs = raw.get("transactions") if isinstance(raw, dict) else None
+        if isinstance(txs, list):
+            merged.extend(txs)
+    return {"transactions": merged}
+
+
+def _bank_pdf_lease_cutoff():
+    return datetime.now(timezone.utc) - timedelta(seconds=BANK_PDF_LEASE_SECONDS)
+
+
+def _reclaim_stale_pdf_extraction(organization_id, file_hash):
+    """Reprend une réservation « extracting » dont le worker est mort (aucun battement depuis
+    BANK_PDF_LEASE_SECONDS) : suppression ATOMIQUE (un seul repreneur gagne), remboursement
+    du scan facturé et jobs actifs correspondants passés en erreur. True si reprise."""
+    cutoff = _bank_pdf_lease_cutoff()
+    stale = db.bank_pdf_extractions.find_one_and_delete({
+        "organization_id": organization_id, "file_hash": file_hash, "status": "extracting",
+        "$or": [{"updated_at": {"$lt": cutoff}},
+                {"updated_at": {"$exists": False}, "created_at": {"$lt": cutoff}}]})
+    if not stale:
+        return False
+    db.organizations.update_one({"id": organization_id}, {"$inc": {"scan_count_this_month": -1}})
+    _interrupt_bank_pdf_jobs({"organization_id": organization_id, "file_hash": file_hash})
+    return True
+
+
+def _interrupt_bank_pdf_jobs(match):
+    """Passe en erreur les jobs encore actifs de `match` (worker mort). Rend le nombre modifié."""
+    now = datetime.now(timezone.utc)
+    return db.bank_pdf_jobs.update_many(
+        {**match, "status": {"$in": list(_BANK_PDF_JOB_ACTIVE)}},
+        {"$set": {"status": "error", "error": "Analyse interrompue — relance l'import.",
+                  "error_status": 500, "finished_at": now, "updated_at": now}}).modified_count
+
+
+def _reserve_pdf_extraction(organization_id, file_hash):
+    """Réserve la clé (org+hash) de façon ATOMIQUE (index unique) puis facture le scan.
+    Retourne (lignes cachées, None) si une extraction fraîche existe déjà (rien n'est réservé
+    ni facturé), sinon (None, lease_id) : l'appelant DOIT alors lancer _run_pdf_extraction
+    avec ce bail. Une réservation dont le worker est mort (bail expiré) est reprise.
+    Extraction concurrente -> 409 ; quota -> 429 (réservation nettoyée)."""
     cached = _get_cached_pdf_extraction(organization_id, file_hash)
     if cached is not None:
-        return cached
-    # Réservation atomique : le gagnant seul facture + extrait.
-    try:
-        db.bank_pdf_extractions.insert_one({
-            "organization_id": organization_id, "file_hash": file_hash,
-            "rows": None, "status": "extracting",
-            "created_at": datetime.now(timezone.utc)})
-    except DuplicateKeyError:
-        existing = _get_cached_pdf_extraction(organization_id, file_hash)
-        if existing is not None:
-            return existing
-        raise HTTPException(409, "Analyse de ce relevé déjà en cours — réessaie dans un instant.")
+        return cached, None
+    lease_id = str(uuid.uuid4())
+    for attempt in range(2):
+        now = datetime.now(timezone.utc)
+        try:
+            db.bank_pdf_extractions.insert_one({
+                "organization_id": organization_id, "file_hash": file_hash,
+                "rows": None, "status": "extracting", "lease_id": lease_id,
+                "created_at": now, "updated_at": now})
+            break
+        except DuplicateKeyError:
+            existing = _get_cached_pdf_extraction(organization_id, file_hash)
+            if existing is not None:
+                return existing, None
+            if attempt or not _reclaim_stale_pdf_extraction(organization_id, file_hash):
+                raise HTTPException(
+                    409, "Analyse de ce relevé déjà en cours — réessaie dans un instant.")
     # Facturation (429 auto-rollback interne) — nettoie la réservation si refusée.
     try:
         _check_and_bill_scan(organization_id)
     except Exception:
-        _delete_pdf_extraction(organization_id, file_hash)
+        _release_pdf_extraction(organization_id, file_hash, lease_id, refund=False)
         raise
-    # Appel Claude + normalisation — rembourse le scan ET nettoie la réservation sur erreur.
-    try:
-        raw_extraction = _call_anthropic_bank_extract(pdf_bytes)
-        rows = _normalize_bank_rows(raw_extraction)
-    except Exception:
+    return None, lease_id
+
+
+def _release_pdf_extraction(organization_id, file_hash, lease_id, refund=True):
+    """Supprime la réservation de CE bail et rembourse son scan. Sans effet si le bail a déjà
+    été repris (_reclaim_stale_pdf_extraction a remboursé) : jamais de double remboursement."""
+    res = db.bank_pdf_extractions.delete_one(
+        {"organization_id": organization_id, "file_hash": file_hash, "lease_id": lease_id})
+    if refund and res.deleted_count:
         db.organizations.update_one(
             {"id": organization_id}, {"$inc": {"scan_count_this_month": -1}})
-        _delete_pdf_extraction(organization_id, file_hash)
+
+
+class _BankPdfHeartbeat:
+    """Battement d'une extraction en cours (thread daemon) : rafraîchit updated_at de la
+    réservation (filtrée sur le bail) et du job toutes les BANK_PDF_LEASE_SECONDS/3, tant que
+    le worker vit. S'il meurt, le bail expire et la réservation devient reprenable."""
+
+    def __init__(self, organization_id, file_hash, lease_id, job_id=None):
+        self._key = {"organization_id": organization_id, "file_hash": file_hash,
+                     "lease_id": lease_id, "status": "extracting"}
+        self._job_id = job_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="bank-pdf-heartbeat")
+
+    def beat(self):
+        now = datetime.now(timezone.utc)
+        db.bank_pdf_extractions.update_one(self._key, {"$set": {"updated_at": now}})
+        if self._job_id:
+            db.bank_pdf_jobs.update_one(
+                {"id": self._job_id, "status": {"$in": list(_BANK_PDF_JOB_ACTIVE)}},
+                {"$set": {"updated_at": now}})
+
+    def _run(self):
+        while not self._stop.wait(max(1, BANK_PDF_LEASE_SECONDS / 3)):
+            try:
+                self.beat()
+            except Exception as e:
+                print(f"WARN bank_pdf_heartbeat_failed type={type(e).__name__}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        return False
+
+
+def _run_pdf_extraction(pdf_bytes, organization_id, file_hash, lease_id,
+                        on_progress=None, job_id=None):
+    """Extraction d'une réservation déjà facturée : appel(s) Claude + normalisation, puis
+    remplit le cache. Rembourse le scan ET supprime la réservation sur toute erreur (sauf si
+    le bail a été repris entre-temps). Le bail est entretenu par un battement."""
+    try:
+        with _BankPdfHeartbeat(organization_id, file_hash, lease_id, job_id):
+            raw_extraction = _extract_pdf_transactions(pdf_bytes, on_progress=on_progress)
+            rows = _normalize_bank_rows(raw_extraction)
+    except Exception:
+        _release_pdf_extraction(organization_id, file_hash, lease_id)
         raise
     db.bank_pdf_extractions.update_one(
-        {"organization_id": organization_id, "file_hash": file_hash},
+        {"organization_id": organization_id, "file_hash": file_hash, "lease_id": lease_id},
         {"$set": {"rows": rows, "status": "done",
                   "created_at": datetime.now(timezone.utc)}})
     return rows
 
 
+def _extract_bank_rows_from_pdf(pdf_bytes, organization_id, file_hash):
+    """Extrait les transactions d'un relevé PDF via Claude, normalisées comme le CSV.
+    Réutilise le cache (org+hash) si frais. Sinon RÉSERVE la clé de façon ATOMIQUE (index
+    unique org+hash) AVANT de facturer/appeler Claude : une 2e requête concurrente sur le
+    même PDF échoue l'insert (DuplicateKeyError) et ne facture donc PAS de 2e scan.
+    Rollback du quota + suppression de la réservation sur toute erreur (jamais de scan
+    facturé sans lignes en cache). Quota -> 429 ; erreur API -> 502 ; extraction concurrente -> 409."""
+    cached, lease_id = _reserve_pdf_extraction(organization_id, file_hash)
+    if cached is not None:
+        return cached
+    return _run_pdf_extraction(pdf_bytes, organization_id, file_hash, lease_id)
+
+
+# ── Mode job (arrière-plan) : l'upload rend un job_id, un pool de workers extrait ──
+_BANK_PDF_JOB_ACTIVE = ("queued", "running")
+
+
+def _bank_pdf_job_progress(job_id):
+    def on_progress(done, total):
+        db.bank_pdf_jobs.update_one({"id": job_id}, {"$set": {
+            "ranges_done": done, "ranges_total": total,
+            "updated_at": datetime.now(timezone.utc)}})
+    return on_progress
+
+
+def _run_bank_pdf_job(job_id, pdf_bytes, organization_id, file_hash, lease_id):
+    """Corps d'un job (thread du pool "jobs") : la réservation est déjà prise et facturée par
+    l'endpoint ; ici on extrait, puis on marque le job done/error. Les erreurs sont
+    consignées sur le job (jamais str(e) d'une exception non-HTTP : peut leaker la clé API)."""
+    now = datetime.now(timezone.utc)
+    started = db.bank_pdf_jobs.update_one({"id": job_id, "status": "queued"}, {"$set": {
+        "status": "running", "started_at": now, "updated_at": now}})
+    if not started.modified_count:
+        return  # job repris (bail expiré pendant l'attente) : réservation déjà remboursée
+    try:
+        rows = _run_pdf_extraction(pdf_bytes, organization_id, file_hash, lease_id,
+                                   on_progress=_bank_pdf_job_progress(job_id), job_id=job_id)
+    except HTTPException as e:
+        update = {"status": "error", "error": e.detail, "error_status": e.status_code}
+    except Exception as e:
+        print(f"ERROR bank_pdf_job_failed job={job_id} type={type(e).__name__}")
+        update = {"status": "error", "error": "Service d'analyse temporairement indisponible",
+                  "error_status": 502}
+    else:
+        update = {"status": "done", "total_rows": len(rows)}
+    now = datetime.now(timezone.utc)
+    db.bank_pdf_jobs.update_one({"id": job_id, "status": "running"}, {"$set": {
+        **update, "finished_at": now, "updated_at": now}})
+
+
+BANK_IMPORT_RESPONSE_TXS = 500  # transactions renvoyées par la réponse d'import (le reste : GET paginé)
+
+
+def _bank_tx_doc(current_user, import_id, row, bank_account=""):
+    """Document bank_transaction (unmatched) d'une ligne mappée."""
+    return {
+        "id": str(uuid.uuid4()),
+        "organization_id": current_user.organization_id,
+        "created_by_user_id": current_user.id,
+        "user_id": current_user.id,  # legacy
+        "import_id": import_id,
+        "bank_account": bank_account,
+        "row_index": row["row_index"],
+        "date": row["date"],
+        "description": row["description"],
+        "amount_cad": row["amount_cad"],
+        "parse_error": row["parse_error"],
+        "raw_line": row.get("raw_line"),
+        "status": "unmatched",
+        "match_kind": None,
+        "match_id": None,
+        "invoice_id": None,
+        "matched_at": None,
+    }
+
+
+def _iter_chunks(iterable, size):
+    """Découpe un itérable en listes de `size` éléments (la dernière peut être plus courte)."""
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _bank_row_key(row):
+    """Clé métier d'une ligne de relevé : (date, montant, description normalisée). None pour
+    une ligne en erreur de parse (jamais dédupliquée : elle est revue à la main)."""
+    if row.get("parse_error") or not row.get("date") or row.get("amount_cad") is None:
+        return None
+    desc = " ".join(unicodedata.normalize("NFKC", row.get("description") or "").casefold().split())
+    return (row["date"], f"{round(float(row['amount_cad']), 2) + 0.0:.2f}", desc)
+
+
+def _bank_account_key(bank_label):
+    """Compte bancaire d'un relevé pour la dédup : libellé de l'import normalisé, figé à
+    l'import (deux comptes aux lignes identiques — virement interne, même paiement — ne se
+    masquent pas)."""
+    return " ".join(unicodedata.normalize("NFKC", bank_label or "").casefold().split())
+
+
+def _bank_row_fingerprint(key, ordinal):
+    """Empreinte d'une ligne : clé métier + rang d'occurrence dans le relevé (deux achats
+    identiques le même jour restent deux lignes ; le même relevé ré-exporté retombe sur les
+    mêmes empreintes)."""
+    raw = "\x1f".join((key[0], key[1], key[2], str(ordinal)))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _assign_bank_row_fingerprints(tx_docs, occurrences):
+    """Pose `row_fingerprint` sur chaque doc dédupliquable (in-place). `occurrences` compte les
+    clés déjà vues dans CE relevé — partagé entre paquets pour des rangs continus."""
+    for doc in tx_docs:
+        key = _bank_row_key(doc)
+        if key is None:
+            continue
+        ordinal = occurrences.get(key, 0)
+        occurrences[key] = ordinal + 1
+        doc["row_fingerprint"] = _bank_row_fingerprint(key, ordinal)
+
+
+def _known_bank_fingerprints(organization_id, bank_account, fingerprints):
+    """Empreintes déjà présentes pour le compte de l'org — UNE requête $in (index unique
+    org+compte+empreinte)."""
+    if not fingerprints:
+        return set()
+    return {d["row_fingerprint"] for d in db.bank_transactions.find(
+        {"organization_id": organization_id, "bank_account": bank_account,
+         "row_fingerprint": {"$in": list(fingerprints)}},
+        {"_id": 0, "row_fingerprint": 1})}
+
+
+def _insert_new_bank_txs(tx_docs):
+    """insert_many non ordonné ; un doublon d'empreinte levé par l'index unique (import
+    concurrent qui chevauche) est ignoré comme une ligne déjà connue. Retourne les docs
+    réellement insérés."""
+    try:
+        db.bank_transactions.insert_many(tx_docs, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        dup = {err["index"] for err in errors}
+        return [d for i, d in enumerate(tx_docs) if i not in dup]
+    return tx_docs
+
+
 def _persist_bank_import(current_user, parsed, file_hash, bank_label, filename,
                          mapping_id=None, source="csv"):
     """Crée le bank_import + les bank_transactions + auto-match. Partagé CSV et PDF
-    pour garantir un pipeline aval identique. Retourne la réponse d'import complète."""
+    pour garantir un pipeline aval identique. Retourne la réponse d'import complète.
+
+    `parsed` est un itérable de lignes mappées (liste pour le PDF, générateur en flux pour
+    CSV/XLSX). Les transactions sont insérées par paquets de BANK_IMPORT_CHUNK_SIZE et chaque
+    paquet est auto-matché dès son insertion (index du matcheur partagé entre paquets) :
+    mémoire O(paquet). La réponse ne porte que les BANK_IMPORT_RESPONSE_TXS premières
+    transactions (+ total_count) ; le reste se lit via GET /api/bank/imports/{id}."""
     now = datetime.now(timezone.utc).isoformat()
     import_id = str(uuid.uuid4())
+    scope = _org_scope(current_user)
     label = (bank_label or "Banque").strip()[:60] or "Banque"
     import_doc = {
         "id": import_id,
@@ -7357,46 +8968,116 @@ def _persist_bank_import(current_user, parsed, file_hash, bank_label, filename,
         "bank_label": label,
         "filename": filename,
         "file_hash": file_hash,
-        "row_count": len(parsed),
+        "row_count": 0,
         "skipped_rows": 0,
         "source": source,
         "imported_at": now,
         "closed_at": None,
     }
     db.bank_imports.insert_one(import_doc)
-    tx_docs = []
-    for row in parsed:
-        tx_docs.append({
-            "id": str(uuid.uuid4()),
-            "organization_id": current_user.organization_id,
-            "created_by_user_id": current_user.id,
-            "user_id": current_user.id,  # legacy
-            "import_id": import_id,
-            "row_index": row["row_index"],
-            "date": row["date"],
-            "description": row["description"],
-            "amount_cad": row["amount_cad"],
-            "parse_error": row["parse_error"],
-            "raw_line": row.get("raw_line"),
-            "status": "unmatched",
-            "match_kind": None,
-            "match_id": None,
-            "invoice_id": None,
-            "matched_at": None,
-        })
-    if tx_docs:
-        db.bank_transactions.insert_many(tx_docs)
+    match_context = None
+    matched_n = 0
+    occurrences = {}
+    account = _bank_account_key(label)
+    for chunk in _iter_chunks(parsed, BANK_IMPORT_CHUNK_SIZE):
+        tx_docs = [_bank_tx_doc(current_user, import_id, row, account) for row in chunk]
+        import_doc["row_count"] += len(tx_docs)
+        # Relevés qui se chevauchent : les lignes déjà importées sur le MÊME compte (même
+        # empreinte) sont sautées.
+        _assign_bank_row_fingerprints(tx_docs, occurrences)
+        known = _known_bank_fingerprints(
+            current_user.organization_id, account,
+            [d["row_fingerprint"] for d in tx_docs if "row_fingerprint" in d])
+        fresh = [d for d in tx_docs if d.get("row_fingerprint") not in known]
+        fresh = _insert_new_bank_txs(fresh) if fresh else []
+        import_doc["skipped_rows"] += len(tx_docs) - len(fresh)
+        if not fresh:
+            continue
+        if match_context is None:
+            match_context = _bank_match_context(scope)
+        matched_n += _auto_match_transactions(
+            import_id, scope, tx_ids=[t["id"] for t in fresh], context=match_context)
+    db.bank_imports.update_one({"id": import_id, **scope},
+                               {"$set": {"row_count": import_doc["row_count"],
+                                         "skipped_rows": import_doc["skipped_rows"]}})
     if mapping_id:
-        db.bank_mappings.update_one({"id": mapping_id, **_org_scope(current_user)},
+        db.bank_mappings.update_one({"id": mapping_id, **scope},
                                     {"$set": {"last_used_at": now}})
-    matched_n = _auto_match_transactions(import_id, _org_scope(current_user))
-    final_txs = list(db.bank_transactions.find(
-        {"import_id": import_id, **_org_scope(current_user)}, {"_id": 0}))
+    final_txs = db.bank_transactions.find(
+        {"import_id": import_id, **scope}, {"_id": 0}
+    ).sort("row_index", 1).limit(BANK_IMPORT_RESPONSE_TXS)
     return {"import": clean_doc(import_doc),
             "transactions": [clean_doc(t) for t in final_txs],
+            "total_count": import_doc["row_count"] - import_doc["skipped_rows"],
+            "skipped_rows": import_doc["skipped_rows"],
             "auto_matched": matched_n}
 
 
+def migrate_bank_row_fingerprints_v1():
+    """Idempotente. Pose `row_fingerprint` sur les bank_transactions antérieures à la dédup
+    par ligne, import par import (du plus ancien au plus récent, rangs d'occurrence recalculés
+    sur TOUT l'import trié par row_index). Une ligne déjà connue d'un import plus ancien
+    (relevés chevauchants importés avant la dédup) reçoit `row_fingerprint: None` : elle reste
+    en place (jamais de suppression) mais ne viole pas l'index unique et n'est plus re-visitée."""
+    pending = db.bank_transactions.distinct(
+        "import_id", {"row_fingerprint": {"$exists": False},
+                      "organization_id": {"$exists": True}})
+    if not pending:
+        return
+    done = 0
+    for imp in db.bank_imports.find({"id": {"$in": pending}},
+                                    {"_id": 0, "id": 1, "bank_label": 1}).sort("imported_at", 1):
+        occurrences = {}
+        account = _bank_account_key(imp.get("bank_label"))
+        for chunk in _iter_chunks(db.bank_transactions.find(
+                {"import_id": imp["id"], "organization_id": {"$exists": True}},
+                {"_id": 0, "id": 1, "organization_id": 1, "date": 1, "amount_cad": 1,
+                 "description": 1, "parse_error": 1, "row_fingerprint": 1}
+        ).sort("row_index", 1), BANK_IMPORT_CHUNK_SIZE):
+            # Rangs calculés dans l'ordre sur toutes les lignes (y compris celles déjà traitées).
+            copies = [{k: v for k, v in t.items() if k != "row_fingerprint"} for t in chunk]
+            _assign_bank_row_fingerprints(copies, occurrences)
+            todo = [c for c, t in zip(copies, chunk) if "row_fingerprint" not in t]
+            if not todo:
+                continue
+            org_id = todo[0]["organization_id"]
+            known = _known_bank_fingerprints(
+                org_id, account, [t["row_fingerprint"] for t in todo if "row_fingerprint" in t])
+            ops = []
+            for t in todo:
+                fp = t.get("row_fingerprint")
+                ops.append(UpdateOne({"id": t["id"], "row_fingerprint": {"$exists": False}},
+                                     {"$set": {"bank_account": account, "row_fingerprint":
+                                               fp if fp and fp not in known else None}}))
+            db.bank_transactions.bulk_write(ops, ordered=False)
+            done += len(ops)
+    if done:
+        print(f"Migration bank_row_fingerprints_v1: {done} transaction(s) fingerprinted")
+
+
+def migrate_bank_row_accounts_v1():
+    """Idempotente. Pose `bank_account` (libellé normalisé de l'import) sur les
+    bank_transactions antérieures à la dédup par compte. Sans conflit d'index : l'ancien index
+    unique (org, empreinte) garantissait déjà l'unicité, a fortiori par compte."""
+    pending = db.bank_transactions.distinct(
+        "import_id", {"bank_account": {"$exists": False}, "organization_id": {"$exists": True}})
+    done = 0
+    for imp in db.bank_imports.find({"id": {"$in": pending}}, {"_id": 0, "id": 1, "bank_label": 1}):
+        done += db.bank_transactions.update_many(
+            {"import_id": imp["id"], "bank_account": {"$exists": False}},
+            {"$set": {"bank_account": _bank_account_key(imp.get("bank_label"))}}).modified_count
+    if done:
+        print(f"Migration bank_row_accounts_v1: {done} transaction(s) tagged with their account")
+
+
+def _upload_size(fileobj):
+    """Taille d'un fichier d'upload seekable, sans le lire."""
+    fileobj.seek(0, io.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
 @app.post("/api/bank/imports", status_code=201)
 async def create_bank_import(
     file: UploadFile = File(...),
@@ -7407,16 +9088,20 @@ async def create_bank_import(
     response: Response = None,
     current_user: CurrentUser = Depends(require_permission("bank:write")),
 ):
-    # ── 1. lecture + détection PDF / XLSX / CSV (magic-bytes) ──
-    raw = await file.read()
-    is_pdf = raw[:16].lstrip().startswith(b"%PDF")
-    is_xlsx = raw[:4] == b"PK\x03\x04"  # XLSX = archive ZIP Office Open XML
+    # ── 1. détection PDF / XLSX / CSV (magic-bytes) — l'upload reste dans son fichier spoolé ──
+    upload = file.file
+    size = _upload_size(upload)
+    head = upload.read(16)
+    is_pdf = head.lstrip().startswith(b"%PDF")
+    is_xlsx = head[:4] == b"PK\x03\x04"  # XLSX = archive ZIP Office Open XML
 
     # ── PDF : extraction des transactions via Claude (feature #7.1) ──
     # Réutilise le MÊME pipeline aval (dédup, bank_transactions, auto-match) que le CSV.
     if is_pdf:
-        if len(raw) > MAX_BANK_PDF_BYTES:
+        if size > MAX_BANK_PDF_BYTES:
             raise HTTPException(413, f"PDF exceeds size limit ({MAX_BANK_PDF_BYTES // (1024*1024)} MB)")
+        upload.seek(0)
+        raw = upload.read()
         file_hash = _compute_file_hash(raw)
         if dry_run:
             # Aperçu : extrait (1 scan facturé, mis en cache) et renvoie TOUTES les lignes
@@ -7441,8 +9126,8 @@ async def create_bank_import(
         _delete_pdf_extraction(current_user.organization_id, file_hash)
         return result
 
-    # ── CSV ou XLSX : size cap + mapping + parse (même mapping/pipeline, parseur choisi) ──
-    if len(raw) > MAX_BANK_CSV_BYTES:
+    # ── CSV ou XLSX : size cap + mapping + parse en flux (même mapping/pipeline, parseur choisi) ──
+    if size > MAX_BANK_CSV_BYTES:
         raise HTTPException(413, f"File exceeds size limit ({MAX_BANK_CSV_BYTES // (1024*1024)} MB)")
 
     if mapping_id:
@@ -7459,8 +9144,10 @@ async def create_bank_import(
         raise HTTPException(422, "mapping_id or mapping required")
 
     src = "xlsx" if is_xlsx else "csv"
+    # Passe de validation (encodage/largeur, plafond de lignes, aperçu) AVANT toute écriture :
+    # un 413/422 ne laisse jamais d'import partiel.
     try:
-        parsed = _parse_xlsx_rows(raw, mapping_doc) if is_xlsx else _parse_csv_rows(raw, mapping_doc)
+        open_rows, total_rows, preview = _scan_bank_upload(upload, mapping_doc, src)
     except ValueError as e:
         if "row limit" in str(e):
             raise HTTPException(413, str(e))
@@ -7469,38 +9156,158 @@ async def create_bank_import(
     if dry_run:
         if response is not None:
             response.status_code = 200
-        return {"parsed_rows": parsed[:10], "total_rows": len(parsed), "source": src}
+        return {"parsed_rows": preview, "total_rows": total_rows, "source": src}
 
-    file_hash = _compute_file_hash(raw)
+    file_hash = _compute_file_hash_stream(upload)
     existing = db.bank_imports.find_one(
         {**_org_scope(current_user), "file_hash": file_hash}, {"_id": 0})
     if existing:
         raise HTTPException(409, f"Duplicate import (existing import_id: {existing['id']})")
 
     return _persist_bank_import(
-        current_user, parsed, file_hash,
+        current_user, open_rows(), file_hash,
         bank_label or mapping_doc.get("bank_label"),
         file.filename or ("import.xlsx" if is_xlsx else "import.csv"),
         mapping_id=mapping_id, source=src)
 
 
-def _import_with_live_counts(imp):
-    """Enrichit un bank_import avec les counts live des transactions."""
-    counts = {"matched": 0, "ignored": 0, "unmatched": 0}
-    for s in ("matched", "ignored", "unmatched"):
-        counts[s] = db.bank_transactions.count_documents(
-            {"import_id": imp["id"], "status": s})
-    out = clean_doc(imp)
-    out["matched_count"] = counts["matched"]
-    out["ignored_count"] = counts["ignored"]
-    out["unmatched_count"] = counts["unmatched"]
+def _bank_pdf_job_view(job):
+    """Réponse de statut d'un job : progression (tranches de pages) + lignes une fois terminé
+    (lues dans le cache org+hash, comme l'aperçu synchrone)."""
+    total = job.get("ranges_total") or 0
+    out = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "filename": job.get("filename"),
+        "ranges_done": job.get("ranges_done", 0),
+        "ranges_total": total,
+        "progress": 1.0 if job["status"] == "done" else (
+            round(job.get("ranges_done", 0) / total, 3) if total else 0.0),
+        "error": job.get("error"),
+        "created_at": job.get("created_at"),
+        "finished_at": job.get("finished_at"),
+        "source": "pdf",
+    }
+    if job["status"] == "done":
+        rows = _get_cached_pdf_extraction(job["organization_id"], job["file_hash"])
+        out["expired"] = rows is None  # cache expiré ou déjà consommé par l'import
+        out["parsed_rows"] = rows
+        out["total_rows"] = len(rows) if rows is not None else job.get("total_rows", 0)
     return out
 
 
-@app.get("/api/bank/imports")
-def list_bank_imports(limit: int = 50,
-                      current_user: CurrentUser = Depends(require_permission("bank:read"))):
-    limit = min(max(limit, 1), 50)
+@app.post("/api/bank/pdf-jobs", status_code=202)
+async def create_bank_pdf_job(
+    file: UploadFile = File(...),
+    current_user: CurrentUser = Depends(require_permission("bank:write")),
+):
+    """Aperçu PDF en arrière-plan : réserve + facture le scan (mêmes 409/429 que l'aperçu
+    synchrone), rend un job_id TOUT DE SUITE et confie l'extraction au pool de workers.
+    Le même relevé déjà en cours d'analyse rattache l'appelant au job existant (aucun
+    2e scan) ; déjà en cache -> job immédiatement terminé. L'import réel reste
+    POST /api/bank/imports (réutilise le cache rempli par le job)."""
+    upload = file.file
+    size = _upload_size(upload)
+    if size > MAX_BANK_PDF_BYTES:
+        raise HTTPException(413, f"PDF exceeds size limit ({MAX_BANK_PDF_BYTES // (1024*1024)} MB)")
+    raw = upload.read()
+    if not raw.lstrip().startswith(b"%PDF"):
+        raise HTTPException(422, "Le fichier n'est pas un PDF")
+    org_id = current_user.organization_id
+    file_hash = _compute_file_hash(raw)
+    # Job actif ET vivant (battement récent) : un job dont le worker est mort n'est jamais
+    # rejoint — la réservation sera reprise (scan remboursé) par _reserve_pdf_extraction.
+    active = {"organization_id": org_id, "file_hash": file_hash,
+              "status": {"$in": list(_BANK_PDF_JOB_ACTIVE)},
+              "updated_at": {"$gte": _bank_pdf_lease_cutoff()}}
+    job = db.bank_pdf_jobs.find_one(active, {"_id": 0})
+    if job:
+        return _bank_pdf_job_view(job)
+    try:
+        cached, lease_id = _reserve_pdf_extraction(org_id, file_hash)
+    except HTTPException as e:
+        # Course avec un autre upload du même relevé : se rattacher à son job s'il existe.
+        job = db.bank_pdf_jobs.find_one(active, {"_id": 0}) if e.status_code == 409 else None
+        if job:
+            return _bank_pdf_job_view(job)
+        raise
+    now = datetime.now(timezone.utc)
+    job = {
+        "id": str(uuid.uuid4()),
+        "organization_id": org_id,
+        "created_by_user_id": current_user.id,
+        "file_hash": file_hash,
+        "filename": file.filename or "releve.pdf",
+        "status": "done" if cached is not None else "queued",
+        "ranges_done": 0,
+        "ranges_total": 0,
+        "total_rows": len(cached) if cached is not None else None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "finished_at": now if cached is not None else None,
+    }
+    try:
+        db.bank_pdf_jobs.insert_one(job)
+        if cached is None:
+            _bank_pdf_pool("jobs").submit(_run_bank_pdf_job, job["id"], raw, org_id, file_hash,
+                                          lease_id)
+    except Exception:
+        if cached is None:  # réservation facturée mais jamais lancée : rembourse
+            _release_pdf_extraction(org_id, file_hash, lease_id)
+        raise
+    return _bank_pdf_job_view(clean_doc(job))
+
+
+@app.get("/api/bank/pdf-jobs/{job_id}")
+def get_bank_pdf_job(job_id: str,
+                     current_user: CurrentUser = Depends(require_permission("bank:read"))):
+    job = db.bank_pdf_jobs.find_one(
+        {"id": job_id, "organization_id": current_user.organization_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(404, "Job not found")
+    # Worker mort (aucun battement depuis le bail) : job en erreur, scan remboursé.
+    if job["status"] in _BANK_PDF_JOB_ACTIVE and _interrupt_bank_pdf_jobs(
+            {"id": job_id, "updated_at": {"$lt": _bank_pdf_lease_cutoff()}}):
+        _reclaim_stale_pdf_extraction(job["organization_id"], job["file_hash"])
+        job = db.bank_pdf_jobs.find_one({"id": job_id}, {"_id": 0})
+    return _bank_pdf_job_view(job)
+
+
+def _bank_import_status_counts(import_ids):
+    """Counts live par statut pour plusieurs imports en UNE agrégation ($group sur
+    (import_id, status)) au lieu de 3 count_documents par import.
+    Retourne {import_id: {"matched": n, "ignored": n, "unmatched": n}} (zéros si aucun)."""
+    counts = {iid: {"matched": 0, "ignored": 0, "unmatched": 0} for iid in import_ids}
+    if not counts:
+        return counts
+    for row in db.bank_transactions.aggregate([
+        {"$match": {"import_id": {"$in": list(counts)}}},
+        {"$group": {"_id": {"import_id": "$import_id", "status": "$status"},
+                    "n": {"$sum": 1}}},
+    ]):
+        bucket = counts.get(row["_id"].get("import_id"))
+        if bucket is not None and row["_id"].get("status") in bucket:
+            bucket[row["_id"]["status"]] = row["n"]
+    return counts
+
+
+def _import_with_live_counts(imp, counts=None):
+    """Enrichit un bank_import avec les counts live des transactions. `counts` : résultat
+    pré-agrégé de `_bank_import_status_counts` (liste d'imports), sinon calculé pour cet import."""
+    if counts is None:
+        counts = _bank_import_status_counts([imp["id"]])[imp["id"]]
+    out = clean_doc(imp)
+    out["matched_count"] = counts["matched"]
+    out["ignored_count"] = counts["ignored"]
+    out["unmatched_count"] = counts["unmatched"]
+    return out
+
+
+@app.get("/api/bank/imports")
+def list_bank_imports(limit: int = 50,
+                      current_user: CurrentUser = Depends(require_permission("bank:read"))):
+    limit = min(max(limit, 1), 50)
     cursor = db.bank_imports.find(
         {"$or": [
             {"organization_id": current_user.organization_id},
@@ -7508,7 +9315,9 @@ def list_bank_imports(limit: int = 50,
         ]},
         {"_id": 0}
     ).sort("imported_at", -1).limit(limit)
-    return [_import_with_live_counts(imp) for imp in cursor]
+    imports = list(cursor)
+    counts = _bank_import_status_counts([imp["id"] for imp in imports])
+    return [_import_with_live_counts(imp, counts[imp["id"]]) for imp in imports]
 
 
 @app.get("/api/bank/imports/{import_id}")
@@ -7605,6 +9414,7 @@ def unmatch_bank_transaction(tx_id: str,
             new_status = _recompute_invoice_status(updated)
             db.invoices.update_one({"id": invoice["id"], **_org_scope(current_user)},
                                    {"$set": {"status": new_status}})
+            _report_data_changed(invoice.get("organization_id"), invoice.get("issue_date"))
     elif tx.get("match_kind") == "invoice_split":
         # Défaire un split : supprimer TOUS les payments créés (identifiés par bank_transaction_id
         # = tx.id). $pull atomique — évite d'écraser un payment concurrent ajouté entre-temps.
@@ -7622,6 +9432,7 @@ def unmatch_bank_transaction(tx_id: str,
                 updated["status"] = "sent"
             new_status = _recompute_invoice_status(updated)
             db.invoices.update_one({"id": iid, **scope}, {"$set": {"status": new_status}})
+            _report_data_changed(updated.get("organization_id"), updated.get("issue_date"))
     elif tx.get("match_kind") == "expense":
         exp = db.expenses.find_one(
             {"id": tx.get("match_id"), **_org_scope(current_user)}, {"_id": 0})
@@ -7641,6 +9452,8 @@ def unmatch_bank_transaction(tx_id: str,
                 restore["personal_use_amount_cad"] = round(est - new_ded, 2)
         db.expenses.update_one(
             {"id": tx.get("match_id"), **_org_scope(current_user)}, {"$set": restore})
+        if exp and "amount_cad" in restore:
+            _report_data_changed(exp.get("organization_id"), exp.get("expense_date"))
         if "amount_cad" in restore:
             _repost_expense_gl(
                 exp.get("organization_id"),
@@ -7682,50 +9495,88 @@ def get_bank_suggestions(tx_id: str,
     tx = _get_tx_or_404(tx_id, scope)
     if tx.get("date") is None or tx.get("amount_cad") is None:
         return {"invoices": [], "expenses": []}
+    return _bank_tx_suggestions(tx, _bank_match_context(scope))
+
+
+BANK_SUGGESTIONS_TOP = 3
+BANK_SUGGESTIONS_BATCH_MAX = 500
+
+
+def _bank_tx_suggestions(tx, context):
+    """Top-3 candidats d'une transaction (factures pour un crédit, dépenses pour un débit), lus
+    dans l'index du matcheur (`_bank_match_context`) : montant à ±0,01 (pas de fourchette
+    devise), facture émise dans [tx − 90 j, tx + 3 j], dépense à ±3 j. Même scoring et même
+    départage que l'auto-match ; le nom client vient du lookup $in du contexte."""
+    out = {"invoices": [], "expenses": []}
+    if tx.get("date") is None or tx.get("amount_cad") is None:
+        return out
     tx_date = _parse_iso_date(tx["date"])
     target = abs(float(tx["amount_cad"]))
+    if tx_date is None or not math.isfinite(target):
+        return out
+    index = context["index"]
     desc_lower = (tx.get("description") or "").lower()
     tx_tokens = _significant_tokens(tx.get("description"))
-    aliases = list(db.bank_match_aliases.find(scope, {"_id": 0}))
-    invoices_out = []
-    expenses_out = []
     if tx["amount_cad"] > 0:
         cands = []
-        for inv in db.invoices.find(
-                {**scope,
-                 "status": {"$in": ["sent", "partial", "overdue"]}}, {"_id": 0}):
-            outstanding = _get_invoice_outstanding(inv)
-            if abs(outstanding - target) > 0.01:
-                continue
-            issue = _parse_iso_date(inv.get("issue_date"))
-            if not issue or not (tx_date - timedelta(days=90) <= issue <= tx_date + timedelta(days=3)):
-                continue
-            client = db.clients.find_one(
-                {"id": inv.get("client_id"), **scope},
-                {"_id": 0, "name": 1}) or {}
-            client_name = (client.get("name") or "").lower()
-            score, ddiff, adiff = _score_invoice_candidate(
-                tx_date, target, inv, client_name, desc_lower)
-            cands.append((score, ddiff, adiff, inv, client.get("name") or ""))
+        for entry in _match_index_invoices(index, tx_date, target):
+            score, ddiff, adiff = _score_invoice_entry(
+                tx_date, target, entry, desc_lower, desc_tokens=tx_tokens)
+            cands.append((score, ddiff, adiff, entry["doc"]))
         cands.sort(key=lambda c: (-c[0], c[1], c[2]))
-        for score, ddiff, adiff, inv, cname in cands[:3]:
-            invoices_out.append({"invoice": clean_doc(inv), "client_name": cname, "score": score})
+        for score, ddiff, adiff, inv in cands[:BANK_SUGGESTIONS_TOP]:
+            out["invoices"].append({
+                "invoice": clean_doc(inv),
+                "client_name": context["client_names"].get(inv.get("client_id"), ""),
+                "score": score})
     elif tx["amount_cad"] < 0:
         cands = []
-        for exp in db.expenses.find(
-                {**scope, "bank_transaction_id": None}, {"_id": 0}):
-            if abs(float(exp.get("amount_cad", 0)) - target) > 0.01:
-                continue
-            exp_date = _parse_iso_date(exp.get("expense_date") or exp.get("date"))
-            if not exp_date or abs((tx_date - exp_date).days) > 3:
-                continue
-            score, ddiff, adiff = _score_expense_candidate(
-                tx_date, target, exp, desc_lower, aliases, tx_tokens)
-            cands.append((score, ddiff, adiff, exp))
+        for entry in _match_index_expenses(index, tx_date, target, max_days=3,
+                                           fx_tolerance=False):
+            score, ddiff, adiff = _score_expense_entry(
+                tx_date, target, entry, desc_lower, context["aliases"], tx_tokens,
+                desc_tokens=tx_tokens)
+            cands.append((score, ddiff, adiff, entry["doc"]))
         cands.sort(key=lambda c: (-c[0], c[1], c[2]))
-        for score, ddiff, adiff, exp in cands[:3]:
-            expenses_out.append({"expense": clean_doc(exp), "score": score})
-    return {"invoices": invoices_out, "expenses": expenses_out}
+        for score, ddiff, adiff, exp in cands[:BANK_SUGGESTIONS_TOP]:
+            out["expenses"].append({"expense": clean_doc(exp), "score": score})
+    return out
+
+
+@app.post("/api/bank/suggestions")
+def get_bank_suggestions_batch(body: dict,
+                               current_user: CurrentUser = Depends(require_permission("bank:read"))):
+    """Suggestions de plusieurs transactions en une requête : `tx_ids` (liste, max 500) OU
+    `import_id` + `page`/`per_page` (les transactions NON rapprochées de la page, même tri que
+    GET /api/bank/imports/{id}). Un seul index de candidats + un seul lookup clients pour tout
+    le lot. Retourne {"suggestions": {tx_id: {"invoices": [...], "expenses": [...]}}}."""
+    scope = _org_scope(current_user)
+    tx_ids = body.get("tx_ids")
+    import_id = body.get("import_id")
+    if tx_ids is not None:
+        if not isinstance(tx_ids, list) or not all(isinstance(i, str) for i in tx_ids):
+            raise HTTPException(422, "tx_ids must be a list of ids")
+        if len(tx_ids) > BANK_SUGGESTIONS_BATCH_MAX:
+            raise HTTPException(422, f"At most {BANK_SUGGESTIONS_BATCH_MAX} transactions per batch")
+        txs = list(db.bank_transactions.find({**scope, "id": {"$in": tx_ids}}, {"_id": 0}))
+    elif import_id:
+        try:
+            page = max(int(body.get("page", 1)), 1)
+            per_page = min(max(int(body.get("per_page", 100)), 1), BANK_SUGGESTIONS_BATCH_MAX)
+        except (TypeError, ValueError):
+            raise HTTPException(422, "page and per_page must be integers")
+        if not db.bank_imports.find_one({**scope, "id": import_id}, {"_id": 1}):
+            raise HTTPException(404, "Import not found")
+        txs = list(db.bank_transactions.find(
+            {**scope, "import_id": import_id}, {"_id": 0}
+        ).sort("row_index", 1).skip((page - 1) * per_page).limit(per_page))
+        txs = [t for t in txs if t.get("status") == "unmatched"]
+    else:
+        raise HTTPException(422, "tx_ids or import_id required")
+    if not txs:
+        return {"suggestions": {}}
+    context = _bank_match_context(scope)
+    return {"suggestions": {tx["id"]: _bank_tx_suggestions(tx, context) for tx in txs}}
 
 
 @app.post("/api/bank/transactions/{tx_id}/create-expense", status_code=201)
@@ -7778,6 +9629,7 @@ def create_expense_from_tx(tx_id: str, body: dict,
         "hst_paid_cad": 0.0,
         "taxes_auto_computed": False,
         "expense_date": tx["date"],
+        "expense_day": _canonical_day(tx["date"]),
         "status": "pending",
         "receipt_url": "",
         "receipt_file_id": None,
@@ -7786,6 +9638,7 @@ def create_expense_from_tx(tx_id: str, body: dict,
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
     db.expenses.insert_one(expense_doc)
+    _report_data_changed(expense_doc["organization_id"], expense_doc["expense_date"])
     now = datetime.now(timezone.utc).isoformat()
     db.bank_transactions.update_one(
         {"id": tx_id, **_org_scope(current_user)},
@@ -7834,6 +9687,7 @@ def create_invoice_from_tx(tx_id: str, body: dict,
         "client_id": client_id,
         "invoice_number": f"INV-{count + 1:04d}",
         "issue_date": tx["date"],
+        "issue_day": _canonical_day(tx["date"]),
         "due_date": tx["date"],
         "items": [{"description": item_desc, "quantity": 1, "unit_price": total}],
         "subtotal": total,
@@ -7855,6 +9709,7 @@ def create_invoice_from_tx(tx_id: str, body: dict,
     }
     invoice_doc["tax_registrations"] = _build_tax_registrations(_org_scope(current_user), client_id)
     db.invoices.insert_one(invoice_doc)
+    _report_data_changed(invoice_doc["organization_id"], invoice_doc["issue_date"])
     db.bank_transactions.update_one(
         {"id": tx_id, **_org_scope(current_user)},
         {"$set": {"status": "matched", "match_kind": "invoice_payment",
@@ -7938,6 +9793,7 @@ def delete_bank_import(import_id: str, force: bool = False,
                 new_status = _recompute_invoice_status(updated)
                 db.invoices.update_one({"id": inv["id"], **_org_scope(current_user)},
                                        {"$set": {"status": new_status}})
+                _report_data_changed(inv.get("organization_id"), inv.get("issue_date"))
         elif tx.get("match_kind") == "expense":
             db.expenses.update_one(
                 {"id": tx.get("match_id"), **_org_scope(current_user)},
@@ -7961,17 +9817,417 @@ def rematch_bank_import(import_id: str,
     return {"auto_matched": matched}
 
 
+# ─── Re-match en masse (plusieurs imports, une org ou toutes) sur un pool de process ───
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+BANK_REMATCH_WORKERS = int(os.environ.get("BANK_REMATCH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+
+def _rematch_worker_init():
+    """Initialiseur d'un process du pool : ouvre SON propre MongoClient (un client pymongo
+    ne se partage pas entre process) et le substitue au `db` du module."""
+    global client, db
+    client = MongoClient(MONGO_URL)
+    db = client[DB_NAME]
+
+
+def _import_match_scope(imp):
+    """Scope d'un import hors requête : même forme que `_org_scope` de son créateur."""
+    return {"$or": [
+        {"organization_id": imp.get("organization_id")},
+        {"user_id": imp.get("created_by_user_id") or imp.get("user_id"),
+         "organization_id": {"$exists": False}},
+    ]}
+
+
+def _rematch_import_task(import_id, scope, pending):
+    """Unité de travail (process du pool ou inline) : auto-match d'UN import. Les
+    rapprochements passent par `_apply_match` (réclamations conditionnelles) : deux workers
+    qui visent la même dépense -> un seul l'obtient, l'autre transaction reste à revoir."""
+    started = time.monotonic()
+    out = {"import_id": import_id, "organization_id": _scope_organization_id(scope),
+           "pending": pending, "auto_matched": 0, "error": None}
+    try:
+        out["auto_matched"] = _auto_match_transactions(import_id, scope)
+    except Exception as e:  # noqa: BLE001 — un import en échec ne bloque pas les autres
+        out["error"] = type(e).__name__
+        print(f"ERROR bank_rematch import={import_id} type={type(e).__name__}")
+    out["seconds"] = round(time.monotonic() - started, 3)
+    return out
+
+
+def _bulk_rematch_bank_imports(organization_id=None, workers=None, processes=False):
+    """Relance l'auto-match sur tous les imports OUVERTS ayant des transactions non rapprochées
+    (d'une org, ou de toutes si `organization_id` est None), les plus gros d'abord.
+    `processes=True` (CLI, toutes les orgs) : pool de process spawn dont chaque process a son
+    propre client Mongo — démarrer un interpréteur qui ré-importe le module coûte cher, donc
+    jamais par requête HTTP. Sinon : pool de threads dans le process courant.
+    Retourne le débit et le résultat par import."""
+    started = time.monotonic()
+    imp_query = {"closed_at": None}
+    if organization_id is not None:
+        imp_query["organization_id"] = organization_id
+    imports = {imp["id"]: imp for imp in db.bank_imports.find(
+        imp_query, {"_id": 0, "id": 1, "organization_id": 1, "created_by_user_id": 1,
+                    "user_id": 1})}
+    pending = {}
+    if imports:
+        for row in db.bank_transactions.aggregate([
+            {"$match": {"import_id": {"$in": list(imports)}, "status": "unmatched",
+                        "parse_error": False}},
+            {"$group": {"_id": "$import_id", "n": {"$sum": 1}}},
+        ]):
+            pending[row["_id"]] = row["n"]
+    tasks = sorted(pending.items(), key=lambda kv: -kv[1])
+    workers = max(1, min(workers or BANK_REMATCH_WORKERS, len(tasks) or 1))
+    args = [(iid, _import_match_scope(imports[iid]), n) for iid, n in tasks]
+    if workers == 1 or len(args) <= 1:
+        results = [_rematch_import_task(*a) for a in args]
+    elif not processes:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bank-rematch") as pool:
+            results = list(pool.map(lambda a: _rematch_import_task(*a), args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_rematch_worker_init) as pool:
+            results = list(pool.map(_rematch_import_task, *zip(*args)))
+    elapsed = time.monotonic() - started
+    scanned = sum(pending.values())
+    return {
+        "imports": len(results),
+        "workers": workers,
+        "transactions_scanned": scanned,
+        "auto_matched": sum(r["auto_matched"] for r in results),
+        "failed_imports": sum(1 for r in results if r["error"]),
+        "seconds": round(elapsed, 3),
+        "transactions_per_second": round(scanned / elapsed, 1) if elapsed > 0 else None,
+        "results": results,
+    }
+
+
+@app.post("/api/bank/rematch")
+def rematch_all_bank_imports(current_user: CurrentUser = Depends(require_permission("bank:write"))):
+    """Re-match de TOUS les imports ouverts de l'org (ex. après une saisie massive de dépenses).
+    Même garanties que /imports/{id}/rematch : ne touche jamais aux transactions déjà
+    rapprochées ni ignorées."""
+    return _bulk_rematch_bank_imports(current_user.organization_id)
+
+
+# ─── Blob store adressé par contenu (SHA-256) : reçus, logos, fichiers téléversés ───
+# db.files ne garde que les métadonnées + `sha256` ; les octets vivent dans le blob store.
+# Deux reçus/logos identiques = un seul blob. Les blobs ne sont jamais supprimés par l'API
+# (db.files est en soft-delete et plusieurs fichiers peuvent partager le même contenu) ; seuls
+# les rendus PDF remplacés sont collectés, hors ligne (collect_orphan_blobs).
+import gridfs
+import tempfile
+
+BLOB_STORE_BACKEND = os.environ.get("BLOB_STORE", "gridfs").lower()  # "gridfs" | "local"
+BLOB_STORE_DIR = os.environ.get(
+    "BLOB_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "blobs"))
+BLOB_MIGRATION_BATCH = 100
+# Migration des octets inline au démarrage, dans un thread (jamais dans seed_data : une grosse
+# collection db.files bloquerait le boot). 0 = uniquement via `python server.py files-to-blob-store`.
+BLOB_MIGRATION_ON_STARTUP = os.environ.get("BLOB_MIGRATION_ON_STARTUP", "1") == "1"
+
+
+class _LocalBlobStore:
+    """Blobs sur disque : <root>/ab/cd/<sha256>. Écriture atomique (fichier temporaire dans le
+    même répertoire puis os.replace) : un lecteur ne voit jamais un blob partiel."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, sha):
+        return os.path.join(self.root, sha[:2], sha[2:4], sha)
+
+    def exists(self, sha):
+        return os.path.exists(self._path(sha))
+
+    def put(self, sha, data):
+        path = self._path(sha)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def open(self, sha):
+        """Flux binaire seekable ; FileNotFoundError si absent."""
+        return open(self._path(sha), "rb")
+
+    def size(self, sha):
+        return os.path.getsize(self._path(sha))
+
+    def delete(self, sha):
+        try:
+            os.remove(self._path(sha))
+        except FileNotFoundError:
+            pass
+
+
+class _GridFSBlobStore:
+    """Blobs dans GridFS (bucket `blobs`) avec _id = sha256 : le dédoublonnage est porté par
+    l'unicité de _id. Le bucket est résolu sur le `db` courant à chaque appel (process du pool
+    de re-match qui rouvrent leur client)."""
+
+    def _bucket(self):
+        return gridfs.GridFSBucket(db, bucket_name="blobs")
+
+    def exists(self, sha):
+        return db["blobs.files"].find_one({"_id": sha}, {"_id": 1}) is not None
+
+    def put(self, sha, data):
+        if self.exists(sha):
+            return
+        try:
+            self._bucket().upload_from_stream_with_id(sha, sha, data)
+        except (gridfs.errors.FileExists, DuplicateKeyError):
+            pass  # upload concurrent du même contenu
+
+    def open(self, sha):
+        try:
+            return self._bucket().open_download_stream(sha)
+        except gridfs.errors.NoFile:
+            raise FileNotFoundError(sha)
+
+    def size(self, sha):
+        doc = db["blobs.files"].find_one({"_id": sha}, {"length": 1})
+        if doc is None:
+            raise FileNotFoundError(sha)
+        return doc["length"]
+
+    def delete(self, sha):
+        try:
+            self._bucket().delete(sha)
+        except gridfs.errors.NoFile:
+            pass
+
+
+_blob_store_instance = None
+
+
+def _blob_store():
+    global _blob_store_instance
+    if _blob_store_instance is None:
+        _blob_store_instance = (_LocalBlobStore(BLOB_STORE_DIR) if BLOB_STORE_BACKEND == "local"
+                                else _GridFSBlobStore())
+    return _blob_store_instance
+
+
+def _store_blob(data):
+    """Range `data` dans le blob store et retourne son sha256 (clé de contenu)."""
+    data = bytes(data)
+    sha = hashlib.sha256(data).hexdigest()
+    _blob_store().put(sha, data)
+    return sha
+
+
+# Collecte des blobs orphelins. Seuls les blobs JETABLES (rendus PDF remplacés ou
+# invalidés) sont candidats : ils entrent dans `blob_gc_queue` et `collect_orphan_blobs`
+# (CLI `blob-gc`) les supprime après un délai de grâce s'ils ne sont plus référencés
+# nulle part (pdf_renders, db.files, pièces jointes de l'outbox) — le contenu est partagé.
+BLOB_GC_GRACE_SECONDS = int(os.environ.get("BLOB_GC_GRACE_SECONDS", "3600"))
+
+
+def _queue_blob_gc(shas):
+    now = datetime.now(timezone.utc)
+    for sha in {s for s in shas if s}:
+        db.blob_gc_queue.update_one({"_id": sha}, {"$set": {"queued_at": now}}, upsert=True)
+
+
+def _blob_referenced(sha):
+    return any(coll.find_one(query, {"_id": 1}) is not None for coll, query in (
+        (db.pdf_renders, {"sha256": sha}),
+        (db.files, {"sha256": sha}),
+        (db.files, {"thumbnail_sha256": sha}),
+        (db.email_outbox, {"attachments.sha256": sha}),
+    ))
+
+
+def collect_orphan_blobs(grace_seconds=None):
+    """Supprime les blobs candidats (file de collecte depuis plus de `grace_seconds`) qui ne
+    sont plus référencés ; les autres quittent la file. Retourne {checked, deleted}."""
+    grace = BLOB_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace)
+    report = {"checked": 0, "deleted": 0}
+    for cand in list(db.blob_gc_queue.find({"queued_at": {"$lte": cutoff}})):
+        # Retrait conditionnel : un remplacement concurrent l'a peut-être re-mis en file
+        if not db.blob_gc_queue.delete_one({"_id": cand["_id"],
+                                            "queued_at": cand["queued_at"]}).deleted_count:
+            continue
+        report["checked"] += 1
+        if not _blob_referenced(cand["_id"]):
+            _blob_store().delete(cand["_id"])
+            report["deleted"] += 1
+    return report
+
+
+def _file_bytes(record, field="data"):
+    """Octets d'un fichier db.files (`field` = "data" ou "thumbnail") : blob store via
+    `sha256`/`thumbnail_sha256`, ou Binary inline d'un document pas encore migré.
+    None si le fichier n'a pas de contenu (ancien stockage externe) ou blob introuvable."""
+    if record.get(field) is not None:
+        return bytes(record[field])
+    sha = record.get("sha256" if field == "data" else f"{field}_sha256")
+    if not sha:
+        return None
+    try:
+        with _blob_store().open(sha) as f:
+            return f.read()
+    except FileNotFoundError:
+        print(f"ERROR blob_missing sha256={sha}")
+        return None
+
+
+def migrate_files_to_blob_store_v1(batch_size=BLOB_MIGRATION_BATCH):
+    """Idempotente. Sort les octets inline (`data`, `thumbnail`) des documents db.files vers
+    le blob store, par paquets de `batch_size` (mémoire bornée) : le blob est écrit AVANT le
+    $unset, donc une interruption laisse au pire un blob dédoublonné au prochain passage.
+    Seuls les `data` binaires sont migrés (un `data: null` n'a rien à sortir).
+    Retourne le nombre de fichiers migrés."""
+    moved = 0
+    while True:
+        batch = list(db.files.find({"data": {"$type": "binData"}},
+                                   {"_id": 1, "data": 1, "thumbnail": 1}).limit(batch_size))
+        if not batch:
+            break
+        ops = []
+        for doc in batch:
+            data = bytes(doc["data"])
+            update = {"sha256": _store_blob(data)}
+            unset = {"data": ""}
+            if isinstance(doc.get("thumbnail"), bytes):
+                update["thumbnail_sha256"] = _store_blob(doc["thumbnail"])
+                unset["thumbnail"] = ""
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": update, "$unset": unset}))
+        db.files.bulk_write(ops, ordered=False)
+        moved += len(ops)
+    if moved:
+        print(f"Migration files_to_blob_store_v1: {moved} file(s) moved to {BLOB_STORE_BACKEND}")
+    return moved
+
+
+BLOB_STREAM_CHUNK = 64 * 1024
+
+
+def _file_source(record):
+    """(ouvreur de flux seekable, taille, sha256) pour le contenu d'un document db.files, ou
+    None si absent. Blob store : lu par morceaux sans copie intégrale ; document pas encore
+    migré : flux en mémoire sur le Binary inline (sha calculé à la volée)."""
+    sha = record.get("sha256")
+    if record.get("data") is not None:
+        data = record["data"]
+        return (lambda: io.BytesIO(data)), len(data), hashlib.sha256(data).hexdigest()
+    if not sha:
+        return None
+    try:
+        size = _blob_store().size(sha)
+    except FileNotFoundError:
+        print(f"ERROR blob_missing sha256={sha}")
+        return None
+    return (lambda: _blob_store().open(sha)), size, sha
+
+
+def _parse_byte_range(header, size):
+    """En-tête `Range` -> (début, fin inclusive), None si absent/ignoré (multi-plages, unité
+    inconnue, syntaxe invalide : on sert alors le fichier entier, comme le permet la RFC 9110),
+    ou "unsatisfiable" si la plage tombe hors du fichier (416)."""
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:  # suffixe : les N derniers octets
+            n = int(last)
+            if n <= 0 or size == 0:  # fichier vide : aucune plage satisfiable (pas de 0--1)
+                return "unsatisfiable"
+            return max(0, size - n), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return "unsatisfiable"
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def _etag_matches(header, etag):
+    """If-None-Match / If-Range : liste d'ETags (comparaison faible pour If-None-Match) ou `*`."""
+    if not header:
+        return False
+    candidates = [t.strip() for t in header.split(",")]
+    return "*" in candidates or any(t.removeprefix("W/") == etag for t in candidates)
+
+
+def _iter_file_range(opener, start, length):
+    with opener() as f:
+        if start:
+            f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(BLOB_STREAM_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _file_download_response(request, source, media_type, headers=None):
+    """Réponse de téléchargement conditionnelle : ETag fort = sha256 du contenu
+    (If-None-Match -> 304), Range mono-plage -> 206 (If-Range respecté), sinon 200.
+    Le corps est streamé par morceaux depuis le blob store."""
+    opener, size, sha = source
+    etag = f'"{sha}"'
+    headers = {**(headers or {}), "ETag": etag, "Accept-Ranges": "bytes"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range.strip() == etag:
+        byte_range = _parse_byte_range(request.headers.get("range"), size)
+    if byte_range == "unsatisfiable":
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        start, length, status_code = 0, size, 200
+    else:
+        start, end = byte_range
+        length, status_code = end - start + 1, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(length)
+    return StreamingResponse(_iter_file_range(opener, start, length), status_code=status_code,
+                             media_type=media_type, headers=headers)
+
+
 # ─── Receipt OCR endpoints (feature #8) ───
+import asyncio
+from starlette.concurrency import run_in_threadpool
+
 MAX_RECEIPT_BYTES = 5 * 1024 * 1024
 
 
-@app.post("/api/expenses/scan-receipt")
-async def scan_receipt(
-    file: UploadFile = File(...),
-    current_user: CurrentUser = Depends(require_permission("receipts:scan")),
-):
-    # 1. Lecture + size cap
-    raw = await file.read()
+RECEIPT_BATCH_MAX = 100
+RECEIPT_SCAN_CONCURRENCY = int(os.environ.get("RECEIPT_SCAN_CONCURRENCY", "6"))
+
+
+def _prepare_receipt(raw):
+    """Validation + normalisation d'un reçu téléversé. Retourne (payload, payload_mime,
+    normalized) ; lève HTTPException 413/422 si le fichier est refusé."""
+    # 1. Size cap
     if len(raw) > MAX_RECEIPT_BYTES:
         raise HTTPException(413, f"File exceeds {MAX_RECEIPT_BYTES // 1024 // 1024} MB limit")
 
@@ -7981,58 +10237,295 @@ async def scan_receipt(
         raise HTTPException(422, "Format non supporté. Utilise JPG, PNG, WEBP, GIF ou PDF.")
 
     # 3. Décompression bomb check (images seulement — PIL ne gère pas les PDF)
+    #    puis normalisation (rotation EXIF, réduction, ré-encodage) : l'image normalisée
+    #    alimente l'appel modèle ET le stockage ; les PDF passent tels quels.
+    payload, payload_mime, normalized = raw, mime, None
     if mime.startswith("image/"):
         try:
-            _check_image_decompression(raw)
+            img = _check_image_decompression(raw)
         except ValueError as e:
             raise HTTPException(422, str(e))
+        try:
+            normalized = _normalize_receipt_image(img, raw, mime)
+            payload, payload_mime = normalized["data"], normalized["mime_type"]
+        except Exception as e:  # noqa: BLE001 — l'original reste un reçu valide
+            print(f"WARN receipt_normalize_failed type={type(e).__name__} mime={mime}")
+    return payload, payload_mime, normalized
 
-    # 4. Quota check + bill (atomique)
-    scan_count = _check_and_bill_scan(current_user.organization_id)
-
-    # 5. Appel Anthropic
-    try:
-        raw_extraction = _call_anthropic_extract(raw, mime)
-    except HTTPException:
-        # rollback quota (org-scoped depuis feature #11)
-        db.organizations.update_one(
-            {"id": current_user.organization_id},
-            {"$inc": {"scan_count_this_month": -1}},
-        )
-        raise
-
-    # 6. Normalize
-    extraction = _normalize_extraction(raw_extraction)
 
-    # 7. Persiste le fichier (APRÈS succès Anthropic — zéro orphelin sur erreur)
+def _persist_receipt_file(current_user, raw, payload, payload_mime, normalized, filename):
+    """Persiste le fichier reçu (APRÈS succès de l'extraction — zéro orphelin sur erreur)."""
     file_id = str(uuid.uuid4())
-    db.files.insert_one({
+    file_doc = {
         "id": file_id,
         "organization_id": current_user.organization_id,
         "created_by_user_id": current_user.id,
         "user_id": current_user.id,  # legacy
-        "data": raw,
-        "mime_type": mime,
-        "original_filename": file.filename or "receipt.jpg",
-        "size_bytes": len(raw),
+        "sha256": _store_blob(payload),
+        "mime_type": payload_mime,
+        "original_filename": filename or "receipt.jpg",
+        "size_bytes": len(payload),
+        "original_size_bytes": len(raw),
         "purpose": "receipt",
         "is_deleted": False,
         "created_at": datetime.now(timezone.utc).isoformat(),
-    })
+    }
+    if normalized:
+        file_doc.update({"width": normalized["width"], "height": normalized["height"],
+                         "thumbnail_sha256": _store_blob(normalized["thumbnail"]),
+                         "thumbnail_mime_type": "image/jpeg"})
+    db.files.insert_one(file_doc)
+    return file_id
+
+
+# Cache d'extraction des reçus : clé UNIQUE (org, sha256 du payload normalisé) + TTL. Même
+# schéma réserver-puis-remplir que le cache PDF bancaire : un ré-envoi du même reçu (retry,
+# doublon entre deux membres) ne facture pas de 2e scan et n'appelle pas le modèle.
+RECEIPT_EXTRACTION_CACHE_TTL_SECONDS = 30 * 24 * 3600
+RECEIPT_EXTRACTION_RESERVATION_SECONDS = 300  # réservation orpheline (process tué) reprenable
+
+
+def _get_cached_receipt_extraction(organization_id, sha):
+    """Extraction normalisée en cache si TERMINÉE et fraîche (<TTL), sinon None (une
+    réservation « extracting » n'est pas disponible)."""
+    doc = db.receipt_extractions.find_one({"organization_id": organization_id, "sha256": sha})
+    if not doc:
+        return None
+    created = doc.get("created_at")
+    if isinstance(created, datetime):
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=timezone.utc)
+        if (datetime.now(timezone.utc) - created).total_seconds() > RECEIPT_EXTRACTION_CACHE_TTL_SECONDS:
+            return None
+    return doc.get("extraction")
+
+
+def _reserve_receipt_extractions(organization_id, shas):
+    """Réserve ATOMIQUEMENT (index unique) chaque clé absente du cache, puis facture les
+    réservations en UN appel `_check_and_bill_scan` (429 -> réservations nettoyées).
+    Retourne (cached {sha: extraction}, reserved {sha: lease}, busy [sha]) : `busy` =
+    extraction concurrente en cours ailleurs (ni réservée ni facturée). Chaque réservation
+    porte un `lease` : seul son détenteur peut la remplir (`_fill_receipt_extraction`) ou la
+    libérer (`_release_receipt_extractions`) — l'appelant DOIT faire l'un ou l'autre."""
+    cached, reserved, busy = {}, {}, []
+    lease = str(uuid.uuid4())
+    for sha in dict.fromkeys(shas):
+        hit = _get_cached_receipt_extraction(organization_id, sha)
+        if hit is not None:
+            cached[sha] = hit
+            continue
+        try:
+            db.receipt_extractions.insert_one({
+                "organization_id": organization_id, "sha256": sha,
+                "extraction": None, "status": "extracting", "lease": lease,
+                "created_at": datetime.now(timezone.utc)})
+        except DuplicateKeyError:
+            hit = _get_cached_receipt_extraction(organization_id, sha)
+            if hit is not None:
+                cached[sha] = hit
+                continue
+            # réservation périmée (extraction interrompue) : reprise ATOMIQUE (un seul
+            # repreneur gagne) et remboursement du scan facturé à la réservation abandonnée
+            stale = db.receipt_extractions.find_one_and_update(
+                {"organization_id": organization_id, "sha256": sha, "status": "extracting",
+                 "created_at": {"$lt": datetime.now(timezone.utc)
+                                - timedelta(seconds=RECEIPT_EXTRACTION_RESERVATION_SECONDS)}},
+                {"$set": {"created_at": datetime.now(timezone.utc), "lease": lease}})
+            if stale is None:
+                busy.append(sha)
+                continue
+            _refund_scans(organization_id)
+        reserved[sha] = lease
+    if reserved:
+        try:
+            _check_and_bill_scan(organization_id, len(reserved))
+        except Exception:
+            db.receipt_extractions.delete_many(
+                {"organization_id": organization_id, "sha256": {"$in": list(reserved)},
+                 "status": "extracting", "lease": lease})
+            raise
+    return cached, reserved, busy
+
+
+def _fill_receipt_extraction(organization_id, sha, extraction, lease):
+    """Remplit la réservation `lease`. Sans effet si elle a été reprise entre-temps."""
+    db.receipt_extractions.update_one(
+        {"organization_id": organization_id, "sha256": sha, "status": "extracting", "lease": lease},
+        {"$set": {"extraction": extraction, "status": "done",
+                  "created_at": datetime.now(timezone.utc)}})
+
+
+def _release_receipt_extractions(organization_id, leases):
+    """Échec d'extraction : supprime les réservations {sha: lease} encore détenues et
+    rembourse leurs scans. Une réservation reprise par un autre (déjà remboursée à la
+    reprise) n'est ni supprimée ni remboursée. Rend le nombre de scans remboursés."""
+    refunded = 0
+    for sha, lease in leases.items():
+        refunded += db.receipt_extractions.delete_one(
+            {"organization_id": organization_id, "sha256": sha, "status": "extracting",
+             "lease": lease}).deleted_count
+    _refund_scans(organization_id, refunded)
+    return refunded
+
+
+def _current_scan_count(organization_id):
+    org = db.organizations.find_one({"id": organization_id}, {"_id": 0, "scan_count_this_month": 1})
+    return (org or {}).get("scan_count_this_month", 0)
+
+
+@app.post("/api/expenses/scan-receipt")
+async def scan_receipt(
+    file: UploadFile = File(...),
+    current_user: CurrentUser = Depends(require_permission("receipts:scan")),
+):
+    # 1-3. Lecture, validation, normalisation (CPU : hors boucle d'événements)
+    raw = await file.read()
+    payload, payload_mime, normalized = await run_in_threadpool(_prepare_receipt, raw)
+    org_id = current_user.organization_id
+    sha = hashlib.sha256(payload).hexdigest()
+
+    # 4. Cache (org+sha) ou réservation + bill (atomique). Un hit ne touche pas au quota.
+    cached, reserved, _busy = await run_in_threadpool(_reserve_receipt_extractions, org_id, [sha])
+    if sha in cached:
+        extraction = cached[sha]
+    elif not reserved:
+        raise HTTPException(409, "Analyse de ce reçu déjà en cours — réessaie dans un instant.")
+    else:
+        # 5. Appel Anthropic (client async : ne bloque pas les autres requêtes)
+        try:
+            raw_extraction = await _call_anthropic_extract_async(payload, payload_mime)
+            # 6. Normalize + mise en cache
+            extraction = _normalize_extraction(raw_extraction)
+            await run_in_threadpool(_fill_receipt_extraction, org_id, sha, extraction, reserved[sha])
+        except Exception:
+            # rollback quota (org-scoped depuis feature #11) + libère la réservation
+            await run_in_threadpool(_release_receipt_extractions, org_id, reserved)
+            raise
+    scan_count = await run_in_threadpool(_current_scan_count, org_id)
+
+    # 7. Persiste le fichier
+    file_id = await run_in_threadpool(_persist_receipt_file, current_user, raw, payload,
+                                      payload_mime, normalized, file.filename)
 
     # 8. Log INFO
-    print(f"INFO scan_receipt user={current_user.id} file_size={len(raw)} "
-          f"category={extraction['category_code']} quota_used={scan_count}/{SCAN_QUOTA_LIMIT}")
+    print(f"INFO scan_receipt user={current_user.id} file_size={len(raw)} stored_size={len(payload)} "
+          f"category={extraction['category_code']} cached={sha in cached} "
+          f"quota_used={scan_count}/{SCAN_QUOTA_LIMIT}")
 
     return {
         "file_id": file_id,
         "scan_count_this_month": scan_count,
         "extraction": extraction,
+        "cached": sha in cached,
+    }
+
+
+@app.post("/api/expenses/scan-receipts")
+async def scan_receipts(
+    files: List[UploadFile] = File(...),
+    current_user: CurrentUser = Depends(require_permission("receipts:scan")),
+):
+    """Scan d'un lot de reçus (fin de mois). Les fichiers invalides sont rejetés un par un
+    (413/422) sans être facturés ; le quota des fichiers valides est réservé d'un coup
+    (429 pour tout le lot s'il ne suffit pas) ; les extractions tournent en parallèle sous
+    un sémaphore (RECEIPT_SCAN_CONCURRENCY) et chaque échec est remboursé. Réponse :
+    un résultat par fichier, dans l'ordre d'envoi."""
+    if len(files) > RECEIPT_BATCH_MAX:
+        raise HTTPException(413, f"Maximum {RECEIPT_BATCH_MAX} reçus par lot")
+    org_id = current_user.organization_id
+    results = [None] * len(files)
+    prepared = []
+    for i, f in enumerate(files):
+        raw = await f.read()
+        try:
+            payload, payload_mime, normalized = await run_in_threadpool(_prepare_receipt, raw)
+        except HTTPException as e:
+            results[i] = {"index": i, "filename": f.filename, "status": "error",
+                          "status_code": e.status_code, "error": e.detail, "refunded": False}
+            continue
+        prepared.append((i, f.filename, raw, payload, payload_mime, normalized,
+                         hashlib.sha256(payload).hexdigest()))
+
+    # Cache (org+sha) d'abord, puis réservation + facturation des seuls contenus inconnus ;
+    # un même reçu présent deux fois dans le lot n'est extrait (et facturé) qu'une fois.
+    cached, reserved, busy = (await run_in_threadpool(_reserve_receipt_extractions, org_id,
+                                                      [p[6] for p in prepared])
+                              if prepared else ({}, [], []))
+    semaphore = asyncio.Semaphore(max(1, RECEIPT_SCAN_CONCURRENCY))
+    extractions = dict(cached)
+    failures = {}
+
+    async def _extract(sha, payload, payload_mime):
+        async with semaphore:
+            try:
+                raw_extraction = await _call_anthropic_extract_async(payload, payload_mime)
+                extraction = _normalize_extraction(raw_extraction)
+                await run_in_threadpool(_fill_receipt_extraction, org_id, sha, extraction,
+                                        reserved[sha])
+                extractions[sha] = extraction
+            except Exception as e:
+                if not isinstance(e, HTTPException):
+                    print(f"ERROR scan_receipts_unexpected type={type(e).__name__}")
+                    e = HTTPException(502, "Service d'analyse temporairement indisponible")
+                failures[sha] = e
+
+    first = {}
+    for item in prepared:
+        first.setdefault(item[6], item)
+    await asyncio.gather(*(_extract(sha, first[sha][3], first[sha][4]) for sha in reserved))
+    await run_in_threadpool(_release_receipt_extractions, org_id,
+                            {sha: reserved[sha] for sha in failures})
+
+    # Échec d'enregistrement du fichier : résultat en erreur ; le scan facturé est rendu si
+    # aucun fichier de ce contenu n'a pu être enregistré (l'extraction reste en cache).
+    persisted, persist_failed = set(), set()
+    for i, filename, raw, payload, payload_mime, normalized, sha in prepared:
+        if sha in extractions:
+            try:
+                file_id = await run_in_threadpool(_persist_receipt_file, current_user, raw, payload,
+                                                  payload_mime, normalized, filename)
+            except Exception as e:
+                print(f"ERROR scan_receipts_persist type={type(e).__name__}")
+                persist_failed.add(sha)
+                results[i] = {"index": i, "filename": filename, "status": "error",
+                              "status_code": 500, "error": "Enregistrement du reçu impossible",
+                              "refunded": False}
+                continue
+            persisted.add(sha)
+            results[i] = {"index": i, "filename": filename, "status": "ok", "file_id": file_id,
+                          "extraction": extractions[sha], "cached": sha in cached}
+        elif sha in failures:
+            e = failures[sha]
+            results[i] = {"index": i, "filename": filename, "status": "error",
+                          "status_code": e.status_code, "error": e.detail,
+                          "refunded": first[sha][0] == i}
+        else:  # busy : extraction concurrente ailleurs, rien de facturé
+            results[i] = {"index": i, "filename": filename, "status": "error", "status_code": 409,
+                          "error": "Analyse de ce reçu déjà en cours — réessaie dans un instant.",
+                          "refunded": False}
+
+    persist_refunds = [sha for sha in persist_failed if sha in reserved and sha not in persisted]
+    if persist_refunds:
+        await run_in_threadpool(_refund_scans, org_id, len(persist_refunds))
+        for sha in persist_refunds:
+            results[first[sha][0]]["refunded"] = True
+    refunded = len(failures) + len(persist_refunds)
+    scanned = sum(1 for r in results if r["status"] == "ok")
+    scan_count = await run_in_threadpool(_current_scan_count, org_id)
+    print(f"INFO scan_receipts user={current_user.id} files={len(files)} scanned={scanned} "
+          f"billed={len(reserved) - refunded} cached={len(cached)} refunded={refunded} "
+          f"quota_used={scan_count}/{SCAN_QUOTA_LIMIT}")
+    return {
+        "results": results,
+        "scanned": scanned,
+        "failed": len(files) - scanned,
+        "refunded": refunded,
+        "scan_count_this_month": scan_count,
     }
 
 
 @app.get("/api/receipts/{file_id}")
-def get_receipt_file(file_id: str,
+def get_receipt_file(file_id: str, request: Request,
                      current_user: CurrentUser = Depends(require_permission("expenses:read"))):
     """Endpoint authentifié pour servir les images de reçus.
     Filtre par organization_id (fallback user_id pre-migration) ET purpose=receipt pour ne pas exposer les logos."""
@@ -8044,14 +10537,34 @@ def get_receipt_file(file_id: str,
             {"organization_id": current_user.organization_id},
             {"user_id": current_user.id, "organization_id": {"$exists": False}},
         ],
-    })
-    if not record:
+    }, {"thumbnail": 0})
+    source = _file_source(record) if record else None
+    if source is None:
         raise HTTPException(404, "Receipt not found")
-    return StreamingResponse(
-        io.BytesIO(bytes(record["data"])),
-        media_type=record.get("mime_type", "image/jpeg"),
-        headers={"Cache-Control": "private, max-age=3600"},
-    )
+    return _file_download_response(request, source, record.get("mime_type", "image/jpeg"),
+                                   {"Cache-Control": "private, max-age=3600"})
+
+
+@app.get("/api/receipts/{file_id}/thumbnail")
+def get_receipt_thumbnail(file_id: str,
+                          current_user: CurrentUser = Depends(require_permission("expenses:read"))):
+    """Miniature JPEG d'un reçu image (vues liste). 404 pour un PDF ou un reçu antérieur à la
+    normalisation (le client retombe alors sur /api/receipts/{id})."""
+    record = db.files.find_one({
+        "id": file_id,
+        "purpose": "receipt",
+        "is_deleted": False,
+        "$or": [
+            {"organization_id": current_user.organization_id},
+            {"user_id": current_user.id, "organization_id": {"$exists": False}},
+        ],
+    }, {"_id": 0, "thumbnail": 1, "thumbnail_sha256": 1, "thumbnail_mime_type": 1})
+    thumbnail = _file_bytes(record, "thumbnail") if record else None
+    if thumbnail is None:
+        raise HTTPException(404, "Thumbnail not found")
+    return Response(content=thumbnail,
+                    media_type=record.get("thumbnail_mime_type", "image/jpeg"),
+                    headers={"Cache-Control": "private, max-age=3600"})
 
 
 @app.delete("/api/files/{file_id}")
@@ -8432,6 +10945,7 @@ def update_quote(quote_id: str, quote_data: dict, current_user: CurrentUser = De
     client_id_for_snapshot = quote_data.get("client_id", existing.get("client_id"))
     quote_data["tax_registrations"] = _build_tax_registrations(_org_scope(current_user), client_id_for_snapshot)
     db.quotes.update_one({"id": quote_id, **_org_scope(current_user)}, {"$set": quote_data})
+    _invalidate_document_pdfs(existing.get("organization_id"), "quote", quote_id)
     return clean_doc(db.quotes.find_one({"id": quote_id}, {"_id": 0}))
 
 @app.post("/api/quotes/{quote_id}/convert")
@@ -8440,13 +10954,15 @@ def convert_quote_to_invoice(quote_id: str, body: dict, current_user: CurrentUse
     if not quote:
         raise HTTPException(404, "Quote not found")
     count = db.invoices.count_documents(_org_scope(current_user))
+    issue_date = datetime.now(timezone.utc).isoformat()
     invoice_doc = {
         "id": str(uuid.uuid4()),
         "organization_id": current_user.organization_id,
         "created_by_user_id": current_user.id,
         "user_id": current_user.id,  # legacy
         "client_id": quote["client_id"], "invoice_number": f"INV-{count + 1:04d}",
-        "issue_date": datetime.now(timezone.utc).isoformat(),
+        "issue_date": issue_date,
+        "issue_day": _canonical_day(issue_date),
         "due_date": body.get("due_date", ""), "items": quote.get("items", []),
         "subtotal": quote.get("subtotal", 0), "gst_amount": quote.get("gst_amount", 0),
         "pst_amount": quote.get("pst_amount", 0), "hst_amount": quote.get("hst_amount", 0),
@@ -8462,6 +10978,7 @@ def convert_quote_to_invoice(quote_id: str, body: dict, current_user: CurrentUse
     invoice_doc["tax_registrations"] = quote.get("tax_registrations") or \
         _build_tax_registrations(_org_scope(current_user), quote.get("client_id"))
     db.invoices.insert_one(invoice_doc)
+    _bump_org_data_version(current_user.organization_id)  # brouillon : aucun rollup touché
     db.quotes.update_one({"id": quote_id, **_org_scope(current_user)}, {"$set": {"status": "converted"}})
     return clean_doc(invoice_doc)
 
@@ -8478,6 +10995,7 @@ def delete_quote(quote_id: str, current_user: CurrentUser = Depends(require_perm
     result = db.quotes.delete_one({"id": quote_id, **_org_scope(current_user)})
     if result.deleted_count == 0:
         raise HTTPException(404, "Quote not found")
+    _invalidate_document_pdfs(current_user.organization_id, "quote", quote_id)
     return {"message": "Quote deleted"}
 
 # ─── Employees CRUD ───
@@ -8569,7 +11087,9 @@ def create_expense(expense_data: dict, current_user: CurrentUser = Depends(requi
         "notes": expense_data.get("notes", ""), "created_at": datetime.now(timezone.utc).isoformat()
     }
     doc["receipt_file_id"] = expense_data.get("receipt_file_id")
+    doc["expense_day"] = _canonical_day(doc["expense_date"])
     db.expenses.insert_one(doc)
+    _report_data_changed(doc["organization_id"], doc["expense_date"])
     # [GL P2 — T9] Écriture de charge auto (§5.6), opt-in par org : Dr 5xxx (charge
     # nette par différence) + Dr taxes 12xx récupérables + Cr 1000/2000. Idempotent
     # (_post_source_entry no-op si vivant). _safe_autopost avale toute erreur → le
@@ -8586,8 +11106,10 @@ def create_expense(expense_data: dict, current_user: CurrentUser = Depends(requi
 
 @app.put("/api/expenses/{expense_id}")
 def update_expense(expense_id: str, expense_data: dict, current_user: CurrentUser = Depends(require_permission("expenses:write"))):
-    for k in ("id", "user_id", "organization_id", "_id"):
+    for k in ("id", "user_id", "organization_id", "_id", "expense_day"):
         expense_data.pop(k, None)
+    if "expense_date" in expense_data:
+        expense_data["expense_day"] = _canonical_day(expense_data["expense_date"])
     # [SÉCURITÉ COMPTA] Champs DÉRIVÉS côté serveur (snapshot catégorie + télécom). On les
     # retire du body pour ne JAMAIS les écrire verbatim : sinon un client pourrait persister
     # un personal_use_amount_cad > amount_cad (→ écriture GL déséquilibrée, trou comptable) ou
@@ -8651,6 +11173,8 @@ def update_expense(expense_id: str, expense_data: dict, current_user: CurrentUse
             )
     db.expenses.update_one({"id": expense_id, **_org_scope(current_user)}, {"$set": expense_data})
     updated = db.expenses.find_one({"id": expense_id, **_org_scope(current_user)}, {"_id": 0})
+    _report_data_changed(current.get("organization_id"), current.get("expense_date"),
+                         expense_data.get("expense_date", current.get("expense_date")))
     # [GL P2 — T9] Régénération auto de l'écriture de charge (§5.7), opt-in par org.
     # On CONTRE-PASSE l'ancienne écriture (miroir POSTED — l'origine reste posted,
     # net zéro) puis on POSTE la nouvelle avec les valeurs à jour. Toujours
@@ -8707,6 +11231,7 @@ def update_expense_status(expense_id: str, status_data: dict, current_user: Curr
     result = db.expenses.update_one({"id": expense_id, **_org_scope(current_user)}, {"$set": {"status": status_data.get("status", "pending")}})
     if result.matched_count == 0:
         raise HTTPException(404, "Expense not found")
+    _bump_org_data_version(current_user.organization_id)
     return {"message": "Status updated"}
 
 @app.delete("/api/expenses/{expense_id}")
@@ -8741,6 +11266,7 @@ def delete_expense(expense_id: str, current_user: CurrentUser = Depends(require_
     result = db.expenses.delete_one({"id": expense_id, **_org_scope(current_user)})
     if result.deleted_count == 0:
         raise HTTPException(404, "Expense not found")
+    _report_data_changed(exp.get("organization_id"), exp.get("expense_date"))
     return {"message": "deleted"}
 
 # ─── CSV Import for Expenses ───
@@ -8857,6 +11383,7 @@ def import_csv_confirm(import_data: dict, current_user: CurrentUser = Depends(re
     if not rows:
         raise HTTPException(400, "Aucune donnee a importer")
     created = 0
+    imported_dates = []
     for row in rows:
         amt = parse_amount(str(row.get("amount", 0)))
         if amt == 0 and not row.get("description"):
@@ -8874,8 +11401,12 @@ def import_csv_confirm(import_data: dict, current_user: CurrentUser = Depends(re
             "status": "pending", "receipt_url": "",
             "notes": row.get("notes", ""), "created_at": datetime.now(timezone.utc).isoformat()
         }
+        doc["expense_day"] = _canonical_day(doc["expense_date"])
         db.expenses.insert_one(doc)
+        imported_dates.append(doc["expense_date"])
         created += 1
+    if imported_dates:
+        _report_data_changed(current_user.organization_id, *imported_dates)
     return {"message": f"{created} depense(s) importee(s)", "created": created}
 
 
@@ -9081,7 +11612,184 @@ def _mileage_flag_rate_missing(org_id, year):
         pass
 
 
-def _mileage_enrich_trip(trip: dict, scope, _preloaded_trips=None) -> dict:
+# ─── Cumul YTD persisté (`ytd_before_km`) ───
+# Chaque trajet porte le km cumulé de ses trajets ANTÉRIEURS (même personne+véhicule+année,
+# ordre _mileage_order_key). Création / édition / suppression ne recalculent que l'effet
+# local : le cumul du trajet (une agrégation sur les jours antérieurs + les trajets du même
+# jour) et UN update_many $inc sur les trajets postérieurs du groupe. Les lectures
+# (GET trajet, liste) n'ont plus à recharger l'année. Les trajets sans champ (antérieurs à
+# la migration) retombent sur le calcul à la volée ; `python server.py mileage-ytd repair`
+# les renseigne. Les écritures d'un même groupe sont SÉRIALISÉES par un verrou à bail
+# (`mileage_ytd_locks`) : deux saisies concurrentes ne se marchent pas dessus, et un verrou
+# repris après la mort de son détenteur (écriture à moitié faite) recalcule le groupe.
+
+def _mileage_group_filter(doc) -> dict:
+    """Filtre Mongo du groupe de cumul du trajet (org, véhicule, personne — même clé que
+    _mileage_employee_key : employee_id, sinon le créateur)."""
+    query = {"organization_id": doc["organization_id"], "vehicle_id": doc["vehicle_id"]}
+    if doc.get("employee_id"):
+        query["employee_id"] = doc["employee_id"]
+    else:
+        query["employee_id"] = {"$in": [None, ""]}
+        query["created_by_user_id"] = doc.get("created_by_user_id")
+    return query
+
+
+def _mileage_same_day_split(doc, group):
+    """(km des trajets du même jour ANTÉRIEURS au trajet, ids des trajets du même jour
+    POSTÉRIEURS) — seul cas où l'ordre dépend de created_at/id et non du jour seul."""
+    day = _mileage_trip_date_str(doc["trip_date"])
+    key = _mileage_order_key(day, doc.get("created_at", ""), doc["id"])
+    before, later = 0.0, []
+    same_day = db.mileage_trips.find(
+        {**group, "id": {"$ne": doc["id"]}, "trip_date": {"$gte": day, "$lt": day + "~"}},
+        {"_id": 0, "id": 1, "trip_date": 1, "created_at": 1, "distance_km": 1})
+    for t in sorted(same_day, key=lambda t: _mileage_order_key(
+            _mileage_trip_date_str(t["trip_date"]), t.get("created_at"), t["id"])):
+        if _mileage_order_key(day, t.get("created_at"), t["id"]) < key:
+            before += float(t.get("distance_km", 0.0))
+        else:
+            later.append(t["id"])
+    return before, later
+
+
+def _mileage_compute_ytd_before_km(doc) -> float:
+    """Cumul antérieur du trajet lu en base : somme des jours antérieurs de l'année côté
+    serveur ($group) + trajets antérieurs du même jour."""
+    group = _mileage_group_filter(doc)
+    day = _mileage_trip_date_str(doc["trip_date"])
+    earlier = list(db.mileage_trips.aggregate([
+        {"$match": {**group, "trip_date": {"$gte": f"{day[:4]}-01-01", "$lt": day}}},
+        {"$group": {"_id": None, "km": {"$sum": "$distance_km"}}},
+    ]))
+    same_day_before, _ = _mileage_same_day_split(doc, group)
+    return round((earlier[0]["km"] if earlier else 0.0) + same_day_before, 2)
+
+
+def _mileage_shift_later_trips(doc, delta_km):
+    """Ajoute `delta_km` au cumul des trajets postérieurs du groupe dans l'année (jours
+    suivants + postérieurs du même jour), en UN update_many. Les trajets sans cumul
+    persisté ne sont pas touchés (un $inc créerait un cumul faux)."""
+    group = _mileage_group_filter(doc)
+    day = _mileage_trip_date_str(doc["trip_date"])
+    _, later_ids = _mileage_same_day_split(doc, group)
+    db.mileage_trips.update_many(
+        {**group, "id": {"$ne": doc["id"]}, "ytd_before_km": {"$exists": True},
+         "$or": [{"trip_date": {"$gte": day + "~", "$lt": f"{int(day[:4]) + 1}-01-01"}},
+                 {"id": {"$in": later_ids}}]},
+        {"$inc": {"ytd_before_km": delta_km}})
+
+
+from contextlib import contextmanager
+
+MILEAGE_YTD_LOCK_SECONDS = 30       # bail du verrou de groupe (une écriture dure quelques ms)
+MILEAGE_YTD_LOCK_WAIT_SECONDS = 10  # attente max du verrou avant 409
+
+
+def _mileage_group_lock_id(doc) -> str:
+    """Clé du verrou de groupe : org + véhicule + personne (toutes années : une édition peut
+    changer l'année du trajet)."""
+    return "|".join([doc["organization_id"], doc["vehicle_id"], _mileage_employee_key(
+        doc.get("employee_id"), doc.get("created_by_user_id"))])
+
+
+def _mileage_acquire_group_lock(lock_id, token) -> bool:
+    """Prend le verrou `lock_id` (libre ou bail expiré) ; attend sinon, puis 409. Rend True si
+    le verrou a été REPRIS à un détenteur mort (bail expiré sans libération)."""
+    deadline = time.monotonic() + MILEAGE_YTD_LOCK_WAIT_SECONDS
+    while True:
+        now = datetime.now(timezone.utc)
+        try:
+            previous = db.mileage_ytd_locks.find_one_and_update(
+                {"_id": lock_id, "$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}]},
+                {"$set": {"token": token,
+                          "lease_until": now + timedelta(seconds=MILEAGE_YTD_LOCK_SECONDS)}},
+                upsert=True)
+            return bool(previous and previous.get("token"))
+        except DuplicateKeyError:  # verrou tenu : l'upsert heurte le _id existant
+            if time.monotonic() > deadline:
+                raise HTTPException(status_code=409,
+                                    detail="Trajets en cours de mise à jour — réessayez")
+            time.sleep(0.02)
+
+
+def _mileage_ytd_mismatches(docs):
+    """[(trajet, cumul persisté, cumul attendu)] des trajets dont le cumul persisté diffère
+    du calcul de référence (index de sommes préfixes sur `docs`)."""
+    index = _build_mileage_ytd_index([_mileage_ytd_trip(d) for d in docs])
+    out = []
+    for d in docs:
+        expected = _mileage_index_ytd_before(index, d)
+        stored = d.get("ytd_before_km")
+        if stored is None or round(float(stored), 2) != expected:
+            out.append((d, stored, expected))
+    return out
+
+
+def _mileage_repair_group(doc):
+    """Recalcule les cumuls persistés du groupe de `doc` (toutes années)."""
+    group = _mileage_group_filter(doc)
+    ops = [UpdateOne({**group, "id": d["id"]}, {"$set": {"ytd_before_km": expected}})
+           for d, _, expected in _mileage_ytd_mismatches(
+               list(db.mileage_trips.find(group, {"_id": 0})))]
+    if ops:
+        db.mileage_trips.bulk_write(ops, ordered=False)
+
+
+@contextmanager
+def _mileage_group_lock(*docs):
+    """Sérialise les écritures de cumul des groupes de `docs` (ancien + nouveau groupe d'une
+    édition). Verrous pris dans l'ordre des clés (pas d'interblocage) ; un groupe dont le
+    verrou est repris à un détenteur mort est d'abord réparé."""
+    token = str(uuid.uuid4())
+    held = []
+    try:
+        for lock_id, doc in sorted({_mileage_group_lock_id(d): d for d in docs}.items()):
+            taken_over = _mileage_acquire_group_lock(lock_id, token)
+            held.append(lock_id)
+            if taken_over:
+                _mileage_repair_group(doc)
+        yield
+    finally:
+        for lock_id in held:
+            db.mileage_ytd_locks.update_one({"_id": lock_id, "token": token},
+                                            {"$set": {"token": None, "lease_until": None}})
+
+
+def _mileage_reload_locked_trip(scope, trip_id, locked_docs):
+    """Relit le trajet sous verrou (une écriture concurrente a pu changer sa date ou sa
+    distance). 404 s'il a disparu ; 409 s'il a changé de groupe (verrou non tenu)."""
+    doc = db.mileage_trips.find_one({**scope, "id": trip_id})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Trajet introuvable")
+    if _mileage_group_lock_id(doc) not in {_mileage_group_lock_id(d) for d in locked_docs}:
+        raise HTTPException(status_code=409, detail="Trajet modifié en parallèle — réessayez")
+    return doc
+
+
+def verify_mileage_ytd(org_id=None, repair=False):
+    """Recalcule le cumul de chaque trajet (index de sommes préfixes) et le compare au cumul
+    persisté. `repair` réécrit les écarts (bulk_write). Retourne {checked, mismatches,
+    repaired} ; mismatches = [{organization_id, id, stored, expected}]."""
+    org_ids = [org_id] if org_id else sorted(
+        o for o in db.mileage_trips.distinct("organization_id") if isinstance(o, str))
+    report = {"checked": 0, "mismatches": [], "repaired": 0}
+    for oid in org_ids:
+        docs = list(db.mileage_trips.find({"organization_id": oid}, {"_id": 0}))
+        report["checked"] += len(docs)
+        ops = []
+        for d, stored, expected in _mileage_ytd_mismatches(docs):
+            report["mismatches"].append({"organization_id": oid, "id": d["id"],
+                                         "stored": stored, "expected": expected})
+            ops.append(UpdateOne({"id": d["id"], "organization_id": oid},
+                                 {"$set": {"ytd_before_km": expected}}))
+        if repair and ops:
+            db.mileage_trips.bulk_write(ops, ordered=False)
+            report["repaired"] += len(ops)
+    return report
+
+
+def _mileage_enrich_trip(trip: dict, scope, _ytd_index=None) -> dict:
     """Enrichit un trajet de son allocation calculée À LA VOLÉE (jamais figée sur
     le document). Forme de retour stable : {trip, allocation, ytd_before,
     running_total_km, rate_missing_year}.
@@ -9095,23 +11803,22 @@ def _mileage_enrich_trip(trip: dict, scope, _preloaded_trips=None) -> dict:
     running_total_km = ytd_before + distance_km (cumul APRÈS ce trajet, colonne
     « Cumul » exigée par l'ARC au carnet).
 
-    [perf audit] `_preloaded_trips` : quand la liste des trajets de l'année est
-    déjà chargée en mémoire (cas `list_mileage_trips` qui enrichit N trajets), on
-    calcule le cumul YTD via `_mileage_sum_ytd` DIRECTEMENT sur cette liste au lieu
-    de re-requêter la DB par trajet (évite le N+1). Résultat IDENTIQUE : _mileage_sum_ytd
-    filtre déjà par (employee_key, vehicle_id, année), donc une liste couvrant les
-    années présentes suffit. Sans ce param → comportement inchangé (requête par trajet)."""
+    [perf] Le cumul persisté `ytd_before_km` est lu tel quel (aucune requête). Sinon
+    (trajet antérieur à la migration) : `_ytd_index`, index de cumul déjà construit
+    (_build_mileage_ytd_index, cas d'une liste), ou à défaut un index construit sur les
+    trajets de l'année du véhicule (une requête)."""
     year = int(_mileage_trip_date_str(trip["trip_date"])[:4])
-    rates = _mileage_rate_for_year(year)
-    employee_key = _mileage_employee_key(trip.get("employee_id"), trip.get("created_by_user_id"))
-    if _preloaded_trips is not None:
-        ytd_before = _mileage_sum_ytd(
-            _preloaded_trips, trip["id"], trip["trip_date"], employee_key,
-            trip["vehicle_id"], trip.get("created_at", ""))
+    if _ytd_index is None and trip.get("ytd_before_km") is not None:
+        ytd_before = round(float(trip["ytd_before_km"]), 2)
+        rates = _mileage_rate_for_year(year)
+        if rates is not None:
+            amount, breakdown = _mileage_allocation(float(trip.get("distance_km", 0.0)),
+                                                    ytd_before, rates)
     else:
-        ytd_before = _mileage_ytd_before(
-            scope, employee_key, trip["vehicle_id"], trip["trip_date"], trip["id"],
-            current_created_at=trip.get("created_at", ""))
+        if _ytd_index is None:
+            _ytd_index = _build_mileage_ytd_index(
+                _mileage_ytd_trips(scope, year, year, trip["vehicle_id"]))
+        ytd_before, rates, amount, breakdown = _mileage_index_allocation(_ytd_index, trip)
     distance_km = float(trip.get("distance_km", 0.0))
     running_total_km = round(ytd_before + distance_km, 2)
     if rates is None:
@@ -9123,7 +11830,6 @@ def _mileage_enrich_trip(trip: dict, scope, _preloaded_trips=None) -> dict:
             "running_total_km": running_total_km,
             "rate_missing_year": year,
         }
-    amount, breakdown = _mileage_allocation(distance_km, ytd_before, rates)
     return {
         "trip": trip,
         "allocation": {"amount_cad": amount, "breakdown": breakdown},
@@ -9201,7 +11907,10 @@ def create_mileage_trip(payload: dict, current_user: CurrentUser = Depends(requi
         "notes": (payload.get("notes") or None),
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
-    db.mileage_trips.insert_one(doc)
+    with _mileage_group_lock(doc):
+        doc["ytd_before_km"] = _mileage_compute_ytd_before_km(doc)
+        db.mileage_trips.insert_one(doc)
+        _mileage_shift_later_trips(doc, doc["distance_km"])
     doc.pop("_id", None)
     return _mileage_enrich_trip(doc, scope)
 
@@ -9223,28 +11932,15 @@ def list_mileage_trips(year: int = None, month: int = None, vehicle_id: str = No
         query["vehicle_id"] = vehicle_id
     docs = list(db.mileage_trips.find(query, {"_id": 0}))
     docs.sort(key=lambda d: (d["trip_date"], d["id"]))
-    # [perf audit] Cumul YTD en BATCH : au lieu d'une requête par trajet
-    # (_mileage_ytd_before ×N), on charge UNE fois les trajets des années présentes
-    # dans le résultat et on calcule chaque cumul en mémoire. Montants identiques
-    # (_mileage_sum_ytd filtre par employee+véhicule+année). Union des années =
-    # complète car le YTD d'un trajet ne dépend que de sa propre année.
-    preloaded = None
-    if docs:
+    # [perf] Cumuls lus sur les documents (`ytd_before_km`). Si un trajet n'en a pas encore
+    # (antérieur à la migration) : UNE requête sur les années présentes dans le résultat,
+    # un index de sommes préfixes, puis une recherche O(log n) par trajet. Union des
+    # années = complète car le YTD d'un trajet ne dépend que de sa propre année.
+    index = None
+    if any(d.get("ytd_before_km") is None for d in docs):
         years = sorted({_mileage_trip_date_str(d["trip_date"])[:4] for d in docs})
-        lo, hi = years[0], str(int(years[-1]) + 1)
-        preloaded = [
-            {
-                "id": t["id"], "trip_date": t["trip_date"],
-                "distance_km": t.get("distance_km", 0.0),
-                "created_at": t.get("created_at", ""),
-                "employee_key": _mileage_employee_key(t.get("employee_id"), t.get("created_by_user_id")),
-                "vehicle_id": t["vehicle_id"],
-            }
-            for t in db.mileage_trips.find(
-                {**scope, "trip_date": {"$gte": f"{lo}-01-01", "$lt": f"{hi}-01-01"}},
-                {"_id": 0})
-        ]
-    return [_mileage_enrich_trip(d, scope, _preloaded_trips=preloaded) for d in docs]
+        index = _build_mileage_ytd_index(_mileage_ytd_trips(scope, years[0], years[-1]))
+    return [_mileage_enrich_trip(d, scope, _ytd_index=index) for d in docs]
 
 
 @app.get("/api/mileage/trips/{trip_id}")
@@ -9263,10 +11959,10 @@ def update_mileage_trip(trip_id: str, payload: dict,
     """Édite un trajet (org-scopé) et retourne le trajet ENRICHI recalculé.
 
     [CALCUL] La distance et l'allocation ne sont jamais figées : distance_km est
-    toujours recalculée backend (aller-retour doublé, valeur client ignorée), et
-    l'allocation + le cumul YTD sont re-dérivés à la volée par _mileage_enrich_trip
-    — la bascule 5000 km reste donc correcte après édition (y compris le split du
-    trajet à cheval). Mêmes invariants ARC qu'à la création : motif obligatoire,
+    toujours recalculée backend (aller-retour doublé, valeur client ignorée), le
+    cumul persisté du trajet et de ses postérieurs est ajusté, et l'allocation est
+    re-dérivée par _mileage_enrich_trip — la bascule 5000 km reste donc correcte
+    après édition (y compris le split du trajet à cheval). Mêmes invariants ARC qu'à la création : motif obligatoire,
     km aller-simple > 0, date pure AAAA-MM-JJ calendaire canonique.
 
     Garde-fou de cohérence : un trajet déjà rattaché à une dépense (expense_id non
@@ -9328,8 +12024,20 @@ def update_mileage_trip(trip_id: str, payload: dict,
         "notes": (payload.get("notes") or None),
         "updated_at": datetime.now(timezone.utc).isoformat(),
     }
-    db.mileage_trips.update_one({**scope, "id": trip_id}, {"$set": updates})
-    fresh = db.mileage_trips.find_one({**scope, "id": trip_id}, {"_id": 0})
+    # Cumuls persistés : retrait du trajet à son ancienne position, puis insertion à la
+    # nouvelle (date, véhicule, personne ou distance ont pu changer), sous le verrou des
+    # deux groupes. Le trajet est relu sous verrou : une édition concurrente l'a peut-être
+    # déplacé (autre groupe -> 409, réessayer).
+    locked = (doc, {**doc, **updates})
+    with _mileage_group_lock(*locked):
+        doc = _mileage_reload_locked_trip(scope, trip_id, locked)
+        _mileage_shift_later_trips(doc, -float(doc.get("distance_km", 0.0)))
+        db.mileage_trips.update_one({**scope, "id": trip_id}, {"$set": updates})
+        fresh = db.mileage_trips.find_one({**scope, "id": trip_id}, {"_id": 0})
+        fresh["ytd_before_km"] = _mileage_compute_ytd_before_km(fresh)
+        db.mileage_trips.update_one({**scope, "id": trip_id},
+                                    {"$set": {"ytd_before_km": fresh["ytd_before_km"]}})
+        _mileage_shift_later_trips(fresh, fresh["distance_km"])
     return _mileage_enrich_trip(fresh, scope)
 
 
@@ -9338,9 +12046,8 @@ def delete_mileage_trip(trip_id: str,
                         current_user: CurrentUser = Depends(require_permission("expenses:write"))):
     """Supprime un trajet (org-scopé). 404 si absent/hors org.
 
-    [CALCUL] Le cumul YTD n'étant jamais figé, la suppression fait automatiquement
-    baisser l'allocation des trajets postérieurs de la même personne+véhicule+année
-    (recalculé à la volée au prochain GET) — aucune donnée dérivée à réconcilier.
+    [CALCUL] La suppression fait baisser le cumul persisté (`ytd_before_km`) des
+    trajets postérieurs de la même personne+véhicule+année, donc leur allocation.
 
     Garde-fou : un trajet lié à une dépense (expense_id) est verrouillé (400) ;
     détacher la dépense d'abord (Task 10)."""
@@ -9351,7 +12058,10 @@ def delete_mileage_trip(trip_id: str,
     if doc.get("expense_id"):
         raise HTTPException(status_code=400,
                             detail="Trajet lié à une dépense — détachez-la d'abord")
-    db.mileage_trips.delete_one({**scope, "id": trip_id})
+    with _mileage_group_lock(doc):
+        doc = _mileage_reload_locked_trip(scope, trip_id, (doc,))
+        _mileage_shift_later_trips(doc, -float(doc.get("distance_km", 0.0)))
+        db.mileage_trips.delete_one({**scope, "id": trip_id})
     return {"status": "deleted", "id": trip_id}
 
 
@@ -9374,22 +12084,21 @@ def _mileage_build_expense_for_trips(trip_docs, scope, current_user):
     (aucun montant deviné). Le doc dépense est aligné sur create_expense (mêmes
     champs) pour s'afficher à l'identique dans ExpensesPage."""
     ordered = sorted(trip_docs, key=lambda d: (_mileage_trip_date_str(d["trip_date"]), d["id"]))
+    # Cumuls de TOUS les trajets de l'org sur les années du lot : une requête + un index
+    # (au lieu d'une requête _mileage_ytd_before par trajet du lot)
+    years = sorted({_mileage_trip_date_str(d["trip_date"])[:4] for d in ordered})
+    index = _build_mileage_ytd_index(_mileage_ytd_trips(scope, years[0], years[-1])) if years else {}
     total = 0.0
     trip_ids = []
     origins_dests = []
     first_date = None
     for trip in ordered:
         year = int(_mileage_trip_date_str(trip["trip_date"])[:4])
-        rates = _mileage_rate_for_year(year)
+        _, rates, amount, _ = _mileage_index_allocation(index, trip)
         if rates is None:
             raise HTTPException(
                 status_code=400,
                 detail=f"Taux ARC {year} non configuré — allocation bloquée (voir rappel annuel)")
-        employee_key = _mileage_employee_key(trip.get("employee_id"), trip.get("created_by_user_id"))
-        ytd_before = _mileage_ytd_before(
-            scope, employee_key, trip["vehicle_id"], trip["trip_date"], trip["id"],
-            current_created_at=trip.get("created_at", ""))
-        amount, _ = _mileage_allocation(float(trip.get("distance_km", 0.0)), ytd_before, rates)
         total += amount
         trip_ids.append(trip["id"])
         origins_dests.append(f"{trip.get('origin', '')} → {trip.get('destination', '')}")
@@ -9422,6 +12131,7 @@ def _mileage_build_expense_for_trips(trip_docs, scope, current_user):
         "hst_paid_cad": 0.0,
         "taxes_auto_computed": False,
         "expense_date": first_date,
+        "expense_day": _canonical_day(first_date),
         "status": "pending",
         "receipt_url": "",
         "receipt_file_id": None,
@@ -9431,6 +12141,7 @@ def _mileage_build_expense_for_trips(trip_docs, scope, current_user):
         "created_at": now_iso,
     }
     db.expenses.insert_one(expense_doc)
+    _report_data_changed(expense_doc["organization_id"], expense_doc["expense_date"])
     db.mileage_trips.update_many(
         {**scope, "id": {"$in": trip_ids}},
         {"$set": {"expense_id": expense_doc["id"]}},
@@ -9681,21 +12392,20 @@ def _mileage_logbook_rows(scope, year, vehicle_id):
     docs.sort(key=lambda d: _mileage_order_key(
         _mileage_trip_date_str(d["trip_date"]), d.get("created_at"), d["id"]))
     rates = _mileage_rate_for_year(year)
-    running = {}  # (employee_key, vehicle_id) -> km cumulés dans l'année
+    # Cumul brut (non arrondi) par (personne, véhicule), comme le cumul courant historique
+    index = _build_mileage_ytd_index([_mileage_ytd_trip(d) for d in docs])
     rows = []
     total_km = 0.0
     total_alloc = 0.0
     for d in docs:
-        employee_key = _mileage_employee_key(d.get("employee_id"), d.get("created_by_user_id"))
-        key = (employee_key, d["vehicle_id"])
-        ytd_before = running.get(key, 0.0)
+        ytd_before = _mileage_index_ytd_before(index, d, rounded=False)
         distance_km = float(d.get("distance_km", 0.0))
         alloc = None
         if rates is not None:
             amount, _ = _mileage_allocation(distance_km, ytd_before, rates)
             alloc = amount
             total_alloc += amount
-        running[key] = ytd_before + distance_km
+        running_km = ytd_before + distance_km
         total_km += distance_km
         rows.append({
             "trip_date": _mileage_trip_date_str(d["trip_date"]),
@@ -9703,7 +12413,7 @@ def _mileage_logbook_rows(scope, year, vehicle_id):
             "destination": d.get("destination", ""),
             "purpose": d.get("purpose", ""),
             "distance_km": round(distance_km, 2),
-            "running_total_km": round(running[key], 2),
+            "running_total_km": round(running_km, 2),
             "allocation_cad": alloc,
             "expense_id": d.get("expense_id"),
         })
@@ -9889,60 +12599,206 @@ def get_expense_analytics(current_user: CurrentUser = Depends(require_permission
     total = round(sum(by_category.values()), 2)
     return {"by_category": categories_chart, "by_month": monthly_chart, "categories": all_cats, "total": total}
 
-# ─── Exchange Rates ───
-_historical_rate_cache = {}  # {date_str: {rates}} — taux historiques figés, cache permanent
-_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# ─── Exchange Rates ───
+# Taux base CAD persistés dans db.exchange_rates ({date, rates, fetched_at}) : partagés entre
+# workers et conservés au redémarrage, avec un LRU borné en mémoire devant. Un document par
+# JOUR CALENDAIRE passé (week-ends/fériés = dernier jour ouvrable publié, comme frankfurter),
+# donc une date se résout par égalité exacte ; le taux du jour est le document "latest",
+# rafraîchi en arrière-plan (`_exchange_rate_refresher`).
+FRANKFURTER_URL = "https://api.frankfurter.dev/v1"
+EXCHANGE_RATE_LRU_SIZE = 1024
+EXCHANGE_RATE_REFRESH_SECONDS = int(os.environ.get("EXCHANGE_RATE_REFRESH_SECONDS", "3600"))
+_FALLBACK_RATES = {"CAD": 1.0, "USD": 0.73, "EUR": 0.67, "GBP": 0.57}
+_LATEST = "latest"
+_exchange_rate_lru = _LRUCache(EXCHANGE_RATE_LRU_SIZE)
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def _clean_rates(raw):
+    result = {"CAD": 1.0}
+    for cur, rate in (raw or {}).items():
+        if rate and rate > 0:
+            result[cur] = round(rate, 6)
+    return result
+
+
+def _fill_rate_series(series, start, end):
+    """{jour ouvrable: rates} (réponse time-series frankfurter) -> {jour calendaire: rates}
+    pour chaque jour de [start, end] : un jour sans publication reprend le dernier jour
+    ouvrable précédent. Les jours antérieurs à la 1re publication connue sont omis."""
+    published = sorted(series)
+    filled, current, i = {}, None, 0
+    day, last = date.fromisoformat(start), date.fromisoformat(end)
+    while day <= last:
+        key = day.isoformat()
+        while i < len(published) and published[i] <= key:
+            current = series[published[i]]
+            i += 1
+        if current is not None:
+            filled[key] = current
+        day += timedelta(days=1)
+    return filled
+
+
+def _fetch_latest_rates():
+    resp = httpx.get(f"{FRANKFURTER_URL}/latest?from=CAD&to=USD,EUR,GBP", timeout=10)
+    return _clean_rates(resp.json().get("rates"))
+
+
+def _prefetch_exchange_rates(start, end):
+    """Charge les taux de [start, end] (dates passées) en UN appel time-series frankfurter et
+    les persiste jour par jour. La fenêtre est élargie de 7 jours en amont pour que les
+    week-ends/fériés en tête de plage aient leur jour ouvrable précédent. Retourne
+    {date: rates} (vide si l'appel échoue)."""
+    fetch_from = (date.fromisoformat(start) - timedelta(days=7)).isoformat()
+    try:
+        resp = httpx.get(f"{FRANKFURTER_URL}/{fetch_from}..{end}?from=CAD&to=USD,EUR,GBP",
+                         timeout=20)
+        series = {d: _clean_rates(r) for d, r in (resp.json().get("rates") or {}).items()}
+    except Exception as e:
+        print(f"Exchange rate range fetch error for {start}..{end}: {type(e).__name__}")
+        return {}
+    filled = {d: r for d, r in _fill_rate_series(series, start, end).items() if len(r) > 1}
+    if filled:
+        now = datetime.now(timezone.utc)
+        db.exchange_rates.bulk_write([
+            UpdateOne({"date": d}, {"$set": {"rates": r, "fetched_at": now}}, upsert=True)
+            for d, r in filled.items()], ordered=False)
+        for d, r in filled.items():
+            _exchange_rate_lru.put(d, r)
+    return filled
+
+
+def _refresh_latest_rates():
+    """Rafraîchit le taux du jour (document "latest" + LRU). Retourne les taux ou None."""
+    try:
+        rates = _fetch_latest_rates()
+    except Exception as e:
+        print(f"Exchange rate fetch error: {type(e).__name__}")
+        return None
+    if len(rates) <= 1:
+        return None
+    now = datetime.now(timezone.utc)
+    db.exchange_rates.update_one({"date": _LATEST}, {"$set": {"rates": rates, "fetched_at": now}},
+                                 upsert=True)
+    _exchange_rate_lru.put(_LATEST, (rates, now))
+    return rates
+
+
+# Rattrapage d'un "latest" périmé quand aucun refresher ne tourne (désactivé, thread mort,
+# process sans startup) : au plus une tentative par EXCHANGE_RATE_CATCHUP_SECONDS, en
+# arrière-plan — la requête sert le document périmé sans attendre le réseau.
+EXCHANGE_RATE_CATCHUP_SECONDS = int(os.environ.get("EXCHANGE_RATE_CATCHUP_SECONDS", "300"))
+_exchange_rate_refresher_beat = None  # time.monotonic() du dernier tour du refresher
+_latest_catchup_lock = threading.Lock()
+_latest_catchup_at = None
+
+
+def _exchange_rate_refresher_running():
+    beat = _exchange_rate_refresher_beat
+    return beat is not None and time.monotonic() - beat < 2 * EXCHANGE_RATE_REFRESH_SECONDS
+
+
+def _catch_up_latest_rates():
+    """Lance _refresh_latest_rates dans un thread, sauf tentative récente ou déjà en cours."""
+    global _latest_catchup_at
+    if not _latest_catchup_lock.acquire(blocking=False):
+        return False
+    now = time.monotonic()
+    if _latest_catchup_at is not None and now - _latest_catchup_at < EXCHANGE_RATE_CATCHUP_SECONDS:
+        _latest_catchup_lock.release()
+        return False
+    _latest_catchup_at = now
+
+    def run():
+        try:
+            _refresh_latest_rates()
+        finally:
+            _latest_catchup_lock.release()
+    threading.Thread(target=run, name="exchange-rate-catchup", daemon=True).start()
+    return True
 
 
-def _get_exchange_rates(date=None):
-    """Fetch and cache exchange rates from frankfurter.dev.
-    date=None → taux du jour (cache 1h). date='YYYY-MM-DD' → taux historique
-    à cette date (cache permanent car figé). Frankfurter renvoie le dernier jour
-    ouvrable si la date tombe un weekend/férié."""
+def _latest_rates():
     now = datetime.now(timezone.utc)
+    cached = _exchange_rate_lru.get(_LATEST)
+    if cached and (now - cached[1]).total_seconds() < EXCHANGE_RATE_REFRESH_SECONDS:
+        return cached[0]
+    doc = db.exchange_rates.find_one({"date": _LATEST}, {"_id": 0})
+    if doc:
+        # Même périmé, le document est servi ; le refresher le renouvelle, ou à défaut un
+        # rattrapage en arrière-plan.
+        fetched = doc.get("fetched_at")
+        if isinstance(fetched, datetime) and fetched.tzinfo is None:
+            fetched = fetched.replace(tzinfo=timezone.utc)
+        stale = (not isinstance(fetched, datetime)
+                 or (now - fetched).total_seconds() >= EXCHANGE_RATE_REFRESH_SECONDS)
+        if stale and not _exchange_rate_refresher_running():
+            _catch_up_latest_rates()
+        _exchange_rate_lru.put(_LATEST, (doc["rates"], now))
+        return doc["rates"]
+    # Démarrage à froid (aucun taux stocké) : seul cas où une requête attend le réseau
+    if cached:
+        return cached[0]
+    return _refresh_latest_rates() or dict(_FALLBACK_RATES)
+
+
+def _get_exchange_rates_bulk(dates):
+    """{date: rates} pour une liste de dates 'YYYY-MM-DD' : LRU, puis UNE requête Mongo pour
+    le reste, puis UN appel time-series frankfurter pour ce qui manque encore. Dates futures,
+    du jour ou invalides -> taux du jour ; échec réseau -> taux du jour aussi."""
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    result, missing = {}, set()
+    for d in set(dates):
+        if not d or not _DATE_RE.match(d) or d >= today:
+            result[d] = None
+            continue
+        hit = _exchange_rate_lru.get(d)
+        if hit is not None:
+            result[d] = hit
+        else:
+            missing.add(d)
+    if missing:
+        for doc in db.exchange_rates.find({"date": {"$in": sorted(missing)}}, {"_id": 0}):
+            result[doc["date"]] = doc["rates"]
+            _exchange_rate_lru.put(doc["date"], doc["rates"])
+            missing.discard(doc["date"])
+    if missing:
+        fetched = _prefetch_exchange_rates(min(missing), max(missing))
+        for d in missing:
+            result[d] = fetched.get(d)
+    if any(r is None for r in result.values()):
+        latest = _latest_rates()
+        result = {d: (r if r is not None else latest) for d, r in result.items()}
+    return result
+
 
-    # Taux historique
+def _get_exchange_rates(date=None):
+    """Taux base CAD. date=None → taux du jour (refresher 1h). date='YYYY-MM-DD' → taux
+    historique à cette date (figé ; frankfurter renvoie le dernier jour ouvrable si la date
+    tombe un weekend/férié). Date future → taux courant."""
     if date and _DATE_RE.match(date):
-        # Date future → pas de taux historique, on utilise le taux courant
-        if date > now.strftime("%Y-%m-%d"):
-            return _get_exchange_rates()
-        if date in _historical_rate_cache:
-            return _historical_rate_cache[date]
+        return _get_exchange_rates_bulk([date])[date]
+    return _latest_rates()
+
+
+def _exchange_rate_refresher():
+    """Thread démon : taux du jour toutes les EXCHANGE_RATE_REFRESH_SECONDS, et complète
+    la semaine écoulée (les jours passés deviennent des documents figés)."""
+    global _exchange_rate_refresher_beat
+    while True:
+        _exchange_rate_refresher_beat = time.monotonic()
         try:
-            resp = httpx.get(f"https://api.frankfurter.dev/v1/{date}?from=CAD&to=USD,EUR,GBP", timeout=10)
-            data = resp.json()
-            rates = data.get("rates", {})
-            result = {"CAD": 1.0}
-            for cur, rate in rates.items():
-                if rate > 0:
-                    result[cur] = round(rate, 6)
-            if len(result) > 1:
-                _historical_rate_cache[date] = result
-                return result
+            _refresh_latest_rates()
+            today = datetime.now(timezone.utc).date()
+            start = (today - timedelta(days=7)).isoformat()
+            yesterday = (today - timedelta(days=1)).isoformat()
+            known = db.exchange_rates.count_documents({"date": {"$gte": start, "$lte": yesterday}})
+            if known < 7:
+                _prefetch_exchange_rates(start, yesterday)
         except Exception as e:
-            print(f"Historical exchange rate fetch error for {date}: {e}")
-        # Fallback : taux courant
-        return _get_exchange_rates()
-
-    # Taux du jour (cache 1h)
-    if _exchange_rate_cache["fetched_at"] and (now - _exchange_rate_cache["fetched_at"]).total_seconds() < 3600:
-        return _exchange_rate_cache["rates"]
-    try:
-        resp = httpx.get("https://api.frankfurter.dev/v1/latest?from=CAD&to=USD,EUR,GBP", timeout=10)
-        data = resp.json()
-        rates = data.get("rates", {})
-        result = {"CAD": 1.0}
-        for cur, rate in rates.items():
-            if rate > 0:
-                result[cur] = round(rate, 6)
-        _exchange_rate_cache["rates"] = result
-        _exchange_rate_cache["fetched_at"] = now
-        return result
-    except Exception as e:
-        print(f"Exchange rate fetch error: {e}")
-        if _exchange_rate_cache["rates"]:
-            return _exchange_rate_cache["rates"]
-        return {"CAD": 1.0, "USD": 0.73, "EUR": 0.67, "GBP": 0.57}
+            print(f"WARN exchange_rate_refresher type={type(e).__name__}")
+        time.sleep(EXCHANGE_RATE_REFRESH_SECONDS)
 
 
 def _convert_to_cad(amount, currency):
@@ -9957,9 +12813,14 @@ def _convert_to_cad(amount, currency):
 
 
 @app.get("/api/exchange-rates")
-def get_exchange_rates(date: str = None):
+def get_exchange_rates(date: str = None, dates: str = None):
     """Taux de change base CAD. Param optionnel `date` (YYYY-MM-DD) pour le
-    taux historique à cette date (ex: date de la facture)."""
+    taux historique à cette date (ex: date de la facture). `dates` (liste séparée
+    par des virgules) résout plusieurs dates en un seul aller-retour."""
+    if dates:
+        wanted = [d.strip() for d in dates.split(",") if d.strip()][:366]
+        return {"base": "CAD", "rates_by_date": _get_exchange_rates_bulk(wanted),
+                "supported": SUPPORTED_CURRENCIES}
     rates = _get_exchange_rates(date)
     return {"base": "CAD", "rates": rates, "supported": SUPPORTED_CURRENCIES,
             "date": date if (date and _DATE_RE.match(date)) else "latest"}
@@ -9987,6 +12848,7 @@ def get_settings(current_user: CurrentUser = Depends(require_permission("setting
             "province": "QC",
         }
         db.company_settings.insert_one(default)
+        _bump_org_data_version(current_user.organization_id)
         settings = {k: v for k, v in default.items() if k != "_id"}
     # Ensure all 5 tax fields exist in response
     for f in TAX_FIELDS:
@@ -10080,6 +12942,8 @@ def update_settings(
             }},
             upsert=True,
         )
+    _bump_org_data_version(current_user.organization_id)
+    _invalidate_document_pdfs(current_user.organization_id)
     # Re-fetch + decorate so the frontend can update warnings without a separate GET
     settings = db.company_settings.find_one(_org_scope(current_user), {"_id": 0}) or {}
     for f in TAX_FIELDS:
@@ -10092,6 +12956,7 @@ def update_settings(
 @app.post("/api/settings/company/upload-logo")
 def upload_logo(logo_data: dict, current_user: User = Depends(get_current_user_with_access)):
     db.company_settings.update_one({"user_id": current_user.id}, {"$set": {"logo_url": logo_data.get("logo_url", "")}}, upsert=True)
+    _settings_data_changed({"user_id": current_user.id})
     return {"message": "Logo saved", "logo_url": logo_data.get("logo_url", "")}
 
 # ─── File Upload/Download ───
@@ -10109,7 +12974,7 @@ def upload_file(file: UploadFile = File(...), current_user: User = Depends(get_c
     file_doc = {
         "id": str(uuid.uuid4()),
         "user_id": current_user.id,
-        "data": Binary(data),
+        "sha256": _store_blob(data),
         "original_filename": file.filename,
         "content_type": file.content_type,
         "size": len(data),
@@ -10121,13 +12986,15 @@ def upload_file(file: UploadFile = File(...), current_user: User = Depends(get_c
     return {"file_id": file_doc["id"], "filename": file.filename}
 
 @app.get("/api/files/{file_id}")
-def download_file(file_id: str):
-    record = db.files.find_one({"id": file_id, "is_deleted": False}, {"_id": 0})
+def download_file(file_id: str, request: Request):
+    record = db.files.find_one({"id": file_id, "is_deleted": False}, {"_id": 0, "thumbnail": 0})
     if not record:
         raise HTTPException(404, "File not found")
-    if "data" not in record:
+    source = _file_source(record)
+    if source is None:
         raise HTTPException(410, "Fichier sur l'ancien stockage Emergent. Veuillez le re-televerser.")
-    return Response(content=bytes(record["data"]), media_type=record.get("content_type", "application/octet-stream"))
+    return _file_download_response(request, source,
+                                   record.get("content_type", "application/octet-stream"))
 
 @app.post("/api/settings/company/upload-logo-file")
 def upload_logo_file(file: UploadFile = File(...), current_user: User = Depends(get_current_user_with_access)):
@@ -10142,7 +13009,7 @@ def upload_logo_file(file: UploadFile = File(...), current_user: User = Depends(
     file_doc = {
         "id": str(uuid.uuid4()),
         "user_id": current_user.id,
-        "data": Binary(data),
+        "sha256": _store_blob(data),
         "original_filename": file.filename,
         "content_type": file.content_type,
         "size": len(data),
@@ -10157,6 +13024,7 @@ def upload_logo_file(file: UploadFile = File(...), current_user: User = Depends(
         {"$set": {"logo_url": logo_url}},
         upsert=True
     )
+    _settings_data_changed({"user_id": current_user.id})
 
     return {"message": "Logo televerse avec succes", "logo_url": logo_url, "file_id": file_doc["id"]}
 
@@ -10192,6 +13060,7 @@ def get_overdue_invoices(current_user: CurrentUser = Depends(require_permission(
     ]}
     invoices = list(db.invoices.find({**scope, "status": {"$in": ["sent", "partial", "overdue"]}}, {"_id": 0}))
     overdue = []
+    flagged = False
     for inv in invoices:
         raw_due = inv.get("due_date", "")
         if isinstance(raw_due, datetime):
@@ -10203,6 +13072,7 @@ def get_overdue_invoices(current_user: CurrentUser = Depends(require_permission(
             if inv.get("status") != "overdue":
                 db.invoices.update_one({"id": inv["id"]}, {"$set": {"status": "overdue"}})
                 inv["status"] = "overdue"
+                flagged = True
             _enrich_invoice(inv)
             client = db.clients.find_one({"id": inv.get("client_id"), **scope}, {"_id": 0})
             overdue.append({
@@ -10217,6 +13087,8 @@ def get_overdue_invoices(current_user: CurrentUser = Depends(require_permission(
                 "days_overdue": days,
                 "last_reminded": inv.get("last_reminded", ""),
             })
+    if flagged:
+        _bump_org_data_version(current_user.organization_id)
     overdue.sort(key=lambda x: x["days_overdue"], reverse=True)
     total_overdue = sum(i["total"] for i in overdue)
     return {"overdue_invoices": overdue, "total_overdue": round(total_overdue, 2), "count": len(overdue)}
@@ -10251,9 +13123,7 @@ def send_invoice_reminder(invoice_id: str, body: dict, current_user: CurrentUser
     if not to_email:
         raise HTTPException(400, "Adresse email du destinataire requise")
     products = list(db.products.find(_org_scope(current_user), {"_id": 0}))
-    pdf_buffer = generate_document_pdf("invoice", invoice, settings, client_info, products)
-    pdf_bytes = pdf_buffer.read()
-    pdf_b64 = base64.b64encode(pdf_bytes).decode()
+    pdf_bytes = _document_pdf_bytes("invoice", invoice, settings, client_info, products)
     comp_name = settings.get('company_name', 'FacturePro')
     inv_num = invoice.get('invoice_number', 'N/A')
     due_date = invoice.get('due_date', '')[:10]
@@ -10265,19 +13135,15 @@ def send_invoice_reminder(invoice_id: str, body: dict, current_user: CurrentUser
                f"Veuillez trouver ci-joint une copie de la facture.\n\n"
                f"Merci de proceder au paiement dans les meilleurs delais.\n\n"
                f"Cordialement,\n{comp_name}")
-    params = {
-        "from": SENDER_EMAIL,
-        "to": [to_email],
-        "subject": subject,
-        "text": message,
-        "attachments": [{"filename": f"facture_{inv_num}.pdf", "content": pdf_b64}]
-    }
-    try:
-        r = resend.Emails.send(params)
-        db.invoices.update_one({"id": invoice_id, **_org_scope(current_user)}, {"$set": {"last_reminded": datetime.now(timezone.utc).isoformat()}})
-        return {"message": f"Rappel envoye a {to_email}", "email_id": r.get("id") if isinstance(r, dict) else str(r)}
-    except Exception as e:
-        raise HTTPException(500, f"Erreur envoi rappel: {str(e)}")
+    params = {"from": SENDER_EMAIL, "to": [to_email], "subject": subject, "text": message}
+    outbox_id = _enqueue_email(params, "invoice_reminder", _client_idempotency_key(
+                                   current_user.organization_id, "invoice_reminder", invoice_id,
+                                   body.get("idempotency_key")),
+                               current_user.organization_id,
+                               attachments=[(f"facture_{inv_num}.pdf", pdf_bytes)])
+    db.invoices.update_one({"id": invoice_id, **_org_scope(current_user)}, {"$set": {"last_reminded": datetime.now(timezone.utc).isoformat()}})
+    _bump_org_data_version(current_user.organization_id)
+    return {"message": f"Rappel envoye a {to_email}", "email_id": outbox_id, "status": "queued"}
 
 # ─── CSV Exports ───
 @app.get("/api/export/invoices/csv")
@@ -10309,22 +13175,34 @@ def export_expenses_csv(current_user: CurrentUser = Depends(require_permission("
 
 
 # ─── PDF Generation ───
-def generate_document_pdf(doc_type, document, company_settings, client_info, products_list):
-    """Generate a professional PDF for a quote or invoice."""
+def _document_logo_bytes(company_settings):
+    """Octets du logo de l'entreprise (`logo_url` = /api/files/{id}), ou None si absent ou
+    illisible. Séparé du rendu pour que le lot PDF le lise UNE fois dans le process parent."""
+    logo_url = company_settings.get('logo_url', '')
+    if not logo_url or not logo_url.startswith('/api/files/'):
+        return None
+    try:
+        record = db.files.find_one({"id": logo_url.split('/')[-1], "is_deleted": False},
+                                   {"_id": 0, "data": 1, "sha256": 1})
+        return _file_bytes(record) if record else None
+    except Exception:
+        return None
+
+
+def generate_document_pdf(doc_type, document, company_settings, client_info, products_list,
+                          logo_bytes=None):
+    """Generate a professional PDF for a quote or invoice.
+
+    `logo_bytes` : logo déjà lu (ex. rendu dans un process du pool, sans accès DB) ; None =
+    lu depuis db.files, b"" = pas de logo."""
     buffer = io.BytesIO()
     pdf = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch, leftMargin=0.6*inch, rightMargin=0.6*inch)
 
-    styles = getSampleStyleSheet()
-    teal = HexColor('#00A08C')
-    dark = HexColor('#1f2937')
-    gray = HexColor('#6b7280')
-
-    title_style = ParagraphStyle('DocTitle', parent=styles['Heading1'], fontSize=28, textColor=teal, spaceAfter=4)
-    subtitle_style = ParagraphStyle('Subtitle', parent=styles['Normal'], fontSize=11, textColor=gray)
-    company_style = ParagraphStyle('Company', parent=styles['Normal'], fontSize=10, textColor=dark, leading=14)
-    small_style = ParagraphStyle('Small', parent=styles['Normal'], fontSize=9, textColor=gray, leading=12)
-    right_style = ParagraphStyle('Right', parent=styles['Normal'], fontSize=10, textColor=dark, alignment=TA_RIGHT)
-    terms_style = ParagraphStyle('Terms', parent=styles['Normal'], fontSize=8, textColor=gray, leading=11)
+    theme = _pdf_theme("document", '#00A08C', '#1f2937')
+    teal, dark, gray = theme["primary"], theme["secondary"], theme["gray"]
+    title_style, subtitle_style = theme["title"], theme["subtitle"]
+    company_style, small_style = theme["company"], theme["small"]
+    right_style, terms_style = theme["right"], theme["terms"]
 
     # Tax registrations source:
     # - Quotes: always use current company settings (quote is not a final fiscal doc).
@@ -10357,24 +13235,19 @@ def generate_document_pdf(doc_type, document, company_settings, client_info, pro
 
     # Try to load logo
     logo_elem = None
-    logo_url = company_settings.get('logo_url', '')
-    if logo_url:
-        try:
-            if logo_url.startswith('/api/files/'):
-                file_id = logo_url.split('/')[-1]
-                record = db.files.find_one({"id": file_id, "is_deleted": False})
-                if record and "data" in record:
-                    logo_buf = io.BytesIO(bytes(record["data"]))
-                    logo_elem = RLImage(logo_buf, width=1.2*inch, height=1.2*inch)
-        except Exception:
-            pass
+    if logo_bytes is None:
+        logo_reader = _org_pdf_logo(company_settings.get('organization_id'), company_settings)
+    else:
+        logo_reader = _decode_pdf_logo(logo_bytes) if logo_bytes else None
+    if logo_reader is not None:
+        logo_elem = _PdfLogo(logo_reader, 1.2*inch, 1.2*inch)
 
     # Build header table
     left_parts = []
     if logo_elem:
         left_parts.append(logo_elem)
         left_parts.append(Spacer(1, 8))
-    left_parts.append(Paragraph(comp_name, ParagraphStyle('CompName', parent=styles['Normal'], fontSize=14, textColor=dark, fontName='Helvetica-Bold', leading=18)))
+    left_parts.append(Paragraph(comp_name, theme["company_name"]))
     left_parts.append(Spacer(1, 4))
     if comp_address:
         left_parts.append(Paragraph(comp_address, small_style))
@@ -10393,7 +13266,7 @@ def generate_document_pdf(doc_type, document, company_settings, client_info, pro
     doc_number = document.get('quote_number' if doc_type == 'quote' else 'invoice_number', 'N/A')
 
     right_parts = []
-    right_parts.append(Paragraph(doc_label, ParagraphStyle('DocLabel', parent=styles['Normal'], fontSize=20, textColor=teal, alignment=TA_RIGHT, fontName='Helvetica-Bold', spaceAfter=6)))
+    right_parts.append(Paragraph(doc_label, theme["doc_label"]))
     right_parts.append(Spacer(1, 4))
     right_parts.append(Paragraph(f"No: {doc_number}", right_style))
 
@@ -10424,7 +13297,7 @@ def generate_document_pdf(doc_type, document, company_settings, client_info, pro
     status_label = document.get('status', '')
     if status_label:
         right_parts.append(Spacer(1, 6))
-        right_parts.append(Paragraph(f"Statut: {status_label.upper()}", ParagraphStyle('Status', parent=styles['Normal'], fontSize=10, textColor=teal, alignment=TA_RIGHT, fontName='Helvetica-Bold')))
+        right_parts.append(Paragraph(f"Statut: {status_label.upper()}", theme["status"]))
 
     header_data = [[left_parts, right_parts]]
     header_table = Table(header_data, colWidths=[3.5*inch, 3.5*inch])
@@ -10444,24 +13317,22 @@ def generate_document_pdf(doc_type, document, company_settings, client_info, pro
 
     bill_to = [Paragraph("<b>Facturer a:</b>", company_style)]
     bill_to.append(Spacer(1, 6))
-    bill_to.append(Paragraph(client_name, ParagraphStyle('ClientName', parent=styles['Normal'], fontSize=12, textColor=dark, fontName='Helvetica-Bold', leading=16)))
+    bill_to.append(Paragraph(client_name, theme["client_name"]))
     if client_addr:
         bill_to.append(Spacer(1, 3))
-        bill_to.append(Paragraph(client_addr, ParagraphStyle('ClientAddr', parent=small_style, leading=14)))
+        bill_to.append(Paragraph(client_addr, theme["client_line"]))
     if client_city or client_postal:
         bill_to.append(Spacer(1, 3))
-        bill_to.append(Paragraph(f"{client_city} {client_postal}".strip(), ParagraphStyle('ClientCity', parent=small_style, leading=14)))
+        bill_to.append(Paragraph(f"{client_city} {client_postal}".strip(), theme["client_line"]))
     if client_email:
         bill_to.append(Spacer(1, 3))
-        bill_to.append(Paragraph(client_email, ParagraphStyle('ClientEmail', parent=small_style, leading=14)))
+        bill_to.append(Paragraph(client_email, theme["client_line"]))
 
     # Numéros officiels du client (B2B), affichés en monospace si renseignés
     client_num_parts = _reg_label_parts(tax_regs.get('client', {}))
     if client_num_parts:
         bill_to.append(Spacer(1, 4))
-        client_nums_style = ParagraphStyle('ClientNums', parent=small_style,
-                                            fontName='Courier', fontSize=8, leading=11)
-        bill_to.append(Paragraph(' &nbsp;·&nbsp; '.join(client_num_parts), client_nums_style))
+        bill_to.append(Paragraph(' &nbsp;·&nbsp; '.join(client_num_parts), theme["client_nums"]))
 
     client_table = Table([[bill_to]], colWidths=[7*inch])
     client_table.setStyle(TableStyle([
@@ -10561,10 +13432,7 @@ def generate_document_pdf(doc_type, document, company_settings, client_info, pro
     company_num_parts = _reg_label_parts(tax_regs.get('company', {}))
     if company_num_parts:
         elements.append(Spacer(1, 0.3*inch))
-        reg_title_style = ParagraphStyle('RegTitle', parent=small_style,
-                                          fontName='Helvetica-Bold', fontSize=8.5, textColor=dark)
-        reg_body_style = ParagraphStyle('RegBody', parent=small_style,
-                                         fontName='Courier', fontSize=8, leading=11)
+        reg_title_style, reg_body_style = theme["reg_title"], theme["reg_body"]
         reg_inner = [
             Paragraph("Numeros d'enregistrement", reg_title_style),
             Spacer(1, 3),
@@ -10620,12 +13488,128 @@ def generate_document_pdf(doc_type, document, company_settings, client_info, pro
 
     # Footer
     elements.append(Spacer(1, 0.5*inch))
-    elements.append(Paragraph(f"Merci pour votre confiance ! — {comp_name}", ParagraphStyle('Footer', parent=styles['Normal'], fontSize=10, textColor=teal, alignment=TA_CENTER)))
+    elements.append(Paragraph(f"Merci pour votre confiance ! — {comp_name}", theme["footer"]))
 
     pdf.build(elements)
     buffer.seek(0)
     return buffer
 
+# ─── Cache des PDF rendus (factures/soumissions) ───
+# Clé = empreinte des ENTRÉES du rendu : champs du document, paramètres d'entreprise affichés,
+# fiche client, numéros d'enregistrement et sha256 du logo (+ version du gabarit). Une entrée
+# modifiée change la clé : pas de PDF périmé possible. Mémoire : un emplacement par document
+# (LRU borné). Les factures non brouillon (documents fiscaux figés) sont aussi persistées
+# dans le blob store, référencées par `pdf_renders` (survit aux redémarrages/autres workers).
+PDF_CACHE_MAX = int(os.environ.get("PDF_CACHE_MAX", "256"))
+PDF_RENDER_VERSION = 1  # à incrémenter à chaque changement de mise en page de generate_document_pdf
+
+# Champs lus par generate_document_pdf — à tenir à jour avec le gabarit. Les champs de suivi
+# (last_reminded, sent_at, ...) n'en font pas partie : un rappel réutilise le même PDF.
+_PDF_DOCUMENT_FIELDS = (
+    "status", "invoice_number", "quote_number", "issue_date", "due_date", "valid_until",
+    "currency", "province", "items", "subtotal", "gst_amount", "pst_amount", "hst_amount",
+    "total", "total_cad", "notes", "terms", "payments", "tax_registrations",
+)
+_PDF_SETTINGS_FIELDS = ("company_name", "email", "phone", "address", "city", "postal_code",
+                        "country", "logo_url", "bn_number", "gst_number", "qst_number",
+                        "hst_number", "neq_number")
+_PDF_CLIENT_FIELDS = ("name", "email", "address", "city", "postal_code", "bn_number",
+                      "gst_number", "qst_number", "hst_number", "neq_number")
+
+_PDF_CACHE = _LRUCache(PDF_CACHE_MAX)
+
+
+def _document_logo_sha(company_settings):
+    """sha256 du logo (métadonnée db.files, sans lire les octets d'un blob), "" si aucun."""
+    logo_url = company_settings.get("logo_url", "")
+    if not logo_url or not logo_url.startswith("/api/files/"):
+        return ""
+    record = db.files.find_one({"id": logo_url.split("/")[-1], "is_deleted": False},
+                               {"_id": 0, "sha256": 1, "data": 1})
+    if not record:
+        return ""
+    if record.get("sha256"):
+        return record["sha256"]
+    return hashlib.sha256(bytes(record["data"])).hexdigest() if record.get("data") is not None else ""
+
+
+def _document_pdf_key(doc_type, document, company_settings, client_info, logo_sha):
+    """Empreinte des entrées du rendu (voir en-tête de section)."""
+    payload = [
+        PDF_RENDER_VERSION, doc_type,
+        {f: document.get(f) for f in _PDF_DOCUMENT_FIELDS},
+        {f: company_settings.get(f) for f in _PDF_SETTINGS_FIELDS},
+        {f: client_info.get(f) for f in _PDF_CLIENT_FIELDS} if client_info else None,
+        logo_sha,
+    ]
+    return hashlib.sha256(_json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _document_pdf_bytes(doc_type, document, company_settings, client_info, products_list):
+    """Octets du PDF d'une facture/soumission : cache mémoire, puis rendu persisté (factures
+    non brouillon), sinon rendu puis mise en cache. Sans organisation (docs legacy) : rendu
+    direct, jamais mis en cache."""
+    org_id = document.get("organization_id")
+    if not org_id or not document.get("id"):
+        return generate_document_pdf(doc_type, document, company_settings, client_info,
+                                     products_list).getvalue()
+    slot = (doc_type, document["id"])
+    key = _document_pdf_key(doc_type, document, company_settings, client_info,
+                            _document_logo_sha(company_settings))
+    cached = _PDF_CACHE.get(slot)
+    if cached is not None and cached[1] == key:
+        return cached[2]
+
+    persist = doc_type == "invoice" and document.get("status", "draft") != "draft"
+    pdf = None
+    if persist:
+        ref = db.pdf_renders.find_one({"organization_id": org_id, "doc_type": doc_type,
+                                       "doc_id": document["id"], "key": key},
+                                      {"_id": 0, "sha256": 1})
+        if ref:
+            try:
+                with _blob_store().open(ref["sha256"]) as f:
+                    pdf = f.read()
+            except FileNotFoundError:
+                pdf = None
+    if pdf is None:
+        pdf = generate_document_pdf(doc_type, document, company_settings, client_info,
+                                    products_list).getvalue()
+        if persist:
+            sha = _store_blob(pdf)
+            try:
+                previous = db.pdf_renders.find_one_and_update(
+                    {"organization_id": org_id, "doc_type": doc_type, "doc_id": document["id"]},
+                    {"$set": {"key": key, "sha256": sha, "size": len(pdf),
+                              "rendered_at": datetime.now(timezone.utc).isoformat()}},
+                    projection={"_id": 0, "sha256": 1}, upsert=True)
+            except DuplicateKeyError:
+                previous = None  # rendu concurrent du même document : l'autre upsert a gagné
+            if previous and previous.get("sha256") != sha:
+                _queue_blob_gc([previous.get("sha256")])  # rendu remplacé
+    _PDF_CACHE.put(slot, (org_id, key, pdf))
+    return pdf
+
+
+def _invalidate_document_pdfs(org_id, doc_type=None, doc_id=None):
+    """Oublie les PDF rendus d'un document (modification/suppression) ou, sans `doc_id`, de
+    toute l'org (paramètres d'entreprise, logo). Leurs blobs passent en file de collecte
+    (collect_orphan_blobs)."""
+    if doc_id is not None:
+        _PDF_CACHE.pop((doc_type, doc_id))
+    if not org_id:
+        return  # sans org : rien n'a été mis en cache
+    if doc_id is not None:
+        match = {"organization_id": org_id, "doc_type": doc_type, "doc_id": doc_id}
+    else:
+        _PDF_CACHE.pop_where(lambda slot, entry: entry[0] == org_id)
+        _forget_org_pdf_logo(org_id)
+        match = {"organization_id": org_id}
+    shas = db.pdf_renders.distinct("sha256", match)
+    db.pdf_renders.delete_many(match)
+    _queue_blob_gc(shas)
+
+
 # ─── PDF Endpoints ───
 @app.get("/api/quotes/{quote_id}/pdf")
 def get_quote_pdf(quote_id: str, current_user: CurrentUser = Depends(require_permission("quotes:read"))):
@@ -10640,9 +13624,9 @@ def get_quote_pdf(quote_id: str, current_user: CurrentUser = Depends(require_per
     client_info = db.clients.find_one({"id": quote.get("client_id"), **scope}, {"_id": 0})
     products = list(db.products.find(scope, {"_id": 0}))
 
-    pdf_buffer = generate_document_pdf("quote", quote, settings, client_info, products)
+    pdf_bytes = _document_pdf_bytes("quote", quote, settings, client_info, products)
     filename = f"soumission_{quote.get('quote_number', 'N-A')}.pdf"
-    return StreamingResponse(pdf_buffer, media_type="application/pdf",
+    return StreamingResponse(io.BytesIO(pdf_bytes), media_type="application/pdf",
         headers={
             "Content-Disposition": f"attachment; filename={filename}",
             "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
@@ -10662,15 +13646,400 @@ def get_invoice_pdf(invoice_id: str, current_user: CurrentUser = Depends(require
     client_info = db.clients.find_one({"id": invoice.get("client_id"), **scope}, {"_id": 0})
     products = list(db.products.find(scope, {"_id": 0}))
 
-    pdf_buffer = generate_document_pdf("invoice", invoice, settings, client_info, products)
+    pdf_bytes = _document_pdf_bytes("invoice", invoice, settings, client_info, products)
     filename = f"facture_{invoice.get('invoice_number', 'N-A')}.pdf"
-    return StreamingResponse(pdf_buffer, media_type="application/pdf",
+    return StreamingResponse(io.BytesIO(pdf_bytes), media_type="application/pdf",
         headers={
             "Content-Disposition": f"attachment; filename={filename}",
             "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
             "Pragma": "no-cache",
         })
 
+# ─── Export PDF en lot : rendu ReportLab sur un pool de process, ZIP en flux ───
+# ReportLab est CPU-bound et garde le GIL : rendu en série sur le thread de la requête, un
+# export de fin d'année (300 factures) = 300 requêtes séquentielles. Ici chaque facture est
+# rendue dans un process du pool ; les entrées (paramètres, clients, produits, logo) sont lues
+# UNE fois dans le parent, les workers n'ont pas besoin de Mongo.
+import zipfile
+from concurrent.futures import wait as _futures_wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+PDF_RENDER_WORKERS = int(os.environ.get("PDF_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_BATCH_MAX_INVOICES = int(os.environ.get("PDF_BATCH_MAX_INVOICES", "1000"))
+
+_pdf_render_pool_state = {"pool": None}
+_pdf_render_pool_lock = threading.Lock()
+
+
+def _pdf_render_pool():
+    """Pool de process process-wide (lazy, contexte spawn comme le re-match bancaire), gardé
+    ouvert entre les requêtes : démarrer des interpréteurs coûte plus cher qu'un rendu."""
+    with _pdf_render_pool_lock:
+        pool = _pdf_render_pool_state["pool"]
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=max(1, PDF_RENDER_WORKERS),
+                                       mp_context=multiprocessing.get_context("spawn"))
+            _pdf_render_pool_state["pool"] = pool
+        return pool
+
+
+def _reset_pdf_render_pool(pool):
+    """Écarte un pool cassé (worker tué) : le prochain appel en recrée un."""
+    with _pdf_render_pool_lock:
+        if _pdf_render_pool_state["pool"] is pool:
+            _pdf_render_pool_state["pool"] = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _render_document_pdf_bytes(doc_type, document, company_settings, client_info, products_list,
+                               logo_bytes):
+    """Unité de travail du pool (doit rester picklable, donc au niveau module)."""
+    return generate_document_pdf(doc_type, document, company_settings, client_info,
+                                 products_list, logo_bytes=logo_bytes).getvalue()
+
+
+class _ZipChunkSink:
+    """Flux d'écriture non seekable pour `zipfile` : accumule les octets écrits, que le
+    générateur draine après chaque fichier (l'archive part au client au fil de l'eau)."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        out = b"".join(self._chunks)
+        self._chunks.clear()
+        return out
+
+
+def _iter_pdf_zip(jobs, render=_render_document_pdf_bytes, workers=None):
+    """Rend `jobs` = [(nom_fichier, args_de_render), ...] et produit l'archive ZIP par
+    morceaux, chaque PDF étant ajouté DÈS qu'il est prêt (ordre d'achèvement, pas d'entrée).
+
+    workers <= 1 (ou un seul job) : rendu inline. Un rendu en échec ne coupe pas l'archive :
+    il est listé dans ERREURS.txt en fin de ZIP. Si le pool casse, le reste est rendu inline."""
+    workers = PDF_RENDER_WORKERS if workers is None else workers
+    sink = _ZipChunkSink()
+    failures = []
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        def _add(name, data):
+            zf.writestr(name, data)
+            return sink.drain()
+
+        def _inline(name, args):
+            try:
+                return _add(name, render(*args))
+            except Exception as e:  # noqa: BLE001 — une facture illisible ne bloque pas le lot
+                failures.append((name, type(e).__name__))
+                return b""
+
+        if workers <= 1 or len(jobs) <= 1:
+            for name, args in jobs:
+                yield _inline(name, args)
+        else:
+            pool = _pdf_render_pool()
+            pending = {}
+            try:
+                for name, args in jobs:
+                    pending[pool.submit(render, *args)] = (name, args)
+                while pending:
+                    done, _ = _futures_wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        name, args = pending.pop(fut)
+                        try:
+                            data = fut.result()
+                        except BrokenProcessPool:
+                            _reset_pdf_render_pool(pool)
+                            yield _inline(name, args)
+                            continue
+                        except Exception as e:  # noqa: BLE001
+                            failures.append((name, type(e).__name__))
+                            continue
+                        yield _add(name, data)
+            finally:
+                for fut in pending:  # client déconnecté / pool cassé : on n'attend pas le reste
+                    fut.cancel()
+        if failures:
+            zf.writestr("ERREURS.txt", "".join(f"{name}\t{err}\n" for name, err in failures))
+    yield sink.drain()
+
+
+def _pdf_zip_member_name(prefix, number, used):
+    """Nom de fichier sûr et unique dans l'archive (deux factures peuvent partager un numéro)."""
+    base = f"{prefix}_{re.sub(r'[^A-Za-z0-9._-]+', '_', str(number or 'N-A'))}"
+    name, n = f"{base}.pdf", 1
+    while name in used:
+        n += 1
+        name = f"{base}_{n}.pdf"
+    used.add(name)
+    return name
+
+
+@app.post("/api/invoices/pdf-batch")
+def export_invoices_pdf_batch(body: dict,
+                              current_user: CurrentUser = Depends(require_permission("invoices:read"))):
+    """Export de plusieurs factures en un ZIP de PDF.
+
+    body : {"invoice_ids": [...]} ou {"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD"}
+    (date d'émission, bornes incluses). Paramètres, clients, produits et logo sont lus une
+    fois pour tout le lot ; les PDF sont rendus en parallèle et l'archive est envoyée en flux."""
+    scope = _org_scope(current_user)
+    ids = body.get("invoice_ids")
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+            raise HTTPException(400, "invoice_ids must be a list of ids")
+        invoices = list(db.invoices.find({"id": {"$in": ids}, **scope}, {"_id": 0}))
+        order = {iid: n for n, iid in enumerate(ids)}
+        invoices.sort(key=lambda inv: order.get(inv["id"], 0))
+    else:
+        start = _parse_iso_date(body.get("start_date"))
+        end = _parse_iso_date(body.get("end_date"))
+        if not start or not end or start > end:
+            raise HTTPException(400, "Provide invoice_ids or a valid start_date/end_date range")
+        invoices = _find_in_period(db.invoices, scope, "issue_day", "issue_date", start, end)
+        invoices.sort(key=lambda inv: (str(inv.get("issue_date") or ""),
+                                       str(inv.get("invoice_number") or "")))
+    if not invoices:
+        raise HTTPException(404, "No invoices found")
+    if len(invoices) > PDF_BATCH_MAX_INVOICES:
+        raise HTTPException(400, f"Too many invoices ({len(invoices)} > {PDF_BATCH_MAX_INVOICES})")
+
+    settings = db.company_settings.find_one(scope, {"_id": 0}) or {}
+    logo = _document_logo_bytes(settings) or b""
+    client_ids = list({inv.get("client_id") for inv in invoices if inv.get("client_id")})
+    clients = {c["id"]: c for c in db.clients.find({"id": {"$in": client_ids}, **scope}, {"_id": 0})}
+    products = list(db.products.find(scope, {"_id": 0}))
+
+    used = set()
+    jobs = [(_pdf_zip_member_name("facture", inv.get("invoice_number"), used),
+             ("invoice", inv, settings, clients.get(inv.get("client_id")), products, logo))
+            for inv in invoices]
+    return StreamingResponse(_iter_pdf_zip(jobs), media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename=factures_{datetime.now(timezone.utc):%Y%m%d}.zip",
+            "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
+            "Pragma": "no-cache",
+        })
+
+# ─── Outbox email : envoi différé, concurrence bornée, retries, idempotence ───
+# Les handlers n'appellent plus Resend en ligne : ils ENFILENT le message dans db.email_outbox
+# (pièces jointes dans le blob store) et rendent la main. Un worker (thread démon par process,
+# réveillé à chaque enfilage) réclame les messages dus par mise à jour conditionnelle avec bail,
+# les envoie sur un pool borné et replanifie les échecs avec un délai exponentiel. La clé
+# d'idempotence (unique) dédoublonne l'enfilage ET est transmise au fournisseur : un retry
+# après un timeout (courriel en fait parti) ne produit pas de doublon.
+EMAIL_OUTBOX_WORKER = os.environ.get("EMAIL_OUTBOX_WORKER", "1") == "1"
+EMAIL_OUTBOX_CONCURRENCY = int(os.environ.get("EMAIL_OUTBOX_CONCURRENCY", "4"))
+EMAIL_OUTBOX_BATCH = int(os.environ.get("EMAIL_OUTBOX_BATCH", "20"))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("EMAIL_OUTBOX_MAX_ATTEMPTS", "8"))
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = 30
+EMAIL_OUTBOX_RETRY_MAX_SECONDS = 6 * 3600
+EMAIL_OUTBOX_LEASE_SECONDS = 120
+EMAIL_OUTBOX_POLL_SECONDS = 15
+
+# Expéditeur : callable(params, idempotency_key) -> id fournisseur. None = Resend. Les tests y
+# branchent un stub local (jamais set en prod).
+_EMAIL_SENDER = None
+_email_outbox_wakeup = threading.Event()
+
+
+def _resend_send(params, idempotency_key):
+    r = resend.Emails.send(params, {"idempotency_key": idempotency_key})
+    return r.get("id") if isinstance(r, dict) else str(r)
+
+
+def _email_sender():
+    return _EMAIL_SENDER or _resend_send
+
+
+def _outbox_doc(params, kind, idempotency_key, organization_id, attachments, now):
+    return {
+        "id": str(uuid.uuid4()), "idempotency_key": idempotency_key or str(uuid.uuid4()),
+        "kind": kind, "organization_id": organization_id, "params": params,
+        "attachments": [{"filename": name, "sha256": _store_blob(data)}
+                        for name, data in attachments or []],
+        "status": "pending", "attempts": 0, "next_attempt_at": now, "lease_until": None,
+        "last_error": None, "provider_id": None, "created_at": now, "sent_at": None,
+    }
+
+
+def _client_idempotency_key(organization_id, kind, doc_id, client_key):
+    """Clé d'idempotence fournie par le client, préfixée de sa portée (org, type, document) :
+    la même clé réutilisée par une autre org ou un autre document n'y est jamais confondue.
+    C'est aussi la clé transmise à Resend. None sans clé client."""
+    if not client_key:
+        return None
+    return f"{organization_id}:{kind}:{doc_id}:{str(client_key)[:128]}"
+
+
+def _enqueue_email(params, kind, idempotency_key=None, organization_id=None, attachments=None):
+    """Enfile un courriel et retourne l'id du message. `params` = paramètres Resend sans
+    pièces jointes ; `attachments` = [(nom_fichier, octets)], rangées dans le blob store.
+    Clé d'idempotence déjà enfilée par la MÊME org (double clic, cron rejoué) : retourne le
+    message existant sans rien enfiler ; ses pièces jointes passent en file de collecte."""
+    doc = _outbox_doc(params, kind, idempotency_key, organization_id, attachments,
+                      datetime.now(timezone.utc))
+    try:
+        db.email_outbox.insert_one(doc)
+    except DuplicateKeyError:
+        _queue_blob_gc([a["sha256"] for a in doc["attachments"]])  # gardés si référencés
+        existing = db.email_outbox.find_one(
+            {"idempotency_key": doc["idempotency_key"], "organization_id": organization_id},
+            {"_id": 0, "id": 1})
+        if existing is None:  # clé d'une autre portée : jamais renvoyer son message
+            raise HTTPException(409, "Clé d'idempotence déjà utilisée")
+        return existing["id"]
+    _email_outbox_wakeup.set()
+    return doc["id"]
+
+
+def _enqueue_email_batch(messages):
+    """Enfile en UN insert_many non ordonné une liste de (params, kind, clé, organization_id)
+    — crons de masse. Les clés déjà enfilées sont ignorées comme par `_enqueue_email`.
+    Retourne le nombre de messages réellement enfilés."""
+    if not messages:
+        return 0
+    now = datetime.now(timezone.utc)
+    docs = [_outbox_doc(params, kind, key, org_id, None, now)
+            for params, kind, key, org_id in messages]
+    try:
+        db.email_outbox.insert_many(docs, ordered=False)
+        inserted = len(docs)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        inserted = len(docs) - len(errors)
+    _email_outbox_wakeup.set()
+    return inserted
+
+
+def _outbox_retry_delay(attempts):
+    """Délai avant la tentative suivante : 30 s, 1 min, 2 min, ... plafonné à 6 h."""
+    return min(EMAIL_OUTBOX_RETRY_MAX_SECONDS, EMAIL_OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+def _claim_outbox_batch(limit):
+    """Réclame jusqu'à `limit` messages dus (en attente, ou en envoi dont le bail a expiré :
+    worker mort en plein envoi). La mise à jour conditionnelle garantit qu'un message n'est
+    réclamé que par un seul worker à la fois."""
+    now = datetime.now(timezone.utc)
+    claimed = []
+    for _ in range(limit):
+        msg = db.email_outbox.find_one_and_update(
+            {"$or": [{"status": "pending", "next_attempt_at": {"$lte": now}},
+                     {"status": "sending", "lease_until": {"$lte": now}}]},
+            {"$set": {"status": "sending",
+                      "lease_until": now + timedelta(seconds=EMAIL_OUTBOX_LEASE_SECONDS)},
+             "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", 1)], projection={"_id": 0},
+            return_document=ReturnDocument.AFTER)
+        if msg is None:
+            break
+        claimed.append(msg)
+    return claimed
+
+
+def _deliver_outbox_message(msg):
+    """Envoie un message réclamé. Retourne (msg, id_fournisseur, type_erreur|None) — jamais
+    str(e) (pattern anti-leak)."""
+    try:
+        params = dict(msg["params"])
+        if msg.get("attachments"):
+            params["attachments"] = []
+            for att in msg["attachments"]:
+                data = _file_bytes({"sha256": att["sha256"]})
+                if data is None:
+                    raise FileNotFoundError(att["sha256"])
+                params["attachments"].append({"filename": att["filename"],
+                                              "content": base64.b64encode(data).decode()})
+        return msg, _email_sender()(params, msg["idempotency_key"]), None
+    except Exception as e:  # noqa: BLE001 — l'échec est replanifié, pas propagé
+        return msg, None, type(e).__name__
+
+
+def process_email_outbox(limit=None, concurrency=None):
+    """Un passage du worker : réclame jusqu'à `limit` messages dus, les envoie avec au plus
+    `concurrency` envois simultanés et écrit les résultats en un bulk_write. Un échec est
+    replanifié (délai exponentiel) jusqu'à EMAIL_OUTBOX_MAX_ATTEMPTS, puis marqué `failed`."""
+    batch = _claim_outbox_batch(limit or EMAIL_OUTBOX_BATCH)
+    stats = {"claimed": len(batch), "sent": 0, "retried": 0, "failed": 0}
+    if not batch:
+        return stats
+    workers = max(1, min(concurrency or EMAIL_OUTBOX_CONCURRENCY, len(batch)))
+    if workers == 1:
+        results = [_deliver_outbox_message(m) for m in batch]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="email-outbox") as pool:
+            results = list(pool.map(_deliver_outbox_message, batch))
+    now = datetime.now(timezone.utc)
+    ops = []
+    for msg, provider_id, error in results:
+        claim = {"id": msg["id"], "status": "sending"}
+        if error is None:
+            ops.append(UpdateOne(claim, {"$set": {
+                "status": "sent", "sent_at": now, "provider_id": provider_id,
+                "lease_until": None, "last_error": None}}))
+            stats["sent"] += 1
+        elif msg["attempts"] >= EMAIL_OUTBOX_MAX_ATTEMPTS:
+            ops.append(UpdateOne(claim, {"$set": {
+                "status": "failed", "failed_at": now, "lease_until": None, "last_error": error}}))
+            stats["failed"] += 1
+            print(f"ERROR email_outbox id={msg['id']} kind={msg.get('kind')} type={error}")
+        else:
+            ops.append(UpdateOne(claim, {"$set": {
+                "status": "pending", "lease_until": None, "last_error": error,
+                "next_attempt_at": now + timedelta(seconds=_outbox_retry_delay(msg["attempts"]))}}))
+            stats["retried"] += 1
+    db.email_outbox.bulk_write(ops, ordered=False)
+    return stats
+
+
+def _email_outbox_worker():
+    """Thread démon : vide l'outbox, puis attend un enfilage (ou EMAIL_OUTBOX_POLL_SECONDS
+    pour les retries planifiés)."""
+    while True:
+        _email_outbox_wakeup.clear()
+        try:
+            while process_email_outbox()["claimed"]:
+                pass
+        except Exception as e:
+            print(f"WARN email_outbox_worker type={type(e).__name__}")
+        _email_outbox_wakeup.wait(EMAIL_OUTBOX_POLL_SECONDS)
+
+
+def _email_outbox_stats(organization_id=None):
+    """Profondeur (en attente + en envoi), retries en cours et échecs définitifs de l'outbox,
+    d'une org ou globale."""
+    match = {} if organization_id is None else {"organization_id": organization_id}
+    counts = {row["_id"]: row["n"] for row in db.email_outbox.aggregate([
+        {"$match": match}, {"$group": {"_id": "$status", "n": {"$sum": 1}}}])}
+    oldest = db.email_outbox.find_one({**match, "status": "pending"}, {"_id": 0, "created_at": 1},
+                                      sort=[("created_at", 1)])
+    return {
+        "depth": counts.get("pending", 0) + counts.get("sending", 0),
+        "pending": counts.get("pending", 0),
+        "sending": counts.get("sending", 0),
+        "retrying": db.email_outbox.count_documents(
+            {**match, "status": "pending", "attempts": {"$gt": 0}}),
+        "sent": counts.get("sent", 0),
+        "failed": counts.get("failed", 0),
+        "oldest_pending_at": oldest["created_at"].isoformat() if oldest else None,
+    }
+
+
+@app.get("/api/email-outbox/stats")
+def get_email_outbox_stats(current_user: CurrentUser = Depends(require_permission("settings:read"))):
+    """Métriques de l'outbox email de l'organisation (profondeur, retries, échecs)."""
+    return _email_outbox_stats(current_user.organization_id)
+
+
 # ─── Email Sending ───
 @app.post("/api/quotes/{quote_id}/send")
 def send_quote_email(quote_id: str, body: dict, current_user: CurrentUser = Depends(require_permission("quotes:write"))):
@@ -10688,28 +14057,21 @@ def send_quote_email(quote_id: str, body: dict, current_user: CurrentUser = Depe
     if not to_email:
         raise HTTPException(400, "Adresse email du destinataire requise")
 
-    pdf_buffer = generate_document_pdf("quote", quote, settings, client_info, products)
-    pdf_bytes = pdf_buffer.read()
-    pdf_b64 = base64.b64encode(pdf_bytes).decode()
+    pdf_bytes = _document_pdf_bytes("quote", quote, settings, client_info, products)
 
     comp_name = settings.get('company_name', 'FacturePro')
     quote_num = quote.get('quote_number', 'N/A')
     subject = body.get("subject", f"Soumission {quote_num} - {comp_name}")
     message = body.get("message", f"Bonjour,\n\nVeuillez trouver ci-joint la soumission {quote_num}.\n\nCordialement,\n{comp_name}")
 
-    params = {
-        "from": SENDER_EMAIL,
-        "to": [to_email],
-        "subject": subject,
-        "text": message,
-        "attachments": [{"filename": f"soumission_{quote_num}.pdf", "content": pdf_b64}]
-    }
-    try:
-        r = resend.Emails.send(params)
-        db.quotes.update_one({"id": quote_id, **_org_scope(current_user)}, {"$set": {"status": "sent", "sent_at": datetime.now(timezone.utc).isoformat(), "sent_to": to_email}})
-        return {"message": f"Soumission envoyee a {to_email}", "email_id": r.get("id") if isinstance(r, dict) else str(r)}
-    except Exception as e:
-        raise HTTPException(500, f"Erreur envoi email: {str(e)}")
+    params = {"from": SENDER_EMAIL, "to": [to_email], "subject": subject, "text": message}
+    outbox_id = _enqueue_email(params, "quote", _client_idempotency_key(
+                                   current_user.organization_id, "quote", quote_id,
+                                   body.get("idempotency_key")),
+                               current_user.organization_id,
+                               attachments=[(f"soumission_{quote_num}.pdf", pdf_bytes)])
+    db.quotes.update_one({"id": quote_id, **_org_scope(current_user)}, {"$set": {"status": "sent", "sent_at": datetime.now(timezone.utc).isoformat(), "sent_to": to_email}})
+    return {"message": f"Soumission envoyee a {to_email}", "email_id": outbox_id, "status": "queued"}
 
 @app.post("/api/invoices/{invoice_id}/send")
 def send_invoice_email(invoice_id: str, body: dict, current_user: CurrentUser = Depends(require_permission("invoices:write"))):
@@ -10727,28 +14089,22 @@ def send_invoice_email(invoice_id: str, body: dict, current_user: CurrentUser =
     if not to_email:
         raise HTTPException(400, "Adresse email du destinataire requise")
 
-    pdf_buffer = generate_document_pdf("invoice", invoice, settings, client_info, products)
-    pdf_bytes = pdf_buffer.read()
-    pdf_b64 = base64.b64encode(pdf_bytes).decode()
+    pdf_bytes = _document_pdf_bytes("invoice", invoice, settings, client_info, products)
 
     comp_name = settings.get('company_name', 'FacturePro')
     inv_num = invoice.get('invoice_number', 'N/A')
     subject = body.get("subject", f"Facture {inv_num} - {comp_name}")
     message = body.get("message", f"Bonjour,\n\nVeuillez trouver ci-joint la facture {inv_num}.\n\nCordialement,\n{comp_name}")
 
-    params = {
-        "from": SENDER_EMAIL,
-        "to": [to_email],
-        "subject": subject,
-        "text": message,
-        "attachments": [{"filename": f"facture_{inv_num}.pdf", "content": pdf_b64}]
-    }
-    try:
-        r = resend.Emails.send(params)
-        db.invoices.update_one({"id": invoice_id, **_org_scope(current_user)}, {"$set": {"status": "sent", "sent_at": datetime.now(timezone.utc).isoformat(), "sent_to": to_email}})
-        return {"message": f"Facture envoyee a {to_email}", "email_id": r.get("id") if isinstance(r, dict) else str(r)}
-    except Exception as e:
-        raise HTTPException(500, f"Erreur envoi email: {str(e)}")
+    params = {"from": SENDER_EMAIL, "to": [to_email], "subject": subject, "text": message}
+    outbox_id = _enqueue_email(params, "invoice", _client_idempotency_key(
+                                   current_user.organization_id, "invoice", invoice_id,
+                                   body.get("idempotency_key")),
+                               current_user.organization_id,
+                               attachments=[(f"facture_{inv_num}.pdf", pdf_bytes)])
+    db.invoices.update_one({"id": invoice_id, **_org_scope(current_user)}, {"$set": {"status": "sent", "sent_at": datetime.now(timezone.utc).isoformat(), "sent_to": to_email}})
+    _report_data_changed(invoice.get("organization_id"), invoice.get("issue_date"))
+    return {"message": f"Facture envoyee a {to_email}", "email_id": outbox_id, "status": "queued"}
 
 
 # ─── Stripe Subscription ───
@@ -10943,72 +14299,154 @@ async def stripe_webhook(request: Request):
         return {"status": "error", "message": str(e)}
 
 
+# ─── Crons de notification : requêtes ensemblistes ───
+# Une agrégation par cron ($match indexé, $lookup de l'owner, anti-jointure sur les
+# notifications déjà faites) au lieu de find_one par org ; emails enfilés et traces
+# écrites par lots de CRON_NOTIFY_BATCH (insert_many / bulk_write).
+CRON_NOTIFY_BATCH = 500
+
+
+CRON_SECRET = os.environ.get("CRON_SECRET", "")
+
+
+def _is_dry_run(request):
+    """`?dry_run=1` : réservé au cron, authentifié par l'en-tête X-Cron-Secret (403 sinon,
+    y compris si CRON_SECRET n'est pas configuré). Le dry-run ne rend que des ids."""
+    if request.query_params.get("dry_run", "").lower() not in ("1", "true", "yes"):
+        return False
+    provided = request.headers.get("x-cron-secret", "")
+    if not CRON_SECRET or not secrets.compare_digest(provided.encode(), CRON_SECRET.encode()):
+        raise HTTPException(403, "Dry-run réservé au cron")
+    return True
+
+
+def _bulk_upsert_ignoring_races(collection, ops):
+    """bulk_write non ordonné d'upserts ; un doublon levé par l'index unique (cron concurrent
+    qui a écrit la même trace entre-temps) est bénin."""
+    try:
+        collection.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+
+def _trial_expiry_targets(now):
+    """Owners à prévenir : essai qui expire dans 0 à 3 jours, pas encore notifiés. Le $match
+    sur la chaîne ISO `trial_ends_at` est élargi d'un jour de part et d'autre (décalages
+    horaires) ; la fenêtre exacte est appliquée ensuite, comme l'ancienne boucle."""
+    lo = (now - timedelta(days=1)).strftime("%Y-%m-%d")
+    hi = (now + timedelta(days=5)).strftime("%Y-%m-%d")
+    pipeline = [
+        {"$match": {"subscription_status": "trial", "trial_ends_at": {"$gte": lo, "$lt": hi}}},
+        {"$lookup": {"from": "users", "localField": "owner_id", "foreignField": "id", "as": "owner"}},
+        {"$unwind": "$owner"},
+        {"$match": {"owner.email": {"$nin": EXEMPT_USERS + [None, ""]}}},
+        {"$lookup": {"from": "trial_notifications", "localField": "owner.id",
+                     "foreignField": "user_id", "as": "notified"}},
+        {"$match": {"notified.type": {"$ne": "trial_expiry_3d"}}},
+        {"$project": {"_id": 0, "id": 1, "trial_ends_at": 1, "owner.id": 1, "owner.email": 1,
+                      "owner.company_name": 1, "owner.organization_id": 1}},
+    ]
+    targets, seen = [], set()
+    for row in db.organizations.aggregate(pipeline):
+        try:
+            days_left = (datetime.fromisoformat(row["trial_ends_at"]) - now).days
+        except (TypeError, ValueError):
+            continue
+        owner = row["owner"]
+        if not 0 <= days_left <= 3 or owner["id"] in seen:
+            continue
+        seen.add(owner["id"])
+        targets.append({"user_id": owner["id"], "email": owner["email"],
+                        "company_name": owner.get("company_name", ""),
+                        "organization_id": owner.get("organization_id") or row.get("id"),
+                        "trial_ends_at": row["trial_ends_at"], "days_left": days_left})
+    return targets
+
+
+def _trial_expiry_email(target):
+    days_left = target["days_left"]
+    return {
+        "from": SENDER_EMAIL,
+        "to": [target["email"]],
+        "subject": "FacturePro — Votre essai gratuit expire bientot",
+        "html": f"""<div style="font-family:Arial,sans-serif;max-width:600px;margin:0 auto">
+<h2 style="color:#1f2937">Bonjour {target['company_name']},</h2>
+<p>Votre essai gratuit de <strong>FacturePro</strong> expire dans <strong>{days_left} jour{'s' if days_left != 1 else ''}</strong>.</p>
+<p>Pour continuer a profiter de toutes les fonctionnalites (factures, soumissions, suivi des paiements, etc.), abonnez-vous des maintenant pour seulement <strong>15 $/mois CAD</strong>.</p>
+<p style="margin:24px 0"><a href="https://facturepro.ca/subscription" style="background:#00A08C;color:white;padding:12px 28px;border-radius:8px;text-decoration:none;font-weight:600">S'abonner maintenant</a></p>
+<p style="color:#6b7280;font-size:13px">Merci de faire confiance a FacturePro!</p>
+</div>"""
+    }
+
+
 @app.post("/api/subscription/check-trial-expiry")
 async def check_trial_expiry(request: Request):
     """Check for orgs whose trial expires in 3 days and email their owner.
     Feature #11 — l'organisation est la source de vérité de l'abonnement ;
-    on itère donc sur `db.organizations` (subscription_status='trial') et
-    on cible l'owner pour l'email."""
+    on cible les orgs `subscription_status='trial'` et l'owner pour l'email.
+    `?dry_run=1` (en-tête X-Cron-Secret) retourne les orgs ciblées, sans email ni nom,
+    sans rien écrire ni enfiler."""
+    now = datetime.now(timezone.utc)
+    if _is_dry_run(request):
+        targets = _trial_expiry_targets(now)
+        return {"dry_run": True, "total_eligible": len(targets),
+                "targets": [{"organization_id": t["organization_id"], "days_left": t["days_left"]}
+                            for t in targets]}
     if not RESEND_API_KEY:
         raise HTTPException(500, "Email non configure")
-    now = datetime.now(timezone.utc)
-    three_days = now + timedelta(days=3)
-    users_to_notify = []
-    all_trial_orgs = list(db.organizations.find(
-        {"subscription_status": "trial"}, {"_id": 0}
-    ))
-    for org in all_trial_orgs:
-        trial_end = org.get("trial_ends_at")
-        if not trial_end:
-            continue
-        owner = db.users.find_one({"id": org.get("owner_id")}, {"_id": 0})
-        if not owner:
-            continue
-        if owner.get("email") in EXEMPT_USERS:
-            continue
-        try:
-            end_dt = datetime.fromisoformat(trial_end)
-            days_left = (end_dt - now).days
-            if 0 <= days_left <= 3:
-                already_notified = db.trial_notifications.find_one(
-                    {"user_id": owner["id"], "type": "trial_expiry_3d"}
-                )
-                if not already_notified:
-                    # Attach trial_end for the mailing loop below (kept
-                    # under 'trial_end_date' for backward compat).
-                    owner = dict(owner)
-                    owner["trial_end_date"] = trial_end
-                    users_to_notify.append(owner)
-        except Exception:
-            continue
+    targets = _trial_expiry_targets(now)
     sent = 0
-    for u in users_to_notify:
+    for i in range(0, len(targets), CRON_NOTIFY_BATCH):
+        chunk = targets[i:i + CRON_NOTIFY_BATCH]
         try:
-            trial_end = datetime.fromisoformat(u["trial_end_date"])
-            days_left = max(0, (trial_end - now).days)
-            params = {
-                "from": SENDER_EMAIL,
-                "to": [u["email"]],
-                "subject": "FacturePro — Votre essai gratuit expire bientot",
-                "html": f"""<div style="font-family:Arial,sans-serif;max-width:600px;margin:0 auto">
-<h2 style="color:#1f2937">Bonjour {u.get('company_name', '')},</h2>
-<p>Votre essai gratuit de <strong>FacturePro</strong> expire dans <strong>{days_left} jour{'s' if days_left != 1 else ''}</strong>.</p>
-<p>Pour continuer a profiter de toutes les fonctionnalites (factures, soumissions, suivi des paiements, etc.), abonnez-vous des maintenant pour seulement <strong>15 $/mois CAD</strong>.</p>
-<p style="margin:24px 0"><a href="https://facturepro.ca/subscription" style="background:#00A08C;color:white;padding:12px 28px;border-radius:8px;text-decoration:none;font-weight:600">S'abonner maintenant</a></p>
-<p style="color:#6b7280;font-size:13px">Merci de faire confiance a FacturePro!</p>
-</div>"""
-            }
-            resend.Emails.send(params)
-            db.trial_notifications.insert_one({
-                "user_id": u["id"],
-                "email": u["email"],
-                "type": "trial_expiry_3d",
-                "sent_at": now.isoformat()
-            })
-            sent += 1
+            _enqueue_email_batch([(_trial_expiry_email(t), "trial_expiry",
+                                   f"trial_expiry_3d:{t['user_id']}", t["organization_id"])
+                                  for t in chunk])
+            # Trace écrite APRÈS l'enfilage : un lot en échec est repris au prochain ping
+            _bulk_upsert_ignoring_races(db.trial_notifications, [UpdateOne(
+                {"user_id": t["user_id"], "type": "trial_expiry_3d"},
+                {"$setOnInsert": {"email": t["email"], "sent_at": now.isoformat()}},
+                upsert=True) for t in chunk])
+            sent += len(chunk)
         except Exception as e:
-            print(f"Trial notification error for {u.get('email')}: {e}")
-    return {"notified": sent, "total_eligible": len(users_to_notify)}
+            print(f"Trial notification batch error ({len(chunk)} owners): {type(e).__name__}")
+    return {"notified": sent, "total_eligible": len(targets)}
+
+
+def _mileage_rate_reminder_targets(year):
+    """Orgs dont l'owner a un email et sans reminder DÉJÀ notifié pour `year` (un reminder
+    pré-flaggé à la saisie d'un trajet, `notified_at=None`, ne compte pas)."""
+    pipeline = [
+        {"$match": {"id": {"$nin": [None, ""]}}},
+        {"$lookup": {"from": "mileage_rate_reminders", "localField": "id",
+                     "foreignField": "organization_id", "as": "reminders"}},
+        {"$match": {"reminders": {"$not": {"$elemMatch": {
+            "year": year, "notified_at": {"$nin": [None, ""]}}}}}},
+        {"$lookup": {"from": "users", "localField": "owner_id", "foreignField": "id", "as": "owner"}},
+        {"$unwind": "$owner"},
+        {"$match": {"owner.email": {"$nin": [None, ""]}}},
+        {"$project": {"_id": 0, "id": 1, "owner.email": 1}},
+    ]
+    return [{"organization_id": row["id"], "email": row["owner"]["email"]}
+            for row in db.organizations.aggregate(pipeline)]
+
+
+def _mileage_rate_reminder_email(year, email):
+    return {
+        "from": SENDER_EMAIL,
+        "to": [email],
+        "subject": f"FacturePro — Taux d'allocation automobile ARC {year} a confirmer",
+        "html": (
+            f"""<div style="font-family:Arial,sans-serif;max-width:600px;margin:0 auto">
+<h2 style="color:#1f2937">Taux d'allocation automobile {year}</h2>
+<p>Le taux d'allocation automobile de l'ARC pour <strong>{year}</strong> n'est pas encore configure dans <strong>FacturePro</strong>.</p>
+<p>Verifiez le taux officiel sur <a href="https://www.canada.ca">canada.ca</a> (allocations pour frais d'automobile), puis mettez a jour l'application.</p>
+<p>En attendant, le calcul d'allocation du carnet de route pour {year} est <strong>bloque</strong> avec un message explicite — aucun montant n'est devine.</p>
+<p style="color:#6b7280;font-size:13px">Ce rappel est automatique et ne sera envoye qu'une fois par annee.</p>
+</div>"""
+        ),
+    }
 
 
 @app.post("/api/mileage/check-rate-update")
@@ -11028,71 +14466,48 @@ async def check_mileage_rate_update(request: Request):
     reminder pré-flaggé à la saisie d'un trajet (`_mileage_flag_rate_missing`,
     `notified_at=None`) N'EST PAS considéré comme notifié : le cron l'upgrade en
     posant `notified_at` après envoi réussi. Aucune auth (endpoint cron externe,
-    idempotent et sans effet destructif)."""
+    idempotent et sans effet destructif).
+
+    Ensembliste : UN pipeline (anti-jointure sur les reminders déjà notifiés de l'année,
+    $lookup de l'owner), emails enfilés et reminders écrits par lots. `?dry_run=1` (en-tête
+    X-Cron-Secret) retourne les ids des orgs ciblées sans rien écrire ni enfiler."""
     year = datetime.now(timezone.utc).year
     if _mileage_rate_for_year(year) is not None:
         return {"status": "ok", "year": year, "action": "rate_present"}
 
+    if _is_dry_run(request):
+        targets = _mileage_rate_reminder_targets(year)
+        return {"status": "ok", "year": year, "action": "dry_run", "count": len(targets),
+                "organization_ids": [t["organization_id"] for t in targets]}
+
     if not RESEND_API_KEY:
         # Email non configuré : on ne trace RIEN (pas d'envoi = pas de reminder),
         # pour que le prochain ping avec email configuré puisse notifier.
         return {"status": "skipped", "year": year, "reason": "email_not_configured"}
 
+    targets = _mileage_rate_reminder_targets(year)
     notified = 0
-    for org in db.organizations.find({}, {"_id": 0}):
-        org_id = org.get("id")
-        if not org_id:
-            continue
-        reminder_id = f"{org_id}:{year}"
-        # Idempotence : ne renotifie pas si un envoi a DÉJÀ eu lieu pour (org,
-        # année). On teste `notified_at` renseigné, pas la simple existence de la
-        # ligne : un reminder flaggé à la saisie d'un trajet a `notified_at=None`
-        # et DOIT encore être notifié (sinon l'org ne serait jamais alertée).
-        existing = db.mileage_rate_reminders.find_one({"id": reminder_id})
-        if existing and existing.get("notified_at"):
-            continue
-        owner = db.users.find_one({"id": org.get("owner_id")}, {"_id": 0})
-        if not owner or not owner.get("email"):
-            continue
+    for i in range(0, len(targets), CRON_NOTIFY_BATCH):
+        chunk = targets[i:i + CRON_NOTIFY_BATCH]
         try:
-            params = {
-                "from": SENDER_EMAIL,
-                "to": [owner["email"]],
-                "subject": f"FacturePro — Taux d'allocation automobile ARC {year} a confirmer",
-                "html": (
-                    f"""<div style="font-family:Arial,sans-serif;max-width:600px;margin:0 auto">
-<h2 style="color:#1f2937">Taux d'allocation automobile {year}</h2>
-<p>Le taux d'allocation automobile de l'ARC pour <strong>{year}</strong> n'est pas encore configure dans <strong>FacturePro</strong>.</p>
-<p>Verifiez le taux officiel sur <a href="https://www.canada.ca">canada.ca</a> (allocations pour frais d'automobile), puis mettez a jour l'application.</p>
-<p>En attendant, le calcul d'allocation du carnet de route pour {year} est <strong>bloque</strong> avec un message explicite — aucun montant n'est devine.</p>
-<p style="color:#6b7280;font-size:13px">Ce rappel est automatique et ne sera envoye qu'une fois par annee.</p>
-</div>"""
-                ),
-            }
-            resend.Emails.send(params)
+            _enqueue_email_batch([(_mileage_rate_reminder_email(year, t["email"]),
+                                   "mileage_rate_reminder",
+                                   f"mileage_rate:{t['organization_id']}:{year}", t["organization_id"])
+                                  for t in chunk])
             now_iso = datetime.now(timezone.utc).isoformat()
-            # Upsert : crée la ligne si absente, ou pose `notified_at` sur une
-            # ligne pré-flaggée à la saisie d'un trajet. L'état n'est écrit
-            # qu'APRÈS envoi réussi -> retente au prochain ping si l'envoi échoue.
-            db.mileage_rate_reminders.update_one(
-                {"id": reminder_id},
-                {
-                    "$set": {
-                        "organization_id": org_id,
-                        "year": year,
-                        "notified_at": now_iso,
-                        "source": "cron_annual",
-                    },
-                    "$setOnInsert": {"id": reminder_id, "flagged_at": now_iso},
-                },
-                upsert=True,
-            )
-            notified += 1
+            # Upsert : crée la ligne si absente, ou pose `notified_at` sur une ligne
+            # pré-flaggée à la saisie d'un trajet. L'état n'est écrit qu'APRÈS l'enfilage
+            # -> un lot en échec est retenté au prochain ping.
+            _bulk_upsert_ignoring_races(db.mileage_rate_reminders, [UpdateOne(
+                {"id": f"{t['organization_id']}:{year}"},
+                {"$set": {"organization_id": t["organization_id"], "year": year,
+                          "notified_at": now_iso, "source": "cron_annual"},
+                 "$setOnInsert": {"id": f"{t['organization_id']}:{year}", "flagged_at": now_iso}},
+                upsert=True) for t in chunk])
+            notified += len(chunk)
         except Exception as e:
-            # Capturé par org, n'interrompt pas la boucle ; l'état n'est écrit
-            # qu'après envoi réussi -> retente au prochain ping cron.
-            print(f"[mileage rate reminder] echec envoi org {org_id}: {type(e).__name__}")
-            continue
+            # Capturé par lot, n'interrompt pas les suivants
+            print(f"[mileage rate reminder] echec lot ({len(chunk)} orgs): {type(e).__name__}")
     return {"status": "ok", "year": year, "action": "notified", "count": notified}
 
 
@@ -11106,51 +14521,16 @@ def _aggregate_sales_tax(scope, start, end):
     # l'émission de la facture, pas au paiement. L'exclure sous-comptait la TPS/TVQ
     # collectée dès qu'une facture était partiellement payée. Aligné sur
     # _aggregate_pnl et l'auto-posting (statuts non-draft).
-    invoices = list(db.invoices.find({
-        **scope,
-        "status": {"$in": ["sent", "partial", "paid", "overdue"]},
-        "issue_date": {"$gte": start, "$lte": end},
-    }, {"_id": 0}))
-    expenses = list(db.expenses.find({
-        **scope,
-        "expense_date": {"$gte": start, "$lte": end},
-    }, {"_id": 0}))
-
-    def to_cad(amount, rate, currency):
-        if amount is None:
-            return 0
-        if currency == "CAD" or not rate:
-            return float(amount)
-        rate_f = float(rate)
-        return float(amount) / rate_f if rate_f > 0 else float(amount)
-
-    gst_collected = 0.0
-    qst_collected = 0.0
-    hst_collected = 0.0
-    sales_total = 0.0
-    sales_qc_total = 0.0
-    for inv in invoices:
-        rate = inv.get("exchange_rate_to_cad", 1.0) or 1.0
-        cur = inv.get("currency", "CAD")
-        subtotal_cad = to_cad(inv.get("subtotal", 0), rate, cur)
-        gst_cad = to_cad(inv.get("gst_amount", 0), rate, cur)
-        qst_cad = to_cad(inv.get("pst_amount", 0), rate, cur)  # pst_amount = TVQ legacy
-        hst_cad = to_cad(inv.get("hst_amount", 0), rate, cur)
-        sales_total += subtotal_cad
-        if inv.get("province") == "QC":
-            sales_qc_total += subtotal_cad
-        gst_collected += gst_cad
-        qst_collected += qst_cad
-        hst_collected += hst_cad
-
-    # [COMPTA] Feature #7.7 — le CTI/RTI récupérable délégué à `_expense_recoverable_tax_cad` :
-    # celui-ci applique la fraction (50 % repas + seuils télécom) ET le PLAFONNEMENT partagé avec
-    # le grand livre (cap = amount − personal, revue adversariale). Somme naïve = biais rapport↔GL
-    # quand le plafond absorbe des taxes qu'un calcul naïf compterait quand même.
-    _rec = [_expense_recoverable_tax_cad(e) for e in expenses]
-    gst_paid = sum(r[0] for r in _rec)
-    qst_paid = sum(r[1] for r in _rec)
-    hst_paid = sum(r[2] for r in _rec)
+    # Période sur les jours canoniques (cf. _aggregate_pnl) : une facture datée
+    # '2026-03-31T22:00:00' entre dans la période qui finit le 31 mars.
+    # Les taxes payées viennent de `_expense_recoverable_tax_cad` (feature #7.7 : fraction
+    # 50 % repas + seuils télécom ET plafonnement partagé avec le grand livre) — jamais d'une
+    # somme naïve, sinon biais rapport↔GL. Mois entiers lus dans les rollups (_report_totals).
+    totals = _report_totals(scope, start, end, "accrual")
+    gst_collected, qst_collected, hst_collected = (
+        totals["gst_collected"], totals["qst_collected"], totals["hst_collected"])
+    gst_paid, qst_paid, hst_paid = totals["gst_paid"], totals["qst_paid"], totals["hst_paid"]
+    sales_total, sales_qc_total = totals["revenue"], totals["sales_qc"]
 
     def r(v):
         return round(v, 2)
@@ -11180,8 +14560,8 @@ def _aggregate_sales_tax(scope, start, end):
         "summary": summary,
         "cra_detail": cra_detail,
         "rq_detail": rq_detail,
-        "invoice_count": len(invoices),
-        "expense_count": len(expenses),
+        "invoice_count": totals["invoice_count"],
+        "expense_count": totals["expense_count"],
     }
 
 
@@ -11189,12 +14569,15 @@ def _aggregate_sales_tax(scope, start, end):
 def get_sales_tax_report(start: str = Query(...), end: str = Query(...),
                          current_user: CurrentUser = Depends(require_permission("reports:read"))):
     """Rapport TPS/TVQ pour une période donnée."""
-    return _aggregate_sales_tax(_org_scope(current_user), start, end)
+    scope = _org_scope(current_user)
+    return _cached_report(scope, "sales-tax", {"start": start, "end": end},
+                          lambda: _aggregate_sales_tax(scope, start, end))
 
 
 def generate_sales_tax_report_pdf(scope, start, end):
     """Génère un PDF A4 du rapport TPS/TVQ."""
-    data = _aggregate_sales_tax(scope, start, end)
+    data = _cached_report(scope, "sales-tax", {"start": start, "end": end},
+                          lambda: _aggregate_sales_tax(scope, start, end))
     company_settings = db.company_settings.find_one(scope, {"_id": 0}) or {}
 
     buffer = io.BytesIO()
@@ -11313,9 +14696,14 @@ def generate_sales_tax_report_pdf(scope, start, end):
 @app.get("/api/reports/sales-tax/pdf")
 def get_sales_tax_report_pdf(start: str = Query(...), end: str = Query(...),
                               current_user: CurrentUser = Depends(require_permission("reports:read"))):
-    pdf_buffer = generate_sales_tax_report_pdf(_org_scope(current_user), start, end)
+    scope = _org_scope(current_user)
+    # Le PDF porte sa date de génération : clé au jour près.
+    pdf_bytes = _cached_report(
+        scope, "sales-tax.pdf",
+        {"start": start, "end": end, "day": datetime.now(timezone.utc).strftime("%Y-%m-%d")},
+        lambda: generate_sales_tax_report_pdf(scope, start, end).getvalue())
     filename = f"rapport-tps-tvq-{start}-au-{end}.pdf"
-    return StreamingResponse(pdf_buffer, media_type="application/pdf",
+    return StreamingResponse(io.BytesIO(pdf_bytes), media_type="application/pdf",
                               headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 
@@ -11332,8 +14720,13 @@ def get_pnl_report(
         basis = "accrual"
     if compare not in ("none", "previous", "prior_year"):
         compare = "none"
-
     scope = _org_scope(current_user)
+    return _cached_report(scope, "pnl",
+                          {"start": start, "end": end, "basis": basis, "compare": compare},
+                          lambda: _build_pnl_report(scope, start, end, basis, compare))
+
+
+def _build_pnl_report(scope, start, end, basis, compare):
     current = _aggregate_pnl(scope, start, end, basis)
     out = {
         "period": {"start": start, "end": end},
@@ -11390,15 +14783,21 @@ def get_pnl_category_expenses(
     la même sélection que _aggregate_pnl côté dépenses (filtre par category_code + _in_period sur
     expense_date, aucun filtre de statut) → la somme des lignes = le total de la catégorie affiché."""
     scope = _org_scope(current_user)
+    return _cached_report(scope, "pnl/expenses",
+                          {"start": start, "end": end, "category_code": category_code},
+                          lambda: _build_pnl_category_expenses(scope, start, end, category_code))
+
+
+def _build_pnl_category_expenses(scope, start, end, category_code):
     lo, hi = _parse_iso_date(start), _parse_iso_date(end)
     wanted = (category_code or "").strip() or None
+    # "other" couvre aussi les dépenses sans category_code : filtré en Python ci-dessous.
+    extra = {"category_code": wanted} if wanted and wanted != "other" else None
     rows = []
-    for e in db.expenses.find(scope, {"_id": 0}):
+    for e in _find_in_period(db.expenses, scope, "expense_day", "expense_date", lo, hi, extra):
         code = e.get("category_code") or "other"
         if wanted and code != wanted:
             continue
-        if not _in_period(e.get("expense_date"), lo, hi):
-            continue
         amount_cad = float(e.get("amount_cad", 0) or 0)
         personal = e.get("personal_use_amount_cad")
         # « Brut » P&L = montant moins la portion perso télécom (cf. _aggregate_pnl).
@@ -11552,9 +14951,15 @@ def get_pnl_report_pdf(
     current_user: CurrentUser = Depends(require_permission("reports:read")),
 ):
     data = get_pnl_report(start, end, basis, compare, current_user)
-    pdf_buffer = generate_pnl_report_pdf(_org_scope(current_user), data)
+    scope = _org_scope(current_user)
+    # Le PDF porte sa date de génération : clé au jour près.
+    pdf_bytes = _cached_report(
+        scope, "pnl.pdf",
+        {"start": start, "end": end, "basis": data["basis"], "compare": data["compare"],
+         "day": datetime.now(timezone.utc).strftime("%Y-%m-%d")},
+        lambda: generate_pnl_report_pdf(scope, data).getvalue())
     filename = f"etat-des-resultats-{start}-au-{end}.pdf"
-    return StreamingResponse(pdf_buffer, media_type="application/pdf",
+    return StreamingResponse(io.BytesIO(pdf_bytes), media_type="application/pdf",
                               headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 
@@ -11568,7 +14973,12 @@ def get_gifi_report(
     current_user: CurrentUser = Depends(require_permission("reports:read")),
 ):
     """Retourne le rapport Sommaire GIFI au format JSON pour preview UI (entité corporation)."""
-    return _build_gifi_report(_org_scope(current_user), year, basis)
+    return _cached_gifi_report(_org_scope(current_user), year, basis)
+
+
+def _cached_gifi_report(scope, year, basis):
+    return _cached_report(scope, "gifi", {"year": year, "basis": basis},
+                          lambda: _build_gifi_report(scope, year, basis))
 
 
 @app.get("/api/reports/gifi/csv")
@@ -11581,7 +14991,7 @@ def get_gifi_report_csv(
     scope = _org_scope(current_user)
     if basis not in T2125_VALID_BASES:
         raise HTTPException(422, "basis must be 'accrual' or 'cash'")
-    report = _build_gifi_report(scope, year, basis)
+    report = _cached_gifi_report(scope, year, basis)
     buf = io.StringIO()
     w = csv.writer(buf)
     w.writerow(["Code GIFI", "Libellé (EN)", "Montant CAD"])
@@ -11637,8 +15047,9 @@ def get_gifi_report_pdf(
     scope = _org_scope(current_user)
     if basis not in T2125_VALID_BASES:
         raise HTTPException(422, "basis must be 'accrual' or 'cash'")
-    report = _build_gifi_report(scope, year, basis)
-    pdf_bytes = _render_gifi_pdf(report)
+    report = _cached_gifi_report(scope, year, basis)
+    pdf_bytes = _cached_report(scope, "gifi.pdf", {"year": year, "basis": basis},
+                               lambda: _render_gifi_pdf(report))
     return Response(content=pdf_bytes, media_type="application/pdf",
                      headers={"Content-Disposition": f'attachment; filename="gifi-{year}.pdf"'})
 
@@ -11653,7 +15064,12 @@ def get_t2125_report(
     current_user: CurrentUser = Depends(require_permission("reports:read")),
 ):
     """Retourne le rapport T2125 au format JSON pour preview UI."""
-    return _build_t2125_report(_org_scope(current_user), year, basis)
+    return _cached_t2125_report(_org_scope(current_user), year, basis)
+
+
+def _cached_t2125_report(scope, year, basis):
+    return _cached_report(scope, "t2125", {"year": year, "basis": basis},
+                          lambda: _build_t2125_report(scope, year, basis))
 
 
 def _render_t2125_csv(report):
@@ -11700,8 +15116,10 @@ def get_t2125_csv(
     current_user: CurrentUser = Depends(require_permission("reports:read")),
 ):
     """Export T2125 au format CSV (UTF-8 BOM)."""
-    report = _build_t2125_report(_org_scope(current_user), year, basis)
-    csv_bytes = _render_t2125_csv(report)
+    scope = _org_scope(current_user)
+    report = _cached_t2125_report(scope, year, basis)
+    csv_bytes = _cached_report(scope, "t2125.csv", {"year": year, "basis": basis},
+                               lambda: _render_t2125_csv(report))
     return Response(
         content=csv_bytes,
         media_type="text/csv; charset=utf-8",
@@ -11902,7 +15320,8 @@ def get_t2125_pdf(
     current_user: CurrentUser = Depends(require_permission("reports:read")),
 ):
     """Export T2125 au format PDF."""
-    report = _build_t2125_report(_org_scope(current_user), year, basis)
+    # Seul le rapport est mis en cache : le PDF est horodaté à la minute près.
+    report = _cached_t2125_report(_org_scope(current_user), year, basis)
     pdf_bytes = _render_t2125_pdf(report)
     return Response(
         content=pdf_bytes,
@@ -11915,6 +15334,12 @@ def get_t2125_pdf(
     )
 
 
+@app.get("/api/reports/cache-stats")
+def get_report_cache_stats(current_user: CurrentUser = Depends(require_permission("reports:read"))):
+    """Compteurs du cache de rapports (succès mémoire/partagés, échecs, taille) du processus."""
+    return _report_cache_stats()
+
+
 # ─── Startup Seed ───
 @app.on_event("startup")
 def seed_data():
@@ -11966,13 +15391,72 @@ def seed_data():
         _safe_index(db.payment_transactions, "session_id", "payment_transactions.session_id", unique=True)
         _safe_index(db.payment_transactions, [("user_id", 1)], "payment_transactions.user_id")
         _safe_index(db.trial_notifications, [("user_id", 1), ("type", 1)], "trial_notifications.user_type", unique=True)
+        # Crons de notification : essais qui expirent, reminders de taux kilométrique par org
+        _safe_index(db.organizations, [("subscription_status", 1), ("trial_ends_at", 1)],
+                    "organizations.status_trial_end")
+        _safe_index(db.mileage_rate_reminders, [("organization_id", 1), ("year", 1)],
+                    "mileage_rate_reminders.org_year")
         # Cache d'extraction PDF bancaire (feature #7.1) : clé UNIQUE org+hash + TTL auto-purge.
         _safe_index(db.bank_pdf_extractions, [("organization_id", 1), ("file_hash", 1)],
                     "bank_pdf_extractions.org_hash", unique=True)
         _safe_index(db.bank_pdf_extractions, "created_at", "bank_pdf_extractions.ttl",
                     expireAfterSeconds=_BANK_PDF_CACHE_TTL_SECONDS)
+        # Périodes des rapports (P&L, taxes, backfill) : plage sur le jour canonique
+        _safe_index(db.invoices, [("organization_id", 1), ("issue_day", 1)], "invoices.org_issue_day")
+        _safe_index(db.expenses, [("organization_id", 1), ("expense_day", 1)], "expenses.org_expense_day")
+        # Rollups mensuels des rapports : un document par (org, mois, base)
+        _safe_index(db.report_rollups, [("organization_id", 1), ("basis", 1), ("month", 1)],
+                    "report_rollups.org_basis_month", unique=True)
+        # Cache des rapports : version de données par org + stockage partagé optionnel (TTL)
+        _safe_index(db.org_data_versions, "organization_id", "org_data_versions.org", unique=True)
+        if REPORT_CACHE_SHARED:
+            _safe_index(db.report_cache, "key", "report_cache.key", unique=True)
+            _safe_index(db.report_cache, "created_at", "report_cache.ttl",
+                        expireAfterSeconds=REPORT_CACHE_SHARED_TTL_SECONDS)
+        # Planificateur des factures récurrentes : échéances dues de toutes les orgs
+        _safe_index(db.invoices, [("recurrence_active", 1), ("next_send_date", 1)],
+                    "invoices.recurrence_due")
+        # Outbox email : dédoublonnage par clé d'idempotence, réclamation des messages dus
+        _safe_index(db.email_outbox, "idempotency_key", "email_outbox.idempotency_key", unique=True)
+        _safe_index(db.email_outbox, [("status", 1), ("next_attempt_at", 1)], "email_outbox.status_due")
+        _safe_index(db.email_outbox, [("organization_id", 1), ("status", 1)], "email_outbox.org_status")
+        # PDF rendus persistés : un emplacement par document
+        _safe_index(db.pdf_renders, [("organization_id", 1), ("doc_type", 1), ("doc_id", 1)],
+                    "pdf_renders.org_doc", unique=True)
+        # Collecte des blobs : références cherchées par sha256 (collect_orphan_blobs)
+        _safe_index(db.blob_gc_queue, "queued_at", "blob_gc_queue.queued_at")
+        _safe_index(db.pdf_renders, "sha256", "pdf_renders.sha256")
+        _safe_index(db.files, "sha256", "files.sha256", sparse=True)
+        _safe_index(db.files, "thumbnail_sha256", "files.thumbnail_sha256", sparse=True)
+        _safe_index(db.email_outbox, "attachments.sha256", "email_outbox.attachments_sha256")
+        # Taux de change persistés (un document par jour calendaire + "latest")
+        _safe_index(db.exchange_rates, "date", "exchange_rates.date", unique=True)
+        # Cache d'extraction des reçus : clé UNIQUE org+sha256 + TTL auto-purge.
+        _safe_index(db.receipt_extractions, [("organization_id", 1), ("sha256", 1)],
+                    "receipt_extractions.org_sha", unique=True)
+        _safe_index(db.receipt_extractions, "created_at", "receipt_extractions.ttl",
+                    expireAfterSeconds=RECEIPT_EXTRACTION_CACHE_TTL_SECONDS)
+        # Jobs d'extraction PDF en arrière-plan (même durée de vie que le cache d'extraction)
+        _safe_index(db.bank_pdf_jobs, "id", "bank_pdf_jobs.id", unique=True)
+        _safe_index(db.bank_pdf_jobs, [("organization_id", 1), ("file_hash", 1), ("status", 1)],
+                    "bank_pdf_jobs.org_hash_status")
+        _safe_index(db.bank_pdf_jobs, "created_at", "bank_pdf_jobs.ttl",
+                    expireAfterSeconds=_BANK_PDF_CACHE_TTL_SECONDS)
         # Mémoire de rapprochements manuels (feature #7.3)
         _safe_index(db.bank_match_aliases, [("organization_id", 1)], "bank_match_aliases.org")
+        # Counts par statut des imports (liste des imports : un seul $group par page)
+        _safe_index(db.bank_transactions, [("import_id", 1), ("status", 1)],
+                    "bank_transactions.import_status")
+        # Dédup par ligne (relevés qui se chevauchent) : empreinte unique par org ET compte.
+        # L'ancien index (org, empreinte) rejetait les lignes identiques de deux comptes.
+        try:
+            db.bank_transactions.drop_index("organization_id_1_row_fingerprint_1")
+        except OperationFailure:
+            pass  # déjà supprimé
+        _safe_index(db.bank_transactions,
+                    [("organization_id", 1), ("bank_account", 1), ("row_fingerprint", 1)],
+                    "bank_transactions.org_account_fingerprint", unique=True,
+                    partialFilterExpression={"row_fingerprint": {"$type": "string"}})
         print("Database indexes created")
 
         # [ROBUSTESSE] Chaque migration est ISOLÉE dans son propre try/except : le bloc de
@@ -12007,6 +15491,12 @@ def seed_data():
         _run_migration(migrate_expense_tax_codes_v1, "expense_tax_codes_v1")
         # Feature #7.7 — recale les dépenses vers le net de taxes (déductible + re-post repas).
         _run_migration(migrate_expense_net_tax_v1, "expense_net_tax_v1")
+        # Dédup par ligne des relevés bancaires — empreinte sur l'historique (idempotente)
+        _run_migration(migrate_bank_row_fingerprints_v1, "bank_row_fingerprints_v1")
+        # Dédup par compte : `bank_account` sur les transactions existantes (idempotente)
+        _run_migration(migrate_bank_row_accounts_v1, "bank_row_accounts_v1")
+        # Jours canoniques issue_day/expense_day (requêtes de période indexées)
+        _run_migration(migrate_day_fields_v1, "day_fields_v1")
 
         # Feature #8 — set purpose="logo" sur les anciens db.files (idempotent)
         res = db.files.update_many(
@@ -12057,7 +15547,128 @@ def seed_data():
         print(f"Startup error: {e}")
 
 
+EXCHANGE_RATE_REFRESHER = os.environ.get("EXCHANGE_RATE_REFRESHER", "1") == "1"
+
+
+@app.on_event("startup")
+def start_exchange_rate_refresher():
+    if EXCHANGE_RATE_REFRESHER:
+        threading.Thread(target=_exchange_rate_refresher, name="exchange-rate-refresher",
+                         daemon=True).start()
+
+
+@app.on_event("startup")
+def start_email_outbox_worker():
+    if EMAIL_OUTBOX_WORKER:
+        threading.Thread(target=_email_outbox_worker, name="email-outbox", daemon=True).start()
+
+
+def _blob_migration_in_background():
+    try:
+        migrate_files_to_blob_store_v1()
+    except Exception as e:  # noqa: BLE001 — idempotente : reprise au prochain démarrage / CLI
+        print(f"Migration files_to_blob_store_v1 failed (non-fatal): {type(e).__name__}: {e}")
+
+
+@app.on_event("startup")
+def start_blob_migration():
+    # Octets de db.files -> blob store adressé par contenu (idempotente, par paquets)
+    if BLOB_MIGRATION_ON_STARTUP:
+        threading.Thread(target=_blob_migration_in_background, name="blob-migration",
+                         daemon=True).start()
+
+
+@app.on_event("startup")
+def start_recurring_scheduler():
+    if RECURRING_SCHEDULER_SECONDS > 0:
+        threading.Thread(target=_recurring_scheduler, name="recurring-scheduler", daemon=True).start()
+
+
+def _run_cli(argv):
+    """Commandes d'exploitation : `python server.py <commande> [options]`."""
+    import argparse
+    parser = argparse.ArgumentParser(prog="server.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("bank-rematch", help="Re-match des imports bancaires ouverts")
+    p.add_argument("--org", help="organization_id (défaut : toutes les organisations)")
+    p.add_argument("--workers", type=int, default=None)
+    p = sub.add_parser("files-to-blob-store", help="Sort les octets de db.files vers le blob store")
+    p.add_argument("--batch", type=int, default=BLOB_MIGRATION_BATCH)
+    p = sub.add_parser("blob-gc", help="Supprime les blobs de rendus PDF remplacés et non référencés")
+    p.add_argument("--grace", type=int, default=None, help="délai de grâce en secondes")
+    p = sub.add_parser("report-rollups", help="Reconstruit ou vérifie les rollups mensuels des rapports")
+    p.add_argument("action", choices=["rebuild", "verify"])
+    p.add_argument("--org", help="organization_id (défaut : toutes les organisations)")
+    p = sub.add_parser("pdf-setup-bench", help="Micro-benchmark styles + logo par rendu PDF")
+    p.add_argument("--iterations", type=int, default=200)
+    p = sub.add_parser("recurring-invoices", help="Envoie les factures récurrentes dues (toutes les orgs)")
+    p.add_argument("--org", help="organization_id (défaut : toutes les organisations)")
+    p.add_argument("--workers", type=int, default=None)
+    p = sub.add_parser("mileage-ytd", help="Vérifie ou répare les cumuls km persistés des trajets")
+    p.add_argument("action", choices=["verify", "repair"])
+    p.add_argument("--org", help="organization_id (défaut : toutes les organisations)")
+    p = sub.add_parser("email-outbox", help="Vide l'outbox email ou affiche ses métriques")
+    p.add_argument("action", choices=["drain", "stats"])
+    p.add_argument("--org", help="organization_id (stats ; défaut : toutes les organisations)")
+    args = parser.parse_args(argv)
+    if args.command == "recurring-invoices":
+        stats = run_recurring_invoices({"organization_id": args.org} if args.org else None,
+                                       workers=args.workers)
+        print(_json.dumps(stats, indent=2))
+        return 1 if stats["errors"] else 0
+    if args.command == "mileage-ytd":
+        report = verify_mileage_ytd(args.org, repair=args.action == "repair")
+        for m in report["mismatches"]:
+            print(f"MISMATCH org={m['organization_id']} trip={m['id']} "
+                  f"stored={m['stored']} expected={m['expected']}")
+        print(f"{report['checked']} trip(s) checked, {len(report['mismatches'])} mismatch(es), "
+              f"{report['repaired']} repaired")
+        return 1 if report["mismatches"] and not report["repaired"] else 0
+    if args.command == "email-outbox":
+        if args.action == "stats":
+            print(_json.dumps(_email_outbox_stats(args.org), indent=2))
+            return 0
+        totals = {"claimed": 0, "sent": 0, "retried": 0, "failed": 0}
+        while True:
+            run = process_email_outbox()
+            for k in totals:
+                totals[k] += run[k]
+            if not run["claimed"]:
+                break
+        print(_json.dumps(totals, indent=2))
+        return 1 if totals["failed"] else 0
+    if args.command == "pdf-setup-bench":
+        print(_json.dumps(_bench_pdf_render_setup(args.iterations), indent=2))
+        return 0
+    if args.command == "report-rollups":
+        if args.action == "rebuild":
+            print(f"{rebuild_report_rollups(args.org)} rollup(s) rebuilt")
+            return 0
+        mismatches = verify_report_rollups(args.org)
+        for m in mismatches:
+            print(f"MISMATCH org={m['organization_id']} month={m['month']} basis={m['basis']}")
+        print(f"{len(mismatches)} mismatch(es)")
+        return 1 if mismatches else 0
+    if args.command == "blob-gc":
+        print(_json.dumps(collect_orphan_blobs(args.grace), indent=2))
+        return 0
+    if args.command == "files-to-blob-store":
+        print(f"{migrate_files_to_blob_store_v1(args.batch)} file(s) moved")
+        return 0
+    if args.command == "bank-rematch":
+        report = _bulk_rematch_bank_imports(args.org, workers=args.workers, processes=True)
+        print(_json.dumps({k: v for k, v in report.items() if k != "results"}, indent=2))
+        for r in report["results"]:
+            print(f"{r['import_id']} org={r['organization_id']} pending={r['pending']} "
+                  f"matched={r['auto_matched']} {r['seconds']}s" + (f" ERROR {r['error']}" if r["error"] else ""))
+        return 1 if report["failed_imports"] else 0
+    return 2
+
+
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1:
+        sys.exit(_run_cli(sys.argv[1:]))
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
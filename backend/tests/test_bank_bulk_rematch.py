@@ -0,0 +1,113 @@
+"""Tests — re-match en masse des imports bancaires (pool de process).
+
+POST /api/bank/rematch relance l'auto-match sur tous les imports ouverts de l'org ; les
+rapprochements restent 1:1 même quand deux workers visent la même dépense (réclamation
+conditionnelle sur `bank_transaction_id` + garde `status: unmatched` côté base).
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from backend.server import (  # noqa: E402
+    HTTPException, app, db, _apply_match, _import_match_scope, _scope_organization_id,
+)
+
+client = TestClient(app)
+
+MAP = {
+    "delimiter": ",", "has_header": True, "date_column": 0, "date_format": "YYYY-MM-DD",
+    "description_column": 1, "amount_mode": "single", "amount_column": 2,
+    "sign_convention": "positive_is_credit",
+}
+
+
+# ─────────────────────────── UNITAIRE ───────────────────────────
+
+def test_import_match_scope_mirrors_org_scope():
+    scope = _import_match_scope({"organization_id": "org-1", "created_by_user_id": "u1"})
+    assert scope == {"$or": [{"organization_id": "org-1"},
+                             {"user_id": "u1", "organization_id": {"$exists": False}}]}
+    assert _scope_organization_id(scope) == "org-1"
+    # imports antérieurs au multi-tenant : seul `user_id` est posé
+    legacy = _import_match_scope({"organization_id": "org-1", "user_id": "u0"})
+    assert legacy["$or"][1]["user_id"] == "u0"
+
+
+# ─────────────────────────── INTÉGRATION ───────────────────────────
+
+@pytest.fixture
+def auth_headers():
+    r = client.post("/api/auth/login", json={"email": "gussdub@gmail.com", "password": "testpass123"})
+    assert r.status_code == 200, r.text
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def _make_expense(auth_headers, amount, name, date):
+    r = client.post("/api/expenses", headers=auth_headers, json={
+        "amount": amount, "currency": "CAD", "category_code": "office_supplies",
+        "description": name, "expense_date": date})
+    assert r.status_code in (200, 201), r.text
+    return r.json()["id"]
+
+
+def _import(auth_headers, csv):
+    r = client.post("/api/bank/imports", headers=auth_headers,
+                    files={"file": ("r.csv", csv, "text/csv")},
+                    data={"mapping": json.dumps(MAP), "bank_label": "Rematch"})
+    assert r.status_code == 201, r.text
+    return r.json()
+
+
+def test_bulk_rematch_matches_expenses_entered_after_import(auth_headers):
+    d1 = _import(auth_headers, "Date,Description,Montant\n2099-08-03,PAPETERIE BUREAU PLUS,-61.37\n")
+    d2 = _import(auth_headers, "Date,Description,Montant\n2099-08-10,QUINCAILLERIE RONA,-18.44\n")
+    imports = [d1["import"]["id"], d2["import"]["id"]]
+    expenses = []
+    try:
+        assert d1["auto_matched"] == d2["auto_matched"] == 0
+        expenses.append(_make_expense(auth_headers, 61.37, "Papeterie Bureau Plus", "2099-08-03"))
+        expenses.append(_make_expense(auth_headers, 18.44, "Quincaillerie Rona", "2099-08-10"))
+        r = client.post("/api/bank/rematch", headers=auth_headers)
+        assert r.status_code == 200, r.text
+        report = r.json()
+        by_import = {res["import_id"]: res for res in report["results"]}
+        assert by_import[imports[0]]["auto_matched"] == 1
+        assert by_import[imports[1]]["auto_matched"] == 1
+        assert report["transactions_scanned"] >= 2 and report["failed_imports"] == 0
+        assert db.bank_transactions.count_documents(
+            {"import_id": {"$in": imports}, "status": "matched"}) == 2
+    finally:
+        for iid in imports:
+            client.delete(f"/api/bank/imports/{iid}?force=true", headers=auth_headers)
+        db.expenses.delete_many({"id": {"$in": expenses}})
+
+
+def test_two_transactions_cannot_claim_the_same_expense(auth_headers):
+    exp_id = _make_expense(auth_headers, 44.10, "Fournisseur Unique", "2099-09-01")
+    d1 = _import(auth_headers, "Date,Description,Montant\n2099-09-01,ZZ AUCUN NOM A,-44.10\n")
+    d2 = _import(auth_headers, "Date,Description,Montant\n2099-09-02,ZZ AUCUN NOM B,-44.10\n")
+    imports = [d1["import"]["id"], d2["import"]["id"]]
+    try:
+        tx1, tx2 = d1["transactions"][0], d2["transactions"][0]
+        scope = _import_match_scope(d1["import"])
+        # Deux « workers » ont lu la même dépense libre ; le 2e perd la réclamation.
+        _apply_match(tx1, "expense", exp_id, scope)
+        with pytest.raises(HTTPException) as exc:
+            _apply_match(tx2, "expense", exp_id, scope)
+        assert exc.value.status_code == 409
+        assert db.expenses.find_one({"id": exp_id})["bank_transaction_id"] == tx1["id"]
+        assert db.bank_transactions.find_one({"id": tx2["id"]})["status"] == "unmatched"
+        # Même transaction rapprochée deux fois (doc lu avant le 1er match) -> 409
+        with pytest.raises(HTTPException):
+            _apply_match(tx1, "expense", exp_id, scope)
+    finally:
+        for iid in imports:
+            client.delete(f"/api/bank/imports/{iid}?force=true", headers=auth_headers)
+        db.expenses.delete_one({"id": exp_id})
@@ -0,0 +1,175 @@
+"""Tests — index du matcheur bancaire (`_build_bank_match_index`).
+
+L'auto-match lit ses candidats dans un index (buckets par montant en centimes, triés par date)
+au lieu de re-parcourir toutes les factures/dépenses ouvertes pour chaque transaction. Les
+candidats retournés — et leur ORDRE, qui départage les ex æquo au tri stable — doivent être
+EXACTEMENT ceux de l'ancienne boucle linéaire. Tests unitaires purs (pas de dépendance DB).
+"""
+import os
+import random
+import sys
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+from backend.server import (  # noqa: E402
+    _bank_tx_suggestions, _build_alias_index, _build_bank_match_index, _match_index_invoices, _match_index_expenses,
+    _get_invoice_outstanding, _parse_iso_date, _score_expense_candidate,
+    _score_expense_entry, _score_invoice_candidate, _score_invoice_entry,
+    _significant_tokens,
+)
+
+
+# ── Référence : les filtres de l'ancienne boucle O(transactions × documents) ──
+
+def _ref_invoices(invoices, tx_date, target):
+    out = []
+    for inv in invoices:
+        if abs(_get_invoice_outstanding(inv) - target) > 0.01:
+            continue
+        issue = _parse_iso_date(inv.get("issue_date"))
+        if not issue:
+            continue
+        if not (tx_date - timedelta(days=90) <= issue <= tx_date + timedelta(days=3)):
+            continue
+        out.append(inv["id"])
+    return out
+
+
+def _ref_expenses(expenses, tx_date, target):
+    out = []
+    for exp in expenses:
+        exp_cad = float(exp.get("amount_cad", 0) or 0)
+        cur = (exp.get("currency") or "CAD").strip().upper()
+        amount_tol = max(0.02, round(target * 0.05, 2)) if cur not in ("", "CAD") else 0.01
+        if abs(exp_cad - target) > amount_tol:
+            continue
+        exp_date = _parse_iso_date(exp.get("expense_date") or exp.get("date"))
+        if not exp_date or abs((tx_date - exp_date).days) > 7:
+            continue
+        out.append(exp["id"])
+    return out
+
+
+def _random_docs(rng, n):
+    invoices, expenses = [], []
+    for i in range(n):
+        day = f"2099-0{rng.randint(1, 4)}-{rng.randint(1, 28):02d}"
+        total = rng.choice([100.0, 100.01, 99.99, 250.5, 37.3, round(rng.uniform(5, 500), 2)])
+        invoices.append({
+            "id": f"inv-{i}", "total": total, "client_id": f"c{i % 3}",
+            "issue_date": rng.choice([day, day + "T10:00:00", None]),
+            "due_date": day,
+            "payments": rng.choice([[], [{"amount_cad": 0.01}], [{"amount_cad": 50}]]),
+        })
+        expenses.append({
+            "id": f"exp-{i}", "amount_cad": total,
+            "currency": rng.choice(["CAD", "CAD", "USD", "", None]),
+            "expense_date": rng.choice([day, day + "T08:00:00Z", None]),
+            "vendor": rng.choice(["Genspark.ai", "Bell", "", None]),
+            "description": rng.choice(["Abonnement", "Hydro-Québec", ""]),
+        })
+    return invoices, expenses
+
+
+def test_index_returns_exactly_the_linear_scan_candidates_in_order():
+    rng = random.Random(26)
+    invoices, expenses = _random_docs(rng, 400)
+    index = _build_bank_match_index(invoices, expenses, {"c0": "Ferme Lebleu", "c1": "", "c2": "Bell"})
+    for _ in range(300):
+        tx_date = _parse_iso_date(f"2099-0{rng.randint(1, 4)}-{rng.randint(1, 28):02d}")
+        target = rng.choice([100.0, 100.01, 100.02, 99.99, 50.0, 250.5, 37.3, 95.0, 105.0,
+                             round(rng.uniform(5, 500), 2)])
+        got_inv = [e["doc"]["id"] for e in _match_index_invoices(index, tx_date, target)]
+        assert got_inv == _ref_invoices(invoices, tx_date, target)
+        got_exp = [e["doc"]["id"] for e in _match_index_expenses(index, tx_date, target)]
+        assert got_exp == _ref_expenses(expenses, tx_date, target)
+
+
+def test_consumed_expense_is_no_longer_a_candidate():
+    exps = [{"id": "a", "amount_cad": 144.67, "currency": "CAD", "expense_date": "2099-03-01"},
+            {"id": "b", "amount_cad": 144.67, "currency": "CAD", "expense_date": "2099-03-02"}]
+    index = _build_bank_match_index([], exps)
+    tx_date = _parse_iso_date("2099-03-01")
+    assert [e["doc"]["id"] for e in _match_index_expenses(index, tx_date, 144.67)] == ["a", "b"]
+    index["consumed"].add("a")
+    assert [e["doc"]["id"] for e in _match_index_expenses(index, tx_date, 144.67)] == ["b"]
+
+
+def test_precomputed_scores_equal_legacy_scoring():
+    tx_date = _parse_iso_date("2099-04-21")
+    desc = "virement interac de /lebleu descham/"
+    inv = {"id": "i", "total": 1839.60, "issue_date": "2099-04-20", "due_date": "2099-05-20",
+           "client_id": "c", "payments": []}
+    index = _build_bank_match_index([inv], [], {"c": "Ferme Lebleu-Deschamps inc."})
+    [entry] = _match_index_invoices(index, tx_date, 1839.60)
+    assert (_score_invoice_entry(tx_date, 1839.60, entry, desc, _significant_tokens(desc))
+            == _score_invoice_candidate(tx_date, 1839.60, inv, "ferme lebleu-deschamps inc.", desc))
+
+    aliases = [{"bank_tokens": ["genspark"], "vendor_tokens": ["mainfunc"]}]
+    exp = {"id": "e", "amount_cad": 37.30, "currency": "CAD", "expense_date": "2099-04-19",
+           "vendor": "MainFunc"}
+    index = _build_bank_match_index([], [exp])
+    [entry] = _match_index_expenses(index, tx_date, 37.30)
+    desc = "genspark.ai 877-4612631"
+    tokens = _significant_tokens(desc)
+    assert (_score_expense_entry(tx_date, 37.30, entry, desc, aliases, tokens, tokens)
+            == _score_expense_candidate(tx_date, 37.30, exp, desc, aliases, tokens)
+            == (5, 2, 0.0))
+
+
+def _ref_suggestions(tx, invoices, expenses, client_names, aliases):
+    """Ancienne boucle de GET /suggestions (1 find_one client par facture candidate)."""
+    tx_date = _parse_iso_date(tx["date"])
+    target = abs(tx["amount_cad"])
+    desc_lower = tx["description"].lower()
+    tokens = _significant_tokens(tx["description"])
+    if tx["amount_cad"] > 0:
+        cands = []
+        for inv in invoices:
+            if abs(_get_invoice_outstanding(inv) - target) > 0.01:
+                continue
+            issue = _parse_iso_date(inv.get("issue_date"))
+            if not issue or not (tx_date - timedelta(days=90) <= issue <= tx_date + timedelta(days=3)):
+                continue
+            name = client_names.get(inv.get("client_id"), "")
+            cands.append((*_score_invoice_candidate(tx_date, target, inv, name.lower(), desc_lower),
+                          inv["id"], name))
+        cands.sort(key=lambda c: (-c[0], c[1], c[2]))
+        return [(c[3], c[4], c[0]) for c in cands[:3]]
+    cands = []
+    for exp in expenses:
+        if abs(float(exp.get("amount_cad", 0)) - target) > 0.01:
+            continue
+        exp_date = _parse_iso_date(exp.get("expense_date") or exp.get("date"))
+        if not exp_date or abs((tx_date - exp_date).days) > 3:
+            continue
+        cands.append((*_score_expense_candidate(tx_date, target, exp, desc_lower, aliases, tokens),
+                      exp["id"]))
+    cands.sort(key=lambda c: (-c[0], c[1], c[2]))
+    return [(c[3], c[0]) for c in cands[:3]]
+
+
+def test_batched_suggestions_equal_per_transaction_loop():
+    rng = random.Random(32)
+    invoices, expenses = _random_docs(rng, 300)
+    client_names = {"c0": "Ferme Lebleu", "c1": "", "c2": "Bell Canada"}
+    context = {"index": _build_bank_match_index(invoices, expenses, client_names),
+               "client_names": client_names, "aliases": _build_alias_index([])}
+    for _ in range(200):
+        amount = rng.choice([100.0, 100.01, 99.99, 250.5, 37.3, round(rng.uniform(5, 500), 2)])
+        tx = {"date": f"2099-0{rng.randint(1, 4)}-{rng.randint(1, 28):02d}",
+              "description": rng.choice(["VIREMENT FERME LEBLEU", "BELL CANADA", "GENSPARK.AI"]),
+              "amount_cad": rng.choice([amount, -amount])}
+        got = _bank_tx_suggestions(tx, context)
+        ref = _ref_suggestions(tx, invoices, expenses, client_names, [])
+        if tx["amount_cad"] > 0:
+            assert [(s["invoice"]["id"], s["client_name"], s["score"])
+                    for s in got["invoices"]] == ref
+            assert got["expenses"] == []
+        else:
+            assert [(s["expense"]["id"], s["score"]) for s in got["expenses"]] == ref
+            assert got["invoices"] == []
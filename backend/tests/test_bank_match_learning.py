@@ -61,6 +61,33 @@ def test_alias_bridges_and_record_skip():
     assert _alias_bridges(_significant_tokens("SQ COFFEE"), _significant_tokens("X"), []) is False
 
 
+def test_alias_inverted_index_bridges_like_linear_scan():
+    """L'index inversé token -> alias donne le MÊME pont que le parcours de la liste, y compris
+    quand le côté relevé et le côté fournisseur recoupent deux alias DIFFÉRENTS (pas de pont)."""
+    from backend.server import _alias_bridges, _build_alias_index, _significant_tokens
+    aliases = [{"bank_tokens": ["coffee"], "vendor_tokens": ["boulangerie"]},
+               {"bank_tokens": ["genspark"], "vendor_tokens": ["mainfunc"]}]
+    index = _build_alias_index(aliases)
+    cases = [("SQ COFFEE SHOP", "Ma Boulangerie"), ("GENSPARK.AI", "MainFunc"),
+             ("SQ COFFEE SHOP", "MainFunc"), ("AMAZON", "Netflix")]
+    for bank, vendor in cases:
+        tx_t, exp_t = _significant_tokens(bank), _significant_tokens(vendor)
+        assert _alias_bridges(tx_t, exp_t, index) is _alias_bridges(tx_t, exp_t, aliases)
+    assert _alias_bridges(_significant_tokens("SQ COFFEE"), _significant_tokens("MainFunc"),
+                          index) is False
+    assert _alias_bridges(_significant_tokens("SQ COFFEE"), _significant_tokens("Boulangerie"),
+                          _build_alias_index([])) is False
+
+
+def test_scope_organization_id_reads_org_scope_filter():
+    from backend.server import _scope_organization_id
+    assert _scope_organization_id({"$or": [
+        {"organization_id": "org-1"},
+        {"user_id": "u", "organization_id": {"$exists": False}}]}) == "org-1"
+    assert _scope_organization_id({"organization_id": "org-2"}) == "org-2"
+    assert _scope_organization_id({"user_id": "u"}) is None
+
+
 # ─────────────────────────── INTÉGRATION ───────────────────────────
 
 def test_learning_bridges_after_manual_match(auth_headers):
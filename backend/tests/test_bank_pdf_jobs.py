@@ -0,0 +1,238 @@
+"""Tests — mode job (arrière-plan) de l'extraction de relevés PDF.
+
+L'upload rend un job_id tout de suite ; un pool de workers extrait (tranches de pages en
+parallèle, fusionnées dans l'ordre) ; GET /api/bank/pdf-jobs/{id} donne la progression puis
+les lignes. Mêmes garanties que l'aperçu synchrone : cache org+hash, 1 seul scan facturé,
+remboursement + réservation supprimée sur erreur, reprise d'un bail expiré (worker mort).
+L'extracteur Claude est remplacé par un stub local via server._TEST_MOCK_BANK_EXTRACTION.
+"""
+import io
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+import backend.server as server  # noqa: E402
+from backend.server import app, db  # noqa: E402
+
+client = TestClient(app)
+
+FAKE_PDF = b"%PDF-1.4 fake bank statement bytes for job mode"
+
+
+def _multipage_pdf(n_pages):
+    """Vrai PDF de n pages (reportlab) ; chaque page porte son numéro."""
+    from reportlab.pdfgen import canvas
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf)
+    for i in range(n_pages):
+        c.drawString(72, 720, f"PAGE-{i}")
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def _page_numbers(pdf_bytes):
+    from pypdf import PdfReader
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    return [int(p.extract_text().strip().split("PAGE-")[1]) for p in reader.pages]
+
+
+def _stub_by_page(pdf_bytes, header_pdf=None):
+    """Stub d'extraction : 1 transaction par page ; les 1res tranches répondent en DERNIER
+    (l'ordre de fin ne doit pas changer l'ordre fusionné)."""
+    pages = _page_numbers(pdf_bytes)
+    time.sleep(0.05 / (1 + pages[0]))
+    return {"transactions": [
+        {"date": "2026-04-%02d" % (p + 1), "description": f"TX{p}", "amount": p + 1.0,
+         "direction": "credit"} for p in pages]}
+
+
+# ─────────────────────────── UNITAIRE ───────────────────────────
+
+def test_split_pdf_page_ranges_keeps_page_order():
+    pytest.importorskip("pypdf")
+    parts = server._split_pdf_page_ranges(_multipage_pdf(20), 8)
+    assert [_page_numbers(p) for p in parts] == [list(range(0, 8)), list(range(8, 16)),
+                                                 list(range(16, 20))]
+
+
+def test_split_short_or_unreadable_pdf_is_left_whole():
+    assert server._split_pdf_page_ranges(FAKE_PDF, 8) == [FAKE_PDF]
+    pytest.importorskip("pypdf")
+    small = _multipage_pdf(3)
+    assert server._split_pdf_page_ranges(small, 8) == [small]
+
+
+def test_ranges_extracted_concurrently_and_merged_in_order(monkeypatch):
+    pytest.importorskip("pypdf")
+    monkeypatch.setattr(server, "_TEST_MOCK_BANK_EXTRACTION", _stub_by_page, raising=False)
+    monkeypatch.setattr(server, "BANK_PDF_PAGES_PER_RANGE", 4)
+    progress = []
+    raw = server._extract_pdf_transactions(_multipage_pdf(14),
+                                           on_progress=lambda d, t: progress.append((d, t)))
+    rows = server._normalize_bank_rows(raw)
+    assert [r["description"] for r in rows] == [f"TX{i}" for i in range(14)]
+    assert [r["row_index"] for r in rows] == list(range(14))
+    assert progress[0] == (0, 4) and progress[-1] == (4, 4)
+
+
+def test_failing_range_fails_whole_extraction(monkeypatch):
+    pytest.importorskip("pypdf")
+
+    def stub(pdf_bytes, header_pdf=None):
+        if _page_numbers(pdf_bytes)[0] == 4:
+            raise server.HTTPException(502, "Service d'analyse temporairement indisponible")
+        return _stub_by_page(pdf_bytes)
+
+    monkeypatch.setattr(server, "_TEST_MOCK_BANK_EXTRACTION", stub, raising=False)
+    monkeypatch.setattr(server, "BANK_PDF_PAGES_PER_RANGE", 4)
+    with pytest.raises(server.HTTPException):
+        server._extract_pdf_transactions(_multipage_pdf(12))
+
+
+def test_later_ranges_receive_the_header_page(monkeypatch):
+    pytest.importorskip("pypdf")
+    headers = {}
+
+    def stub(pdf_bytes, header_pdf=None):
+        first = _page_numbers(pdf_bytes)[0]
+        headers[first] = _page_numbers(header_pdf) if header_pdf else None
+        return _stub_by_page(pdf_bytes)
+
+    monkeypatch.setattr(server, "_TEST_MOCK_BANK_EXTRACTION", stub, raising=False)
+    monkeypatch.setattr(server, "BANK_PDF_PAGES_PER_RANGE", 4)
+    server._extract_pdf_transactions(_multipage_pdf(10))
+    assert headers == {0: None, 4: [0], 8: [0]}
+
+
+# ─────────────────────────── INTÉGRATION ───────────────────────────
+
+@pytest.fixture
+def auth_headers():
+    r = client.post("/api/auth/login", json={"email": "gussdub@gmail.com", "password": "testpass123"})
+    assert r.status_code == 200, r.text
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+@pytest.fixture
+def org_quota():
+    """Compteur de scans de l'org seed remis à 0 pendant le test ; rend l'org_id."""
+    u = db.users.find_one({"email": "gussdub@gmail.com"})
+    org_id = u.get("organization_id")
+    original = (db.organizations.find_one({"id": org_id}) or {}).get("scan_count_this_month", 0)
+    db.organizations.update_one({"id": org_id}, {"$set": {"scan_count_this_month": 0}})
+    fh = server._compute_file_hash(FAKE_PDF)
+    db.bank_pdf_extractions.delete_many({"file_hash": fh})
+    db.bank_pdf_jobs.delete_many({"file_hash": fh})
+    yield org_id
+    db.bank_pdf_extractions.delete_many({"file_hash": fh})
+    db.bank_pdf_jobs.delete_many({"file_hash": fh})
+    db.organizations.update_one({"id": org_id}, {"$set": {"scan_count_this_month": original}})
+
+
+def _wait_job(auth_headers, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        r = client.get(f"/api/bank/pdf-jobs/{job_id}", headers=auth_headers)
+        assert r.status_code == 200, r.text
+        if r.json()["status"] not in ("queued", "running"):
+            return r.json()
+        time.sleep(0.05)
+    raise AssertionError("job toujours en cours")
+
+
+def _scan_count(org_id):
+    return db.organizations.find_one({"id": org_id}).get("scan_count_this_month", 0)
+
+
+def test_job_returns_id_then_rows_and_bills_once(auth_headers, org_quota, monkeypatch):
+    monkeypatch.setattr(server, "_TEST_MOCK_BANK_EXTRACTION", {"transactions": [
+        {"date": "2026-04-01", "description": "PAIEMENT ABC", "amount": 57.21, "direction": "debit"}]},
+        raising=False)
+    r = client.post("/api/bank/pdf-jobs", headers=auth_headers,
+                    files={"file": ("releve.pdf", FAKE_PDF, "application/pdf")})
+    assert r.status_code == 202, r.text
+    job = _wait_job(auth_headers, r.json()["job_id"])
+    assert job["status"] == "done" and job["progress"] == 1.0
+    assert [row["amount_cad"] for row in job["parsed_rows"]] == [-57.21]
+    assert _scan_count(org_quota) == 1
+    # Même relevé : servi par le cache, aucun 2e scan
+    r2 = client.post("/api/bank/pdf-jobs", headers=auth_headers,
+                     files={"file": ("releve.pdf", FAKE_PDF, "application/pdf")})
+    assert r2.status_code == 202 and r2.json()["status"] == "done"
+    assert _scan_count(org_quota) == 1
+
+
+def test_failed_job_refunds_scan_and_drops_reservation(auth_headers, org_quota, monkeypatch):
+    def boom(pdf_bytes, header_pdf=None):
+        raise server.HTTPException(502, "Service d'analyse temporairement indisponible")
+
+    monkeypatch.setattr(server, "_TEST_MOCK_BANK_EXTRACTION", boom, raising=False)
+    r = client.post("/api/bank/pdf-jobs", headers=auth_headers,
+                    files={"file": ("releve.pdf", FAKE_PDF, "application/pdf")})
+    assert r.status_code == 202, r.text
+    job = _wait_job(auth_headers, r.json()["job_id"])
+    assert job["status"] == "error" and "parsed_rows" not in job
+    assert _scan_count(org_quota) == 0
+    assert db.bank_pdf_extractions.count_documents(
+        {"file_hash": server._compute_file_hash(FAKE_PDF)}) == 0
+
+
+def test_job_rejects_non_pdf(auth_headers):
+    r = client.post("/api/bank/pdf-jobs", headers=auth_headers,
+                    files={"file": ("releve.csv", b"Date,Desc\n2026-01-01,x\n", "text/csv")})
+    assert r.status_code == 422
+
+
+def _stale_reservation(org_id, lease_age_seconds):
+    """Réservation « extracting » facturée dont le dernier battement date de N secondes."""
+    past = datetime.now(timezone.utc) - timedelta(seconds=lease_age_seconds)
+    fh = server._compute_file_hash(FAKE_PDF)
+    db.bank_pdf_extractions.insert_one({
+        "organization_id": org_id, "file_hash": fh, "rows": None, "status": "extracting",
+        "lease_id": "mort", "created_at": past, "updated_at": past})
+    db.organizations.update_one({"id": org_id}, {"$inc": {"scan_count_this_month": 1}})
+    job_id = "job-mort-" + fh[:8]
+    db.bank_pdf_jobs.insert_one({
+        "id": job_id, "organization_id": org_id, "file_hash": fh, "filename": "releve.pdf",
+        "status": "running", "created_at": past, "updated_at": past})
+    return job_id
+
+
+def test_live_reservation_still_conflicts(org_quota):
+    _stale_reservation(org_quota, 5)
+    with pytest.raises(server.HTTPException) as exc:
+        server._reserve_pdf_extraction(org_quota, server._compute_file_hash(FAKE_PDF))
+    assert exc.value.status_code == 409
+    assert _scan_count(org_quota) == 1
+
+
+def test_dead_worker_job_is_taken_over_and_refunded(auth_headers, org_quota, monkeypatch):
+    dead = _stale_reservation(org_quota, server.BANK_PDF_LEASE_SECONDS + 60)
+    monkeypatch.setattr(server, "_TEST_MOCK_BANK_EXTRACTION", {"transactions": [
+        {"date": "2026-04-01", "description": "DEPOT", "amount": 10.0, "direction": "credit"}]},
+        raising=False)
+    r = client.post("/api/bank/pdf-jobs", headers=auth_headers,
+                    files={"file": ("releve.pdf", FAKE_PDF, "application/pdf")})
+    assert r.status_code == 202, r.text
+    assert r.json()["job_id"] != dead
+    assert _wait_job(auth_headers, r.json()["job_id"])["status"] == "done"
+    assert _scan_count(org_quota) == 1  # scan mort remboursé, nouveau facturé
+    assert db.bank_pdf_jobs.find_one({"id": dead})["status"] == "error"
+
+
+def test_polling_a_dead_job_interrupts_it_and_refunds(auth_headers, org_quota):
+    dead = _stale_reservation(org_quota, server.BANK_PDF_LEASE_SECONDS + 60)
+    job = client.get(f"/api/bank/pdf-jobs/{dead}", headers=auth_headers).json()
+    assert job["status"] == "error"
+    assert _scan_count(org_quota) == 0
+    assert db.bank_pdf_extractions.count_documents(
+        {"file_hash": server._compute_file_hash(FAKE_PDF)}) == 0
@@ -203,6 +203,85 @@ class TestParseCsvRows:
         assert "bad" in rows[1]["raw_line"]
 
 
+import io
+
+from server import (
+    _compute_file_hash_stream, _scan_bank_upload, _iter_chunks, _BANK_STREAM_BLOCK,
+)
+
+
+class TestStreamingIngestion:
+    _mapping = TestParseCsvRows._mapping
+
+    def test_stream_hash_equals_whole_file_hash(self):
+        # CRLF coupé pile à la frontière d'un bloc de lecture
+        data = b"a" * (_BANK_STREAM_BLOCK - 1) + b"\r\n" + b"x,y\r\n" * 10 + b"z\r"
+        assert _compute_file_hash_stream(io.BytesIO(data)) == _compute_file_hash(data)
+        lf = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        assert _compute_file_hash_stream(io.BytesIO(lf)) == _compute_file_hash(data)
+
+    def test_scan_counts_and_previews_without_materializing(self):
+        lines = ["date,desc,amount"] + [f"2026-03-14,X{i},{i}" for i in range(25)]
+        f = io.BytesIO(("\n".join(lines) + "\n").encode())
+        open_rows, total, preview = _scan_bank_upload(f, self._mapping(), "csv")
+        assert total == 25
+        assert [r["description"] for r in preview] == [f"X{i}" for i in range(10)]
+        rows = open_rows()
+        assert not isinstance(rows, list)  # générateur relu depuis le fichier
+        assert [r["row_index"] for r in rows] == list(range(25))
+
+    def test_encoding_fallback_when_invalid_byte_is_past_the_prefix(self):
+        # Préfixe 100 % ASCII (détecté utf-8), octet latin-1 loin après -> même résultat que
+        # _decode_bank_csv sur le fichier complet : cp1252.
+        filler = [f"2026-03-14,Ligne {i},1.00" for i in range(_BANK_STREAM_BLOCK // 20)]
+        data = ("date,desc,amount\n" + "\n".join(filler) + "\n").encode() \
+            + "2026-03-15,Caf\xe9 Montr\xe9al,2.00\n".encode("latin-1")
+        assert len(data) > _BANK_STREAM_BLOCK
+        rows = _parse_csv_rows(data, self._mapping())
+        assert rows[-1]["description"] == "Café Montréal"
+
+    def test_row_limit_raised_by_scan(self):
+        lines = ["date,desc,amount"] + [f"2026-03-14,X,{i}" for i in range(5001)]
+        with pytest.raises(ValueError, match="row limit"):
+            _scan_bank_upload(io.BytesIO(("\n".join(lines)).encode()), self._mapping(), "csv")
+
+    def test_iter_chunks(self):
+        assert list(_iter_chunks(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+        assert list(_iter_chunks([], 3)) == []
+
+
+from server import _assign_bank_row_fingerprints, _bank_account_key, _bank_row_key
+
+
+class TestRowFingerprint:
+    def test_account_key_normalizes_label(self):
+        assert _bank_account_key("  Desjardins   ÉPARGNE ") == _bank_account_key("desjardins épargne")
+        assert _bank_account_key("Desjardins épargne") != _bank_account_key("Desjardins chèques")
+
+    def test_key_normalizes_description_and_amount(self):
+        a = {"date": "2026-03-14", "amount_cad": -12.5, "description": "  COSTCO   Wholesale "}
+        b = {"date": "2026-03-14", "amount_cad": -12.50, "description": "costco wholesale"}
+        assert _bank_row_key(a) == _bank_row_key(b) == ("2026-03-14", "-12.50", "costco wholesale")
+
+    def test_parse_error_rows_have_no_fingerprint(self):
+        docs = [{"date": None, "amount_cad": None, "description": "x", "parse_error": True}]
+        _assign_bank_row_fingerprints(docs, {})
+        assert "row_fingerprint" not in docs[0]
+
+    def test_identical_rows_get_distinct_ordinals_across_chunks(self):
+        row = {"date": "2026-03-14", "amount_cad": -4.25, "description": "Tim Hortons"}
+        occurrences = {}
+        first, second = [dict(row)], [dict(row), dict(row, amount_cad=-4.26)]
+        _assign_bank_row_fingerprints(first, occurrences)
+        _assign_bank_row_fingerprints(second, occurrences)
+        fps = [d["row_fingerprint"] for d in first + second]
+        assert len(set(fps)) == 3
+        # Ré-export du même relevé : mêmes empreintes, dans le même ordre
+        again = [dict(row), dict(row), dict(row, amount_cad=-4.26)]
+        _assign_bank_row_fingerprints(again, {})
+        assert [d["row_fingerprint"] for d in again] == fps
+
+
 from server import _get_invoice_outstanding
 
 
@@ -182,6 +182,62 @@ class TestImportCreate:
                 pass
 
 
+class TestOverlappingStatements:
+    _cleanup_imports = set()
+    _auth = None
+
+    def test_overlapping_rows_are_skipped(self, auth):
+        TestOverlappingStatements._auth = auth
+        uid = uuid.uuid4().hex[:8]
+        march = [["2099-07-01", f"Loyer-{uid}", "-900.00"],
+                 ["2099-07-15", f"Cafe-{uid}", "-4.25"],
+                 ["2099-07-15", f"Cafe-{uid}", "-4.25"]]
+        r1 = requests.post(f"{BASE_URL}/api/bank/imports", headers=auth,
+                           files={"file": ("a.csv", _csv_bytes(march), "text/csv")},
+                           data={"mapping": _json.dumps(_basic_mapping())})
+        assert r1.status_code == 201, r1.text
+        TestOverlappingStatements._cleanup_imports.add(r1.json()["import"]["id"])
+        assert r1.json()["skipped_rows"] == 0
+        # Export chevauchant : les 3 lignes déjà connues + une 3e occurrence + une nouvelle
+        overlap = march + [["2099-07-15", f"Cafe-{uid}", "-4.25"],
+                           ["2099-07-20", f"Hydro-{uid}", "-80.00"]]
+        r2 = requests.post(f"{BASE_URL}/api/bank/imports", headers=auth,
+                           files={"file": ("b.csv", _csv_bytes(overlap), "text/csv")},
+                           data={"mapping": _json.dumps(_basic_mapping())})
+        assert r2.status_code == 201, r2.text
+        body = r2.json()
+        TestOverlappingStatements._cleanup_imports.add(body["import"]["id"])
+        assert body["skipped_rows"] == 3
+        assert body["import"]["row_count"] == 5
+        assert body["total_count"] == 2
+        assert [t["row_index"] for t in body["transactions"]] == [3, 4]
+
+    def test_identical_rows_on_another_account_are_kept(self, auth):
+        TestOverlappingStatements._auth = auth
+        uid = uuid.uuid4().hex[:8]
+        shared = ["2099-08-01", f"Virement-{uid}", "-250.00"]
+        for n, (label, skipped) in enumerate((("Desjardins chèques", 0), ("Desjardins épargne", 0),
+                                              ("  desjardins   CHÈQUES ", 1))):
+            rows = [shared, ["2099-08-02", f"Frais-{uid}-{n}", "-1.00"]]  # fichiers distincts
+            r = requests.post(f"{BASE_URL}/api/bank/imports", headers=auth,
+                              files={"file": ("c.csv", _csv_bytes(rows), "text/csv")},
+                              data={"mapping": _json.dumps(_basic_mapping()), "bank_label": label})
+            assert r.status_code == 201, r.text
+            TestOverlappingStatements._cleanup_imports.add(r.json()["import"]["id"])
+            assert r.json()["skipped_rows"] == skipped, label
+
+    @classmethod
+    def teardown_class(cls):
+        if not cls._auth:
+            return
+        for iid in cls._cleanup_imports:
+            try:
+                requests.delete(f"{BASE_URL}/api/bank/imports/{iid}?force=true",
+                                headers=cls._auth)
+            except Exception:
+                pass
+
+
 def _create_invoice_for_match(auth, subtotal, issue_date, client_name=None):
     """Crée client + invoice statut sent (province AB → +5% taxes seulement).
     Retourne (invoice_id, client_id, total)."""
@@ -284,6 +340,31 @@ class TestImportsList:
         assert "ignored_count" in first
         assert "unmatched_count" in first
 
+    def test_list_counts_match_detail_counts(self, auth):
+        """Les counts de la liste (une agrégation pour toute la page) == ceux du détail."""
+        suffix = uuid.uuid4().hex[:6]
+        csv = _csv_bytes([
+            ["2099-09-13", f"C-{suffix}", "3.00"],
+            ["2099-09-14", f"D-{suffix}", "4.00"],
+        ])
+        files = {"file": ("c.csv", csv, "text/csv")}
+        data = {"mapping": _json.dumps(_basic_mapping())}
+        body = requests.post(f"{BASE_URL}/api/bank/imports",
+                             files=files, data=data, headers=auth).json()
+        import_id = body["import"]["id"]
+        TestImportsList._cleanup.add(import_id)
+        tx_id = body["transactions"][0]["id"]
+        requests.post(f"{BASE_URL}/api/bank/transactions/{tx_id}/ignore", headers=auth)
+
+        items = requests.get(f"{BASE_URL}/api/bank/imports", headers=auth).json()
+        listed = next(i for i in items if i["id"] == import_id)
+        detail = requests.get(f"{BASE_URL}/api/bank/imports/{import_id}",
+                              headers=auth).json()["import"]
+        for key in ("matched_count", "ignored_count", "unmatched_count"):
+            assert listed[key] == detail[key]
+        assert listed["ignored_count"] == 1
+        assert listed["unmatched_count"] == 1
+
     def test_get_detail_returns_transactions(self, auth):
         suffix = uuid.uuid4().hex[:6]
         csv = _csv_bytes([
@@ -405,6 +486,31 @@ class TestMatchEndpoints:
         assert isinstance(body.get("invoices"), list)
         assert isinstance(body.get("expenses"), list)
 
+    def test_batch_suggestions_match_single_endpoint(self, auth):
+        i1, c1, total1 = _create_invoice_for_match(auth, 61.90, "2099-11-05")
+        TestMatchEndpoints._cleanup["invoices"].add(i1)
+        TestMatchEndpoints._cleanup["clients"].add(c1)
+        tx = self._make_import_with_one_tx(auth, total1, "2099-11-06")
+        single = requests.get(f"{BASE_URL}/api/bank/transactions/{tx['id']}/suggestions",
+                              headers=auth).json()
+        r = requests.post(f"{BASE_URL}/api/bank/suggestions", headers=auth,
+                          json={"tx_ids": [tx["id"], "unknown-tx"]})
+        assert r.status_code == 200, r.text
+        batch = r.json()["suggestions"]
+        assert list(batch) == [tx["id"]]
+        assert batch[tx["id"]] == single
+        assert any(s["invoice"]["id"] == i1 for s in batch[tx["id"]]["invoices"])
+        page = requests.post(f"{BASE_URL}/api/bank/suggestions", headers=auth,
+                             json={"import_id": tx["import_id"]}).json()["suggestions"]
+        assert page[tx["id"]] == single
+
+    def test_batch_suggestions_requires_ids_or_import(self, auth):
+        r = requests.post(f"{BASE_URL}/api/bank/suggestions", headers=auth, json={})
+        assert r.status_code == 422
+        r = requests.post(f"{BASE_URL}/api/bank/suggestions", headers=auth,
+                          json={"import_id": "does-not-exist"})
+        assert r.status_code == 404
+
     @classmethod
     def teardown_class(cls):
         if not cls._auth:
@@ -0,0 +1,167 @@
+"""Tests — blob store adressé par contenu (db.files ne garde que les métadonnées + sha256).
+
+Tests unitaires purs sur le backend local (répertoire temporaire) : pas de dépendance DB,
+sauf la collecte des rendus PDF remplacés (DB isolée).
+"""
+import hashlib
+import io
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+import pytest  # noqa: E402
+import server  # noqa: E402
+from bson import Binary  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+
+
+@pytest.fixture
+def local_store(tmp_path, monkeypatch):
+    store = server._LocalBlobStore(str(tmp_path))
+    monkeypatch.setattr(server, "_blob_store_instance", store)
+    return store
+
+
+def test_store_blob_is_keyed_by_sha256_and_deduplicated(local_store, tmp_path):
+    data = b"\xff\xd8\xff" + b"recu" * 100
+    sha = server._store_blob(data)
+    assert sha == hashlib.sha256(data).hexdigest()
+    assert server._store_blob(bytearray(data)) == sha
+    files = [f for _, _, names in os.walk(tmp_path) for f in names]
+    assert files == [sha], "même contenu -> un seul blob, aucun fichier temporaire résiduel"
+    assert local_store.size(sha) == len(data)
+    with local_store.open(sha) as f:
+        assert f.read() == data
+
+
+def test_file_bytes_reads_blob_or_legacy_inline_data(local_store):
+    sha = server._store_blob(b"logo-bytes")
+    thumb = server._store_blob(b"thumb-bytes")
+    assert server._file_bytes({"sha256": sha}) == b"logo-bytes"
+    assert server._file_bytes({"sha256": sha, "thumbnail_sha256": thumb}, "thumbnail") == b"thumb-bytes"
+    # document pas encore migré : Binary inline prioritaire
+    assert server._file_bytes({"data": Binary(b"inline")}) == b"inline"
+    assert server._file_bytes({"thumbnail": Binary(b"t")}, "thumbnail") == b"t"
+
+
+def test_file_bytes_none_without_content(local_store):
+    assert server._file_bytes({"storage_path": "emergent/x.png"}) is None
+    assert server._file_bytes({"sha256": "0" * 64}) is None, "blob manquant -> None (410/404)"
+    assert server._file_bytes({"sha256": "a" * 64}, "thumbnail") is None
+
+
+# ─── Téléchargements conditionnels (ETag / Range) ───
+
+def _download_client(record):
+    from fastapi import FastAPI, Request
+    from fastapi.testclient import TestClient
+    app = FastAPI()
+
+    @app.get("/f")
+    def f(request: Request):
+        return server._file_download_response(request, server._file_source(record),
+                                              "application/pdf")
+    return TestClient(app)
+
+
+def test_parse_byte_range():
+    parse = server._parse_byte_range
+    assert parse(None, 100) is None
+    assert parse("bytes=0-9", 100) == (0, 9)
+    assert parse("bytes=90-", 100) == (90, 99)
+    assert parse("bytes=-10", 100) == (90, 99)
+    assert parse("bytes=-500", 100) == (0, 99)
+    assert parse("bytes=50-500", 100) == (50, 99)
+    assert parse("bytes=100-", 100) == "unsatisfiable"
+    assert parse("bytes=-5", 0) == "unsatisfiable"
+    assert parse("bytes=0-", 0) == "unsatisfiable"
+    assert parse("bytes=0-1,5-6", 100) is None, "multi-plages -> fichier entier"
+    assert parse("items=0-1", 100) is None
+    assert parse("bytes=abc", 100) is None
+
+
+def test_download_streams_full_range_and_not_modified(local_store, monkeypatch):
+    monkeypatch.setattr(server, "BLOB_STREAM_CHUNK", 7)
+    data = bytes(range(256)) * 3
+    sha = server._store_blob(data)
+    client = _download_client({"sha256": sha})
+    etag = f'"{sha}"'
+
+    r = client.get("/f")
+    assert r.status_code == 200 and r.content == data
+    assert r.headers["etag"] == etag and r.headers["accept-ranges"] == "bytes"
+
+    r = client.get("/f", headers={"Range": "bytes=10-99"})
+    assert r.status_code == 206 and r.content == data[10:100]
+    assert r.headers["content-range"] == f"bytes 10-99/{len(data)}"
+
+    r = client.get("/f", headers={"Range": "bytes=-5"})
+    assert r.status_code == 206 and r.content == data[-5:]
+
+    r = client.get("/f", headers={"Range": f"bytes={len(data)}-"})
+    assert r.status_code == 416 and r.headers["content-range"] == f"bytes */{len(data)}"
+
+    r = client.get("/f", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.content == b"" and r.headers["etag"] == etag
+
+    # If-Range périmé -> fichier entier
+    r = client.get("/f", headers={"Range": "bytes=0-3", "If-Range": '"stale"'})
+    assert r.status_code == 200 and r.content == data
+
+
+def test_download_legacy_inline_record_has_content_etag(local_store):
+    data = b"%PDF-1.4 inline"
+    r = _download_client({"data": Binary(data)}).get("/f", headers={"Range": "bytes=0-3"})
+    assert r.status_code == 206 and r.content == b"%PDF"
+    assert r.headers["etag"] == f'"{hashlib.sha256(data).hexdigest()}"'
+    assert server._file_source({"sha256": "0" * 64}) is None
+
+
+# ─── Collecte des rendus PDF remplacés ───
+
+@pytest.fixture
+def gc_db(local_store, monkeypatch):
+    client = MongoClient("mongodb://localhost:27017")
+    name = f"facturepro_test_blob_gc_{uuid.uuid4().hex[:8]}"
+    test_db = client[name]
+    monkeypatch.setattr(server, "db", test_db)
+    monkeypatch.setattr(server, "_PDF_CACHE", server._LRUCache(8))
+    monkeypatch.setattr(server, "generate_document_pdf", lambda doc_type, document, *a, **k:
+                        io.BytesIO(f"%PDF-{document.get('notes')}".encode()))
+    yield test_db
+    client.drop_database(name)
+
+
+def test_replaced_pdf_render_blob_is_collected_unless_still_referenced(gc_db, local_store):
+    invoice = {"id": "inv-1", "organization_id": "org-gc", "status": "sent", "notes": "v1"}
+    server._document_pdf_bytes("invoice", invoice, {}, {}, [])
+    old = gc_db.pdf_renders.find_one({})["sha256"]
+    server._document_pdf_bytes("invoice", {**invoice, "notes": "v2"}, {}, {}, [])
+    new = gc_db.pdf_renders.find_one({})["sha256"]
+    assert server.collect_orphan_blobs() == {"checked": 0, "deleted": 0}  # délai de grâce
+    assert server.collect_orphan_blobs(grace_seconds=0) == {"checked": 1, "deleted": 1}
+    assert not local_store.exists(old) and local_store.exists(new)
+    # Rendu invalidé mais contenu joint à un courriel : le blob reste
+    gc_db.email_outbox.insert_one({"id": "m1", "attachments": [{"filename": "f.pdf", "sha256": new}]})
+    server._invalidate_document_pdfs("org-gc", "invoice", "inv-1")
+    assert server.collect_orphan_blobs(grace_seconds=0) == {"checked": 1, "deleted": 0}
+    assert local_store.exists(new) and gc_db.blob_gc_queue.count_documents({}) == 0
+
+
+def test_migration_moves_binary_data_and_skips_null(gc_db, local_store):
+    gc_db.files.insert_many([
+        {"id": "f1", "data": Binary(b"recu-1"), "thumbnail": Binary(b"mini-1")},
+        {"id": "f2", "data": None},
+        {"id": "f3", "sha256": "deja-migre"},
+    ])
+    assert server.migrate_files_to_blob_store_v1(batch_size=1) == 1
+    f1 = gc_db.files.find_one({"id": "f1"})
+    assert "data" not in f1 and server._file_bytes(f1) == b"recu-1"
+    assert server._file_bytes(f1, "thumbnail") == b"mini-1"
+    assert gc_db.files.find_one({"id": "f2"})["data"] is None
+    assert server.migrate_files_to_blob_store_v1() == 0
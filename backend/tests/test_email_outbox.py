@@ -0,0 +1,150 @@
+"""Tests — outbox email (`_enqueue_email` / `process_email_outbox`).
+
+Le worker tourne contre un expéditeur STUB local (server._EMAIL_SENDER) sur une DB isolée :
+aucun appel Resend. Vérifie idempotence, pièces jointes via le blob store, retries
+exponentiels, échec définitif et métriques.
+"""
+import hashlib
+import os
+import sys
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+import pytest  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+
+import server  # noqa: E402
+from server import _outbox_retry_delay  # noqa: E402
+
+PARAMS = {"from": "noreply@example.com", "to": ["client@example.com"], "subject": "Facture"}
+
+
+def test_retry_delay_is_exponential_and_capped():
+    assert [_outbox_retry_delay(n) for n in (1, 2, 3, 4)] == [30, 60, 120, 240]
+    assert _outbox_retry_delay(30) == server.EMAIL_OUTBOX_RETRY_MAX_SECONDS
+
+
+@pytest.fixture
+def outbox_db(monkeypatch, tmp_path):
+    client = MongoClient("mongodb://localhost:27017")
+    name = f"facturepro_test_outbox_{uuid.uuid4().hex[:8]}"
+    test_db = client[name]
+    test_db.email_outbox.create_index("idempotency_key", unique=True)
+    monkeypatch.setattr(server, "db", test_db)
+    monkeypatch.setattr(server, "_blob_store_instance", server._LocalBlobStore(str(tmp_path)))
+    yield test_db
+    client.drop_database(name)
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    out = []
+    lock = threading.Lock()
+
+    def stub(params, idempotency_key):
+        with lock:
+            out.append((params, idempotency_key))
+        return f"stub-{len(out)}"
+    monkeypatch.setattr(server, "_EMAIL_SENDER", stub)
+    return out
+
+
+def _make_due(test_db):
+    test_db.email_outbox.update_many({"status": "pending"},
+                                     {"$set": {"next_attempt_at": datetime.now(timezone.utc)}})
+
+
+def test_enqueue_then_worker_sends_with_attachment(outbox_db, sent):
+    oid = server._enqueue_email(dict(PARAMS), "invoice", "k1", "org-o",
+                                attachments=[("facture_1.pdf", b"%PDF-1")])
+    assert outbox_db.email_outbox.find_one({"id": oid})["status"] == "pending"
+    assert server.process_email_outbox() == {"claimed": 1, "sent": 1, "retried": 0, "failed": 0}
+    (params, key), = sent
+    assert key == "k1"
+    assert params["attachments"] == [{"filename": "facture_1.pdf", "content": "JVBERi0x"}]
+    msg = outbox_db.email_outbox.find_one({"id": oid})
+    assert (msg["status"], msg["provider_id"], msg["attempts"]) == ("sent", "stub-1", 1)
+
+
+def test_same_idempotency_key_is_enqueued_once(outbox_db, sent):
+    first = server._enqueue_email(dict(PARAMS), "trial_expiry", "trial_expiry_3d:u1")
+    assert server._enqueue_email(dict(PARAMS), "trial_expiry", "trial_expiry_3d:u1") == first
+    server.process_email_outbox()
+    assert len(sent) == 1
+
+
+def test_client_key_is_scoped_by_org_and_document(outbox_db, sent):
+    keys = {server._client_idempotency_key(org, "invoice", doc, "clic-1")
+            for org, doc in (("org-a", "inv-1"), ("org-b", "inv-1"), ("org-a", "inv-2"))}
+    ids = {server._enqueue_email(dict(PARAMS), "invoice", k, k.split(":")[0]) for k in keys}
+    assert len(ids) == 3
+    server.process_email_outbox()
+    assert sorted(k for _, k in sent) == sorted(keys)  # la clé préfixée part chez Resend
+    assert server._client_idempotency_key("org-a", "invoice", "inv-1", None) is None
+
+
+def test_duplicate_never_returns_another_orgs_message(outbox_db, sent):
+    server._enqueue_email(dict(PARAMS), "invoice", "brute", "org-a")
+    with pytest.raises(server.HTTPException) as exc:
+        server._enqueue_email(dict(PARAMS), "invoice", "brute", "org-b")
+    assert exc.value.status_code == 409
+
+
+def test_duplicate_queues_its_attachment_blobs_for_gc(outbox_db, sent):
+    key = server._client_idempotency_key("org-o", "invoice", "inv-1", "clic-1")
+    first = server._enqueue_email(dict(PARAMS), "invoice", key, "org-o",
+                                  attachments=[("f.pdf", b"%PDF-v1")])
+    assert server._enqueue_email(dict(PARAMS), "invoice", key, "org-o",
+                                 attachments=[("f.pdf", b"%PDF-v2")]) == first
+    orphan = hashlib.sha256(b"%PDF-v2").hexdigest()
+    assert outbox_db.blob_gc_queue.find_one({"_id": orphan}) is not None
+
+
+def test_failure_is_retried_with_backoff_then_marked_failed(outbox_db, monkeypatch):
+    monkeypatch.setattr(server, "EMAIL_OUTBOX_MAX_ATTEMPTS", 2)
+
+    def down(params, idempotency_key):
+        raise ConnectionError("resend indisponible")
+    monkeypatch.setattr(server, "_EMAIL_SENDER", down)
+    oid = server._enqueue_email(dict(PARAMS), "invoice", None, "org-o")
+    assert server.process_email_outbox()["retried"] == 1
+    msg = outbox_db.email_outbox.find_one({"id": oid})
+    assert (msg["status"], msg["last_error"]) == ("pending", "ConnectionError")
+    due = msg["next_attempt_at"].replace(tzinfo=None)  # pymongo rend des dates UTC naïves
+    assert due > datetime.utcnow() + timedelta(seconds=20)
+    assert server.process_email_outbox()["claimed"] == 0  # pas encore dû
+    _make_due(outbox_db)
+    assert server.process_email_outbox()["failed"] == 1
+    assert outbox_db.email_outbox.find_one({"id": oid})["status"] == "failed"
+    stats = server._email_outbox_stats("org-o")
+    assert (stats["depth"], stats["failed"]) == (0, 1)
+
+
+def test_concurrent_workers_never_double_send(outbox_db, sent):
+    for n in range(30):
+        server._enqueue_email(dict(PARAMS), "invoice", f"k{n}", "org-o")
+    runs = []
+    threads = [threading.Thread(target=lambda: runs.append(server.process_email_outbox(limit=30)))
+               for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(r["sent"] for r in runs) == 30
+    assert sorted(k for _, k in sent) == sorted(f"k{n}" for n in range(30))
+    stats = server._email_outbox_stats("org-o")
+    assert (stats["depth"], stats["sent"]) == (0, 30)
+
+
+def test_expired_lease_is_reclaimed(outbox_db, sent):
+    oid = server._enqueue_email(dict(PARAMS), "invoice", "k-lease", "org-o")
+    outbox_db.email_outbox.update_one({"id": oid}, {"$set": {
+        "status": "sending", "lease_until": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    assert server.process_email_outbox()["sent"] == 1
+    assert sent[0][1] == "k-lease"  # même clé : le fournisseur dédoublonne un envoi déjà parti
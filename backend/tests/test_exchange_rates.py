@@ -0,0 +1,80 @@
+"""Tests — store de taux de change (LRU borné + db.exchange_rates + prefetch time-series).
+
+Tests unitaires purs : remplissage calendaire d'une série frankfurter, LRU, résolution en
+lot servie par le LRU, rattrapage d'un taux du jour périmé (pas de dépendance DB ni réseau).
+"""
+import os
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+import server  # noqa: E402
+from server import _LRUCache, _clean_rates, _fill_rate_series  # noqa: E402
+
+
+def test_fill_rate_series_carries_last_business_day_forward():
+    fri, mon = {"CAD": 1.0, "USD": 0.73}, {"CAD": 1.0, "USD": 0.74}
+    series = {"2024-03-01": fri, "2024-03-04": mon}
+    filled = _fill_rate_series(series, "2024-03-01", "2024-03-05")
+    assert filled == {"2024-03-01": fri, "2024-03-02": fri, "2024-03-03": fri,
+                      "2024-03-04": mon, "2024-03-05": mon}
+
+
+def test_fill_rate_series_uses_window_before_start_and_skips_unknown_head():
+    thu = {"CAD": 1.0, "USD": 0.72}
+    # la fenêtre élargie amène le jeudi ; samedi/dimanche en tête de plage le reprennent
+    assert _fill_rate_series({"2024-02-29": thu}, "2024-03-02", "2024-03-03") == {
+        "2024-03-02": thu, "2024-03-03": thu}
+    # rien de publié avant la plage -> jours omis (pas de taux inventé)
+    assert _fill_rate_series({"2024-03-04": thu}, "2024-03-02", "2024-03-04") == {"2024-03-04": thu}
+
+
+def test_clean_rates_drops_non_positive():
+    assert _clean_rates({"USD": 0.7312345678, "EUR": 0, "GBP": None}) == {"CAD": 1.0, "USD": 0.731235}
+
+
+def test_lru_evicts_least_recently_used():
+    lru = _LRUCache(2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    assert lru.get("a") == 1  # "a" redevient récent
+    lru.put("c", 3)
+    assert lru.get("b") is None and lru.get("a") == 1 and lru.get("c") == 3
+    assert len(lru) == 2
+
+
+def test_bulk_rates_served_from_lru_without_db(monkeypatch):
+    lru = _LRUCache(8)
+    monkeypatch.setattr(server, "_exchange_rate_lru", lru)
+    r1, r2 = {"CAD": 1.0, "USD": 0.7}, {"CAD": 1.0, "USD": 0.71}
+    lru.put("2020-01-02", r1)
+    lru.put("2020-01-03", r2)
+    assert server._get_exchange_rates_bulk(["2020-01-02", "2020-01-03", "2020-01-02"]) == {
+        "2020-01-02": r1, "2020-01-03": r2}
+    assert server._get_exchange_rates("2020-01-03") == r2
+
+
+
+def test_stale_latest_is_served_and_refreshed_once_without_refresher(monkeypatch):
+    stale = {"date": "latest", "rates": {"CAD": 1.0, "USD": 0.7},
+             "fetched_at": datetime.now(timezone.utc) - timedelta(days=3)}
+    # Collection minimale : seul find_one("latest") est lu
+    monkeypatch.setattr(server, "db", SimpleNamespace(
+        exchange_rates=SimpleNamespace(find_one=lambda *a, **k: dict(stale))))
+    monkeypatch.setattr(server, "_exchange_rate_lru", _LRUCache(8))
+    monkeypatch.setattr(server, "_exchange_rate_refresher_beat", None)
+    monkeypatch.setattr(server, "_latest_catchup_at", None)
+    refreshed = []
+    done = threading.Event()
+    monkeypatch.setattr(server, "_refresh_latest_rates", lambda: (refreshed.append(1), done.set()))
+    assert server._latest_rates() == {"CAD": 1.0, "USD": 0.7}  # servi sans attendre le réseau
+    assert done.wait(2)
+    server._exchange_rate_lru.pop("latest")
+    server._latest_rates()
+    assert refreshed == [1]  # nouvelle tentative limitée par EXCHANGE_RATE_CATCHUP_SECONDS
@@ -3,8 +3,10 @@
 Task 1 : table des taux ARC + `_mileage_rate_for_year`.
 Task 2 : distance dérivée + allocation avec split au seuil 5000 km.
 Task 3 : cumul annuel `_mileage_sum_ytd`.
+Moteur de cumul (sommes préfixes) : `_build_mileage_ytd_index` = `_mileage_sum_ytd`.
 """
 import os
+import random
 import sys
 
 # Le module server.py se connecte à Mongo au chargement (db = client[DB_NAME]),
@@ -30,8 +32,12 @@ from backend.server import (  # noqa: E402
     _mileage_rate_for_year,
     _mileage_distance_km,
     _mileage_allocation,
+    _build_mileage_ytd_index,
+    _mileage_index_allocation,
+    _mileage_index_ytd_before,
     _mileage_sum_ytd,
     _mileage_trip_date_str,
+    _mileage_ytd_trip,
 )
 
 
@@ -295,3 +301,52 @@ def test_missing_year_enrich_returns_none_allocation():
     # Test unitaire du contrat via _mileage_rate_for_year déjà couvert ; ici on
     # documente la garde côté helper d'allocation batch (pas de fallback silencieux).
     assert _mileage_rate_for_year(2099) is None
+
+
+# ─── Moteur de cumul : sommes préfixes + bisect ≡ _mileage_sum_ytd ───────────
+
+
+def _random_trip_docs(rng, n):
+    docs = []
+    for i in range(n):
+        day = f"{rng.choice([2025, 2026])}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        docs.append({
+            "id": f"t{i:04d}", "vehicle_id": rng.choice(["V1", "V2"]),
+            "employee_id": rng.choice(["EMP1", None]), "created_by_user_id": "U1",
+            "trip_date": rng.choice([day, day + "T09:00"]),
+            "created_at": rng.choice(["", f"{day}T{rng.randint(0, 23):02d}:00"]),
+            "distance_km": round(rng.uniform(0.5, 180), 2),
+        })
+    return docs
+
+
+def test_index_ytd_equals_reference_sum_and_split():
+    rng = random.Random(49)
+    docs = _random_trip_docs(rng, 600)
+    light = [_mileage_ytd_trip(d) for d in docs]
+    index = _build_mileage_ytd_index(light)
+    for d, t in zip(docs, light):
+        ref = _mileage_sum_ytd(light, d["id"], d["trip_date"], t["employee_key"],
+                               d["vehicle_id"], d["created_at"])
+        assert _mileage_index_ytd_before(index, d) == ref
+        ytd, rates, amount, breakdown = _mileage_index_allocation(index, d)
+        assert (amount, breakdown) == _mileage_allocation(d["distance_km"], ref, rates)
+
+
+def test_index_raw_running_total_matches_sequential_accumulation():
+    rng = random.Random(7)
+    docs = [d for d in _random_trip_docs(rng, 300) if d["trip_date"].startswith("2026")]
+    docs.sort(key=lambda d: (_mileage_trip_date_str(d["trip_date"]), d["created_at"], d["id"]))
+    index = _build_mileage_ytd_index([_mileage_ytd_trip(d) for d in docs])
+    running = {}
+    for d in docs:
+        key = (_mileage_ytd_trip(d)["employee_key"], d["vehicle_id"])
+        assert _mileage_index_ytd_before(index, d, rounded=False) == running.get(key, 0.0)
+        running[key] = running.get(key, 0.0) + float(d["distance_km"])
+
+
+def test_index_unknown_group_has_no_prior_km():
+    index = _build_mileage_ytd_index([_trip("2026-01-05", 100.0, "a")])
+    trip = {"id": "b", "trip_date": "2026-02-01", "vehicle_id": "V9",
+            "created_by_user_id": "U1", "distance_km": 10.0}
+    assert _mileage_index_ytd_before(index, trip) == 0.0
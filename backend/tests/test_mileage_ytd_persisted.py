@@ -0,0 +1,119 @@
+"""Tests — cumul km persisté sur les trajets (`ytd_before_km`).
+
+DB isolée. Après une série de créations, éditions (changement de date/distance) et
+suppressions, le cumul persisté de chaque trajet doit égaler le calcul de référence
+(`verify_mileage_ytd` sans écart) ; `repair` renseigne les trajets sans cumul.
+"""
+import os
+import random
+import sys
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+import pytest  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+
+import server  # noqa: E402
+
+USER = server.CurrentUser(id="U1", email="owner@example.com", organization_id="org-km",
+                          role="owner", permissions=["expenses:read", "expenses:write"])
+
+
+@pytest.fixture
+def km_db(monkeypatch):
+    client = MongoClient("mongodb://localhost:27017")
+    name = f"facturepro_test_mileage_ytd_{uuid.uuid4().hex[:8]}"
+    test_db = client[name]
+    monkeypatch.setattr(server, "db", test_db)
+    yield test_db
+    client.drop_database(name)
+
+
+def _create(rng, day=None):
+    day = day or f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    return server.create_mileage_trip({"purpose": "Client", "trip_date": day,
+                                       "one_way_km": round(rng.uniform(5, 300), 2),
+                                       "round_trip": rng.random() < 0.5}, USER)["trip"]["id"]
+
+
+def test_persisted_cumul_follows_create_update_delete(km_db):
+    rng = random.Random(50)
+    ids = [_create(rng) for _ in range(30)] + [_create(rng, "2026-06-15") for _ in range(4)]
+    assert server.verify_mileage_ytd("org-km")["mismatches"] == []
+    for tid in ids[:8] + ids[-2:]:
+        server.update_mileage_trip(tid, {"purpose": "Client", "trip_date": f"2026-{rng.randint(1, 12):02d}-15",
+                                         "one_way_km": round(rng.uniform(5, 300), 2)}, current_user=USER)
+    for tid in ids[8:14]:
+        server.delete_mileage_trip(tid, current_user=USER)
+    assert server.verify_mileage_ytd("org-km")["mismatches"] == []
+
+
+def test_reads_use_persisted_cumul_and_cross_the_threshold(km_db):
+    rng = random.Random(5)
+    for _ in range(40):
+        _create(rng)
+    listed = server.list_mileage_trips(year=2026, current_user=USER)
+    index = server._build_mileage_ytd_index([server._mileage_ytd_trip(r["trip"]) for r in listed])
+    for r in listed:
+        assert r["ytd_before"] == server._mileage_index_ytd_before(index, r["trip"])
+        assert server.get_mileage_trip(r["trip"]["id"], current_user=USER) == r
+    assert any(r["allocation"]["breakdown"]["km_reduced"] > 0 for r in listed)
+
+
+def test_repair_backfills_trips_without_cumul(km_db):
+    rng = random.Random(1)
+    for _ in range(10):
+        _create(rng)
+    km_db.mileage_trips.update_many({}, {"$unset": {"ytd_before_km": ""}})
+    assert len(server.verify_mileage_ytd()["mismatches"]) == 10
+    assert server.verify_mileage_ytd(repair=True)["repaired"] == 10
+    assert server.verify_mileage_ytd()["mismatches"] == []
+
+
+def test_concurrent_writes_on_one_group_keep_cumul_exact(km_db):
+    rng = random.Random(7)
+    ids = [_create(rng) for _ in range(10)]
+    errors = []
+
+    def worker(seed):
+        r = random.Random(seed)
+        try:
+            for _ in range(5):
+                _create(r)
+            server.update_mileage_trip(ids[seed], {"purpose": "Client", "trip_date": "2026-03-03",
+                                                   "one_way_km": 42.0}, current_user=USER)
+        except Exception as e:  # pragma: no cover - remonté par l'assert
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert server.verify_mileage_ytd("org-km")["mismatches"] == []
+
+
+def test_lock_of_dead_writer_is_taken_over_and_group_repaired(km_db, monkeypatch):
+    rng = random.Random(3)
+    first = _create(rng, "2026-02-01")
+    _create(rng, "2026-05-01")
+    # Écrivain mort au milieu d'une écriture : cumul faux et verrou jamais libéré
+    km_db.mileage_trips.update_many({"id": {"$ne": first}}, {"$set": {"ytd_before_km": 999.0}})
+    lock_id = server._mileage_group_lock_id(km_db.mileage_trips.find_one({"id": first}))
+    km_db.mileage_ytd_locks.update_one({"_id": lock_id}, {"$set": {
+        "token": "mort", "lease_until": datetime.now(timezone.utc) + timedelta(minutes=1)}})
+    monkeypatch.setattr(server, "MILEAGE_YTD_LOCK_WAIT_SECONDS", 0.1)
+    with pytest.raises(server.HTTPException) as exc:
+        _create(rng, "2026-03-01")
+    assert exc.value.status_code == 409
+    km_db.mileage_ytd_locks.update_one({"_id": lock_id}, {"$set": {
+        "lease_until": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    _create(rng, "2026-03-01")
+    assert server.verify_mileage_ytd("org-km")["mismatches"] == []
@@ -0,0 +1,102 @@
+"""Tests — crons de notification ensemblistes (`check_trial_expiry`, `check_mileage_rate_update`).
+
+DB isolée, emails vérifiés dans l'outbox (aucun appel Resend). Couvre la fenêtre d'expiration,
+l'anti-jointure sur les notifications déjà faites, les exemptés, le mode dry-run et
+l'idempotence par (org, année) des reminders de taux kilométrique.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+import pytest  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def cron_db(monkeypatch):
+    client = MongoClient("mongodb://localhost:27017")
+    name = f"facturepro_test_crons_{uuid.uuid4().hex[:8]}"
+    test_db = client[name]
+    test_db.email_outbox.create_index("idempotency_key", unique=True)
+    test_db.trial_notifications.create_index([("user_id", 1), ("type", 1)], unique=True)
+    test_db.mileage_rate_reminders.create_index("id", unique=True)
+    monkeypatch.setattr(server, "db", test_db)
+    monkeypatch.setattr(server, "RESEND_API_KEY", "re_test")
+    monkeypatch.setattr(server, "CRON_SECRET", "cron-s3cret")
+    yield test_db
+    client.drop_database(name)
+
+
+def _call(endpoint, query=b"", secret=b"cron-s3cret"):
+    headers = [(b"x-cron-secret", secret)] if secret else []
+    return asyncio.run(endpoint(Request({"type": "http", "query_string": query, "headers": headers})))
+
+
+def _org(test_db, n, trial_ends_at=None, email=None):
+    test_db.users.insert_one({"id": f"u{n}", "email": email or f"owner{n}@example.com",
+                              "company_name": f"Entreprise {n}", "organization_id": f"org{n}"})
+    test_db.organizations.insert_one({"id": f"org{n}", "owner_id": f"u{n}",
+                                      "subscription_status": "trial" if trial_ends_at else "active",
+                                      "trial_ends_at": trial_ends_at})
+
+
+def _in(**delta):
+    return (datetime.now(timezone.utc) + timedelta(**delta)).isoformat()
+
+
+def test_trial_expiry_targets_window_and_skips_notified(cron_db):
+    _org(cron_db, 1, _in(days=2, hours=1))
+    _org(cron_db, 2, _in(days=3, hours=12))
+    _org(cron_db, 3, _in(days=6))            # trop tôt
+    _org(cron_db, 4, _in(hours=-2))          # déjà expiré
+    _org(cron_db, 5, _in(days=1), email=server.EXEMPT_USERS[0])
+    _org(cron_db, 6, _in(days=1))
+    cron_db.trial_notifications.insert_one({"user_id": "u6", "type": "trial_expiry_3d"})
+    dry = _call(server.check_trial_expiry, b"dry_run=1")
+    assert sorted(t["organization_id"] for t in dry["targets"]) == ["org1", "org2"]
+    assert "owner1@example.com" not in str(dry)
+    assert cron_db.email_outbox.count_documents({}) == 0
+
+    assert _call(server.check_trial_expiry) == {"notified": 2, "total_eligible": 2}
+    assert cron_db.email_outbox.count_documents({"kind": "trial_expiry"}) == 2
+    assert cron_db.trial_notifications.count_documents({"type": "trial_expiry_3d"}) == 3
+    assert _call(server.check_trial_expiry) == {"notified": 0, "total_eligible": 0}
+
+
+def test_mileage_reminder_notifies_each_org_once(cron_db, monkeypatch):
+    monkeypatch.setattr(server, "_mileage_rate_for_year", lambda year: None)
+    year = datetime.now(timezone.utc).year
+    for n in range(1, 4):
+        _org(cron_db, n)
+    cron_db.mileage_rate_reminders.insert_many([
+        {"id": f"org1:{year}", "organization_id": "org1", "year": year, "notified_at": "2026-01-02"},
+        {"id": f"org2:{year}", "organization_id": "org2", "year": year, "notified_at": None},
+        {"id": f"org3:{year - 1}", "organization_id": "org3", "year": year - 1,
+         "notified_at": "2025-01-02"},
+    ])
+    dry = _call(server.check_mileage_rate_update, b"dry_run=true")
+    assert sorted(dry["organization_ids"]) == ["org2", "org3"]
+
+    assert _call(server.check_mileage_rate_update)["count"] == 2
+    assert cron_db.email_outbox.count_documents({"kind": "mileage_rate_reminder"}) == 2
+    flagged = cron_db.mileage_rate_reminders.find_one({"id": f"org2:{year}"})
+    assert flagged["notified_at"] and flagged["source"] == "cron_annual"
+    assert _call(server.check_mileage_rate_update)["count"] == 0
+
+
+@pytest.mark.parametrize("secret", [None, b"mauvais"])
+def test_dry_run_requires_cron_secret(cron_db, secret):
+    _org(cron_db, 1, _in(days=2))
+    with pytest.raises(server.HTTPException) as exc:
+        _call(server.check_trial_expiry, b"dry_run=1", secret=secret)
+    assert exc.value.status_code == 403
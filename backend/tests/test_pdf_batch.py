@@ -0,0 +1,74 @@
+"""Tests — export PDF en lot (`_iter_pdf_zip`) : ZIP produit en flux, rendu inline ou sur le
+pool de process, rendus en échec listés dans ERREURS.txt. Tests unitaires purs (logo passé en
+octets : aucun accès DB, y compris dans les workers).
+"""
+import io
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+from server import _iter_pdf_zip, _pdf_zip_member_name  # noqa: E402
+
+SETTINGS = {"company_name": "Ferme Lebleu", "tax_registrations": {}}
+
+
+def _invoice(n):
+    return {"id": f"inv-{n}", "invoice_number": f"FAC-{n:03d}", "status": "sent",
+            "issue_date": "2026-03-01", "due_date": "2026-03-31", "items": [
+                {"description": "Service", "quantity": 1, "unit_price": 100.0 + n}],
+            "subtotal": 100.0 + n, "total": 100.0 + n}
+
+
+def _jobs(count):
+    used = set()
+    return [(_pdf_zip_member_name("facture", inv["invoice_number"], used),
+             ("invoice", inv, SETTINGS, {"name": "Client"}, [], b""))
+            for inv in map(_invoice, range(count))]
+
+
+def _unzip(chunks):
+    return zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+
+
+def test_inline_zip_contains_every_pdf():
+    zf = _unzip(_iter_pdf_zip(_jobs(3), workers=1))
+    assert sorted(zf.namelist()) == ["facture_FAC-000.pdf", "facture_FAC-001.pdf",
+                                     "facture_FAC-002.pdf"]
+    assert all(zf.read(n).startswith(b"%PDF") for n in zf.namelist())
+
+
+def test_pool_renders_same_members_as_inline():
+    zf = _unzip(_iter_pdf_zip(_jobs(4), workers=2))
+    assert sorted(zf.namelist()) == [f"facture_FAC-{n:03d}.pdf" for n in range(4)]
+    assert all(zf.read(n).startswith(b"%PDF") for n in zf.namelist())
+
+
+def test_zip_is_streamed_one_chunk_per_file():
+    chunks = list(_iter_pdf_zip(_jobs(3), workers=1))
+    # un morceau par PDF (dès qu'il est prêt) + le répertoire central final
+    assert len(chunks) == 4 and all(chunks)
+
+
+def _flaky_render(name):
+    if name == "bad":
+        raise ValueError("facture corrompue")
+    return b"%PDF-" + name.encode()
+
+
+def test_failed_render_is_listed_and_does_not_break_archive():
+    jobs = [("a.pdf", ("a",)), ("bad.pdf", ("bad",)), ("c.pdf", ("c",))]
+    zf = _unzip(_iter_pdf_zip(jobs, render=_flaky_render, workers=1))
+    assert zf.namelist() == ["a.pdf", "c.pdf", "ERREURS.txt"]
+    assert zf.read("ERREURS.txt").decode() == "bad.pdf\tValueError\n"
+
+
+def test_member_names_are_sanitized_and_unique():
+    used = set()
+    assert _pdf_zip_member_name("facture", "FAC 2026/001", used) == "facture_FAC_2026_001.pdf"
+    assert _pdf_zip_member_name("facture", "FAC 2026/001", used) == "facture_FAC_2026_001_2.pdf"
+    assert _pdf_zip_member_name("facture", None, used) == "facture_N-A.pdf"
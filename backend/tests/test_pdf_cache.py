@@ -0,0 +1,76 @@
+"""Tests — cache des PDF rendus (`_document_pdf_bytes`, clé = empreinte des entrées du rendu).
+
+Tests unitaires purs : soumissions / brouillons sans logo (aucun accès DB) ; le rendu est
+compté via un monkeypatch de `generate_document_pdf`.
+"""
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+import pytest  # noqa: E402
+
+import server  # noqa: E402
+from server import _LRUCache, _document_pdf_bytes, _document_pdf_key  # noqa: E402
+
+SETTINGS = {"company_name": "Ferme Lebleu", "gst_number": "123456789RT0001"}
+CLIENT = {"id": "c1", "name": "Client", "email": "client@example.com"}
+QUOTE = {"id": "q1", "organization_id": "org-p", "quote_number": "SOU-001", "status": "pending",
+         "items": [{"description": "Service", "quantity": 2, "unit_price": 50.0}], "total": 100.0}
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    calls = []
+
+    def fake_render(doc_type, document, *args, **kwargs):
+        calls.append(document["id"])
+        return io.BytesIO(f"%PDF-{document['id']}-{len(calls)}".encode())
+    monkeypatch.setattr(server, "generate_document_pdf", fake_render)
+    monkeypatch.setattr(server, "_PDF_CACHE", _LRUCache(8))
+    return calls
+
+
+def test_key_ignores_tracking_fields_but_not_rendered_ones():
+    base = _document_pdf_key("quote", QUOTE, SETTINGS, CLIENT, "")
+    assert _document_pdf_key("quote", {**QUOTE, "last_reminded": "2026-10-01", "sent_at": "x"},
+                             SETTINGS, CLIENT, "") == base
+    assert _document_pdf_key("quote", {**QUOTE, "total": 101.0}, SETTINGS, CLIENT, "") != base
+    assert _document_pdf_key("quote", QUOTE, {**SETTINGS, "gst_number": ""}, CLIENT, "") != base
+    assert _document_pdf_key("quote", QUOTE, SETTINGS, {**CLIENT, "name": "Autre"}, "") != base
+    assert _document_pdf_key("quote", QUOTE, SETTINGS, CLIENT, "ab" * 32) != base
+    assert _document_pdf_key("invoice", QUOTE, SETTINGS, CLIENT, "") != base
+
+
+def test_same_inputs_render_once(renders):
+    first = _document_pdf_bytes("quote", QUOTE, SETTINGS, CLIENT, [])
+    assert _document_pdf_bytes("quote", {**QUOTE, "sent_at": "now"}, SETTINGS, CLIENT, []) == first
+    assert renders == ["q1"]
+
+
+def test_changed_document_replaces_its_slot(renders):
+    _document_pdf_bytes("quote", QUOTE, SETTINGS, CLIENT, [])
+    changed = _document_pdf_bytes("quote", {**QUOTE, "notes": "Merci"}, SETTINGS, CLIENT, [])
+    assert changed.endswith(b"-2")
+    assert len(server._PDF_CACHE) == 1  # un seul emplacement par document
+
+
+def test_document_without_org_is_never_cached(renders):
+    legacy = {k: v for k, v in QUOTE.items() if k != "organization_id"}
+    _document_pdf_bytes("quote", legacy, SETTINGS, CLIENT, [])
+    _document_pdf_bytes("quote", legacy, SETTINGS, CLIENT, [])
+    assert renders == ["q1", "q1"]
+    assert len(server._PDF_CACHE) == 0
+
+
+def test_lru_pop_where_drops_one_org():
+    cache = _LRUCache(8)
+    cache.put(("invoice", "a"), ("org-1", "k", b"a"))
+    cache.put(("quote", "b"), ("org-2", "k", b"b"))
+    cache.pop_where(lambda slot, entry: entry[0] == "org-1")
+    assert cache.get(("invoice", "a")) is None
+    assert cache.get(("quote", "b")) == ("org-2", "k", b"b")
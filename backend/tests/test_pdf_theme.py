@@ -0,0 +1,70 @@
+"""Tests — registre de thèmes PDF et cache de logos décodés (partagés entre les rendus).
+
+Tests unitaires purs : logos synthétiques (PIL), aucun accès DB.
+"""
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+from PIL import Image  # noqa: E402
+
+import server  # noqa: E402
+from server import (  # noqa: E402
+    PDF_LOGO_MAX_PX, _LRUCache, _bench_pdf_render_setup, _decode_pdf_logo, _org_pdf_logo,
+    _pdf_theme, generate_document_pdf,
+)
+
+
+def _png(size, mode="RGBA"):
+    buf = io.BytesIO()
+    Image.new(mode, size).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_theme_built_once_per_color_pair():
+    a = _pdf_theme("document", "#00A08C", "#1f2937")
+    assert _pdf_theme("document", "#00a08c", "#1F2937") is a
+    assert _pdf_theme("document", "#112233", "#1f2937") is not a
+    assert _pdf_theme("ledger", "#00A08C", "#1f2937") is not a
+    assert server._ledger_pdf_styles() is server._ledger_pdf_styles()
+
+
+def test_logo_is_downscaled_once_keeping_aspect():
+    reader = _decode_pdf_logo(_png((1200, 600)))
+    assert reader.getSize() == (PDF_LOGO_MAX_PX, PDF_LOGO_MAX_PX // 2)
+    assert _decode_pdf_logo(_png((40, 40), mode="P")).getSize() == (40, 40)
+    assert _decode_pdf_logo(b"pas une image") is None
+
+
+def test_org_logo_served_from_cache_until_url_changes(monkeypatch):
+    monkeypatch.setattr(server, "_PDF_LOGO_CACHE", _LRUCache(4))
+    reads = []
+
+    def fake_bytes(settings):
+        reads.append(settings["logo_url"])
+        return _png((100, 100))
+    monkeypatch.setattr(server, "_document_logo_bytes", fake_bytes)
+    first = _org_pdf_logo("org-l", {"logo_url": "/api/files/a"})
+    assert _org_pdf_logo("org-l", {"logo_url": "/api/files/a"}) is first
+    assert _org_pdf_logo("org-l", {"logo_url": "/api/files/b"}) is not first
+    server._forget_org_pdf_logo("org-l")
+    _org_pdf_logo("org-l", {"logo_url": "/api/files/b"})
+    assert reads == ["/api/files/a", "/api/files/b", "/api/files/b"]
+
+
+def test_document_renders_with_shared_logo_and_theme():
+    doc = {"id": "i", "invoice_number": "FAC-1", "status": "sent", "items": [], "total": 0}
+    for _ in range(2):
+        pdf = generate_document_pdf("invoice", doc, {"company_name": "X"}, None, [],
+                                    logo_bytes=_png((800, 800))).getvalue()
+        assert pdf.startswith(b"%PDF") and b"/Image" in pdf
+
+
+def test_setup_benchmark_reports_before_and_after():
+    out = _bench_pdf_render_setup(iterations=3)
+    assert out["iterations"] == 3 and out["before_ms"] > out["after_ms"] > 0
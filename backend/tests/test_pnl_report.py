@@ -147,6 +147,22 @@ class TestAggregatePnl:
         assert result["net_income"]["management"] == 2850.00
         assert result["net_income"]["taxable"] == 3000.00
 
+    def test_day_fields_after_migration_give_same_totals(self, isolated_db, monkeypatch):
+        import server
+        monkeypatch.setattr(server, "db", isolated_db)
+        _seed_for_aggregate(isolated_db, "u1")
+        # datetime complet le DERNIER jour : dans la période via le jour canonique
+        isolated_db.invoices.insert_one({
+            "id": "i5", "user_id": "u1", "subtotal": 100, "currency": "CAD",
+            "exchange_rate_to_cad": 1.0, "status": "paid", "issue_date": "2099-06-30T22:00:00+00:00"})
+        before = server._aggregate_pnl({"user_id": "u1"}, "2099-04-01", "2099-06-30", "accrual")
+        assert server.migrate_day_fields_v1(batch_size=2) == 8
+        assert isolated_db.invoices.find_one({"id": "i5"})["issue_day"] == "2099-06-30"
+        assert server.migrate_day_fields_v1() == 0, "idempotente"
+        after = server._aggregate_pnl({"user_id": "u1"}, "2099-04-01", "2099-06-30", "accrual")
+        assert after == before
+        assert after["revenue"] == 3600.00
+
     def test_empty_period(self, isolated_db, monkeypatch):
         import server
         monkeypatch.setattr(server, "db", isolated_db)
@@ -233,3 +249,107 @@ class TestMergeExpenseGroups:
         order = [g["group"] for g in result]
         # office must come before marketing in the canonical order
         assert order.index("office") < order.index("marketing")
+
+
+def test_canonical_day_matches_in_period_reading():
+    from server import _canonical_day
+    assert _canonical_day("2026-03-31") == "2026-03-31"
+    assert _canonical_day("2026-03-31T22:00:00+00:00") == "2026-03-31"
+    assert _canonical_day("2026-03-31T23:59:59Z") == "2026-03-31"
+    assert _canonical_day("31/03/2026") is None
+    assert _canonical_day(None) is None
+    assert _canonical_day(20260331) is None
+
+
+def test_split_period_months_whole_and_edges():
+    from datetime import date
+    from server import _split_period_months
+    whole, edges = _split_period_months(date(2026, 1, 15), date(2026, 4, 10))
+    assert whole == ["2026-02", "2026-03"]
+    assert edges == [(date(2026, 1, 15), date(2026, 1, 31)), (date(2026, 4, 1), date(2026, 4, 10))]
+    whole, edges = _split_period_months(date(2025, 1, 1), date(2025, 12, 31))
+    assert len(whole) == 12 and edges == []
+    assert whole[-1] == "2025-12"
+    whole, edges = _split_period_months(date(2024, 2, 1), date(2024, 2, 29))
+    assert whole == ["2024-02"] and edges == []
+    whole, edges = _split_period_months(date(2026, 3, 5), date(2026, 3, 5))
+    assert whole == [] and edges == [(date(2026, 3, 5), date(2026, 3, 5))]
+
+
+def test_merge_report_totals_adds_amounts_and_categories():
+    from server import _empty_report_totals, _merge_report_totals
+    a = _empty_report_totals()
+    a.update(revenue=100.0, invoice_count=1,
+             categories=[{"code": "rent", "gross": 50.0, "deductible": 50.0}])
+    b = _empty_report_totals()
+    b.update(revenue=20.5, invoice_count=2, gst_paid=1.25,
+             categories=[{"code": "meals_entertainment", "gross": 10.0, "deductible": 5.0},
+                         {"code": "rent", "gross": 5.0, "deductible": 5.0}])
+    total = _merge_report_totals(_empty_report_totals(), a)
+    _merge_report_totals(total, b)
+    assert total["revenue"] == 120.5 and total["invoice_count"] == 3 and total["gst_paid"] == 1.25
+    assert total["categories"] == [{"code": "rent", "gross": 55.0, "deductible": 55.0},
+                                   {"code": "meals_entertainment", "gross": 10.0, "deductible": 5.0}]
+    assert a["categories"] == [{"code": "rent", "gross": 50.0, "deductible": 50.0}], "inchangé"
+
+
+class TestReportRollups:
+    ORG_SCOPE = {"$or": [{"organization_id": "org-r"},
+                         {"user_id": "u1", "organization_id": {"$exists": False}}]}
+
+    def _seed(self, test_db):
+        import server
+        _seed_for_aggregate(test_db, "u1")
+        test_db.invoices.update_many({"id": {"$in": ["i1", "i2", "i3"]}},
+                                     {"$set": {"organization_id": "org-r"}})
+        test_db.expenses.update_many({"id": {"$in": ["e1", "e2"]}},
+                                     {"$set": {"organization_id": "org-r"}})
+        server.migrate_day_fields_v1()
+
+    def test_rollup_composition_equals_raw_aggregation(self, isolated_db, monkeypatch):
+        import server
+        monkeypatch.setattr(server, "db", isolated_db)
+        self._seed(isolated_db)
+        for start, end in (("2099-04-01", "2099-06-30"), ("2099-04-12", "2099-06-25"),
+                           ("2099-05-01", "2099-05-31")):
+            for basis in ("accrual", "cash"):
+                raw = server._report_totals_raw(self.ORG_SCOPE, server._parse_iso_date(start),
+                                                server._parse_iso_date(end), basis)
+                composed = server._report_totals(self.ORG_SCOPE, start, end, basis)
+                assert server._rollup_totals_match(raw, composed), (start, end, basis)
+        assert isolated_db.report_rollups.count_documents({"organization_id": "org-r", "valid": True}) == 6
+        assert server.verify_report_rollups("org-r") == []
+
+    def test_write_invalidates_month_and_report_follows(self, isolated_db, monkeypatch):
+        import server
+        monkeypatch.setattr(server, "db", isolated_db)
+        self._seed(isolated_db)
+        before = server._aggregate_pnl(self.ORG_SCOPE, "2099-04-01", "2099-06-30", "accrual")
+        isolated_db.invoices.update_one({"id": "i2"}, {"$set": {"subtotal": 2500}})
+        server._report_data_changed("org-r", "2099-05-10")
+        may = isolated_db.report_rollups.find_one({"organization_id": "org-r", "month": "2099-05",
+                                                   "basis": "accrual"})
+        assert may["valid"] is False
+        after = server._aggregate_pnl(self.ORG_SCOPE, "2099-04-01", "2099-06-30", "accrual")
+        assert after["revenue"] == before["revenue"] + 500
+        assert server.verify_report_rollups("org-r") == []
+
+    def test_stale_recompute_is_not_stored(self, isolated_db, monkeypatch):
+        import server
+        monkeypatch.setattr(server, "db", isolated_db)
+        self._seed(isolated_db)
+        server._report_data_changed("org-r", "2099-05-10")
+        gen = isolated_db.report_rollups.find_one({"organization_id": "org-r", "month": "2099-05",
+                                                   "basis": "cash"})["gen"]
+        server._report_data_changed("org-r", "2099-05-10")  # écriture pendant le recalcul
+        server._compute_month_rollup("org-r", "2099-05", "cash", gen)
+        doc = isolated_db.report_rollups.find_one({"organization_id": "org-r", "month": "2099-05",
+                                                   "basis": "cash"})
+        assert doc["valid"] is False
+
+    def test_rebuild_covers_months_with_data(self, isolated_db, monkeypatch):
+        import server
+        monkeypatch.setattr(server, "db", isolated_db)
+        self._seed(isolated_db)
+        assert server.rebuild_report_rollups("org-r") == 6  # avril–juin × 2 bases
+        assert server.verify_report_rollups() == []
@@ -45,6 +45,63 @@ class TestCheckImageDecompression:
             _check_image_decompression(b"not an image")
 
 
+import server as _server
+from server import _normalize_receipt_image
+
+
+def _encoded(img, fmt, **kw):
+    buf = io.BytesIO()
+    img.save(buf, fmt, **kw)
+    return buf.getvalue()
+
+
+class TestNormalizeReceiptImage:
+    def _normalize(self, data, mime):
+        return _normalize_receipt_image(_check_image_decompression(data), data, mime)
+
+    def test_large_photo_downscaled_and_recompressed(self):
+        from PIL import Image
+        raw = _encoded(Image.effect_noise((4000, 3000), 60).convert("RGB"), "JPEG", quality=95)
+        out = self._normalize(raw, "image/jpeg")
+        assert (out["width"], out["height"]) == (2000, 1500)
+        assert out["mime_type"] == "image/jpeg"
+        assert len(out["data"]) < len(raw) / 2
+        thumb = Image.open(io.BytesIO(out["thumbnail"]))
+        assert max(thumb.size) == _server.RECEIPT_THUMB_EDGE
+
+    def test_exif_orientation_applied(self):
+        from PIL import Image
+        img = Image.new("RGB", (400, 200), (255, 255, 255))
+        exif = img.getexif()
+        exif[0x0112] = 6  # rotation 90° horaire
+        raw = _encoded(img, "JPEG", exif=exif)
+        out = self._normalize(raw, "image/jpeg")
+        assert (out["width"], out["height"]) == (200, 400)
+        assert Image.open(io.BytesIO(out["data"])).getexif().get(0x0112) is None
+
+    def test_transparent_png_flattened_to_jpeg(self):
+        from PIL import Image
+        raw = _encoded(Image.new("RGBA", (50, 50), (0, 0, 0, 0)), "PNG")
+        out = self._normalize(raw, "image/png")
+        assert out["mime_type"] == "image/jpeg"
+        decoded = Image.open(io.BytesIO(out["data"]))
+        assert decoded.mode == "RGB" and decoded.getpixel((10, 10))[0] > 240
+
+    def test_small_upright_jpeg_kept_as_is(self):
+        from PIL import Image
+        raw = _encoded(Image.effect_noise((300, 200), 40).convert("RGB"), "JPEG", quality=20)
+        assert self._normalize(raw, "image/jpeg")["data"] == raw
+
+    def test_webp_output_when_configured(self, monkeypatch):
+        from PIL import Image
+        monkeypatch.setattr(_server, "RECEIPT_IMAGE_FORMAT", "WEBP")
+        raw = _encoded(Image.new("RGB", (3000, 100), (10, 20, 30)), "PNG")
+        out = self._normalize(raw, "image/png")
+        assert out["mime_type"] == "image/webp"
+        assert _server._detect_image_mime(out["data"]) == "image/webp"
+        assert out["width"] == 2000
+
+
 from server import _normalize_extraction, EXPENSE_CATEGORIES
 
 
@@ -182,6 +239,18 @@ class TestCheckAndBillScan:
         finally:
             self._cleanup(oid)
 
+    def test_batch_reservation_is_all_or_nothing(self):
+        now_iso = datetime.now(timezone.utc).isoformat()
+        oid = self._setup_org(scan_count=395, reset_at=now_iso)
+        try:
+            with pytest.raises(HTTPException) as exc:
+                _check_and_bill_scan(oid, 6)
+            assert exc.value.status_code == 429
+            assert server_db.organizations.find_one({"id": oid})["scan_count_this_month"] == 395
+            assert _check_and_bill_scan(oid, 5) == 400
+        finally:
+            self._cleanup(oid)
+
 
 from unittest.mock import MagicMock
 import server as server_module
@@ -262,3 +331,22 @@ class TestCallAnthropicExtract:
         with pytest.raises(HTTPException) as exc:
             _call_anthropic_extract(b"\xff\xd8\xff\xe0fake", "image/jpeg")
         assert exc.value.status_code == 502
+
+    def test_async_client_happy_path(self, monkeypatch):
+        import asyncio
+        from server import _call_anthropic_extract_async
+        mock_tool_use = MagicMock()
+        mock_tool_use.type = "tool_use"
+        mock_tool_use.input = {"vendor": "Costco", "category_code": "office_supplies"}
+        mock_message = MagicMock()
+        mock_message.content = [mock_tool_use]
+
+        async def _create(**kwargs):
+            assert kwargs["tool_choice"] == {"type": "tool", "name": "extract_receipt"}
+            return mock_message
+        mock_client = MagicMock()
+        mock_client.messages.create = _create
+        monkeypatch.setattr(server_module, "_get_anthropic_async_client", lambda: mock_client)
+
+        result = asyncio.run(_call_anthropic_extract_async(b"\xff\xd8\xff\xe0fake", "image/jpeg"))
+        assert result["vendor"] == "Costco"
@@ -52,6 +52,8 @@ def mock_extraction():
     (bypass total de l'appel SDK). Reset après le test."""
     def _set(extraction_dict):
         server_module._TEST_MOCK_EXTRACTION = extraction_dict
+        # le cache org+sha servirait l'extraction d'un test précédent (même JPEG minimal)
+        server_module.db.receipt_extractions.delete_many({})
     yield _set
     if hasattr(server_module, "_TEST_MOCK_EXTRACTION"):
         delattr(server_module, "_TEST_MOCK_EXTRACTION")
@@ -117,6 +119,148 @@ class TestScanReceiptEndpoint:
             pass
 
 
+class TestScanReceiptsBatch:
+    _cleanup_files = set()
+
+    def test_batch_partial_results_in_order(self, client, auth_headers, mock_extraction):
+        mock_extraction({"vendor": "Costco", "category_code": "office_supplies"})
+        jpeg = _make_minimal_jpeg()
+        before = client.get("/api/auth/me", headers=auth_headers).json()
+        files = [("files", ("a.jpg", jpeg, "image/jpeg")),
+                 ("files", ("evil.jpg", b"<svg>foo</svg>", "image/jpeg")),
+                 ("files", ("b.jpg", jpeg, "image/jpeg"))]
+        r = client.post("/api/expenses/scan-receipts", files=files, headers=auth_headers)
+        assert r.status_code == 200, r.text
+        body = r.json()
+        assert [x["status"] for x in body["results"]] == ["ok", "error", "ok"]
+        assert body["results"][1]["status_code"] == 422
+        assert body["results"][1]["refunded"] is False, "fichier refusé : jamais facturé"
+        assert body["scanned"] == 2 and body["failed"] == 1 and body["refunded"] == 0
+        assert body["results"][0]["extraction"]["vendor"] == "Costco"
+        for x in body["results"]:
+            if x.get("file_id"):
+                TestScanReceiptsBatch._cleanup_files.add(x["file_id"])
+        if before.get("scan_count_this_month") is not None:
+            assert body["scan_count_this_month"] >= 2
+
+    def test_failed_extraction_is_refunded(self, client, auth_headers, monkeypatch):
+        jpeg = _make_minimal_jpeg()
+        png = io.BytesIO()
+        _PILImage.new("RGB", (12, 12), (0, 0, 0)).save(png, "PNG")
+
+        async def _flaky(payload, mime):
+            from fastapi import HTTPException
+            if mime == "image/png":
+                raise HTTPException(502, "Service d'analyse temporairement indisponible")
+            return {"vendor": "OK", "category_code": "other"}
+
+        monkeypatch.setattr(server_module, "_call_anthropic_extract_async", _flaky)
+        # sans normalisation, chaque payload garde son mime d'origine (le PNG échoue)
+        monkeypatch.setattr(server_module, "_normalize_receipt_image",
+                            lambda img, raw, mime: (_ for _ in ()).throw(RuntimeError()))
+        files = [("files", ("a.jpg", jpeg, "image/jpeg")),
+                 ("files", ("b.png", png.getvalue(), "image/png"))]
+        r = client.post("/api/expenses/scan-receipts", files=files, headers=auth_headers)
+        assert r.status_code == 200, r.text
+        body = r.json()
+        assert [x["status"] for x in body["results"]] == ["ok", "error"]
+        assert body["results"][1] == {"index": 1, "filename": "b.png", "status": "error",
+                                      "status_code": 502, "refunded": True,
+                                      "error": "Service d'analyse temporairement indisponible"}
+        assert body["refunded"] == 1
+        TestScanReceiptsBatch._cleanup_files.add(body["results"][0]["file_id"])
+
+    def test_failed_persistence_is_refunded_per_file(self, client, auth_headers, monkeypatch):
+        png = io.BytesIO()
+        # contenu unique : un reçu déjà en cache ne serait pas facturé
+        _PILImage.new("RGB", (12, 12), tuple(os.urandom(3))).save(png, "PNG")
+
+        async def _ok(payload, mime):
+            return {"vendor": "OK", "category_code": "other"}
+
+        def _broken_store(*args, **kwargs):
+            raise OSError("stockage indisponible")
+
+        monkeypatch.setattr(server_module, "_call_anthropic_extract_async", _ok)
+        monkeypatch.setattr(server_module, "_persist_receipt_file", _broken_store)
+        before = client.get("/api/auth/me", headers=auth_headers).json()
+        r = client.post("/api/expenses/scan-receipts",
+                        files=[("files", ("c.png", png.getvalue(), "image/png"))],
+                        headers=auth_headers)
+        assert r.status_code == 200, r.text
+        body = r.json()
+        assert body["results"][0]["status"] == "error"
+        assert body["results"][0]["status_code"] == 500
+        assert body["refunded"] == 1 and body["results"][0]["refunded"] is True
+        if before.get("scan_count_this_month") is not None:
+            assert body["scan_count_this_month"] == before["scan_count_this_month"]
+
+    def test_rescan_same_receipt_hits_cache_without_billing(self, client, auth_headers,
+                                                             mock_extraction):
+        mock_extraction({"vendor": "Cache", "category_code": "other"})
+        jpeg = _make_minimal_jpeg()
+        first = client.post("/api/expenses/scan-receipt",
+                            files={"file": ("a.jpg", jpeg, "image/jpeg")}, headers=auth_headers)
+        assert first.status_code == 200, first.text
+        assert first.json()["cached"] is False
+        server_module._TEST_MOCK_EXTRACTION = {"vendor": "NE DOIT PAS SERVIR", "category_code": "other"}
+        again = client.post("/api/expenses/scan-receipt",
+                            files={"file": ("a-copy.jpg", jpeg, "image/jpeg")}, headers=auth_headers)
+        assert again.status_code == 200, again.text
+        body = again.json()
+        assert body["cached"] is True
+        assert body["extraction"]["vendor"] == "Cache"
+        assert body["scan_count_this_month"] == first.json()["scan_count_this_month"]
+        assert body["file_id"] != first.json()["file_id"], "chaque envoi garde son propre fichier"
+        for r in (first, again):
+            TestScanReceiptsBatch._cleanup_files.add(r.json()["file_id"])
+
+    def test_stale_reservation_takeover_refunds_abandoned_scan(self, client, auth_headers):
+        from datetime import datetime, timedelta, timezone
+        org_id = client.get("/api/auth/me", headers=auth_headers).json()["organization_id"]
+        sha = uuid.uuid4().hex
+        _, old, _ = server_module._reserve_receipt_extractions(org_id, [sha])
+        billed = server_module._current_scan_count(org_id)
+        server_module.db.receipt_extractions.update_one(
+            {"organization_id": org_id, "sha256": sha},
+            {"$set": {"created_at": datetime.now(timezone.utc) - timedelta(hours=1)}})
+        _, new, _ = server_module._reserve_receipt_extractions(org_id, [sha])
+        assert new[sha] != old[sha]
+        assert server_module._current_scan_count(org_id) == billed, "scan abandonné remboursé"
+        # l'ancien détenteur échoue en retard : ni libération ni remboursement du nouveau
+        assert server_module._release_receipt_extractions(org_id, old) == 0
+        server_module._fill_receipt_extraction(org_id, sha, {"vendor": "Ancien"}, old[sha])
+        doc = server_module.db.receipt_extractions.find_one({"organization_id": org_id, "sha256": sha})
+        assert (doc["status"], doc["lease"]) == ("extracting", new[sha])
+        assert server_module._release_receipt_extractions(org_id, new) == 1
+        assert server_module._current_scan_count(org_id) == billed - 1
+
+    def test_scan_receipt_cache_fill_failure_is_refunded(self, client, auth_headers, monkeypatch,
+                                                         mock_extraction):
+        mock_extraction({"vendor": "OK", "category_code": "other"})
+
+        def _broken_fill(*args):
+            raise OSError("cache indisponible")
+
+        monkeypatch.setattr(server_module, "_fill_receipt_extraction", _broken_fill)
+        png = io.BytesIO()
+        _PILImage.new("RGB", (12, 12), tuple(os.urandom(3))).save(png, "PNG")
+        before = client.get("/api/auth/me", headers=auth_headers).json()
+        no_raise = TestClient(server_module.app, raise_server_exceptions=False)
+        r = no_raise.post("/api/expenses/scan-receipt", headers=auth_headers,
+                          files={"file": ("d.png", png.getvalue(), "image/png")})
+        assert r.status_code == 500
+        after = client.get("/api/auth/me", headers=auth_headers).json()
+        assert after.get("scan_count_this_month") == before.get("scan_count_this_month")
+        assert server_module.db.receipt_extractions.count_documents(
+            {"organization_id": after["organization_id"], "status": "extracting"}) == 0
+
+    @classmethod
+    def teardown_class(cls):
+        for fid in cls._cleanup_files:
+            server_module.db.files.update_one({"id": fid}, {"$set": {"is_deleted": True}})
+
+
 class TestGetReceipt:
     _cleanup_files = set()
 
@@ -134,6 +278,10 @@ class TestGetReceipt:
         assert r.headers["content-type"].startswith("image/")
         assert len(r.content) > 0
 
+        thumb = client.get(f"/api/receipts/{fid}/thumbnail", headers=auth_headers)
+        assert thumb.status_code == 200
+        assert thumb.headers["content-type"] == "image/jpeg"
+
     def test_get_unknown_returns_404(self, client, auth_headers):
         r = client.get("/api/receipts/non-existent-id-12345", headers=auth_headers)
         assert r.status_code == 404
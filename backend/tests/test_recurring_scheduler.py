@@ -0,0 +1,137 @@
+"""Tests — planificateur des factures récurrentes (`run_recurring_invoices`).
+
+DB isolée, rendu PDF inline (PDF_RENDER_WORKERS=1) et envoi par l'outbox : on vérifie les
+emails ENFILÉS, aucun appel Resend. Couvre le traitement multi-organisations, l'avance des
+échéances, les baux (pas de double envoi entre exécuteurs concurrents) et les erreurs.
+"""
+import os
+import sys
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+import pytest  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+
+import server  # noqa: E402
+
+TODAY = "2026-05-01"
+
+
+@pytest.fixture
+def rec_db(monkeypatch, tmp_path):
+    client = MongoClient("mongodb://localhost:27017")
+    name = f"facturepro_test_recurring_{uuid.uuid4().hex[:8]}"
+    test_db = client[name]
+    test_db.email_outbox.create_index("idempotency_key", unique=True)
+    monkeypatch.setattr(server, "db", test_db)
+    monkeypatch.setattr(server, "_blob_store_instance", server._LocalBlobStore(str(tmp_path)))
+    monkeypatch.setattr(server, "PDF_RENDER_WORKERS", 1)
+    monkeypatch.setattr(server, "_report_data_changed", lambda *a, **k: None)
+    yield test_db
+    client.drop_database(name)
+
+
+def _seed(test_db, org, count, next_send=TODAY, email="client@example.com"):
+    test_db.company_settings.insert_one({"organization_id": org, "company_name": f"Entreprise {org}"})
+    test_db.clients.insert_one({"id": f"cl-{org}", "organization_id": org, "name": "Client",
+                                "email": email})
+    for n in range(count):
+        test_db.invoices.insert_one({
+            "id": f"{org}-inv-{n}", "organization_id": org, "client_id": f"cl-{org}",
+            "invoice_number": f"FAC-{n:03d}", "status": "sent", "issue_date": "2026-04-01",
+            "due_date": "2026-05-31", "items": [{"description": "Service", "quantity": 1,
+                                                 "unit_price": 100.0}],
+            "subtotal": 100.0, "total": 100.0, "recurrence": "monthly",
+            "recurrence_active": True, "next_send_date": next_send})
+
+
+def test_due_invoices_of_every_org_are_sent_and_advanced(rec_db):
+    _seed(rec_db, "org-a", 3)
+    _seed(rec_db, "org-b", 2)
+    _seed(rec_db, "org-c", 1, next_send="2026-06-01")  # pas encore due
+    stats = server.run_recurring_invoices(workers=3, today=TODAY)
+    assert (stats["due"], stats["sent"], stats["skipped"], stats["errors"]) == (5, 5, 0, [])
+    assert stats["organizations"] == 2
+    assert rec_db.email_outbox.count_documents({"kind": "recurring_invoice"}) == 5
+    inv = rec_db.invoices.find_one({"id": "org-a-inv-0"})
+    assert (inv["next_send_date"], inv["due_date"]) == ("2026-06-01", "2026-06-30")
+    assert "recurrence_lease_token" not in inv
+    assert server.run_recurring_invoices(today=TODAY)["due"] == 0
+
+
+def test_match_limits_run_to_one_org(rec_db):
+    _seed(rec_db, "org-a", 2)
+    _seed(rec_db, "org-b", 2)
+    stats = server.run_recurring_invoices({"organization_id": "org-a"}, today=TODAY)
+    assert stats["sent"] == 2
+    assert rec_db.invoices.count_documents({"organization_id": "org-b",
+                                            "next_send_date": TODAY}) == 2
+
+
+def test_concurrent_runners_never_double_send(rec_db):
+    _seed(rec_db, "org-a", 20)
+    runs = []
+    threads = [threading.Thread(target=lambda: runs.append(
+        server.run_recurring_invoices(workers=4, today=TODAY))) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(r["sent"] for r in runs) == 20
+    assert rec_db.email_outbox.count_documents({}) == 20
+    assert rec_db.invoices.count_documents({"next_send_date": "2026-06-01"}) == 20
+
+
+def test_live_lease_is_skipped_and_expired_lease_is_reclaimed(rec_db):
+    _seed(rec_db, "org-a", 1)
+    now = datetime.now(timezone.utc)
+    rec_db.invoices.update_one({"id": "org-a-inv-0"}, {"$set": {
+        "recurrence_lease_token": "autre", "recurrence_lease_until": now + timedelta(minutes=5)}})
+    assert server.run_recurring_invoices(today=TODAY)["skipped"] == 1
+    rec_db.invoices.update_one({"id": "org-a-inv-0"}, {"$set": {
+        "recurrence_lease_until": now - timedelta(seconds=1)}})
+    assert server.run_recurring_invoices(today=TODAY)["sent"] == 1
+
+
+def test_missing_email_and_render_failure_are_reported(rec_db, monkeypatch):
+    _seed(rec_db, "org-a", 1, email="")
+    _seed(rec_db, "org-b", 1)
+
+    def boom(*args):
+        raise ValueError("rendu impossible")
+    monkeypatch.setattr(server, "_render_document_pdf_bytes", boom)
+    stats = server.run_recurring_invoices(today=TODAY)
+    assert stats["sent"] == 0
+    assert sorted(stats["errors"]) == ["FAC-000: ValueError", "FAC-000: pas d'email client"]
+    inv = rec_db.invoices.find_one({"id": "org-b-inv-0"})
+    assert inv["next_send_date"] == TODAY and "recurrence_lease_token" not in inv
+
+
+def test_legacy_invoice_never_reads_another_tenants_settings(rec_db):
+    # Paramètres d'un AUTRE tenant legacy (sans organization_id) : ne doivent pas fuiter
+    rec_db.company_settings.insert_one({"user_id": "u-other", "company_name": "Autre tenant"})
+    rec_db.company_settings.insert_one({"user_id": "u-legacy", "company_name": "Ferme legacy"})
+    rec_db.clients.insert_one({"id": "cl-l", "user_id": "u-legacy", "email": "c@example.com"})
+    rec_db.invoices.insert_one({
+        "id": "legacy-inv", "user_id": "u-legacy", "client_id": "cl-l", "invoice_number": "L-1",
+        "status": "sent", "issue_date": "2026-04-01", "due_date": "2026-05-31", "items": [],
+        "subtotal": 0.0, "total": 0.0, "recurrence": "monthly", "recurrence_active": True,
+        "next_send_date": TODAY})
+    assert server.run_recurring_invoices(today=TODAY)["sent"] == 1
+    msg = rec_db.email_outbox.find_one({})
+    assert msg["params"]["subject"] == "Facture L-1 - Ferme legacy"
+
+
+def test_org_invoice_finds_legacy_client_of_its_creator(rec_db):
+    _seed(rec_db, "org-a", 1)
+    rec_db.clients.delete_many({})
+    rec_db.clients.insert_one({"id": "cl-org-a", "user_id": "u-a", "email": "c@example.com"})
+    rec_db.invoices.update_many({}, {"$set": {"created_by_user_id": "u-a"}})
+    stats = server.run_recurring_invoices(today=TODAY)
+    assert (stats["sent"], stats["errors"]) == (1, [])
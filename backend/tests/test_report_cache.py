@@ -0,0 +1,83 @@
+"""Tests — cache des résultats de rapports (clé org + rapport + paramètres + version de données).
+
+Tests unitaires purs : la version de données de l'org est simulée (monkeypatch de
+`_org_data_version`), pas de dépendance DB.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("DB_NAME", "facturepro")
+
+import pytest  # noqa: E402
+
+import server  # noqa: E402
+from server import _LRUCache, _cached_report, _report_cache_stats  # noqa: E402
+
+SCOPE = {"$or": [{"organization_id": "org-c"},
+                 {"user_id": "u", "organization_id": {"$exists": False}}]}
+
+
+@pytest.fixture
+def versions(monkeypatch):
+    current = {"org-c": 0}
+    monkeypatch.setattr(server, "_org_data_version", lambda org_id: current.get(org_id, 0))
+    monkeypatch.setattr(server, "_REPORT_CACHE", _LRUCache(8))
+    monkeypatch.setattr(server, "_REPORT_CACHE_STATS", {"hits": 0, "shared_hits": 0, "misses": 0})
+    monkeypatch.setattr(server, "REPORT_CACHE_SHARED", False)
+    return current
+
+
+def _counting(result):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return result
+    return compute, calls
+
+
+def test_same_version_and_params_served_from_cache(versions):
+    compute, calls = _counting({"revenue": 10})
+    assert _cached_report(SCOPE, "pnl", {"start": "2026-01-01", "end": "2026-03-31"}, compute) == {"revenue": 10}
+    assert _cached_report(SCOPE, "pnl", {"end": "2026-03-31", "start": "2026-01-01"}, compute) == {"revenue": 10}
+    assert len(calls) == 1
+    stats = _report_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_data_version_bump_recomputes(versions):
+    compute, calls = _counting({"revenue": 10})
+    _cached_report(SCOPE, "pnl", {"start": "2026-01-01"}, compute)
+    versions["org-c"] = 1  # une écriture a eu lieu
+    _cached_report(SCOPE, "pnl", {"start": "2026-01-01"}, compute)
+    assert len(calls) == 2
+
+
+def test_report_and_params_are_part_of_the_key(versions):
+    compute, calls = _counting({})
+    _cached_report(SCOPE, "pnl", {"basis": "cash"}, compute)
+    _cached_report(SCOPE, "pnl", {"basis": "accrual"}, compute)
+    _cached_report(SCOPE, "sales-tax", {"basis": "cash"}, compute)
+    _cached_report({"organization_id": "org-other"}, "pnl", {"basis": "cash"}, compute)
+    assert len(calls) == 4
+
+
+def test_scope_without_org_is_never_cached(versions):
+    compute, calls = _counting({})
+    _cached_report({"user_id": "u"}, "pnl", {}, compute)
+    _cached_report({"user_id": "u"}, "pnl", {}, compute)
+    assert len(calls) == 2
+    assert _report_cache_stats()["misses"] == 0
+
+
+def test_failed_compute_is_not_cached(versions):
+    def boom():
+        raise ValueError("période invalide")
+    with pytest.raises(ValueError):
+        _cached_report(SCOPE, "t2125", {"year": 1999}, boom)
+    compute, calls = _counting({"ok": True})
+    assert _cached_report(SCOPE, "t2125", {"year": 1999}, compute) == {"ok": True}
+    assert len(calls) == 1
@@ -18,10 +18,18 @@ export default function BankMatchingScreen({ importId, onBack }) {
   const [err, setErr] = useState(null);
   const [openManual, setOpenManual] = useState(null);
   const [openCreate, setOpenCreate] = useState(null);
+  const [suggestions, setSuggestions] = useState(null);
 
   const fetchData = async () => {
     try {
-      const r = await axios.get(`${BACKEND_URL}/api/bank/imports/${importId}?per_page=500`);
+      // Suggestions de toute la page en UNE requête (au lieu d'un appel par transaction) ;
+      // en cas d'échec, repli : chaque ligne charge ses propres suggestions.
+      const [r, s] = await Promise.all([
+        axios.get(`${BACKEND_URL}/api/bank/imports/${importId}?per_page=500`),
+        axios.post(`${BACKEND_URL}/api/bank/suggestions`,
+          { import_id: importId, page: 1, per_page: 500 }).catch(() => null),
+      ]);
+      setSuggestions(s ? (s.data.suggestions || {}) : null);
       setData(r.data);
       setErr(null);
     } catch (e) {
@@ -165,7 +173,8 @@ export default function BankMatchingScreen({ importId, onBack }) {
                  onUnmatch={() => onUnmatch(tx)}
                  onOpenManual={() => setOpenManual(tx)}
                  onOpenCreate={() => setOpenCreate(tx)}
-                 onRefresh={fetchData} />
+                 onRefresh={fetchData}
+                 suggestions={suggestions ? (suggestions[tx.id] || { invoices: [], expenses: [] }) : null} />
         ))}
         {filteredTxs.length === 0 && <p style={{ color: "#6b7280" }}>Aucune transaction.</p>}
       </div>
@@ -184,7 +193,7 @@ export default function BankMatchingScreen({ importId, onBack }) {
   );
 }
 
-function TxRow({ tx, busy, readOnly, onIgnore, onUnignore, onUnmatch, onOpenManual, onOpenCreate, onRefresh }) {
+function TxRow({ tx, busy, readOnly, onIgnore, onUnignore, onUnmatch, onOpenManual, onOpenCreate, onRefresh, suggestions }) {
   const isDebit = tx.amount_cad != null && tx.amount_cad < 0;
   const stateColor = tx.parse_error ? "#dc2626"
     : tx.status === "matched" ? "#059669"
@@ -234,7 +243,7 @@ function TxRow({ tx, busy, readOnly, onIgnore, onUnignore, onUnmatch, onOpenManu
         )}
       </div>
       {!readOnly && tx.status === "unmatched" && !tx.parse_error && (
-        <BankSuggestionsActions tx={tx}
+        <BankSuggestionsActions tx={tx} prefetched={suggestions}
           onMatched={onRefresh} onIgnore={onIgnore}
           onOpenManual={onOpenManual}
           onOpenCreate={onOpenCreate} />
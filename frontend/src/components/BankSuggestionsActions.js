@@ -2,12 +2,18 @@ import React, { useState, useEffect } from "react";
 import axios from "axios";
 import { BACKEND_URL } from "../config";
 
-export default function BankSuggestionsActions({ tx, onMatched, onIgnore, onOpenManual, onOpenCreate }) {
-  const [suggestions, setSuggestions] = useState(null);
-  const [loading, setLoading] = useState(true);
+export default function BankSuggestionsActions({ tx, prefetched, onMatched, onIgnore, onOpenManual, onOpenCreate }) {
+  const [suggestions, setSuggestions] = useState(prefetched || null);
+  const [loading, setLoading] = useState(!prefetched);
   const [busy, setBusy] = useState(false);
 
   useEffect(() => {
+    // Suggestions déjà chargées en lot par l'écran (POST /api/bank/suggestions).
+    if (prefetched) {
+      setSuggestions(prefetched);
+      setLoading(false);
+      return undefined;
+    }
     let cancelled = false;
     setLoading(true);
     axios.get(`${BACKEND_URL}/api/bank/transactions/${tx.id}/suggestions`)
@@ -15,7 +21,7 @@ export default function BankSuggestionsActions({ tx, onMatched, onIgnore, onOpen
       .catch(() => { if (!cancelled) setSuggestions({ invoices: [], expenses: [] }); })
       .finally(() => { if (!cancelled) setLoading(false); });
     return () => { cancelled = true; };
-  }, [tx.id]);
+  }, [tx.id, prefetched]);
 
   const confirm = async (kind, target_id) => {
     setBusy(true);